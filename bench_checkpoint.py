@@ -0,0 +1,84 @@
+# --- bench_checkpoint: arranque en caliente con una red grande ---
+#
+# Genera una topología sintética (por defecto 10.000 nodos y ~50.000 aristas
+# con IP, estadísticas de enlace y posiciones), la guarda con
+# espnow_checkpoint y mide:
+#   - escritura del checkpoint y tamaño
+#   - carga (fichero -> TopologyStore) y carga del índice de rutas
+#   - IncrementalLayout con esas posiciones: tiempo hasta publicar todas y
+#     cuántas iteraciones de fuerzas hicieron falta (0 = sin recalcular)
+#
+# Uso: python bench_checkpoint.py [--nodes 10000] [--degree 10] [--repeat 5]
+
+import argparse, os, random, tempfile, time
+import numpy as np
+from espnow_topology import TopologyStore, int_to_mac
+from espnow_state import EDGE_BASE, EDGE_ESTABLISHED
+from espnow_checkpoint import save_checkpoint, load_checkpoint
+from espnow_routing import RoutingIndex
+from espnow_layout import IncrementalLayout
+
+TARGET_LOAD_MS = 100.0
+
+
+def synthetic(n, degree, seed=1):
+    rng = random.Random(seed)
+    t = TopologyStore(); t.node('ALL')
+    macs = [int_to_mac(0x240AC4000000 + i) for i in range(n)]
+    pos = {}
+    for i, m in enumerate(macs):
+        t.set_addr(m, (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 4210))
+        t.set_edge_status(m, 'ALL', EDGE_BASE)
+        pos[m] = (rng.random(), rng.random())
+    for _ in range(n * degree // 2):
+        a, b = rng.sample(macs, 2)
+        t.set_edge_status(a, b, EDGE_ESTABLISHED if rng.random() < 0.6 else EDGE_BASE)
+    m = t.n_edges; e = t.edges
+    e.ok_ratio[:m] = np.random.default_rng(seed).uniform(0.3, 1.0, m); e.samples[:m] = 10; e.last_seen[:m] = time.time()
+    t.set_positions(pos)
+    return t
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=10000)
+    ap.add_argument('--degree', type=int, default=10)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+    topo = synthetic(args.nodes, args.degree)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.espc')
+    names, cols = topo.export_columns()
+    best_save = best_load = best_routing = float('inf')
+    for _ in range(args.repeat):
+        t0 = time.perf_counter(); size = save_checkpoint(path, names, cols, {'journal_ns': 0})
+        best_save = min(best_save, time.perf_counter() - t0)
+        t0 = time.perf_counter(); t2, _, _ = load_checkpoint(path); best_load = min(best_load, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        est = t2.rows_with_status(EDGE_ESTABLISHED); routing = RoutingIndex()
+        routing.load_rows(t2.node_names(), t2.edges.eu[est], t2.edges.ev[est])
+        best_routing = min(best_routing, time.perf_counter() - t0)
+    assert t2.edge_pairs() == topo.edge_pairs() and t2.positions() == topo.positions()
+    ref = RoutingIndex(); pairs = t2.edge_pairs()
+    ref.load_edges(pairs[r] for r in est.tolist())
+    assert {u: set(vs) for u, vs in routing._adj.items()} == ref._adj
+    pos = t2.positions()
+    t0 = time.perf_counter()
+    layout = IncrementalLayout(fixed={'ALL': (0.5, 0.1)}, initial=pos).start()
+    layout.update_graph(t2.node_names(), t2.edge_pairs())
+    while len(layout.positions()) < t2.n_nodes: time.sleep(0.001)
+    t_layout = time.perf_counter() - t0
+    time.sleep(0.2); layout.stop()
+    moved = sum(1 for v, xy in layout.positions().items() if v in pos and xy != pos[v])
+    total = best_load + best_routing
+    print(f"Red: {t2.n_nodes - 1} nodos, {t2.n_edges} aristas, checkpoint {size / 1024:.0f} KiB")
+    print(f"Escritura: {best_save * 1e3:.1f} ms | carga: {best_load * 1e3:.1f} ms + índice de rutas {best_routing * 1e3:.1f} ms "
+          f"= {total * 1e3:.1f} ms (mejor de {args.repeat})")
+    print(f"Layout con posiciones del checkpoint: publicado en {t_layout * 1e3:.0f} ms, "
+          f"{layout.iterations_run} iteraciones de fuerzas, {moved} nodos movidos")
+    ok = total * 1e3 < TARGET_LOAD_MS
+    print(f"{'OK' if ok else 'FALLO'}: objetivo de carga < {TARGET_LOAD_MS:.0f} ms")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
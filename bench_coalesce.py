@@ -0,0 +1,57 @@
+# --- bench_coalesce: tormenta de descubrimiento con y sin datagramas agrupados ---
+#
+# Arranca un MonitorEngine y una flota espnow_sim en el mismo proceso, hace
+# que cada nodo emita broadcasts ESP-NOW durante unos segundos y compara:
+#   - sin agrupar (un datagrama por reporte, como el firmware actual) y sin
+#     ventana de BROADCAST_RECV
+#   - reportes agrupados por nodo (--coalesce) y ventana de BROADCAST_RECV
+# Cuenta datagramas recibidos (= recvfrom del monitor), lotes de ingesta
+# (= tomas del lock del grafo por la ingesta) y actualizaciones del grafo
+# por BROADCAST_RECV.
+#
+# Uso: python bench_coalesce.py [--nodes 150] [--rate 10] [--seconds 5] [--coalesce 0.02] [--binary]
+
+import argparse, time
+from espnow_engine import MonitorEngine, BROADCAST_WINDOW
+from espnow_sim import SimFleet
+
+SETTLE = 1.0  # segundos tras la tormenta para vaciar colas y ventanas
+
+
+def run(args, coalesce, window):
+    engine = MonitorEngine(0, bind='127.0.0.1', broadcast_window=window).start()
+    fleet = SimFleet(args.nodes, ('127.0.0.1', engine.port), join_rate=2000, seed=args.seed,
+                     binary=args.binary, coalesce=coalesce).start()
+    t_join = fleet.join_all()
+    end = fleet.flood(args.rate, args.seconds, t_join + 0.2)
+    time.sleep(end + SETTLE)
+    fleet.stop(); time.sleep(0.3)
+    ing = engine.ingest.stats(); c = dict(engine.ingest_counts)
+    engine.stop()
+    return {'reports': fleet.counts['reports'], 'datagrams': ing['received'], 'batches': ing['batches'],
+            'events': c['events'], 'bcast': c['broadcast_recv'], 'bcast_applied': c['broadcast_applied'], 'dropped': ing['dropped'], 'nodes': len(engine.topo.node_names()) - 1}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=150)
+    ap.add_argument('--rate', type=float, default=10.0, help="broadcasts por nodo y segundo")
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--coalesce', type=float, default=0.02, help="segundos de agrupación por nodo")
+    ap.add_argument('--binary', action='store_true')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+    base = run(args, 0.0, 0.0)
+    coal = run(args, args.coalesce, BROADCAST_WINDOW)
+    print(f"{'':28s} {'sin agrupar':>12s} {'agrupado':>12s} {'x':>7s}")
+    rows = [('reportes de los nodos', 'reports'), ('datagramas (recvfrom)', 'datagrams'),
+            ('lotes de ingesta (lock)', 'batches'), ('eventos decodificados', 'events'),
+            ('BROADCAST_RECV recibidos', 'bcast'), ('BROADCAST_RECV aplicados', 'bcast_applied')]
+    for name, k in rows:
+        print(f"{name:28s} {base[k]:12,d} {coal[k]:12,d} {base[k] / max(coal[k], 1):7.1f}")
+    print(f"nodos en el grafo: {base['nodes']} / {coal['nodes']}  descartes en cola: {base['dropped']} / {coal['dropped']}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
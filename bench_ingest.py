@@ -0,0 +1,95 @@
+# --- bench_ingest: generador de carga UDP local para espnow_ingest ---
+#
+# Lanza procesos emisores que inundan un puerto de loopback con líneas
+# reales del firmware (BROADCAST_RECV, UNICAST_RECV, ACKs...) a un ritmo
+# objetivo, y mide cuántos datagramas por segundo entrega IngestEngine al
+# manejador, además de descartes en el buffer circular y pérdidas del kernel.
+#
+# Uso: python bench_ingest.py [--rate 60000] [--seconds 5] [--senders 2]
+
+import argparse, multiprocessing, socket, threading, time
+from espnow_ingest import IngestEngine
+
+TARGET_RATE = 50000  # datagramas/s que debe sostener el motor
+
+
+def sample_lines(n_nodes=300):
+    macs = [':'.join(f"{(i >> s) & 0xFF:02X}" for s in (40, 32, 24, 16, 8, 0)) for i in range(0x24A1600000, 0x24A1600000 + n_nodes)]
+    lines = []
+    for i, mac in enumerate(macs):
+        other = macs[(i * 7 + 1) % n_nodes]
+        lines.append(f"<{mac}> CMD:BROADCAST_RECV {other} ping".encode())
+        lines.append(f"<{mac}> CMD:UNICAST_RECV {other} data_ab12".encode())
+        lines.append(f"ACK_ROUTE_ESPNOW_SENT {mac} {other} ab12cd34".encode())
+    return lines
+
+
+def sender(port, rate, seconds, counter):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    lines = sample_lines(); n = len(lines)
+    dest = ('127.0.0.1', port)
+    burst = 200
+    sent = 0
+    t0 = time.perf_counter(); deadline = t0 + seconds
+    while True:
+        now = time.perf_counter()
+        if now >= deadline: break
+        # Ritmo constante: no adelantarse a rate * tiempo transcurrido
+        due = int((now - t0) * rate)
+        if sent >= due:
+            time.sleep(0.0005); continue
+        for _ in range(min(burst, due - sent)):
+            try:
+                s.sendto(lines[sent % n], dest)
+            except BlockingIOError:
+                continue  # Cola del socket emisor llena; no cuenta como enviado
+            sent += 1
+    with counter.get_lock(): counter.value += sent
+    s.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rate', type=int, default=60000, help='datagramas/s totales a emitir')
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--senders', type=int, default=2)
+    ap.add_argument('--port', type=int, default=0)
+    args = ap.parse_args()
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', args.port))
+    port = rx.getsockname()[1]
+
+    handled = [0]
+    def handler(batch):
+        handled[0] += len(batch)
+
+    engine = IngestEngine(rx, handler, lock=threading.Lock()).start()
+    counter = multiprocessing.Value('q', 0)
+    procs = [multiprocessing.Process(target=sender, args=(port, args.rate / args.senders, args.seconds, counter))
+             for _ in range(args.senders)]
+    t0 = time.perf_counter()
+    for p in procs: p.start()
+    for p in procs: p.join()
+    # Esperar a que el consumidor vacíe la cola
+    idle_since = time.perf_counter(); last = -1
+    while time.perf_counter() - idle_since < 0.5:
+        if handled[0] != last: last = handled[0]; idle_since = time.perf_counter()
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - t0 - 0.5
+    engine.stop(); rx.close()
+
+    st = engine.stats(); sent = counter.value
+    rate = handled[0] / args.seconds
+    print(f"Enviados: {sent}  Recibidos: {st['received']}  Entregados: {handled[0]}")
+    print(f"Perdidos en kernel: {sent - st['received']}  Descartados en cola: {st['dropped']}  "
+          f"Profundidad máx. cola: {st['queue_max_depth']}  Lotes: {st['batches']} "
+          f"(media {handled[0] / max(st['batches'], 1):.1f} dgr/lote)")
+    print(f"Ritmo sostenido: {rate:,.0f} dgr/s (ventana de emisión {args.seconds:.1f} s, total {elapsed:.2f} s)")
+    ok = rate >= TARGET_RATE and st['dropped'] == 0
+    print(f"{'OK' if ok else 'FALLO'}: objetivo {TARGET_RATE:,} dgr/s")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+# --- bench_outbound: comandos salientes con y sin ritmo por nodo (espnow_outbound) en loopback ---
+#
+# En otro proceso arranca --nodes nodos virtuales (espnow_sim) que atienden
+# UDP como el firmware: un datagrama por vuelta de --firmware-loop segundos
+# y un buzón de --mailbox datagramas (lo demás se pierde). Este proceso les
+# manda --per-node ROUTE_STEP a cada uno de golpe (como un lote en estrella)
+# por un CommandScheduler y cuenta los ACK_ROUTE_STEP_RECEIVED que vuelven:
+# cada ACK es un comando que el nodo llegó a leer. Para cada variante:
+#   sin ritmo        : rate=0, todo sale en cuanto se encola (lo de antes)
+#   sin ritmo+mmsg   : igual, con sendmmsg desde el primer datagrama (menos llamadas)
+#   ritmo            : NODE_RATE / NODE_BURST por nodo
+#   ritmo alto+reint.: --fast-rate por nodo (más que lo que drena el firmware)
+#                      y reintento de los ROUTE_STEP sin ACK
+# mide comandos leídos por segundo (hasta el último ACK), pérdida, llamadas
+# al sistema y reintentos. Los nodos virtuales comparten la CPU con el banco:
+# con 1 CPU y muchos nodos el simulador se retrasa, sus vueltas de loop()
+# llegan tarde y pierde comandos aunque lleguen con ritmo (de ahí los 50 por
+# defecto).
+#
+# Uso: python bench_outbound.py [--nodes 50] [--per-node 40] [--firmware-loop 0.01] [--mailbox 6] [--fast-rate 200]
+
+import argparse, multiprocessing as mp, os, socket, threading, time
+
+
+def fleet_proc(n, server, udp_loop, mailbox, conn):
+    from espnow_sim import SimFleet
+    fleet = SimFleet(n, server, loss=0.0, edge_loss=0.0, seed=5, udp_loop=udp_loop, mailbox=mailbox).start()
+    conn.send([(nd.mac, nd.sock.getsockname()) for nd in fleet.nodes])
+    conn.recv() # Hasta que el banco termine
+    conn.send(fleet.counts['udp_dropped'])
+    fleet.stop()
+
+
+def collect(sock, acks, stop, sched):
+    # Cuenta los ACK_ROUTE_STEP_RECEIVED (id único por comando) y avisa al planificador
+    sock.settimeout(0.1)
+    while not stop.is_set():
+        try: data = sock.recv(2048)
+        except socket.timeout: continue
+        for line in data.decode('utf-8', 'replace').split('\n'):
+            if line.startswith('ACK_ROUTE_STEP_RECEIVED '):
+                _, mac, msg_id = line.split(' ', 2)
+                if msg_id not in acks: acks[msg_id] = time.perf_counter()
+                if sched[0] is not None: sched[0].ack_step(mac, msg_id)
+
+
+def run(name, nodes, args, acks, sched, **kw):
+    from espnow_outbound import CommandScheduler
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 22)
+    track = kw.pop('track', False)
+    s = sched[0] = CommandScheduler(tx, **kw).start()
+    acks.clear(); tag = name[:2]
+    t0 = time.perf_counter(); sent = 0
+    with s.held(): # Todo de golpe, como un lote que encola a todos los nodos a la vez
+        for k in range(args.per_node):
+            for mac, addr in nodes:
+                msg_id = f"{tag}{k:03d}{mac[-5:].replace(':', '')}"
+                s.send(f"ROUTE_STEP {mac} {mac} {msg_id} data_{k}".encode(), addr, mac if track else None); sent += 1
+    s.wait_idle(120)
+    time.sleep(max(0.5, 3 * args.firmware_loop * args.mailbox)) # Lo que quede en buzones y reintentos en vuelo
+    while s.stats()['unacked_steps'] and time.perf_counter() - t0 < 120: s.wait_idle(1); time.sleep(0.2)
+    st = s.stats(); s.stop(); sched[0] = None; tx.close()
+    got = len(acks); last = max(acks.values()) if acks else t0
+    return {'name': name, 'sent': sent, 'got': got, 'rate': got / max(last - t0, 1e-9), 'loss': 100 * (1 - got / sent),
+            'syscalls': st['syscalls'], 'retries': st['step_retries'], 'overflow': st['overflow'], 'time': last - t0}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=50)
+    ap.add_argument('--per-node', type=int, default=40, help="ROUTE_STEP por nodo en la ráfaga")
+    ap.add_argument('--firmware-loop', type=float, default=0.01, metavar='S')
+    ap.add_argument('--mailbox', type=int, default=6)
+    ap.add_argument('--fast-rate', type=float, default=200.0, help="comandos/s por nodo de la última variante")
+    args = ap.parse_args()
+    from espnow_outbound import NODE_RATE, NODE_BURST
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22); rx.bind(('127.0.0.1', 0))
+    here, there = mp.Pipe()
+    proc = mp.get_context('spawn').Process(target=fleet_proc, args=(args.nodes, rx.getsockname(), args.firmware_loop, args.mailbox, there))
+    proc.start(); nodes = here.recv()
+    acks = {}; sched = [None]; stop = threading.Event()
+    th = threading.Thread(target=collect, args=(rx, acks, stop, sched), daemon=True); th.start()
+    print(f"[i] {os.cpu_count()} CPU; {args.nodes} nodos virtuales (1 datagrama cada {args.firmware_loop * 1e3:g} ms, "
+          f"buzón {args.mailbox}), {args.per_node} ROUTE_STEP por nodo de golpe")
+    variants = [('sin ritmo', dict(rate=0, batch=False)),
+                ('sin ritmo+mmsg', dict(rate=0, batch=True, batch_min=1)),
+                (f'ritmo {NODE_RATE:g}/s ráfaga {NODE_BURST}', dict()),
+                (f'ritmo {args.fast_rate:g}/s+reint.', dict(rate=args.fast_rate, burst=8, track=True))]
+    for name, kw in variants:
+        r = run(name, nodes, args, acks, sched, **kw)
+        print(f"    {r['name']:22s}: {r['got']:6d}/{r['sent']} leídos, {r['rate']:7.0f} comandos/s, pérdida {r['loss']:5.1f} %, "
+              f"{r['time']:5.2f} s, {r['syscalls']:6d} llamadas, {r['retries']:5d} reintentos", flush=True)
+    stop.set(); th.join()
+    here.send(None); dropped = here.recv(); proc.join()
+    print(f"[i] Descartados en los buzones de los nodos: {dropped}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
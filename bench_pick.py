@@ -0,0 +1,64 @@
+# --- bench_pick: selección de nodos con índice espacial (espnow_spatial) frente al recorrido lineal ---
+#
+# Para cada tamaño de red (--sizes) coloca los nodos al azar en el cuadrado
+# unidad (como el layout) y mide, con --clicks clics al azar:
+#   lineal : el on_click() anterior (recorre todos los nodos con el filtro de caja)
+#   rejilla: GridIndex.nearest
+# y comprueba que los dos eligen el mismo nodo. También mide update() cuando
+# el layout publica posiciones nuevas con un 1 % de nodos movidos (lo normal:
+# solo se mueven los nodos calientes) frente a reconstruir el índice, y una
+# selección por caja de ~--box nodos.
+#
+# Uso: python bench_pick.py [--sizes 1000,10000,50000] [--clicks 2000] [--box 300]
+
+import argparse, random, time
+from espnow_spatial import GridIndex
+
+RADIUS_SQ = 0.0025 # NODE_CLICK_RADIUS_SQ del monitor
+
+
+def linear_pick(pos, nodes, x, y):
+    clicked = None; min_d_sq = RADIUS_SQ; r = RADIUS_SQ ** 0.5
+    for n in nodes:
+        if n in pos:
+            xn, yn = pos[n]
+            if abs(xn - x) < r and abs(yn - y) < r:
+                d_sq = (xn - x) ** 2 + (yn - y) ** 2
+                if d_sq < min_d_sq: clicked = n; min_d_sq = d_sq
+    return clicked
+
+
+def run(n, args):
+    rng = random.Random(n)
+    pos = {f"24:0A:C4:{i >> 16 & 255:02X}:{i >> 8 & 255:02X}:{i & 255:02X}": (rng.random(), rng.random()) for i in range(n)}
+    nodes = tuple(pos)
+    clicks = [(rng.random(), rng.random()) for _ in range(args.clicks)]
+    t0 = time.perf_counter(); ref = [linear_pick(pos, nodes, x, y) for x, y in clicks]; t_lin = time.perf_counter() - t0
+    index = GridIndex()
+    t0 = time.perf_counter(); index.update(pos); t_build = time.perf_counter() - t0
+    t0 = time.perf_counter(); got = [index.nearest(x, y, RADIUS_SQ ** 0.5) for x, y in clicks]; t_grid = time.perf_counter() - t0
+    moved = dict(pos)
+    for v in rng.sample(nodes, max(1, n // 100)): x, y = moved[v]; moved[v] = (x + rng.uniform(-0.02, 0.02), y + rng.uniform(-0.02, 0.02))
+    t0 = time.perf_counter(); index.update(moved); t_inc = time.perf_counter() - t0
+    side = (args.box / n) ** 0.5; x0, y0 = rng.random() * (1 - side), rng.random() * (1 - side)
+    t0 = time.perf_counter(); box = index.in_box(x0, y0, x0 + side, y0 + side); t_box = time.perf_counter() - t0
+    return {'n': n, 'lin': t_lin / len(clicks), 'grid': t_grid / len(clicks), 'same': sum(a == b for a, b in zip(ref, got)),
+            'build': t_build, 'inc': t_inc, 'box': t_box, 'box_n': len(box), 'clicks': len(clicks)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='1000,10000,50000')
+    ap.add_argument('--clicks', type=int, default=2000)
+    ap.add_argument('--box', type=int, default=300, help="nodos esperados en la caja")
+    args = ap.parse_args()
+    for n in (int(x) for x in args.sizes.split(',')):
+        r = run(n, args)
+        print(f"    {r['n']:6d} nodos: clic lineal {r['lin'] * 1e6:8.1f} µs, rejilla {r['grid'] * 1e6:5.1f} µs "
+              f"(x{r['lin'] / r['grid']:.0f}, mismo nodo {r['same']}/{r['clicks']}) | índice: construir {r['build'] * 1e3:6.1f} ms, "
+              f"1 % movidos {r['inc'] * 1e3:5.1f} ms | caja de {r['box_n']} nodos {r['box'] * 1e3:.2f} ms", flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# --- bench_protocol: microbenchmark del parser frente a la cascada de regex ---
+#
+# Compara espnow_protocol.parse_datagram con la cadena de regex que usaban
+# listener() en monitor_espnow6.py / monitor_espnow11.py (decode completo +
+# hasta cinco match/search por datagrama) sobre una mezcla de tráfico típica
+# de una tormenta de descubrimiento. También compara tamaño y coste de
+# parseo de las mismas tramas en el formato binario (parse_binary).
+#
+# Uso: python bench_protocol.py [--n 200000]
+
+import argparse, re, time
+from espnow_protocol import parse_datagram, encode_cmd, encode_ack_route_step, encode_ack_espnow_sent, encode_fail_espnow_sent, encode_route_delivered
+
+pattern_cmd = re.compile(r'<([0-9A-F:]{17})>\s+CMD:(\w+)(?:\s+([0-9A-F:]{17}))?(?:\s+(.*))?')
+pattern_recv = re.compile(r'RECEIVED\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})')
+pattern_route_delivered = re.compile(r'ROUTE_DELIVERED\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)\s+(.*)')
+pattern_ack_route_step_rcvd = re.compile(r'ACK_ROUTE_STEP_RECEIVED\s+([0-9A-F:]{17})\s+([\w-]+)')
+pattern_ack_route_espnow_sent = re.compile(r'ACK_ROUTE_ESPNOW_SENT\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)')
+
+
+def regex_chain(data):
+    # Mismo orden que listener() de monitor_espnow6.py
+    line = data.decode().strip()
+    m = pattern_ack_route_step_rcvd.match(line)
+    if m: return m.groups()
+    m = pattern_ack_route_espnow_sent.match(line)
+    if m: return m.groups()
+    m = pattern_route_delivered.match(line)
+    if m: return m.groups()
+    m = pattern_recv.match(line)
+    if m: return m.groups()
+    m = pattern_cmd.search(line)
+    if m: return m.groups()
+    return None
+
+
+MIX = [  # (peso, línea)
+    (70, b"<24:0A:C4:12:34:56> CMD:BROADCAST_RECV 24:0A:C4:65:43:21 ping_servidor_python"),
+    (10, b"<24:0A:C4:12:34:56> CMD:UNICAST_RECV 24:0A:C4:65:43:21 data_ab12"),
+    (5, b"<24:0A:C4:12:34:56> CMD:JOIN"),
+    (4, b"<24:0A:C4:12:34:56> CMD:SEND_FAIL_TO 24:0A:C4:65:43:21"),
+    (4, b"ACK_ROUTE_STEP_RECEIVED 24:0A:C4:12:34:56 ab12cd34"),
+    (4, b"ACK_ROUTE_ESPNOW_SENT 24:0A:C4:12:34:56 24:0A:C4:65:43:21 ab12cd34"),
+    (2, b"ROUTE_DELIVERED 24:0A:C4:65:43:21 24:0A:C4:12:34:56 ab12cd34 data_ab12"),
+    (1, b"FAIL_ROUTE_ESPNOW_SENT 24:0A:C4:12:34:56 24:0A:C4:65:43:21 ab12cd34 ERR:12393"),
+]
+
+
+def to_binary(line):
+    # Línea de texto -> la misma trama en formato binario
+    ev = parse_datagram(line); k = type(ev).__name__
+    if k == 'CmdEvent': return encode_cmd(ev.mac, ev.cmd, ev.target, ev.payload)
+    if k == 'AckRouteStep': return encode_ack_route_step(ev.node, ev.msg_id)
+    if k == 'AckEspnowSent': return encode_ack_espnow_sent(ev.sender, ev.sent_to, ev.msg_id)
+    if k == 'FailEspnowSent': return encode_fail_espnow_sent(ev.sender, ev.sent_to, ev.msg_id, ev.error)
+    return encode_route_delivered(ev.final_dest, ev.prev_hop, ev.msg_id, ev.payload)
+
+
+def _once(fn, lines):
+    t0 = time.process_time()
+    for l in lines: fn(l)
+    return time.process_time() - t0
+
+
+def run_pair(lines, repeat=9):
+    # Pasadas alternadas regex/parser; se queda con la mejor de cada una
+    # para filtrar el ruido del planificador.
+    best_r = best_p = float('inf')
+    for _ in range(repeat):
+        best_r = min(best_r, _once(regex_chain, lines))
+        best_p = min(best_p, _once(parse_datagram, lines))
+    return best_r, best_p
+
+
+def run_formats(text_lines, bin_lines, repeat=9):
+    # Igual que run_pair, pero el mismo parser sobre texto y sobre binario
+    best_t = best_b = float('inf')
+    for _ in range(repeat):
+        best_t = min(best_t, _once(parse_datagram, text_lines))
+        best_b = min(best_b, _once(parse_datagram, bin_lines))
+    return best_t, best_b
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=200000)
+    args = ap.parse_args()
+    unit = [l for w, l in MIX for _ in range(w)]
+    lines = (unit * (args.n // len(unit) + 1))[:args.n]
+    run_pair(lines[:1000], 1)  # calentamiento
+    print(f"{'línea':<26}{'regex ns':>10}{'parser ns':>11}{'x':>7}")
+    for _, l in MIX:
+        batch = [l] * 20000
+        tr, tp = (t / len(batch) * 1e9 for t in run_pair(batch))
+        print(f"{l.split(b' ')[0 if l[0] != 60 else 1].decode()[:25]:<26}{tr:>10.0f}{tp:>11.0f}{tr / tp:>7.2f}")
+    tr, tp = run_pair(lines, 5)
+    print(f"Mezcla ({args.n} líneas): regex {args.n / tr:,.0f} l/s  parser {args.n / tp:,.0f} l/s  ({tr / tp:.2f}x)")
+
+    print(f"\n{'trama':<26}{'texto B':>9}{'bin B':>7}{'texto ns':>10}{'bin ns':>8}{'x':>7}")
+    for _, l in MIX:
+        b = to_binary(l)
+        assert repr(parse_datagram(b)) == repr(parse_datagram(l)), (l, parse_datagram(b))
+        tt, tb = (t / 20000 * 1e9 for t in run_formats([l] * 20000, [b] * 20000))
+        print(f"{l.split(b' ')[0 if l[0] != 60 else 1].decode()[:25]:<26}{len(l):>9}{len(b):>7}{tt:>10.0f}{tb:>8.0f}{tt / tb:>7.2f}")
+    blines = [to_binary(l) for l in unit]; blines = (blines * (args.n // len(blines) + 1))[:args.n]
+    tt, tb = run_formats(lines, blines, 5)
+    st = sum(map(len, lines)) / len(lines); sb = sum(map(len, blines)) / len(blines)
+    print(f"Mezcla: texto {st:.1f} B/trama {args.n / tt:,.0f} t/s | binario {sb:.1f} B/trama {args.n / tb:,.0f} t/s "
+          f"({st / sb:.2f}x menos bytes, {tt / tb:.2f}x más rápido)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# --- bench_render: tiempo por frame de GraphRenderer frente al dibujo por arista ---
+#
+# Mide, con el backend Agg, el coste de un frame con GraphRenderer (solo se
+# actualizan colores/anchos/offsets) y el de la forma anterior de
+# monitor_espnow11.update(): ax.cla() + draw_networkx_* y un
+# draw_networkx_edges por arista. El update() medido incluye lo que hace el
+# monitor en cada frame: colores por tabla a partir de los códigos de estado
+# de arista y de los visuales temporales (edge_style) y de los de nodo.
+#
+# Uso: python bench_render.py [--nodes 1000] [--edges 5000] [--frames 30]
+
+import argparse, os, random, time
+os.environ.setdefault('MPLBACKEND', 'Agg')
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+from espnow_render import GraphRenderer, style_table, edge_style
+
+TARGET_MS = 16.0
+COLORS = ['black', 'red', 'lime', 'green']  # visuales temporales
+EDGE_STYLE = {0: ('lightgray', 2.0, 0.5), 1: ('lightblue', 2.0, 0.8), 2: ('red', 2.0, 0.7)}
+NODE_STYLE = {0: ('skyblue', 0, 0.9), 1: ('orange', 0, 0.9)}
+
+
+def make_graph(n, m, seed=7):
+    # Malla "realista": posiciones aleatorias y aristas entre vecinos cercanos
+    # (como las de un layout de fuerzas), no segmentos que cruzan toda la figura.
+    rng = np.random.default_rng(seed)
+    nodes = [f"24:0A:C4:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}" for i in range(n)]
+    xy = rng.random((n, 2))
+    k = max(2, 2 * m // n + 2)
+    d2 = ((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+    near = np.argsort(d2, axis=1)[:, 1:k + 1]
+    edges = set()
+    while len(edges) < m:
+        a = int(rng.integers(n)); b = int(near[a, rng.integers(k)])
+        edges.add((min(a, b), max(a, b)))
+    pos = dict(zip(nodes, map(tuple, xy.tolist())))
+    return nodes, [(nodes[u], nodes[v]) for u, v in edges], pos
+
+
+def bench_renderer(nodes, edges, pos, frames):
+    fig = plt.figure(figsize=(13, 9)); ax = fig.add_axes([0.05, 0.08, 0.9, 0.88]); ax.set_axis_off()
+    r = GraphRenderer(ax, edge_width=2.0)
+    rnd = random.Random(1)
+    index = {v: i for i, v in enumerate(nodes)}
+    eu = np.array([index[u] for u, _ in edges], np.int32); ev = np.array([index[v] for _, v in edges], np.int32)
+    etab = style_table(EDGE_STYLE); ntab = style_table(NODE_STYLE)
+    status = np.zeros(len(edges), np.uint8); codes = np.zeros(len(nodes), np.uint8); temps = {}
+
+    def frame():
+        ecol, ewid = edge_style(status, etab, temps=temps)
+        return r.update(1, nodes, eu, ev, pos, ntab[0][codes], ecol, ewid)
+
+    frame(); fig.canvas.draw()
+    upd = draw = 0.0
+    for _ in range(frames):
+        # Cambios típicos de un frame: unas aristas cambian de estado, unas pocas con visual temporal y un nodo activo
+        status = status.copy(); status[rnd.sample(range(len(edges)), 20)] = rnd.randrange(3)
+        temps = {i: (rnd.choice(COLORS), 3.0) for i in rnd.sample(range(len(edges)), 20)}
+        codes = np.zeros(len(nodes), np.uint8); codes[rnd.randrange(len(nodes))] = 1
+        t0 = time.perf_counter()
+        frame()
+        t1 = time.perf_counter()
+        fig.canvas.draw()
+        t2 = time.perf_counter()
+        upd += t1 - t0; draw += t2 - t1
+    t0 = time.perf_counter()
+    for _ in range(frames): frame()
+    idle = (time.perf_counter() - t0) / frames
+    plt.close(fig)
+    return upd / frames, draw / frames, idle
+
+
+def bench_per_edge(nodes, edges, pos, frames):
+    fig = plt.figure(figsize=(13, 9)); ax = fig.add_axes([0.05, 0.08, 0.9, 0.88])
+    G = nx.Graph(); G.add_nodes_from(nodes); G.add_edges_from(edges)
+    total = 0.0
+    for _ in range(frames):
+        t0 = time.perf_counter()
+        ax.cla(); ax.set_axis_off()
+        nx.draw_networkx_nodes(G, pos, ax=ax, node_size=700, alpha=0.9, edgecolors='black', linewidths=1.0)
+        nx.draw_networkx_labels(G, pos, ax=ax, font_size=8, font_weight='bold')
+        for u, v in G.edges():
+            nx.draw_networkx_edges(G, pos, ax=ax, edgelist=[(u, v)], edge_color='lightgray', width=2.0, alpha=0.5)
+        fig.canvas.draw()
+        total += time.perf_counter() - t0
+    plt.close(fig)
+    return total / frames
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=1000)
+    ap.add_argument('--edges', type=int, default=5000)
+    ap.add_argument('--frames', type=int, default=30)
+    ap.add_argument('--legacy-edges', type=int, default=200, help='aristas para la medida del método anterior')
+    args = ap.parse_args()
+
+    nodes, edges, pos = make_graph(args.nodes, args.edges)
+    upd, draw, idle = bench_renderer(nodes, edges, pos, args.frames)
+    print(f"GraphRenderer {args.nodes} nodos / {args.edges} aristas:")
+    print(f"  update(): {upd * 1e3:.2f} ms  canvas.draw(): {draw * 1e3:.2f} ms  "
+          f"frame sin cambios: {idle * 1e3:.3f} ms (no se redibuja)")
+    ok = upd * 1e3 < TARGET_MS
+    print(f"  {'OK' if ok else 'FALLO'}: update() < {TARGET_MS:.0f} ms (el rasterizado de Agg depende del backend y del tamaño de la figura)")
+
+    ln, le, lp = make_graph(min(args.nodes, 100), args.legacy_edges)
+    legacy = bench_per_edge(ln, le, lp, 3)
+    print(f"Método anterior (cla + draw por arista) con solo {len(ln)} nodos / {len(le)} aristas: {legacy * 1e3:.0f} ms por frame")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
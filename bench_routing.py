@@ -0,0 +1,91 @@
+# --- bench_routing: consultas de ruta con RoutingIndex frente a G_est + nx.shortest_path ---
+#
+# Malla geométrica de N nodos (vecinos cercanos). Mide:
+#   - el método anterior: reconstruir G_est recorriendo todas las aristas y
+#     llamar a nx.shortest_path en cada consulta
+#   - RoutingIndex con árboles en caché, sin cambios y con cambios de
+#     aristas intercalados (una arista que cambia cada --churn consultas)
+# y comprueba que las longitudes coinciden con networkx.
+#
+# Uso: python bench_routing.py [--nodes 1000] [--degree 6] [--queries 20000] [--churn 100]
+
+import argparse, random, time
+import networkx as nx
+import numpy as np
+from espnow_routing import RoutingIndex
+
+
+def make_mesh(n, degree, seed=7):
+    rng = np.random.default_rng(seed)
+    xy = rng.random((n, 2))
+    d2 = ((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+    near = np.argsort(d2, axis=1)[:, 1:degree + 1]
+    nodes = [f"24:0A:C4:00:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}" for i in range(n)]
+    edges = {(nodes[min(a, b)], nodes[max(a, b)]) for a in range(n) for b in near[a].tolist()}
+    return nodes, sorted(edges)
+
+
+def bench_legacy(nodes, edges, queries):
+    status = {e: 'established' for e in edges}
+    t0 = time.perf_counter()
+    for s, d in queries:
+        G_est = nx.Graph()
+        for (u, v), st in status.items():
+            if st == 'established': G_est.add_edge(u, v)
+        try: nx.shortest_path(G_est, source=s, target=d)
+        except (nx.NetworkXNoPath, nx.NodeNotFound): pass
+    return (time.perf_counter() - t0) / len(queries)
+
+
+def bench_index(r, queries, churn_edges=None, churn=0):
+    t0 = time.perf_counter()
+    flips = 0
+    for k, (s, d) in enumerate(queries):
+        if churn and k % churn == 0:
+            u, v = churn_edges[flips % len(churn_edges)]
+            r.set_edge(u, v, v not in r.neighbors(u)); flips += 1
+        r.path(s, d)
+    return (time.perf_counter() - t0) / len(queries)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=1000)
+    ap.add_argument('--degree', type=int, default=6)
+    ap.add_argument('--queries', type=int, default=20000)
+    ap.add_argument('--sources', type=int, default=50, help='orígenes distintos (nodos que se suelen seleccionar)')
+    ap.add_argument('--churn', type=int, default=100)
+    args = ap.parse_args()
+
+    nodes, edges = make_mesh(args.nodes, args.degree)
+    rnd = random.Random(1)
+    sources = rnd.sample(nodes, args.sources)
+    queries = [(rnd.choice(sources), rnd.choice(nodes)) for _ in range(args.queries)]
+    print(f"Malla: {len(nodes)} nodos / {len(edges)} aristas; {args.queries} consultas desde {args.sources} orígenes")
+
+    r = RoutingIndex()
+    for u, v in edges: r.set_edge(u, v, True)
+    G = nx.Graph(edges)
+    for s, d in queries[:500]:
+        p = r.path(s, d)
+        ok = (p is None and not nx.has_path(G, s, d)) or (p is not None and len(p) == nx.shortest_path_length(G, s, d) + 1)
+        assert ok, (s, d, p)
+
+    legacy = bench_legacy(nodes, edges, queries[:50])
+    r = RoutingIndex()
+    for u, v in edges: r.set_edge(u, v, True)
+    cold = bench_index(r, [(s, nodes[0]) for s in sources])
+    warm = bench_index(r, queries)
+    churn_edges = rnd.sample(edges, 200)
+    inv0 = r.invalidations; miss0 = r.misses
+    churned = bench_index(r, queries, churn_edges, args.churn)
+    print(f"G_est + nx.shortest_path por consulta: {legacy * 1e6:9.0f} us  ({1 / legacy:8.0f} consultas/s)")
+    print(f"RoutingIndex, primer árbol por origen: {cold * 1e6:9.0f} us")
+    print(f"RoutingIndex, árboles en caché:        {warm * 1e6:9.1f} us  ({1 / warm:8.0f} consultas/s, {legacy / warm:.0f}x)")
+    print(f"RoutingIndex, 1 cambio cada {args.churn:<4d}     : {churned * 1e6:9.1f} us  ({1 / churned:8.0f} consultas/s; "
+          f"{r.invalidations - inv0} árboles invalidados, {r.misses - miss0} recalculados)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,122 @@
+# --- bench_split: ingesta con la GUI dibujando, en hilos frente a procesos ---
+#
+# Monta una red de --nodes nodos y --edges aristas 'established' enviando
+# JOIN y UNICAST_RECV por UDP, y después, durante --seconds, un proceso
+# emisor inyecta latidos (JOIN) y BROADCAST_RECV entre vecinos conocidos a
+# --rate datagramas/s mientras el hilo principal redibuja el grafo completo sin parar (backend
+# Agg, canvas.draw() por frame). Mide eventos aplicados por segundo y
+# frames por segundo en tres modos:
+#   solo      motor sin GUI (referencia)
+#   hilos     monitor_espnow11 normal: motor y GUI comparten proceso y GIL
+#   procesos  monitor_espnow11 --split: motor en otro proceso, estado por memoria compartida
+#
+# Uso: python bench_split.py [--nodes 1000] [--edges 5000] [--rate 8000] [--seconds 5]
+
+import argparse, multiprocessing as mp, os, random, socket, time
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+def mac(i): return ':'.join(f"{(i >> s) & 0xFF:02X}" for s in (40, 32, 24, 16, 8, 0))
+
+
+def topology_lines(n, m, seed=1):
+    rng = random.Random(seed); macs = [mac(0x24A1600000 + i) for i in range(n)]
+    lines = [f"<{v}> CMD:JOIN".encode() for v in macs]
+    pairs = set()
+    while len(pairs) < m:
+        a, b = rng.sample(range(n), 2); pairs.add((min(a, b), max(a, b)))
+    lines += [f"<{macs[b]}> CMD:UNICAST_RECV {macs[a]} data".encode() for a, b in sorted(pairs)]
+    return macs, lines, [(macs[a], macs[b]) for a, b in sorted(pairs)]
+
+
+def load_lines(macs, pairs, seed=2):
+    # Latidos y BROADCAST_RECV entre vecinos ya conocidos: cambian estado, no la estructura (el layout no se recalcula)
+    rng = random.Random(seed); out = []
+    for _ in range(4096):
+        if rng.random() < 0.5: out.append(f"<{rng.choice(macs)}> CMD:JOIN".encode())
+        else: a, b = rng.choice(pairs); out.append(f"<{a}> CMD:BROADCAST_RECV {b} ping".encode())
+    return out
+
+
+def send(port, lines, rate, seconds=None):
+    # rate datagramas/s (0 = sin pausa) durante seconds, o una sola pasada por lines si seconds es None
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); dest = ('127.0.0.1', port)
+    sent = 0; t0 = time.perf_counter(); n = len(lines)
+    while True:
+        if seconds is None and sent >= n: break
+        now = time.perf_counter()
+        if seconds is not None and now - t0 >= seconds: break
+        if rate and sent >= (now - t0) * rate: time.sleep(0.0005); continue
+        try: s.sendto(lines[sent % n], dest); sent += 1
+        except BlockingIOError: time.sleep(0.0005)
+    s.close()
+    return sent
+
+
+def applied(engine):
+    return engine.stats()['events'] if hasattr(engine, 'reader') else engine.ingest_counts['events']
+
+
+def run_mode(mode, args, macs, topo_lines, load):
+    import argparse as ap_mod
+    ctx = mp.get_context('spawn')
+    if mode == 'solo':
+        from espnow_engine import MonitorEngine
+        engine = MonitorEngine(port=0).start(); g = None
+    else:
+        import monitor_espnow11 as g
+        import matplotlib.pyplot as plt
+        ap = g.add_arguments(ap_mod.ArgumentParser()); ap.add_argument('--split', action='store_true')
+        g.pos = {'ALL': (0.5, 0.1)}; g._drawn_snap = None; g._layout_topology = -1
+        g.build_gui(ap.parse_args(['--port', '0', '--log-level', 'WARNING'] + (['--split'] if mode == 'procesos' else [])))
+        engine = g.engine
+    port = engine.port
+    send(port, topo_lines, 20000)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline: # Red montada y con posiciones publicadas
+        if g is not None: g.update(None)
+        snap = engine.store.snapshot()
+        if len(snap.edges) >= args.edges + args.nodes and (g is None or len(g.pos) >= len(snap.nodes)): break
+        time.sleep(0.05)
+    snap = engine.store.snapshot()
+    if g is not None: g.render_dirty = True; g.update(None); g.fig.canvas.draw()
+    before = applied(engine)
+    with ctx.Pool(1) as pool:
+        job = pool.apply_async(send, (port, load, args.rate, args.seconds))
+        t0 = time.perf_counter(); frames = 0
+        while not job.ready():
+            if g is not None:
+                g.render_dirty = True; g.update(None); g.fig.canvas.draw(); frames += 1
+            else:
+                time.sleep(0.05)
+        sent = job.get(); elapsed = time.perf_counter() - t0
+    time.sleep(0.5) # Lo que quedó en cola
+    done = applied(engine) - before
+    if g is not None:
+        engine.stop(); g.layout.stop(); plt.close(g.fig)
+    else:
+        engine.stop()
+    return {'mode': mode, 'nodes': len(snap.nodes) - 1, 'edges': len(snap.edges), 'sent': sent,
+            'applied': done, 'rate': done / elapsed, 'fps': frames / elapsed}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=1000)
+    ap.add_argument('--edges', type=int, default=5000)
+    ap.add_argument('--rate', type=int, default=8000, help="datagramas/s ofrecidos durante la medida")
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--modes', default='solo,hilos,procesos')
+    args = ap.parse_args()
+    macs, topo_lines, pairs = topology_lines(args.nodes, args.edges)
+    load = load_lines(macs, pairs)
+    print(f"[i] {os.cpu_count()} CPU; carga ofrecida {args.rate} dgr/s durante {args.seconds:g} s")
+    results = [run_mode(m, args, macs, topo_lines, load) for m in args.modes.split(',')]
+    for r in results:
+        print(f"    {r['mode']:9s} {r['nodes']} nodos / {r['edges']} aristas: enviados {r['sent']}, aplicados {r['applied']} "
+              f"({r['rate']:,.0f} eventos/s, {100 * r['applied'] / max(r['sent'], 1):.0f} %)" + (f", GUI {r['fps']:.1f} frames/s" if r['mode'] != 'solo' else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,49 @@
+# --- bench_startup: tiempo de arranque y memoria del monitor con y sin GUI ---
+#
+# Lanza cada modo en un proceso nuevo varias veces y mide:
+#   - sin GUI: python espnow_engine.py --duration 0 (hasta la línea "Motor en marcha")
+#   - con GUI: python monitor_espnow11.py con MPLBACKEND=Agg (plt.show() vuelve
+#     enseguida: mide importar matplotlib, arrancar el motor y crear la figura)
+# y el RSS máximo del proceso (ru_maxrss de wait4). Solo Linux/macOS.
+#
+# Uso: python bench_startup.py [--runs 5]
+
+import argparse, os, statistics, subprocess, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = {
+    'sin GUI (espnow_engine)': [sys.executable, 'espnow_engine.py', '--port', '0', '--duration', '0'],
+    'con GUI (monitor_espnow11, Agg)': [sys.executable, 'monitor_espnow11.py', '--port', '0'],
+}
+
+
+def run_once(cmd):
+    env = dict(os.environ, MPLBACKEND='Agg')
+    t0 = time.perf_counter()
+    p = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    ready = None; out = []
+    for line in p.stdout:
+        out.append(line)
+        if ready is None and 'Motor en marcha' in line: ready = time.perf_counter() - t0
+    _, status, ru = os.wait4(p.pid, 0)
+    total = time.perf_counter() - t0
+    if status != 0: raise RuntimeError(f"{' '.join(cmd)} terminó con estado {status}:\n{''.join(out)}")
+    rss_kb = ru.ru_maxrss / (1024 if sys.platform == 'darwin' else 1)  # macOS: bytes; Linux: KiB
+    return (ready if ready is not None else total), total, rss_kb, ''.join(out)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--runs', type=int, default=5)
+    args = ap.parse_args()
+    for name, cmd in MODES.items():
+        run_once(cmd)  # calentar la caché de disco / .pyc
+        res = [run_once(cmd) for _ in range(args.runs)]
+        ready = statistics.median(r[0] for r in res); total = statistics.median(r[1] for r in res)
+        rss = statistics.median(r[2] for r in res)
+        print(f"{name:34s} listo en {ready * 1e3:6.0f} ms  (proceso completo {total * 1e3:6.0f} ms)  RSS máx {rss / 1024:6.1f} MiB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
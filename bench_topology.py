@@ -0,0 +1,129 @@
+# --- bench_topology: memoria y búsquedas de TopologyStore frente a networkx + dicts ---
+#
+# Construye la misma topología (nodos con IP y posición, aristas con estado,
+# una fracción con color y visual temporal) de dos formas:
+#   - la anterior: nx.Graph con dict de atributos por arista + mac_ip,
+#     edge_colors, edge_temp_visuals y pos (claves tuple(sorted((u, v))))
+#   - espnow_topology.TopologyStore
+# y mide la memoria asignada (tracemalloc) y el coste de las búsquedas.
+#
+# Uso: python bench_topology.py [--nodes 10000] [--degree 10] [--lookups 200000]
+
+import argparse, gc, random, time, tracemalloc
+import networkx as nx
+from espnow_topology import TopologyStore
+from espnow_state import EDGE_STATUS_CODES
+
+STATUSES = ['base', 'established', 'failed']
+
+
+def make_data(n, degree, seed=7):
+    rnd = random.Random(seed)
+    macs = [f"24:0A:C4:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}" for i in range(n)]
+    edges = set()
+    target = n * degree // 2
+    while len(edges) < target:
+        a = rnd.randrange(n); b = (a + rnd.randint(1, 50)) % n  # vecinos "cercanos", como en una malla
+        if a != b: edges.add((macs[min(a, b)], macs[max(a, b)]))
+    edges = [(u, v, rnd.choice(STATUSES)) for u, v in edges]
+    addrs = {m: (f"192.168.{i >> 8 & 0xFF}.{i & 0xFF}", 4210) for i, m in enumerate(macs)}
+    pos = {m: (rnd.random(), rnd.random()) for m in macs}
+    return macs, edges, addrs, pos
+
+
+def get_edge_key(u, v): return tuple(sorted((u, v)))
+
+
+def build_legacy(macs, edges, addrs, pos):
+    G = nx.Graph(); mac_ip = {}; edge_colors = {}; edge_temp_visuals = {}; p = {}
+    for m in macs: G.add_node(m); mac_ip[m] = addrs[m]; p[m] = pos[m]
+    for k, (u, v, st) in enumerate(edges):
+        G.add_edge(u, v, status=st)
+        if k % 10 == 0: edge_colors[get_edge_key(u, v)] = 'black'
+        if k % 20 == 0: edge_temp_visuals[get_edge_key(u, v)] = {'color': 'lime', 'width': 3.0, 'expires': 1e12}
+    return G, mac_ip, edge_colors, edge_temp_visuals, p
+
+
+def build_store(macs, edges, addrs, pos):
+    t = TopologyStore()
+    for m in macs: t.node(m); t.set_addr(m, addrs[m])
+    t.set_positions(pos)
+    for k, (u, v, st) in enumerate(edges):
+        t.set_edge_status(u, v, EDGE_STATUS_CODES[st])
+        if k % 20 == 0: t.set_temp(u, v, 'lime', 3.0, 1e12)
+    return t
+
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = build(*args)
+    dt = time.perf_counter() - t0
+    cur, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, cur, dt
+
+
+def timeit(fn, pairs):
+    t0 = time.perf_counter()
+    fn(pairs)
+    return (time.perf_counter() - t0) / len(pairs)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=10000)
+    ap.add_argument('--degree', type=int, default=10)
+    ap.add_argument('--lookups', type=int, default=200000)
+    args = ap.parse_args()
+
+    macs, edges, addrs, pos = make_data(args.nodes, args.degree)
+    print(f"{len(macs)} nodos / {len(edges)} aristas")
+    legacy, mem_l, build_l = measure(build_legacy, macs, edges, addrs, pos)
+    store, mem_s, build_s = measure(build_store, macs, edges, addrs, pos)
+    print(f"Memoria  networkx+dicts: {mem_l / 2**20:7.1f} MiB ({mem_l / len(edges):.0f} B/arista)  construcción {build_l:.2f} s")
+    print(f"Memoria  TopologyStore:  {mem_s / 2**20:7.1f} MiB ({mem_s / len(edges):.0f} B/arista)  construcción {build_s:.2f} s"
+          f"  (columnas: {store.nbytes() / 2**20:.1f} MiB)")
+
+    G, mac_ip, edge_colors, temps, _ = legacy
+    rnd = random.Random(1)
+    pairs = [edges[rnd.randrange(len(edges))][:2] for _ in range(args.lookups)]
+    pairs = [(v, u) if rnd.random() < 0.5 else (u, v) for u, v in pairs]
+    misses = [(macs[rnd.randrange(len(macs))], macs[rnd.randrange(len(macs))]) for _ in range(args.lookups // 4)]
+
+    def legacy_status(ps):
+        for u, v in ps:
+            ek = get_edge_key(u, v)
+            d = G.edges[ek] if G.has_edge(*ek) else None
+            st = d.get('status') if d else None
+            c = temps.get(ek) or edge_colors.get(ek)
+
+    def store_status(ps):
+        st = store.edges.status; col = store.edges.color
+        for u, v in ps:
+            r = store.edge(u, v)
+            if r is not None: s = st[r]; c = col[r]
+
+    def legacy_addr(ps):
+        for u, _ in ps: a = mac_ip.get(u)
+
+    def store_addr(ps):
+        for u, _ in ps: a = store.addr(u)
+
+    rows = [
+        ("estado+color de arista (existe)", legacy_status, store_status, pairs),
+        ("estado de arista (par aleatorio)", legacy_status, store_status, misses),
+        ("IP de nodo", legacy_addr, store_addr, pairs),
+    ]
+    for name, fl, fs, ps in rows:
+        tl = min(timeit(fl, ps) for _ in range(3)); ts = min(timeit(fs, ps) for _ in range(3))
+        print(f"{name:34s} networkx+dicts {tl * 1e9:6.0f} ns  TopologyStore {ts * 1e9:6.0f} ns  ({tl / ts:.2f}x)")
+
+    t0 = time.perf_counter(); store.to_networkx(); t_exp = time.perf_counter() - t0
+    print(f"Exportación a networkx bajo demanda: {t_exp * 1e3:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,89 @@
+# --- bench_web: coste del flujo de deltas (espnow_web) frente a tamaño de red y ritmo de cambios ---
+#
+# Para cada combinación de tamaño de red (--sizes nodos:aristas) y ritmo de
+# cambios (--rates cambios/s) arranca un motor con la vista web, monta la
+# red por UDP, conecta --clients clientes de referencia (espnow_web.WsClient
+# + DeltaModel) y durante --seconds envía UNICAST_RECV y SEND_FAIL_TO entre
+# vecinos conocidos (cada uno cambia el estado de una arista y la resalta).
+# Mide KiB/s por cliente, mensajes por segundo y CPU del hilo del servidor
+# web, y comprueba al final que el modelo de cada cliente coincide con la
+# instantánea del servidor.
+#
+# Uso: python bench_web.py [--sizes 200:1000,2000:10000] [--rates 0,100,1000] [--clients 20] [--seconds 5]
+
+import argparse, json, os, random, socket, threading, time, urllib.request
+from bench_split import topology_lines, send
+
+
+def changes(macs, pairs, seed=3):
+    rng = random.Random(seed); out = []
+    for _ in range(8192):
+        a, b = rng.choice(pairs)
+        out.append(f"<{a}> CMD:SEND_FAIL_TO {b}".encode() if rng.random() < 0.5 else f"<{b}> CMD:UNICAST_RECV {a} x".encode())
+    return out
+
+
+def client(url, stop, out):
+    from espnow_web import WsClient, DeltaModel
+    c = WsClient(url); m = DeltaModel(); c.sock.settimeout(0.2)
+    try:
+        while not stop.is_set():
+            try: msg = c.recv()
+            except socket.timeout: continue
+            if msg is None: break
+            m.apply(msg)
+    finally:
+        c.close()
+    out.append((c.bytes_in, m))
+
+
+def run(n_nodes, n_edges, rate, args):
+    from espnow_engine import MonitorEngine
+    from espnow_web import DeltaModel
+    macs, topo, pairs = topology_lines(n_nodes, n_edges)
+    engine = MonitorEngine(port=0, web_port=0, stale_after=0, evict_after=0, edge_stale_after=0, edge_evict_after=0).start()
+    web = engine.web_server; base = f"127.0.0.1:{web.port}"
+    send(engine.port, topo, 20000)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and len(engine.store.snapshot().edges) < n_edges + n_nodes: time.sleep(0.05)
+    while web._layout is not None and len(web._layout.positions()) < n_nodes + 1 and time.monotonic() < deadline: time.sleep(0.05)
+    time.sleep(1.0) # Layout asentado: que las posiciones no cuenten como cambios
+    stop = threading.Event(); out = []
+    threads = [threading.Thread(target=client, args=(f"ws://{base}/ws", stop, out)) for _ in range(args.clients)]
+    for t in threads: t.start()
+    time.sleep(1.0) # Instantáneas iniciales fuera de la medida
+    b0 = web.counts['bytes_out']; d0 = web.counts['deltas']; cpu0 = web.cpu_seconds
+    t0 = time.perf_counter()
+    if rate: send(engine.port, changes(macs, pairs), rate, args.seconds)
+    else: time.sleep(args.seconds)
+    elapsed = time.perf_counter() - t0
+    sent = web.counts['bytes_out'] - b0; deltas = web.counts['deltas'] - d0; cpu = web.cpu_seconds - cpu0
+    time.sleep(1.0)
+    stop.set()
+    for t in threads: t.join()
+    ref = DeltaModel(); ref.apply(json.loads(urllib.request.urlopen(f"http://{base}/snapshot").read()))
+    ok = sum(m.nodes == ref.nodes and m.edges == ref.edges for _, m in out)
+    engine.stop()
+    return {'nodes': n_nodes, 'edges': n_edges, 'rate': rate, 'kib': sent / elapsed / len(out) / 1024,
+            'msgs': deltas / elapsed, 'cpu': 100 * cpu / elapsed, 'ok': ok, 'clients': len(out)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='200:1000,2000:10000', help="lista de nodos:aristas")
+    ap.add_argument('--rates', default='0,100,1000', help="lista de cambios/s")
+    ap.add_argument('--clients', type=int, default=20)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    args = ap.parse_args()
+    print(f"[i] {os.cpu_count()} CPU; {args.clients} clientes, {args.seconds:g} s por medida")
+    for size in args.sizes.split(','):
+        n, m = (int(x) for x in size.split(':'))
+        for rate in (int(x) for x in args.rates.split(',')):
+            r = run(n, m, rate, args)
+            print(f"    {r['nodes']:5d} nodos / {r['edges']:5d} aristas, {r['rate']:5d} cambios/s: {r['kib']:7.1f} KiB/s por cliente, "
+                  f"{r['msgs']:4.1f} deltas/s, CPU del servidor web {r['cpu']:4.1f} %, modelos correctos {r['ok']}/{r['clients']}", flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+# --- bench_workers: escalado de la ingesta repartida (espnow_workers) en loopback ---
+#
+# Monta una red de --nodes nodos y --edges aristas y después, durante
+# --seconds, --senders procesos emisores (cada uno con --sources sockets, es
+# decir, pasarelas con su propio puerto de origen para que SO_REUSEPORT
+# reparta) envían sin pausa una mezcla de latidos (JOIN), BROADCAST_RECV y
+# UNICAST_RECV entre vecinos conocidos. Mide, para cada número de
+# trabajadores (0 = IngestEngine en el proceso del motor, como siempre),
+# eventos contabilizados por segundo (aplicados o plegados por la ventana) y
+# la pérdida en el kernel.
+#
+# Uso: python bench_workers.py [--workers 0,1,2,4] [--senders 2] [--sources 16] [--seconds 5]
+
+import argparse, multiprocessing as mp, os, random, socket, time
+from bench_split import topology_lines, send
+
+
+def load_lines(macs, pairs, seed=2):
+    rng = random.Random(seed); out = []
+    for _ in range(8192):
+        r = rng.random(); a, b = rng.choice(pairs)
+        if r < 0.4: out.append(f"<{rng.choice(macs)}> CMD:JOIN".encode())
+        elif r < 0.8: out.append(f"<{a}> CMD:BROADCAST_RECV {b} ping".encode())
+        else: out.append(f"<{b}> CMD:UNICAST_RECV {a} data".encode())
+    return out
+
+
+def blast(port, lines, sources, seconds, offset):
+    # Sin pausa desde `sources` sockets a la vez (orígenes distintos); devuelve los enviados
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(sources)]
+    dest = ('127.0.0.1', port); n = len(lines); sent = 0; i = offset
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for s in socks:
+            try: s.sendto(lines[i % n], dest); sent += 1
+            except BlockingIOError: pass
+            i += 1
+    for s in socks: s.close()
+    return sent
+
+
+def run(workers, args, topo, load):
+    from espnow_engine import MonitorEngine
+    engine = MonitorEngine(port=0, workers=workers, stale_after=0, evict_after=0, edge_stale_after=0, edge_evict_after=0).start()
+    send(engine.port, topo, 20000)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and len(engine.store.snapshot().edges) < args.edges + args.nodes: time.sleep(0.05)
+    snap = engine.store.snapshot()
+    time.sleep(0.5)
+    before = engine.ingest_counts['events']
+    with mp.get_context('spawn').Pool(args.senders) as pool:
+        t0 = time.perf_counter()
+        jobs = [pool.apply_async(blast, (engine.port, load, args.sources, args.seconds, k * 997)) for k in range(args.senders)]
+        sent = sum(j.get() for j in jobs)
+        elapsed = time.perf_counter() - t0
+    time.sleep(1.0) # Lo que quedó en colas y tuberías
+    done = engine.ingest_counts['events'] - before
+    st = engine.ingest.stats()
+    engine.stop()
+    return {'workers': workers, 'nodes': len(snap.nodes) - 1, 'edges': len(snap.edges), 'sent': sent, 'done': done,
+            'rate': done / elapsed, 'folded': st.get('folded', 0), 'late': st.get('late', 0)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', default='0,1,2,4', help="lista de números de trabajadores (0 = un solo proceso)")
+    ap.add_argument('--senders', type=int, default=2)
+    ap.add_argument('--sources', type=int, default=16, help="sockets de origen por emisor")
+    ap.add_argument('--nodes', type=int, default=1000)
+    ap.add_argument('--edges', type=int, default=5000)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    args = ap.parse_args()
+    macs, topo, pairs = topology_lines(args.nodes, args.edges)
+    load = load_lines(macs, pairs)
+    print(f"[i] {os.cpu_count()} CPU; {args.senders} emisores x {args.sources} orígenes sin pausa durante {args.seconds:g} s")
+    base = None
+    for w in (int(x) for x in args.workers.split(',')):
+        r = run(w, args, topo, load)
+        base = base or r['rate']
+        print(f"    trabajadores {r['workers']}: {r['nodes']} nodos / {r['edges']} aristas, enviados {r['sent']}, "
+              f"contabilizados {r['done']} ({r['rate']:,.0f} eventos/s, x{r['rate'] / base:.2f}, "
+              f"pérdida {100 * (1 - r['done'] / max(r['sent'], 1)):.0f} %), plegados {r['folded']}, tardíos {r['late']}", flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+# --- espnow_checkpoint: instantánea binaria de la topología para arrancar en caliente ---
+#
+# Al arrancar el monitor solo había 'ALL' y el layout se recalculaba desde
+# cero: el mapa tardaba minutos en volver y los nodos salían en otro sitio.
+# Un checkpoint guarda las columnas de TopologyStore tal cual (nodos, MAC,
+# ip/puerto, last_seen, posición x/y; aristas con estado y estadísticas de
+# enlace) en un fichero columnar versionado:
+#
+#   cabecera: b'ESPC' | versión u16 | nº de secciones u16 | creado f64
+#   sección:  long. nombre u8 | nombre | long. dtype u8 | dtype (p. ej. '<f8') | nº elementos u32 | datos
+#
+# más una sección 'names' (nombres de nodo en UTF-8 separados por '\n') y
+# una 'meta' (JSON: t_ns del último registro del diario incluido, etc.).
+# Cargar es leer el fichero una vez y np.frombuffer por columna, sin parsear
+# nodo a nodo; las posiciones guardadas se pasan a IncrementalLayout como
+# ya asentadas, así que no se recalcula el layout.
+#
+# La escritura va a un fichero temporal y se renombra: un corte a mitad deja
+# el checkpoint anterior intacto.
+#
+# Uso: python espnow_checkpoint.py info FICHERO
+
+import argparse, json, os, struct, time
+import numpy as np
+from espnow_topology import TopologyStore
+
+MAGIC = b'ESPC'
+VERSION = 1
+CHECKPOINT_INTERVAL = 60.0   # segundos entre checkpoints periódicos del motor
+
+_HEADER = struct.Struct('<4sHHd')
+_COUNT = struct.Struct('<I')
+
+
+def _section(name, arr):
+    a = np.ascontiguousarray(arr)
+    n = name.encode('ascii'); d = a.dtype.str.encode('ascii')
+    return bytes((len(n),)) + n + bytes((len(d),)) + d + _COUNT.pack(len(a)) + a.tobytes()
+
+
+def _blob(b):
+    return np.frombuffer(b, np.uint8)
+
+
+def save_checkpoint(path, names, cols, meta=None):
+    # names/cols: como los devuelve TopologyStore.export_columns(); meta: dict serializable a JSON
+    parts = [_section('names', _blob('\n'.join(names).encode('utf-8'))),
+             _section('meta', _blob(json.dumps(meta or {}).encode('utf-8')))]
+    parts += [_section(name, arr) for name, arr in cols.items()]
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(parts), time.time()))
+        for p in parts: f.write(p)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def read_sections(path):
+    # Devuelve ({sección: array de solo lectura sobre el buffer del fichero}, creado)
+    with open(path, 'rb') as f: buf = f.read()
+    if len(buf) < _HEADER.size: raise ValueError(f"{path}: checkpoint truncado")
+    magic, version, n_sections, created = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC: raise ValueError(f"{path}: no es un checkpoint del monitor")
+    if version != VERSION: raise ValueError(f"{path}: versión de checkpoint {version} no soportada (se espera {VERSION})")
+    off = _HEADER.size; out = {}
+    for _ in range(n_sections):
+        ln = buf[off]; name = buf[off + 1:off + 1 + ln].decode('ascii'); off += 1 + ln
+        ld = buf[off]; dt = np.dtype(buf[off + 1:off + 1 + ld].decode('ascii')); off += 1 + ld
+        count, = _COUNT.unpack_from(buf, off); off += _COUNT.size
+        if off + dt.itemsize * count > len(buf): raise ValueError(f"{path}: checkpoint truncado")
+        out[name] = np.frombuffer(buf, dt, count, off); off += dt.itemsize * count
+    return out, created
+
+
+def load_checkpoint(path):
+    # Devuelve (TopologyStore, meta, creado)
+    cols, created = read_sections(path)
+    names_b = cols.pop('names').tobytes(); meta_b = cols.pop('meta').tobytes()
+    names = names_b.decode('utf-8').split('\n') if names_b else []
+    meta = json.loads(meta_b) if meta_b else {}
+    return TopologyStore.from_columns(names, cols), meta, created
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Checkpoint de topología del monitor ESP-NOW")
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('info'); p.add_argument('path')
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    topo, meta, created = load_checkpoint(args.path)
+    dt = time.perf_counter() - t0
+    placed = len(topo.positions())
+    print(f"[i] {args.path}: {os.path.getsize(args.path) / 1024:.0f} KiB, creado {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))}")
+    print(f"[i] {topo.n_nodes} nodos ({placed} con posición), {topo.n_edges} aristas, cargado en {dt * 1e3:.1f} ms")
+    if meta: print(f"[i] meta: {meta}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+# --- espnow_comms: seguimiento indexado de comunicaciones / rutas ---
+#
+# Sustituye a los dicts active_communications (v11) y active_routes_viz (v6),
+# que se recorrían enteros en cada UNICAST_RECV / SEND_FAIL_TO y, por nodo,
+# en cada frame, y que nunca se vaciaban. Cada comunicación es un registro
+# con estado explícito, indexado por msg_id, por arista y por nodo:
+#
+#   pending -> step_rcvd -> espnow_sent -> delivered
+#                                  \-> failed / timeout
+#
+# Los estados finales no cambian. Una comunicación que no termina en
+# `timeout` segundos pasa a 'timeout'. Los registros terminados se conservan
+# `retention` segundos (para pintarlos) y como mucho `max_finished`.
+#
+# No tiene lock propio: se usa con el lock del grafo tomado (el del
+# listener), igual que el ExpiryScheduler que recibe.
+
+from collections import OrderedDict
+import time
+
+PENDING, STEP_RCVD, ESPNOW_SENT = 'pending', 'step_rcvd', 'espnow_sent'
+DELIVERED, FAILED, TIMEOUT = 'delivered', 'failed', 'timeout'
+TERMINAL = frozenset((DELIVERED, FAILED, TIMEOUT))
+
+COMM_TIMEOUT = 10.0      # segundos sin terminar -> 'timeout'
+RETENTION_SECONDS = 10.0 # cuánto se conserva un registro terminado
+MAX_FINISHED = 1000      # registros terminados como máximo
+
+
+class CommRecord:
+    __slots__ = ('msg_id', 'kind', 'nodes', 'edges', 'state', 'reason', 'detail', 'hops_acked',
+                 'created', 'updated')
+
+    def __init__(self, msg_id, kind, nodes, edges, now):
+        self.msg_id = msg_id
+        self.kind = kind          # p. ej. 'route' / 'direct'
+        self.nodes = nodes        # tuple de nodos del camino (origen primero)
+        self.edges = edges        # tuple de claves de arista del camino
+        self.state = PENDING
+        self.reason = None        # motivo del fallo ('no_ip', 'espnow', 'send_fail', ...)
+        self.detail = None        # último nodo / salto que informó
+        self.hops_acked = 0
+        self.created = now
+        self.updated = now
+
+    @property
+    def active(self): return self.state not in TERMINAL
+
+    def __repr__(self): return f"CommRecord({self.msg_id}, {self.kind}, {self.state}, {len(self.nodes)} nodos)"
+
+
+class CommTracker:
+    # expiry: ExpiryScheduler (timeouts y retirada de terminados)
+    # on_change(record): opcional, se llama tras cada transición
+    def __init__(self, expiry, timeout=COMM_TIMEOUT, retention=RETENTION_SECONDS,
+                 max_finished=MAX_FINISHED, on_change=None, clock=time.monotonic):
+        self.expiry = expiry
+        self.timeout = timeout
+        self.retention = retention
+        self.max_finished = max_finished
+        self.on_change = on_change
+        self.clock = clock
+        self._by_id = {}              # msg_id -> CommRecord (activos y terminados retenidos)
+        self._by_edge = {}            # clave de arista -> {msg_id: None} (orden de llegada)
+        self._active_nodes = {}       # nodo -> nº de comunicaciones activas que lo incluyen
+        self._finished = OrderedDict()  # msg_id -> None, del más antiguo al más reciente
+        self.counts = {'started': 0, DELIVERED: 0, FAILED: 0, TIMEOUT: 0, 'evicted': 0}
+
+    def __len__(self): return len(self._by_id)
+    def __contains__(self, msg_id): return msg_id in self._by_id
+
+    def get(self, msg_id):
+        return self._by_id.get(msg_id)
+
+    def start(self, msg_id, kind, nodes, edges, timeout=None):
+        # timeout: plazo propio de esta comunicación (por defecto self.timeout)
+        old = self._by_id.get(msg_id)
+        if old is not None: self._forget(old)
+        r = CommRecord(msg_id, kind, tuple(nodes), tuple(edges), self.clock())
+        self._by_id[msg_id] = r
+        for ek in r.edges: self._by_edge.setdefault(ek, {})[msg_id] = None
+        an = self._active_nodes
+        for n in set(r.nodes): an[n] = an.get(n, 0) + 1
+        self.counts['started'] += 1
+        timeout = self.timeout if timeout is None else timeout
+        if timeout: self.expiry.schedule(timeout, self._expire, msg_id, key=('comm', msg_id))
+        self._changed(r)
+        return r
+
+    def advance(self, msg_id, state, detail=None, reason=None):
+        # Transición de estado; devuelve el registro, o None si no existe o ya terminó
+        r = self._by_id.get(msg_id)
+        if r is None or r.state in TERMINAL: return None
+        r.state = state; r.updated = self.clock()
+        if detail is not None: r.detail = detail
+        if reason is not None: r.reason = reason
+        if state == ESPNOW_SENT: r.hops_acked += 1
+        if state in TERMINAL: self._finish(r)
+        self._changed(r)
+        return r
+
+    def on_edge(self, ek):
+        # Registros (activos y terminados retenidos) que pasan por la arista, por orden de llegada
+        ids = self._by_edge.get(ek)
+        return [self._by_id[m] for m in ids] if ids else []
+
+    def active_on_edge(self, ek):
+        return [r for r in self.on_edge(ek) if r.state not in TERMINAL]
+
+    def active_nodes(self):
+        # Vista de los nodos que participan en alguna comunicación activa
+        return self._active_nodes.keys()
+
+    def is_node_active(self, node): return node in self._active_nodes
+
+    def active_count(self):
+        return len(self._by_id) - len(self._finished)
+
+    def records(self):
+        return self._by_id.values()
+
+    # --- Internos ---
+
+    def _changed(self, r):
+        if self.on_change is not None: self.on_change(r)
+
+    def _release_nodes(self, r):
+        an = self._active_nodes
+        for n in set(r.nodes):
+            c = an.get(n, 0) - 1
+            if c > 0: an[n] = c
+            else: an.pop(n, None)
+
+    def _finish(self, r):
+        self._release_nodes(r)
+        self.counts[r.state] += 1
+        self.expiry.cancel(('comm', r.msg_id))
+        self._finished[r.msg_id] = None
+        if self.retention is not None:
+            self.expiry.schedule(self.retention, self._retire, r.msg_id, key=('comm', r.msg_id))
+        while len(self._finished) > self.max_finished:
+            old_id, _ = self._finished.popitem(last=False)
+            self.counts['evicted'] += 1
+            self.expiry.cancel(('comm', old_id))
+            self._forget(self._by_id[old_id])
+
+    def _forget(self, r):
+        if r.state not in TERMINAL: self._release_nodes(r)
+        self._by_id.pop(r.msg_id, None)
+        self._finished.pop(r.msg_id, None)
+        for ek in r.edges:
+            ids = self._by_edge.get(ek)
+            if ids is not None:
+                ids.pop(r.msg_id, None)
+                if not ids: del self._by_edge[ek]
+
+    def _expire(self, msg_id):
+        # Vencimiento del temporizador de una comunicación (con el lock del grafo tomado)
+        r = self._by_id.get(msg_id)
+        if r is not None and r.state not in TERMINAL: self.advance(msg_id, TIMEOUT)
+
+    def _retire(self, msg_id):
+        r = self._by_id.get(msg_id)
+        if r is not None and r.state in TERMINAL:
+            self._forget(r)
+            self._changed(r)
@@ -0,0 +1,159 @@
+# --- espnow_dispatch: envío de rutas por saltos guiado por ACKs ---
+#
+# Antes cada ruta ocupaba un hilo que mandaba todos los ROUTE_STEP seguidos
+# con time.sleep(0.1-0.2) entre saltos, sin esperar a que el salto anterior
+# se hubiera hecho. Ahora el ROUTE_STEP del salto i+1 sale en cuanto llega
+# el ACK_ROUTE_ESPNOW_SENT del nodo i (el firmware solo reenvía por ESP-NOW
+# cuando el servidor se lo ordena por UDP). Cada salto tiene un plazo: si
+# vence, o llega FAIL_ROUTE_ESPNOW_SENT, se reintenta el mismo ROUTE_STEP
+# hasta `retries` veces y después la ruta falla. Tras el último salto se
+# espera el ROUTE_DELIVERED del destino con el mismo esquema.
+#
+# No hay hilos por ruta: los envíos salen desde los manejadores de ACK (hilo
+# del listener) y desde los vencimientos del ExpiryScheduler, así que puede
+# haber cualquier número de rutas en vuelo. Se mide la latencia de extremo a
+# extremo (primer ROUTE_STEP -> ROUTE_DELIVERED) de cada ruta entregada.
+#
+# Sin lock propio: usar con el lock del grafo tomado (el ExpiryScheduler
+# ejecuta los vencimientos con él).
+
+from collections import deque
+import time
+
+HOP_TIMEOUT = 1.0        # segundos para recibir el ACK_ROUTE_ESPNOW_SENT de un salto
+DELIVERY_TIMEOUT = 1.0   # segundos para el ROUTE_DELIVERED tras el último salto
+HOP_RETRIES = 2          # reintentos por salto antes de dar la ruta por fallida
+LATENCY_SAMPLES = 4096   # latencias recientes que se conservan para percentiles
+
+SENDING, AWAIT_DELIVERY = 'sending', 'await_delivery'
+
+
+class _Route:
+    __slots__ = ('msg_id', 'path', 'payload', 'hop', 'attempt', 'phase', 'started', 'retries')
+    def __init__(self, msg_id, path, payload, now):
+        self.msg_id = msg_id; self.path = path; self.payload = payload
+        self.hop = 0; self.attempt = 0; self.phase = SENDING
+        self.started = now; self.retries = 0
+
+
+def percentile(sorted_values, q):
+    if not sorted_values: return None
+    i = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+class RouteDispatcher:
+    # send(nodo, bytes) -> bool: manda un comando UDP al nodo; False si no se conoce su dirección
+    # on_done(msg_id, ok, info): ok=True -> info = latencia (s); ok=False -> info = motivo
+    # on_retry(msg_id, hop, attempt): opcional, para registrar reintentos
+    def __init__(self, send, expiry, hop_timeout=HOP_TIMEOUT, delivery_timeout=DELIVERY_TIMEOUT,
+                 retries=HOP_RETRIES, on_done=None, on_retry=None, clock=time.monotonic):
+        self.send = send
+        self.expiry = expiry
+        self.hop_timeout = hop_timeout
+        self.delivery_timeout = delivery_timeout
+        self.retries = retries
+        self.on_done = on_done
+        self.on_retry = on_retry
+        self.clock = clock
+        self._routes = {}   # msg_id -> _Route en vuelo
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.counts = {'started': 0, 'delivered': 0, 'failed': 0, 'retries': 0, 'steps_sent': 0}
+
+    def __len__(self): return len(self._routes)
+    def __contains__(self, msg_id): return msg_id in self._routes
+
+    def budget(self, n_nodes):
+        # Tiempo máximo que puede tardar una ruta de n_nodes nodos antes de fallar por plazos
+        hops = max(n_nodes - 1, 1)
+        return (hops * self.hop_timeout + self.delivery_timeout) * (self.retries + 1)
+
+    def start(self, msg_id, path, payload):
+        # Lanza la ruta; devuelve False si no se pudo mandar el primer salto
+        if len(path) < 2: return False
+        r = self._routes[msg_id] = _Route(msg_id, tuple(path), payload, self.clock())
+        self.counts['started'] += 1
+        return self._send_step(r)
+
+    def on_step_ack(self, msg_id, node):
+        # ACK_ROUTE_STEP_RECEIVED: el nodo recibió la orden; el plazo sigue corriendo hasta el envío ESP-NOW
+        r = self._routes.get(msg_id)
+        return r is not None and r.path[r.hop] == node
+
+    def on_espnow_sent(self, msg_id, sender, sent_to):
+        r = self._routes.get(msg_id)
+        if r is None or r.phase != SENDING or r.path[r.hop] != sender or r.path[r.hop + 1] != sent_to: return False
+        if r.hop + 2 < len(r.path):
+            r.hop += 1; r.attempt = 0
+            self._send_step(r)
+        else:
+            r.phase = AWAIT_DELIVERY
+            self.expiry.schedule(self.delivery_timeout, self._timeout, msg_id, r.hop, r.attempt, r.phase,
+                                 key=('route_hop', msg_id))
+        return True
+
+    def on_espnow_failed(self, msg_id, sender, sent_to):
+        r = self._routes.get(msg_id)
+        if r is None or r.path[r.hop] != sender or r.path[r.hop + 1] != sent_to: return False
+        self._retry(r, 'espnow')
+        return True
+
+    def on_delivered(self, msg_id, final_dest, prev_hop):
+        # ROUTE_DELIVERED; devuelve la latencia de extremo a extremo o None si la ruta no estaba en vuelo
+        r = self._routes.get(msg_id)
+        if r is None or r.path[-1] != final_dest: return None
+        lat = self.clock() - r.started
+        self._finish(r)
+        self.latencies.append(lat)
+        self.counts['delivered'] += 1
+        # El firmware apaga el LED de ruta de los intermedios con este aviso
+        for node in r.path[1:-1]: self.send(node, f"ROUTE_MSG_ACKNOWLEDGED {msg_id}\n".encode())
+        if self.on_done is not None: self.on_done(msg_id, True, lat)
+        return lat
+
+    def cancel(self, msg_id):
+        r = self._routes.get(msg_id)
+        if r is None: return False
+        self._fail(r, 'cancelled')
+        return True
+
+    def stats(self):
+        lat = sorted(self.latencies)
+        return dict(self.counts, in_flight=len(self._routes),
+                    p50=percentile(lat, 0.50), p95=percentile(lat, 0.95), p99=percentile(lat, 0.99))
+
+    # --- Internos ---
+
+    def _send_step(self, r):
+        i = r.hop
+        line = f"ROUTE_STEP {r.path[i + 1]} {r.path[-1]} {r.msg_id} {r.payload}\n".encode()
+        if not self.send(r.path[i], line):
+            self._fail(r, 'no_ip')
+            return False
+        self.counts['steps_sent'] += 1
+        self.expiry.schedule(self.hop_timeout, self._timeout, r.msg_id, r.hop, r.attempt, r.phase,
+                             key=('route_hop', r.msg_id))
+        return True
+
+    def _timeout(self, msg_id, hop, attempt, phase):
+        r = self._routes.get(msg_id)
+        if r is None or r.hop != hop or r.attempt != attempt or r.phase != phase: return  # plazo ya superado
+        self._retry(r, 'timeout' if phase == SENDING else 'delivery_timeout')
+
+    def _retry(self, r, reason):
+        if r.attempt >= self.retries:
+            self._fail(r, reason)
+            return
+        r.attempt += 1; r.retries += 1; r.phase = SENDING
+        self.counts['retries'] += 1
+        if self.on_retry is not None: self.on_retry(r.msg_id, r.hop, r.attempt)
+        self._send_step(r)
+
+    def _finish(self, r):
+        self._routes.pop(r.msg_id, None)
+        self.expiry.cancel(('route_hop', r.msg_id))
+
+    def _fail(self, r, reason):
+        self._finish(r)
+        self.counts['failed'] += 1
+        if self.on_done is not None: self.on_done(r.msg_id, False, reason)
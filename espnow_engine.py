@@ -0,0 +1,667 @@
+# --- espnow_engine: motor de red del monitor, sin GUI ---
+#
+# Todo lo que monitor_espnow11 hacía al importarse (abrir el socket UDP,
+# arrancar el listener, mantener topología / rutas / comunicaciones) vive
+# ahora en MonitorEngine, con un ciclo de vida explícito start() / stop().
+# Este módulo no importa matplotlib ni networkx: se puede ejecutar en la
+# pasarela sin pantalla con
+#
+#   python espnow_engine.py [--port 12345] [--broadcast 20] [--duration S]
+#   python espnow_engine.py --traffic uniform --concurrency 8 --duration 60
+#   python espnow_engine.py --journal diario/   (reconstruye el estado del diario y sigue escribiéndolo)
+#   python espnow_engine.py --checkpoint red.espc (arranque en caliente desde el último checkpoint)
+#   python espnow_engine.py --stale-after 30 --evict-after 300 (envejecimiento de nodos: espnow_liveness)
+#   python espnow_engine.py --metrics-port 9108 --log-level DEBUG (métricas Prometheus en /metrics: espnow_metrics)
+#   python espnow_engine.py --workers 4 [--port-range] (ingesta en 4 procesos con SO_REUSEPORT: espnow_workers)
+#   python espnow_engine.py --web-port 8766 (la red en el navegador: http://127.0.0.1:8766/, deltas por WebSocket: espnow_web)
+#   python espnow_engine.py --node-rate 50 --node-burst 4 (ritmo de comandos por nodo: espnow_outbound; 0 = sin ritmo)
+#
+# La GUI (monitor_espnow11.py) es un suscriptor opcional: lee las
+# instantáneas de engine.store y recibe los mensajes de estado por
+# on_message(texto).
+#
+# Instrumentación (engine.metrics, siempre activa): por datagrama, parse_seconds;
+# por evento, apply_seconds{cmd=...} y events_total{cmd=...}; publish_seconds
+# al construir cada instantánea; espera/retención de `lock` en los que lo
+# toman desde fuera (ingesta por lote, caducidades, publicación de estado).
+# Los acquire reentrantes de los manejadores van al RLock sin envolver: no
+# pagan la medida y su tiempo ya está dentro de la retención del externo.
+
+import argparse, os, socket, sys, threading, time
+from espnow_ingest import IngestEngine
+from espnow_workers import ShardedIngest, event_of
+from espnow_protocol import parse_events, WIRE_MAGIC, CmdEvent, AckRouteStep, AckEspnowSent, FailEspnowSent, RouteDelivered
+from espnow_state import StateStore, snapshot_from_topology, EDGE_ESTABLISHED, EDGE_STATUS_CODES
+from espnow_topology import TopologyStore
+from espnow_expiry import ExpiryScheduler
+from espnow_routing import RoutingIndex
+from espnow_linkstats import LinkStats
+from espnow_dispatch import RouteDispatcher
+from espnow_comms import CommTracker, STEP_RCVD, ESPNOW_SENT, DELIVERED, FAILED
+from espnow_journal import EventJournal, rebuild, OUT, FLUSH_INTERVAL
+from espnow_checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_INTERVAL
+from espnow_liveness import LivenessTracker, NODE_STALE_AFTER, NODE_EVICT_AFTER, EDGE_STALE_AFTER, EDGE_EVICT_AFTER
+from espnow_metrics import Metrics, MetricsServer, format_summary
+from espnow_web import WebServer, WEB_BIND
+from espnow_outbound import CommandScheduler, NODE_RATE, NODE_BURST
+from espnow_log import get_logger, setup_logging, add_arguments as add_log_arguments
+
+log = get_logger('engine')
+
+UDP_PORT = 12345 # Formato de las líneas: ver espnow_protocol.py
+ROUTING_MODE = 'etx' # 'etx': Dijkstra con coste 1/tasa de éxito del enlace; 'hops': BFS por número de saltos
+
+# Visuales temporales de arista (se guardan en la topología y los pinta la GUI)
+COLOR_EDGE_ATTEMPT = 'black'
+COLOR_EDGE_VIA_ESTABLISHED = 'green'
+COLOR_EDGE_FAIL = 'red'
+COLOR_EDGE_TEMP_SUCCESS = 'lime'
+STYLE_THIN = 1.5; STYLE_NORMAL = 2.0; STYLE_THICK = 3.0
+TEMPORARY_VISUALIZATION_SECONDS = 5.0
+STATUS_INTERVAL = 10.0 # segundos entre líneas de estado sin GUI
+BROADCAST_WINDOW = 0.5 # segundos: tras aplicar un BROADCAST_RECV, los repetidos de la misma pareja en la ventana se descartan (0 = todos)
+BATCH_CONCURRENCY = 8 # comunicaciones en vuelo de un lote lanzado desde una selección (launch_batch)
+MAX_EVENT_KINDS = 32 # etiquetas cmd distintas en las métricas (los comandos llegan de la red); el resto cuenta como 'otro'
+
+
+def get_edge_key(u, v): return tuple(sorted((u, v)))
+
+
+class MonitorEngine:
+    # on_message(texto): opcional, mensajes de estado para el usuario (título de la GUI)
+    # broadcast_interval: segundos entre "BROADCAST ping_servidor_python" (None = no se envía)
+    # broadcast_window: ver BROADCAST_WINDOW
+    # journal_dir: diario de eventos (espnow_journal); al arrancar se reconstruye el estado desde él
+    # checkpoint: fichero de espnow_checkpoint (por defecto <journal_dir>/checkpoint.espc si hay diario);
+    #             se carga al arrancar (y el diario solo se reproduce desde ahí) y se reescribe cada checkpoint_interval
+    # stale_after / evict_after / edge_stale_after / edge_evict_after: umbrales de espnow_liveness (0 = desactivado)
+    # node_rate / node_burst: cubo de fichas por nodo de los comandos salientes (espnow_outbound; node_rate=0: sin ritmo)
+    # metrics_port: sirve engine.metrics en http://127.0.0.1:<puerto>/metrics (None = sin servidor; 0 = puerto libre)
+    # workers: N > 0 reparte la recepción y la decodificación en N procesos (espnow_workers) y aplica aquí la fusión
+    #          ordenada; port_range: el trabajador i escucha en port+i en vez de compartir el puerto con SO_REUSEPORT
+    # web_port: sirve la vista web y el flujo de deltas (espnow_web) en web_bind:<puerto> (None = sin servidor)
+    # web_hosts: nombres extra aceptados en la cabecera Host de la vista web (además de web_bind y los locales)
+    def __init__(self, port=UDP_PORT, bind='', routing_mode=ROUTING_MODE, broadcast_interval=None, on_message=None,
+                 broadcast_window=BROADCAST_WINDOW, journal_dir=None, checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 stale_after=NODE_STALE_AFTER, evict_after=NODE_EVICT_AFTER, edge_stale_after=EDGE_STALE_AFTER,
+                 edge_evict_after=EDGE_EVICT_AFTER, metrics_port=None, workers=0, port_range=False,
+                 web_port=None, web_bind=WEB_BIND, node_rate=NODE_RATE, node_burst=NODE_BURST, web_hosts=()):
+        self.port = port
+        self.bind = bind
+        self.routing_mode = routing_mode
+        self.broadcast_interval = broadcast_interval
+        self.on_message = on_message
+        self.broadcast_window = broadcast_window
+        self.journal_dir = journal_dir
+        self.journal = None
+        if checkpoint is None and journal_dir: checkpoint = os.path.join(journal_dir, 'checkpoint.espc')
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.positions_source = None # Opcional: función -> {nodo: (x, y)} (layout de la GUI) que se guarda en el checkpoint
+        self._checkpoint_writer = None
+        self.replaying = False # Reconstruyendo desde el diario: sin visuales temporales ni mensajes
+        self.metrics = Metrics() # Histogramas por etapa, eventos por comando y gauges (espnow_metrics)
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.workers = workers
+        self.web_port = web_port
+        self.web_bind = web_bind
+        self.web_hosts = tuple(web_hosts or ())
+        self._live_key = None; self._live = ()
+        self.web_server = None
+        self.port_range = port_range
+        self.node_rate = node_rate
+        self.node_burst = node_burst
+        self.outbound = None # CommandScheduler: todos los comandos a los nodos salen por él (cola y ritmo por nodo)
+        self.lock = threading.RLock() # Reentrante: IngestEngine lo toma por lote y los helpers lo vuelven a tomar
+        self.timed_lock = self.metrics.timed_lock('graph_lock', self.lock) # El mismo RLock, midiendo espera y retención
+        self.topo = TopologyStore() # Nodos, aristas, IPs y visuales temporales en columnas
+        self.expiry = ExpiryScheduler(lock=self.timed_lock) # Un solo hilo para todas las caducidades
+        self.routing = RoutingIndex() # Adyacencia de aristas 'established' + árboles BFS en caché
+        self.links = LinkStats(self.topo) # Tasa de éxito EWMA, last_seen y latencia por salto
+        self.comms = CommTracker(self.expiry, on_change=self._on_comm_change) # Indexado por msg_id, arista y nodo
+        self.dispatcher = RouteDispatcher(self.send_to_node, self.expiry, on_done=self._on_route_done)
+        self.liveness = LivenessTracker(self.topo, self.expiry, on_stale=self._on_node_stale, on_alive=self._on_node_alive,
+                                        on_edge_stale=self._on_edge_stale, on_evict=self._evict, stale_after=stale_after,
+                                        evict_after=evict_after, edge_stale_after=edge_stale_after,
+                                        edge_evict_after=edge_evict_after) # last_seen por nodo/arista, inactivos y expulsiones
+        self.store = StateStore(self.timed_lock, self._build_snapshot)
+        self.selected_nodes = [] # Selección de la GUI; va en la instantánea
+        self.traffic = None      # TrafficGenerator activo (recibe el final de cada comunicación)
+        self.batch = None        # Lote de la selección en marcha (TrafficGenerator con pattern 'batch'; launch_batch)
+        self.sock = None
+        self.ingest = None
+        self.started_at = None
+        self._bcast_recent = set() # (mac, objetivo) ya aplicados en la ventana de BROADCAST_RECV actual
+        self.ingest_counts = {'datagrams': 0, 'events': 0, 'broadcast_recv': 0, 'broadcast_applied': 0}
+        self.handlers = {CmdEvent: self._on_cmd, AckRouteStep: self._on_ack_route_step, AckEspnowSent: self._on_ack_espnow_sent,
+                         FailEspnowSent: self._on_fail_espnow_sent, RouteDelivered: self._on_route_delivered}
+        m = self.metrics
+        self._h_parse = m.histogram('parse_seconds', "Decodificación de un datagrama (todos sus eventos)")
+        self._h_publish = m.histogram('publish_seconds', "Construcción de una instantánea para la GUI")
+        self._event_counts = m.counter('events', 'cmd', "Eventos recibidos por comando")
+        self._h_apply = {} # tipo de evento -> (etiqueta, histograma apply_seconds)
+        m.gauge('nodes', lambda: self.topo.n_nodes - 1, "Nodos en la topología")
+        m.gauge('edges', lambda: self.topo.n_edges, "Aristas en la topología")
+        m.gauge('stale_nodes', lambda: len(self.liveness.stale), "Nodos inactivos")
+        m.gauge('active_comms', lambda: self.comms.active_count(), "Comunicaciones en vuelo")
+        m.gauge('expiry_entries', lambda: len(self.expiry), "Entradas en ExpiryScheduler")
+        m.gauge('ingest', lambda: {k: v for k, v in self.ingest.stats().items() if k in ('queue_depth', 'dropped', 'received')}
+                if self.ingest is not None else {}, "Cola de ingesta: profundidad, descartes y recibidos")
+        self.topo.node('ALL')
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        if self.sock is not None: return self
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((self.bind, 0 if self.workers else self.port)) # Con trabajadores solo envía: escuchan ellos
+        self.sock = sock
+        if not self.workers: self.port = sock.getsockname()[1] # port=0: el sistema elige
+        self.outbound = CommandScheduler(sock, self.node_rate, self.node_burst, metrics=self.metrics).start()
+        self.expiry.start()
+        journal_ns = self._load_checkpoint() if self.checkpoint else 0
+        if self.journal_dir: self._open_journal(journal_ns)
+        if self.checkpoint and self.checkpoint_interval:
+            self.expiry.schedule(self.checkpoint_interval, self._periodic_checkpoint, key=('checkpoint',))
+        self.store.touch(topology=True); self.store.start() # Publica ya el nodo 'ALL'
+        if self.workers:
+            self.ingest = ShardedIngest(self.port, self.procesar_registros, self.workers, bind=self.bind, lock=self.timed_lock,
+                                        port_range=self.port_range, window=self.broadcast_window, metrics=self.metrics,
+                                        log_level=log.getEffectiveLevel()).start()
+            self.port = self.ingest.port
+        else:
+            self.ingest = IngestEngine(sock, self.procesar_lote, lock=self.timed_lock, metrics=self.metrics).start()
+        if self.metrics_port is not None:
+            try: self.metrics_server = MetricsServer(self.metrics, self.metrics_port).start()
+            except OSError as e: log.warning("[!] No se pudo abrir el puerto de métricas %s: %s", self.metrics_port, e)
+            else: log.info("[i] Métricas en http://127.0.0.1:%d/metrics", self.metrics_server.port)
+        if self.web_port is not None:
+            try: self.web_server = WebServer(self, self.web_port, self.web_bind, metrics=self.metrics, hosts=self.web_hosts).start()
+            except OSError as e: log.warning("[!] No se pudo abrir el puerto web %s: %s", self.web_port, e)
+            else: log.info("[i] Vista web en http://%s:%d/ (WebSocket en /ws)", self.web_bind, self.web_server.port)
+        if self.broadcast_interval: self.expiry.schedule(0.0, self._broadcast, key=('broadcast',))
+        self.started_at = time.monotonic()
+        return self
+
+    def stop(self):
+        if self.sock is None: return
+        self.cancel_batch()
+        self.expiry.cancel(('broadcast',)); self.expiry.cancel(('bcast_window',)); self.expiry.cancel(('journal_flush',))
+        self.expiry.cancel(('checkpoint',)); self.expiry.cancel(('evict',))
+        self.ingest.stop(); self.store.stop(); self.expiry.stop()
+        if self.metrics_server is not None: self.metrics_server.stop(); self.metrics_server = None
+        if self.web_server is not None: self.web_server.stop(); self.web_server = None
+        if self.checkpoint: # Checkpoint final: el próximo arranque no reproduce nada del diario
+            if self._checkpoint_writer is not None: self._checkpoint_writer.join()
+            self._write_checkpoint(*self._export_checkpoint())
+        if self.journal is not None:
+            with self.lock: self.journal.close(); self.journal = None
+        self.outbound.stop()
+        self.sock.close(); self.sock = None
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+    def message(self, text):
+        if self.on_message is not None and not self.replaying: self.on_message(text)
+
+    def _load_checkpoint(self): # Antes de arrancar la ingesta; devuelve el t_ns del diario que ya incluye
+        if not os.path.exists(self.checkpoint): return 0
+        t0 = time.perf_counter()
+        try: topo, meta, _ = load_checkpoint(self.checkpoint)
+        except (OSError, ValueError) as e:
+            log.warning("[!] Checkpoint %s ilegible, se ignora: %s", self.checkpoint, e); return 0
+        with self.lock:
+            topo.node('ALL')
+            self.topo = topo; self.links.topo = topo; self.liveness.topo = topo
+            est = topo.rows_with_status(EDGE_ESTABLISHED)
+            self.routing.load_rows(topo.node_names(), topo.edges.eu[est], topo.edges.ev[est])
+            self.liveness.track_all() # Todos con un plazo completo desde este arranque
+        log.info("[i] Checkpoint: %d nodos, %d aristas (%d 'established') cargados en %.0f ms",
+                 topo.n_nodes - 1, topo.n_edges, len(est), (time.perf_counter() - t0) * 1e3)
+        return meta.get('journal_ns', 0)
+
+    def _export_checkpoint(self): # Copia de columnas con `lock` tomado; la escritura va sin lock
+        with self.lock:
+            if self.positions_source is not None: self.topo.set_positions(self.positions_source())
+            names, cols = self.topo.export_columns()
+            meta = {'journal_ns': self.journal.last_ns if self.journal is not None else 0, 'port': self.port}
+        return names, cols, meta
+
+    def _write_checkpoint(self, names, cols, meta):
+        try:
+            t0 = time.perf_counter(); size = save_checkpoint(self.checkpoint, names, cols, meta)
+            return size, time.perf_counter() - t0
+        except OSError as e:
+            log.error("[!] No se pudo escribir el checkpoint %s: %s", self.checkpoint, e)
+
+    def _periodic_checkpoint(self): # ExpiryScheduler, con `lock` tomado; escribe en otro hilo
+        if self._checkpoint_writer is None or not self._checkpoint_writer.is_alive():
+            self._checkpoint_writer = threading.Thread(target=self._write_checkpoint, args=self._export_checkpoint(),
+                                                       name="checkpoint", daemon=True)
+            self._checkpoint_writer.start()
+        self.expiry.schedule(self.checkpoint_interval, self._periodic_checkpoint, key=('checkpoint',))
+
+    def _open_journal(self, since_ns=0): # Antes de arrancar la ingesta: reproduce la cola del diario y abre un segmento nuevo
+        t0 = time.perf_counter()
+        with self.lock:
+            self.replaying = True
+            try: n, last_ns = rebuild(self.procesar_lote, self.journal_dir, since_ns=since_ns + 1 if since_ns else 0)
+            finally: self.replaying = False
+            for k in self.ingest_counts: self.ingest_counts[k] = 0 # Las cuentas de ingesta son solo de esta sesión
+            self.journal = EventJournal(self.journal_dir, last_ns=max(last_ns, since_ns))
+        if n: log.info("[i] Diario: %d eventos reproducidos en %.0f ms (%d nodos, %d aristas)",
+                       n, (time.perf_counter() - t0) * 1e3, self.topo.n_nodes - 1, self.topo.n_edges)
+        self.expiry.schedule(FLUSH_INTERVAL, self._flush_journal, key=('journal_flush',))
+
+    def _flush_journal(self): # ExpiryScheduler, con `lock` tomado; se reprograma a sí mismo
+        if self.journal is None: return
+        self.journal.flush()
+        self.expiry.schedule(FLUSH_INTERVAL, self._flush_journal, key=('journal_flush',))
+
+    def _journal_out(self, line, addr): # Comando enviado a un nodo (historial de rutas en el diario)
+        if self.journal is not None:
+            with self.lock: self.journal.append(line, addr, OUT)
+
+    def _broadcast(self): # Con `lock` tomado (ExpiryScheduler); se reprograma a sí mismo
+        self.outbound.send(b'BROADCAST ping_servidor_python\n', ('255.255.255.255', self.port))
+        self.expiry.schedule(self.broadcast_interval, self._broadcast, key=('broadcast',))
+
+    # --- Estado ---
+
+    def set_edge_status(self, u, v, status_str): # Cada cambio incrementa la versión del estado
+        with self.lock:
+            code = EDGE_STATUS_CODES[status_str]; m = self.topo.n_edges
+            structural, changed = self.topo.set_edge_status(u, v, code)
+            self.routing.set_edge(u, v, code == EDGE_ESTABLISHED and self.liveness.usable(u, v)) # Sin nodos inactivos en las rutas
+            if structural: self.store.touch(topology=True); self.liveness.track_edges(m)
+            elif changed: self.store.touch()
+
+    def apply_temp_visual(self, ek_list, color, width=STYLE_THICK, duration=TEMPORARY_VISUALIZATION_SECONDS):
+        # ek_list: lista de aristas [('N1','N2'), ...] o una sola arista ('N1','N2')
+        if self.replaying: return
+        if not isinstance(ek_list, list): ek_list = [ek_list]
+        exp_time = time.time() + duration
+        with self.lock:
+            n_edges = self.topo.n_edges
+            for u, v in ek_list:
+                row = self.topo.set_temp(u, v, color, width, exp_time)
+                self.expiry.schedule(duration, self._clear_temp_visual, row, key=('temp', row)) # Sustituye al vencimiento anterior
+            self.store.touch(topology=self.topo.n_edges != n_edges) # Un visual sobre una arista inexistente la crea
+            if self.topo.n_edges != n_edges: self.liveness.track_edges(n_edges)
+
+    def _clear_temp_visual(self, row): # Llamado por ExpiryScheduler con `lock` tomado, solo al vencer
+        self.topo.clear_temp(row); self.store.touch()
+
+    # --- Envejecimiento (LivenessTracker, con `lock` tomado) ---
+
+    def _on_node_stale(self, node): # Sin señales: fuera de las rutas, gris en la GUI
+        self.routing.remove_node(node); self.store.touch()
+        if not self.replaying: log.info("[-]Inactivo:%s", node)
+
+    def _on_node_alive(self, node): # Volvió: sus aristas 'established' (con el otro extremo activo) vuelven al índice de rutas
+        topo = self.topo; pairs = topo.edge_pairs(); st = topo.edges.status
+        for r in topo.node_edge_rows(node).tolist():
+            u, v = pairs[r]
+            if st[r] == EDGE_ESTABLISHED and self.liveness.usable(u, v): self.routing.set_edge(u, v, True)
+        self.store.touch()
+        if not self.replaying: log.info("[+]Activo:%s", node)
+
+    def _on_edge_stale(self, u, v): # Enlace sin confirmar desde hace edge_stale_after: no se usa para rutas
+        self.set_edge_status(u, v, 'base')
+
+    def _evict(self, nodes, edges): # Compacta la topología: las filas cambian, así que los visuales temporales se reprograman
+        topo = self.topo; now = time.time()
+        for v in nodes: self.routing.remove_node(v)
+        for u, v in edges: self.routing.set_edge(u, v, False)
+        temps = list(topo.temp_visuals())
+        for r in temps: self.expiry.cancel(('temp', r))
+        row_map = topo.remove(nodes, edges).tolist()
+        for r in temps:
+            new = row_map[r]
+            if new >= 0: self.expiry.schedule(max(float(topo.edges.until[new]) - now, 0.0), self._clear_temp_visual, new, key=('temp', new))
+        if nodes: self.selected_nodes[:] = [v for v in self.selected_nodes if v not in nodes]
+        self.store.touch(topology=True)
+        log.info("[i] Expulsados %d nodos y %d aristas sin señales (%d nodos, %d aristas)",
+                 len(nodes), len(edges), topo.n_nodes - 1, topo.n_edges)
+
+    def select(self, node): # Clic de la GUI: alterna el nodo en la selección; con dos, la vacía y devuelve la pareja
+        # -> (hubo cambio, pareja o None, selección actual)
+        with self.lock:
+            sel = self.selected_nodes; changed = True; pair = None
+            if node in sel: sel.remove(node)
+            elif len(sel) < 2: sel.append(node)
+            else: changed = False
+            if len(sel) == 2: pair = tuple(sel); sel.clear()
+            if changed: self.store.touch()
+            return changed, pair, tuple(sel)
+
+    def select_many(self, nodes, add=False): # Caja o lazo de la GUI: sustituye (o amplía) la selección; [] la vacía
+        with self.lock:
+            sel = self.selected_nodes
+            if not add: sel.clear()
+            have = set(sel)
+            sel.extend(v for v in dict.fromkeys(nodes) if v not in have and v != 'ALL')
+            self.store.touch()
+            return tuple(sel)
+
+    def launch_batch(self, nodes, mode='all-pairs', source=None, concurrency=BATCH_CONCURRENCY):
+        # Lote sobre una selección ('all-pairs' o 'star' desde source): un único hilo planificador con
+        # `concurrency` comunicaciones en vuelo (espnow_traffic), no un hilo por pareja. -> (lanzado, mensaje)
+        from espnow_traffic import TrafficGenerator, batch_pairs
+        pairs, total = batch_pairs(nodes, mode, source)
+        if not total: return False, "Lote vacío: seleccione al menos 2 nodos"
+        with self.lock:
+            if self.batch is not None: return False, f"Ya hay un lote en marcha ({self.batch.summary()['launched']}/{self.batch.total})"
+            gen = self.batch = TrafficGenerator(None, lambda s, d, m: self.launch_interaction(s, d, m)[0],
+                                                concurrency=concurrency, pairs=pairs, total=total)
+        threading.Thread(target=self._run_batch, args=(gen, mode), name='batch', daemon=True).start()
+        return True, f"Lote {mode}: {total} comunicaciones, {gen.concurrency} en vuelo"
+
+    def _run_batch(self, gen, mode):
+        def report(line):
+            log.info("%s", line); self.message(self._batch_line(gen, mode))
+        try: s = gen.run(None, report=report)
+        finally:
+            with self.lock: self.batch = None
+        log.info("%s", gen.format(s)); self.message(self._batch_line(gen, mode, s))
+
+    @staticmethod
+    def _batch_line(gen, mode, s=None): # Resumen corto del lote para el título de la GUI
+        s = s or gen.summary()
+        line = (f"Lote {mode} {'terminado' if gen.finished is not None else 'en marcha'}: lanzadas {s['launched']}/{s['total']}, "
+                f"entregadas {s['delivered']}, fallos {s['failed'] + s['timeout']}")
+        return line + (f", sin lanzar {s['not_launched']}" if s['not_launched'] else "")
+
+    def cancel_batch(self): # Deja de lanzar; las que estén en vuelo acaban solas
+        with self.lock: gen = self.batch
+        if gen is None: return False
+        gen.stop(); return True
+
+    def live_nodes(self): # Nodos que no están inactivos (candidatos del generador de tráfico); la misma tupla mientras no cambian
+        names = self.topo.node_names(); stale = self.liveness.stale; c = self.liveness.counts
+        key = (names, c['stale'], c['revived'], len(stale))
+        if self._live_key is None or key[1:] != self._live_key[1:] or key[0] is not self._live_key[0]:
+            self._live_key = key; self._live = tuple(v for v in names if v not in stale) if stale else names
+        return self._live
+
+    def _on_comm_change(self, r): # CommTracker.on_change, con `lock` tomado
+        self.store.touch()
+        if self.traffic is not None: self.traffic.on_record(r)
+        if self.batch is not None: self.batch.on_record(r)
+        if self.web_server is not None: self.web_server.on_record(r)
+
+    def _build_snapshot(self, version, topology_version): # Llamado por StateStore con `lock` tomado
+        t0 = time.perf_counter_ns()
+        snap = snapshot_from_topology(version, topology_version, self.topo, self.comms.active_nodes(),
+                                      self.comms.active_count(), self.selected_nodes, self.liveness.stale)
+        self._h_publish.record_ns(time.perf_counter_ns() - t0)
+        return snap
+
+    # --- Envíos ---
+
+    def send_to_node(self, node, line): # Comando UDP a un nodo por su última dirección conocida
+        addr = self.topo.addr(node)
+        if addr is None: log.warning("[!]No IP:%s", node); return False
+        self.outbound.send(line, addr, node); self._journal_out(line, addr); return True
+
+    def find_path(self, s1, s2):
+        with self.lock:
+            if self.routing_mode == 'etx': return self.routing.weighted_path(s1, s2, self.links.etx)[0] # Menor nº esperado de transmisiones
+            return self.routing.path(s1, s2) # Árbol BFS en caché
+
+    def launch_interaction(self, s1, s2, msg_id):
+        # Ruta por aristas 'established' o, si no hay, UNICAST directo. Devuelve (lanzada, mensaje)
+        with self.outbound.held(): return self._launch(s1, s2, msg_id) # El primer salto sale desde este hilo
+
+    def _launch(self, s1, s2, msg_id):
+        payload = f"data_{msg_id[:4]}"
+        for s in (s1, s2): # apply_temp_visual / set_edge_status crean lo que no existe: solo nodos conocidos
+            if s == 'ALL' or s not in self.topo: return False, f"Nodo desconocido {s}"
+        for s in (s1, s2):
+            if s in self.liveness.stale: return False, f"Nodo inactivo {s}" # Sin señales: ni ruta ni UNICAST
+        path = self.find_path(s1, s2)
+        if path and len(path) > 1:
+            p_edges = [(path[i], path[i + 1]) for i in range(len(path) - 1)]
+            self.apply_temp_visual(p_edges, COLOR_EDGE_VIA_ESTABLISHED, STYLE_THICK)
+            with self.lock: # Sin time.sleep entre saltos: cada ROUTE_STEP sale al llegar el ACK del salto anterior
+                self.comms.start(msg_id, 'route', path, [get_edge_key(u, v) for u, v in p_edges],
+                                 timeout=self.dispatcher.budget(len(path)))
+                started = self.dispatcher.start(msg_id, path, payload)
+            return started, (f"Ruta Verde {s1}->{s2}" if started else f"FALLO Ruta {msg_id[:4]} (no_ip)")
+        elif s1 != s2:
+            with self.lock: self.comms.start(msg_id, 'direct', [s1, s2], [get_edge_key(s1, s2)])
+            self.apply_temp_visual([(s1, s2)], COLOR_EDGE_ATTEMPT, STYLE_NORMAL)
+            s1_addr = self.topo.addr(s1)
+            if s1_addr is None:
+                self.set_edge_status(s1, s2, 'failed'); self.apply_temp_visual([(s1, s2)], COLOR_EDGE_FAIL, duration=0.2)
+                with self.lock: self.comms.advance(msg_id, FAILED, detail=s1, reason='no_ip')
+                return False, f"FALLO IP {s1}"
+            line = f"UNICAST {s2} {payload}\n".encode()
+            self.outbound.send(line, s1_addr); self._journal_out(line, s1_addr)
+            return True, f"Intento UNICAST {s1}->{s2}"
+        return False, "Origen y destino iguales."
+
+    # --- Ingesta ---
+
+    def procesar_datagrama(self, data, addr): # Un datagrama puede traer varios eventos (ver espnow_protocol)
+        counts = self.ingest_counts; perf = time.perf_counter_ns
+        try:
+            t0 = perf(); events = parse_events(data); self._h_parse.record_ns(perf() - t0)
+            counts['datagrams'] += 1; counts['events'] += len(events)
+            if self.journal is not None:
+                if len(events) == 1 and data[0] == WIRE_MAGIC: self.journal.append(data, addr) # Ya es la trama binaria del evento
+                else:
+                    for ev in events: self.journal.append_event(ev, addr)
+            for ev in events: self._procesar_evento(ev, addr)
+        except Exception as e:
+            log.exception("[!]ExListener:%s", e)
+
+    def procesar_registros(self, records, folded, datagrams): # ShardedIngest, con `lock` ya tomado: eventos ya decodificados, en orden de llegada
+        counts = self.ingest_counts; ev_counts = self._event_counts; journal = self.journal
+        counts['datagrams'] += datagrams; counts['events'] += len(records)
+        for cmd, n in folded.items(): # Repetidos de la ventana descartados en los trabajadores: solo se cuentan
+            label = self._event_stage(cmd)[0]; ev_counts[label] = ev_counts.get(label, 0) + n; counts['events'] += n
+            if cmd == "BROADCAST_RECV": counts['broadcast_recv'] += n
+        with self.outbound.held():
+            for _, code, fields, addr in records:
+                try:
+                    ev = event_of(code, fields)
+                    if journal is not None: journal.append_event(ev, addr)
+                    self._procesar_evento(ev, addr)
+                except Exception as e:
+                    log.exception("[!]ExListener:%s", e)
+
+    def _procesar_evento(self, ev, addr): # Contadores, ventana de BROADCAST_RECV y manejador del tipo de evento
+        label, h = self._event_stage(ev.cmd if type(ev) is CmdEvent else type(ev).__name__)
+        ev_counts = self._event_counts; ev_counts[label] = ev_counts.get(label, 0) + 1 # Recibidos (también los repetidos que se descartan)
+        if type(ev) is CmdEvent and ev.cmd == "BROADCAST_RECV" and ev.target:
+            counts = self.ingest_counts; counts['broadcast_recv'] += 1
+            if self.broadcast_window > 0 and self._broadcast_repeated(ev): return
+            counts['broadcast_applied'] += 1
+        handler = self.handlers.get(type(ev))
+        if handler is None: return
+        t0 = time.perf_counter_ns(); handler(ev, addr); h.record_ns(time.perf_counter_ns() - t0)
+
+    def _event_stage(self, kind): # (etiqueta cmd, histograma apply_seconds) del tipo de evento (cmd o nombre de la clase)
+        r = self._h_apply.get(kind)
+        if r is None:
+            label = kind if len(self._h_apply) < MAX_EVENT_KINDS else 'otro'
+            r = self._h_apply[kind] = (label, self.metrics.histogram('apply_seconds', "Aplicación de un evento al grafo", cmd=label))
+        return r
+
+    def procesar_lote(self, batch): # Llamado por IngestEngine con `lock` ya tomado (una vez por lote)
+        with self.outbound.held(): # Los comandos que provoque el lote salen juntos al final (un sendmmsg)
+            for data, addr in batch: self.procesar_datagrama(data, addr)
+
+    def _broadcast_repeated(self, ev): # En una tormenta de descubrimiento casi todos los BROADCAST_RECV son repetidos
+        # El primero de cada pareja se aplica al momento (sin retraso); los demás de la ventana no tocan el grafo
+        key = (ev.mac, ev.target); recent = self._bcast_recent
+        if key in recent: return True
+        with self.lock:
+            if not recent: self.expiry.schedule(self.broadcast_window, recent.clear, key=('bcast_window',))
+            recent.add(key)
+        return False
+
+    def _on_cmd(self, ev, addr): # <MAC> CMD:...
+        mac_o, cmd_t, mac_t = ev.mac, ev.cmd, ev.target
+        topo, links, comms = self.topo, self.links, self.comms
+        with self.lock:
+            added = False
+            if mac_o not in topo: log.info("[+]Nodo:%s", mac_o); added = True
+            topo.set_addr(mac_o, addr)
+            if mac_t and mac_t not in topo: topo.node(mac_t); log.info("[+]Nodo(tgt):%s", mac_t); added = True
+            if added: self.store.touch(topology=True)
+            live = self.liveness; live.node_seen(mac_o)
+            if mac_t: (live.node_seen if cmd_t.endswith('_RECV') else live.track_node)(mac_t) # *_RECV: mac_t emitió y se le oyó
+        ek_inv = get_edge_key(mac_o, mac_t) if mac_t else None
+        if cmd_t == "JOIN": self.set_edge_status(mac_o, 'ALL', 'base')
+        elif cmd_t == "BROADCAST_RECV" and ek_inv:
+            with self.lock: cur_stat = topo.status(mac_o, mac_t); links.seen(mac_o, mac_t)
+            if cur_stat != EDGE_ESTABLISHED: self.set_edge_status(mac_o, mac_t, 'base')
+        elif cmd_t == "UNICAST_RECV" and ek_inv:
+            self.set_edge_status(mac_t, mac_o, 'established')
+            self.apply_temp_visual([ek_inv], COLOR_EDGE_TEMP_SUCCESS, STYLE_THICK, TEMPORARY_VISUALIZATION_SECONDS)
+            mid_res = None
+            with self.lock:
+                links.observe(mac_t, mac_o, True)
+                for C in comms.active_on_edge(ek_inv): # Solo las comunicaciones de esta arista, no todas
+                    if C.kind == 'direct' and C.nodes == (mac_t, mac_o):
+                        comms.advance(C.msg_id, DELIVERED, detail=mac_o); mid_res = C.msg_id; break
+            if mid_res: self.message(f"UNICAST {mac_t[:5]}->{mac_o[:5]} OK!")
+        elif cmd_t == "SEND_FAIL_TO" and ek_inv:
+            self.set_edge_status(mac_o, mac_t, 'failed'); self.apply_temp_visual([ek_inv], COLOR_EDGE_FAIL, STYLE_THICK, 0.5)
+            self.message(f"FALLO {mac_o[:5]}->{mac_t[:5]}")
+            with self.lock:
+                links.observe(mac_o, mac_t, False)
+                for C in comms.active_on_edge(ek_inv):
+                    if C.kind == 'route' and C.msg_id in self.dispatcher: # Ruta en vuelo: reintenta el salto o agota su plazo
+                        self.dispatcher.on_espnow_failed(C.msg_id, mac_o, mac_t); continue
+                    if (C.kind == 'direct' and C.nodes[0] == mac_o) or C.kind == 'route':
+                        comms.advance(C.msg_id, FAILED, detail=mac_o, reason='send_fail'); break
+
+    def _on_ack_route_step(self, ev, addr): # El salto recibió el ROUTE_STEP por UDP: empieza la medida de latencia del salto
+        self.liveness.node_seen(ev.node)
+        self.comms.advance(ev.msg_id, STEP_RCVD, detail=ev.node); self.links.step_acked(ev.msg_id, ev.node)
+        self.dispatcher.on_step_ack(ev.msg_id, ev.node); self.outbound.ack_step(ev.node, ev.msg_id)
+
+    def _on_ack_espnow_sent(self, ev, addr):
+        self.comms.advance(ev.msg_id, ESPNOW_SENT, detail=ev.sender)
+        self.dispatcher.on_espnow_sent(ev.msg_id, ev.sender, ev.sent_to) # Lanza el siguiente salto
+        self.apply_temp_visual(get_edge_key(ev.sender, ev.sent_to), COLOR_EDGE_TEMP_SUCCESS, STYLE_NORMAL, 1.5)
+        with self.lock:
+            self.liveness.node_seen(ev.sender)
+            self.links.observe(ev.sender, ev.sent_to, True); self.links.hop_done(ev.msg_id, ev.sender, ev.sender, ev.sent_to)
+
+    def _on_fail_espnow_sent(self, ev, addr): # esp_now_send() falló en un salto de la ruta
+        self.set_edge_status(ev.sender, ev.sent_to, 'failed')
+        self.apply_temp_visual([(ev.sender, ev.sent_to)], COLOR_EDGE_FAIL, STYLE_THICK, 0.5)
+        with self.lock:
+            self.liveness.node_seen(ev.sender)
+            self.links.observe(ev.sender, ev.sent_to, False)
+            if not self.dispatcher.on_espnow_failed(ev.msg_id, ev.sender, ev.sent_to): # En vuelo: el dispatcher reintenta el salto
+                self.comms.advance(ev.msg_id, FAILED, detail=ev.sender, reason='espnow')
+        self.message(f"FALLO Ruta {ev.msg_id[:4]} {ev.sender[:5]}->{ev.sent_to[:5]} (ERR:{ev.error})")
+
+    def _on_route_delivered(self, ev, addr):
+        mid = ev.msg_id
+        with self.lock:
+            self.liveness.node_seen(ev.final_dest); self.liveness.node_seen(ev.prev_hop)
+            self.links.observe(ev.prev_hop, ev.final_dest, True)
+            self.links.hop_done(mid, ev.prev_hop, ev.prev_hop, ev.final_dest, final=True)
+            lat = self.dispatcher.on_delivered(mid, ev.final_dest, ev.prev_hop)
+        C = self.comms.get(mid)
+        if C is not None and C.kind == 'route':
+            self.comms.advance(mid, DELIVERED, detail=ev.final_dest)
+            self.apply_temp_visual(list(C.edges), COLOR_EDGE_TEMP_SUCCESS, STYLE_THICK, 2.0)
+            for u, v in C.edges: self.set_edge_status(u, v, 'established') # Todas las aristas de la ruta pasan a azules
+            self.message(f"Ruta {mid[:4]} OK!" + (f" ({lat * 1e3:.0f} ms)" if lat is not None else ""))
+
+    def _on_route_done(self, msg_id, ok, info): # RouteDispatcher: ok -> info=latencia; fallo -> info=motivo
+        if ok: return
+        self.comms.advance(msg_id, FAILED, reason=info)
+        self.message(f"FALLO Ruta {msg_id[:4]} ({info})")
+
+
+# --- Modo sin GUI ---
+
+def add_arguments(ap):
+    ap.add_argument('--port', type=int, default=UDP_PORT)
+    ap.add_argument('--broadcast', type=float, default=None, metavar='S', help="enviar BROADCAST cada S segundos")
+    ap.add_argument('--routing', choices=('etx', 'hops'), default=ROUTING_MODE)
+    ap.add_argument('--traffic', choices=('uniform', 'hotspot', 'all-pairs'), help="patrón de parejas origen/destino")
+    ap.add_argument('--concurrency', type=int, default=4, help="comunicaciones en vuelo a la vez")
+    ap.add_argument('--duration', type=float, default=None, help="segundos (sin GUI: por defecto hasta Ctrl+C; con --traffic 60)")
+    ap.add_argument('--warmup', type=float, default=10.0, help="segundos de espera inicial para recibir los JOIN")
+    ap.add_argument('--seed', type=int, default=None)
+    ap.add_argument('--journal', metavar='DIR', default=None, help="diario de eventos: reconstruir al arrancar y registrar")
+    ap.add_argument('--checkpoint', metavar='FICHERO', default=None, help="checkpoint de topología (por defecto DIR/checkpoint.espc con --journal)")
+    ap.add_argument('--checkpoint-interval', type=float, default=CHECKPOINT_INTERVAL, metavar='S')
+    ap.add_argument('--stale-after', type=float, default=NODE_STALE_AFTER, metavar='S', help="nodo inactivo tras S segundos sin señales (0 = nunca)")
+    ap.add_argument('--evict-after', type=float, default=NODE_EVICT_AFTER, metavar='S', help="quitar el nodo tras S segundos sin señales (0 = nunca)")
+    ap.add_argument('--edge-stale-after', type=float, default=EDGE_STALE_AFTER, metavar='S')
+    ap.add_argument('--edge-evict-after', type=float, default=EDGE_EVICT_AFTER, metavar='S')
+    ap.add_argument('--metrics-port', type=int, default=None, metavar='PUERTO', help="servir métricas Prometheus en 127.0.0.1:PUERTO/metrics")
+    ap.add_argument('--workers', type=int, default=0, metavar='N', help="recibir y decodificar en N procesos (SO_REUSEPORT)")
+    ap.add_argument('--port-range', action='store_true', help="con --workers: el trabajador i escucha en PUERTO+i")
+    ap.add_argument('--web-port', type=int, default=None, metavar='PUERTO', help="vista web y deltas por WebSocket en PUERTO")
+    ap.add_argument('--web-bind', default=WEB_BIND, metavar='IP', help="dirección de la vista web (0.0.0.0 para la LAN)")
+    ap.add_argument('--web-host', action='append', default=[], metavar='NOMBRE', help="nombre o IP aceptado en la cabecera Host de la vista web (repetible)")
+    ap.add_argument('--node-rate', type=float, default=NODE_RATE, metavar='R', help="comandos/s por nodo (0 = sin ritmo)")
+    ap.add_argument('--node-burst', type=int, default=NODE_BURST, metavar='N', help="ráfaga máxima de comandos por nodo")
+    return add_log_arguments(ap)
+
+
+def run_traffic(engine, args): # Espera a que se unan nodos, genera tráfico e imprime el informe
+    from espnow_traffic import TrafficGenerator
+    print(f"[i] Modo tráfico: esperando {args.warmup:.0f}s a que se unan nodos..."); time.sleep(args.warmup)
+    engine.traffic = TrafficGenerator(engine.live_nodes, lambda s, d, m: engine.launch_interaction(s, d, m)[0],
+                                      args.traffic, args.concurrency, seed=args.seed)
+    print(f"[i] {len(engine.topo.node_names()) - 1} nodos, {engine.routing.number_of_edges()} aristas 'established'")
+    summary = engine.traffic.run(60.0 if args.duration is None else args.duration)
+    print(engine.traffic.format(summary)); print(f"[i] Dispatcher: {engine.dispatcher.stats()}")
+    print(f"[i] Salida: {engine.outbound.stats()}")
+
+
+def run_headless(args):
+    setup_logging(args.log_level, args.log_rate)
+    engine = MonitorEngine(args.port, routing_mode=args.routing, broadcast_interval=args.broadcast,
+                           journal_dir=args.journal, checkpoint=args.checkpoint,
+                           checkpoint_interval=args.checkpoint_interval, stale_after=args.stale_after,
+                           evict_after=args.evict_after, edge_stale_after=args.edge_stale_after,
+                           edge_evict_after=args.edge_evict_after, metrics_port=args.metrics_port,
+                           workers=args.workers, port_range=args.port_range, web_port=args.web_port,
+                           web_bind=args.web_bind, node_rate=args.node_rate, node_burst=args.node_burst,
+                           web_hosts=args.web_host).start()
+    print(f"[i] Motor en marcha en UDP {engine.port} (matplotlib cargado: {'matplotlib' in sys.modules}, "
+          f"networkx: {'networkx' in sys.modules})", flush=True)
+    try:
+        if args.traffic: run_traffic(engine, args)
+        else:
+            end = None if args.duration is None else time.monotonic() + args.duration
+            while end is None or time.monotonic() < end:
+                time.sleep(STATUS_INTERVAL if end is None else max(0.0, min(STATUS_INTERVAL, end - time.monotonic())))
+                snap = engine.store.snapshot()
+                c = engine.ingest_counts; o = engine.outbound.stats()
+                print(f"[i] Nodos: {len(snap.nodes) - 1} ({len(snap.stale)} inactivos) Aristas: {len(snap.edges)} Comms activas: {snap.active_count} "
+                      f"| Ingesta: {engine.ingest.stats()['rate']:.0f} dgr/s, {c['events'] / max(c['datagrams'], 1):.1f} eventos/dgr, "
+                      f"BROADCAST_RECV {c['broadcast_recv']} -> {c['broadcast_applied']} aplicados"
+                      f" | Salida: {o['sent']} comandos en {o['syscalls']} llamadas, {o['pending']} en cola, reintentos {o['step_retries']}"
+                      + (f", descartes {o['overflow']}" if o['overflow'] else ""))
+    except KeyboardInterrupt:
+        pass
+    engine.stop()
+    print(format_summary(engine.metrics))
+    return 0
+
+
+def main():
+    args = add_arguments(argparse.ArgumentParser(description="Monitor ESP-NOW sin GUI")).parse_args()
+    return run_headless(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+# --- espnow_expiry: planificador único de caducidades (TTL) ---
+#
+# Sustituye a los threading.Timer por evento (un hilo nuevo por cada unicast
+# confirmado o ruta entregada) y a los barridos por frame de los visuales
+# temporales. Todas las caducidades viven en un montículo (heap) ordenado por
+# instante de vencimiento y las atiende UN hilo, que duerme hasta el
+# siguiente vencimiento. Vencer k entradas cuesta O(k log n); nunca se
+# recorre lo que no ha vencido.
+#
+# Con key= una entrada sustituye a la anterior de la misma clave (p. ej.
+# volver a resaltar una arista alarga su visual en vez de duplicarlo). Las
+# entradas sustituidas o canceladas se marcan y se descartan al salir del
+# montículo; si se acumulan demasiadas, el montículo se reconstruye.
+
+import heapq, itertools, threading, time
+from espnow_log import get_logger
+
+log = get_logger('expiry')
+
+COMPACT_MIN = 1024  # entradas muertas mínimas antes de reconstruir el montículo
+
+
+class _Entry:
+    __slots__ = ('deadline', 'seq', 'key', 'callback', 'args', 'alive')
+    def __init__(self, deadline, seq, key, callback, args):
+        self.deadline = deadline; self.seq = seq; self.key = key
+        self.callback = callback; self.args = args; self.alive = True
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class ExpiryScheduler:
+    # lock: si se da, los callbacks vencidos se ejecutan con él tomado (un acquire por tanda)
+    def __init__(self, lock=None, clock=time.monotonic):
+        self.lock = lock
+        self.clock = clock
+        self._heap = []
+        self._keyed = {}        # key -> _Entry viva
+        self._dead = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.fired = 0
+        self.callback_errors = 0
+
+    def schedule(self, delay, callback, *args, key=None):
+        # Ejecuta callback(*args) dentro de `delay` segundos
+        return self.schedule_at(self.clock() + delay, callback, *args, key=key)
+
+    def schedule_at(self, deadline, callback, *args, key=None):
+        e = _Entry(deadline, next(self._seq), key, callback, args)
+        with self._cond:
+            if key is not None:
+                old = self._keyed.get(key)
+                if old is not None: old.alive = False; self._dead += 1
+                self._keyed[key] = e
+            heapq.heappush(self._heap, e)
+            if self._heap[0] is e: self._cond.notify()  # vence antes que lo que esperaba el hilo
+            self._maybe_compact()
+        return e
+
+    def cancel(self, key):
+        with self._cond:
+            e = self._keyed.pop(key, None)
+            if e is None: return False
+            e.alive = False; self._dead += 1
+            self._maybe_compact()
+            return True
+
+    def deadline(self, key):
+        e = self._keyed.get(key)
+        return None if e is None else e.deadline
+
+    def __len__(self):
+        return len(self._heap) - self._dead
+
+    def _maybe_compact(self):
+        if self._dead > COMPACT_MIN and self._dead > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if e.alive]
+            heapq.heapify(self._heap)
+            self._dead = 0
+
+    def _pop_due(self, now):
+        # Saca del montículo las entradas vencidas (con self._cond tomado)
+        due = []
+        heap = self._heap
+        while heap and heap[0].deadline <= now:
+            e = heapq.heappop(heap)
+            if not e.alive: self._dead -= 1; continue
+            if e.key is not None and self._keyed.get(e.key) is e: del self._keyed[e.key]
+            due.append(e)
+        return due
+
+    def run_due(self, now=None):
+        # Ejecuta lo vencido; útil también desde un bucle de eventos propio. Devuelve cuántos.
+        with self._cond:
+            due = self._pop_due(self.clock() if now is None else now)
+        if not due: return 0
+        if self.lock is not None:
+            with self.lock: self._fire(due)
+        else:
+            self._fire(due)
+        return len(due)
+
+    def _fire(self, due):
+        for e in due:
+            try: e.callback(*e.args)
+            except Exception as ex:
+                self.callback_errors += 1
+                log.error("[!] Excepción en caducidad %s: %s", e.callback.__name__, ex)
+        self.fired += len(due)
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="expiry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread: self._thread.join(timeout=2.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running: break
+                heap = self._heap
+                while heap and not heap[0].alive:
+                    heapq.heappop(heap); self._dead -= 1
+                timeout = None if not heap else max(heap[0].deadline - self.clock(), 0.0)
+                if timeout is None or timeout > 0: self._cond.wait(timeout)
+                if not self._running: break
+            self.run_due()
@@ -0,0 +1,190 @@
+# --- espnow_ingest: motor de ingesta UDP por lotes ---
+#
+# Un hilo "drenador" espera con select() a que el socket tenga datos y lee
+# TODOS los datagramas pendientes en una sola pasada (socket no bloqueante,
+# estilo recvmmsg). Los datagramas van a un buffer circular acotado y un hilo
+# consumidor los entrega al manejador por lotes, tomando el lock del grafo
+# una sola vez por lote. Así el hilo de matplotlib puede retener `lock` sin
+# que el kernel tire paquetes: el drenador nunca toca el lock del grafo.
+#
+# metrics (espnow_metrics.Metrics, opcional): ingest_queue_seconds (de la
+# recepción al inicio del lote que lo aplica, por datagrama) e
+# ingest_batch_seconds (manejador por lote). El instante de recepción se
+# anota una vez por tanda drenada, no por datagrama.
+
+import socket, selectors, threading, time
+from collections import deque
+from espnow_log import get_logger
+
+log = get_logger('ingest')
+
+RING_CAPACITY = 65536        # datagramas máximos en cola antes de descartar
+BATCH_MAX = 4096             # datagramas máximos entregados por lote
+RECV_BUFSIZE = 2048          # bytes máximos por datagrama
+SOCKET_RCVBUF = 4 * 1024 * 1024
+POLL_INTERVAL = 0.2          # segundos; solo afecta a la latencia de stop()
+
+
+class RingBuffer:
+    # Cola FIFO acotada. Si está llena, los datagramas nuevos se descartan
+    # (y se cuentan) en vez de bloquear al drenador.
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self._items = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def push_many(self, items):
+        with self._cond:
+            free = self.capacity - len(self._items)
+            if free <= 0:
+                self.dropped += len(items)
+                return 0
+            if len(items) > free:
+                self.dropped += len(items) - free
+                items = items[:free]
+            self._items.extend(items)
+            depth = len(self._items)
+            if depth > self.max_depth: self.max_depth = depth
+            self._cond.notify()
+            return len(items)
+
+    def pop_batch(self, max_items=BATCH_MAX, timeout=None):
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return []
+            n = min(max_items, len(self._items))
+            popleft = self._items.popleft
+            return [popleft() for _ in range(n)]
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+class IngestEngine:
+    # sock: socket UDP ya enlazado (se pasa a modo no bloqueante).
+    # handler(batch): recibe una lista de (bytes, addr).
+    # lock: si se indica, se toma una vez alrededor de cada llamada a handler.
+    # metrics: espnow_metrics.Metrics opcional (histogramas de cola y de lote)
+    def __init__(self, sock, handler, lock=None, capacity=RING_CAPACITY, batch_max=BATCH_MAX, metrics=None):
+        self.sock = sock
+        self.handler = handler
+        self.lock = lock
+        self.batch_max = batch_max
+        self.ring = RingBuffer(capacity)
+        self.received = 0
+        self.batches = 0
+        self.handler_errors = 0
+        self.started_at = None
+        self._h_queue = self._h_batch = None
+        if metrics is not None:
+            self._h_queue = metrics.histogram('ingest_queue_seconds', "Del recvfrom al inicio del lote que aplica el datagrama")
+            self._h_batch = metrics.histogram('ingest_batch_seconds', "Manejador por lote (con el lock del grafo)")
+        self._accepted = 0        # datagramas que entraron en el buffer (secuencia)
+        self._applied = 0         # datagramas entregados al manejador
+        self._stamps = deque()    # (secuencia final de la tanda, perf_counter_ns al drenarla)
+        self._running = False
+        self._threads = []
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+        except OSError:
+            pass
+        sock.setblocking(False)
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self.started_at = time.monotonic()
+        self._threads = [threading.Thread(target=self._drain_loop, name="ingest-drain", daemon=True),
+                         threading.Thread(target=self._apply_loop, name="ingest-apply", daemon=True)]
+        for t in self._threads: t.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self.ring.wake()
+        for t in self._threads:
+            if t is not threading.current_thread(): t.join(timeout=2.0)
+        self._threads = []
+
+    def _drain_loop(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ)
+        recvfrom = self.sock.recvfrom
+        try:
+            while self._running:
+                if not sel.select(POLL_INTERVAL): continue
+                pending = []
+                append = pending.append
+                while True:
+                    try:
+                        append(recvfrom(RECV_BUFSIZE))
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionResetError:
+                        # En Windows un ICMP "port unreachable" previo llega aquí; se ignora
+                        continue
+                    except OSError:
+                        if not self._running: return
+                        raise
+                    if len(pending) >= self.batch_max:
+                        self._flush(pending)
+                        pending = []; append = pending.append
+                if pending: self._flush(pending)
+        finally:
+            sel.close()
+
+    def _flush(self, pending):
+        self.received += len(pending)
+        t = time.perf_counter_ns() if self._h_queue is not None else 0
+        n = self.ring.push_many(pending)
+        if n and t: # Si el consumidor saca la tanda antes de anotarla, esas muestras se pierden (no se cuentan mal)
+            self._accepted += n; self._stamps.append((self._accepted, t))
+
+    def _record_queue(self, n, now):
+        # Espera en cola de los n datagramas del lote: una muestra por datagrama, agrupadas por tanda
+        start = self._applied; end = start + n; stamps = self._stamps; record = self._h_queue.record_ns
+        while stamps and start < end:
+            seq, t = stamps[0]
+            k = min(seq, end) - start
+            if k > 0: record(now - t, k); start += k
+            if seq <= end: stamps.popleft()
+            else: break
+        self._applied = end
+
+    def _apply_loop(self):
+        while self._running or len(self.ring):
+            batch = self.ring.pop_batch(self.batch_max, timeout=POLL_INTERVAL)
+            if not batch: continue
+            self.batches += 1
+            try:
+                if self.lock is not None:
+                    with self.lock: self._apply(batch)
+                else:
+                    self._apply(batch)
+            except Exception as e:
+                self.handler_errors += 1
+                log.exception("[!] Excepción en manejador de ingesta: %s", e)
+
+    def _apply(self, batch):
+        h = self._h_batch
+        if h is None: self.handler(batch); return
+        t0 = time.perf_counter_ns(); self._record_queue(len(batch), t0)
+        self.handler(batch); h.record_ns(time.perf_counter_ns() - t0)
+
+    def stats(self):
+        elapsed = (time.monotonic() - self.started_at) if self.started_at else 0.0
+        return {'received': self.received,
+                'dropped': self.ring.dropped,
+                'queue_depth': len(self.ring),
+                'queue_max_depth': self.ring.max_depth,
+                'batches': self.batches,
+                'handler_errors': self.handler_errors,
+                'rate': self.received / elapsed if elapsed > 0 else 0.0}
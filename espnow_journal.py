@@ -0,0 +1,236 @@
+# --- espnow_journal: diario de eventos en disco (solo añadir) y reproducción ---
+#
+# Todo el estado del monitor vive en memoria: al reiniciarlo se perdían la
+# topología, las IP de los nodos y el historial de rutas hasta que cada nodo
+# volvía a hacer JOIN. EventJournal guarda un registro binario por evento
+# recibido (y por comando enviado a un nodo) en segmentos que rotan:
+#
+#   segmento: b'ESPJ' | versión u8 | 3 bytes a cero
+#   registro: longitud u16 | t_ns u64 | dirección u8 | IPv4 4s | puerto u16 | trama
+#
+# t_ns es time.time_ns() forzado a no decrecer dentro del diario. La trama es
+# el evento en el formato binario de espnow_protocol (o la línea de texto si
+# no cabe sin pérdidas: encode_event); un comando enviado se guarda tal cual.
+# Se escribe con buffer y se vuelca cada FLUSH_INTERVAL: tras un corte se
+# pierde como mucho ese intervalo, y un registro a medias al final del último
+# segmento se ignora al leer.
+#
+# Lectura: read_journal() recorre los segmentos en orden, con mmap opcional
+# (no carga el segmento entero en memoria). rebuild() pasa los eventos
+# recibidos por el manejador del monitor (procesar_lote) para reconstruir el
+# estado al arrancar; replay() los reenvía por UDP al puerto del monitor a N
+# veces la velocidad original (0 = sin esperas), para pruebas de carga y
+# para reproducir incidentes.
+#
+# Uso: python espnow_journal.py info DIR
+#      python espnow_journal.py replay DIR [--speed 10] [--target 127.0.0.1:12345]
+
+import argparse, mmap, os, socket, struct, time
+from espnow_protocol import encode_event, parse_events
+
+MAGIC = b'ESPJ'
+VERSION = 1
+SEGMENT_BYTES = 64 * 1024 * 1024   # se rota al pasar de este tamaño
+MAX_SEGMENTS = 16                  # segmentos que se conservan (los más antiguos se borran)
+FLUSH_INTERVAL = 1.0               # segundos entre volcados a disco
+WRITE_BUFFER = 1024 * 1024
+REPLAY_BATCH = 256                 # registros por lote al reconstruir
+
+IN, OUT = 0, 1                     # evento recibido / comando enviado a un nodo
+
+_HEADER = struct.Struct('>4sB3x')
+_REC = struct.Struct('>HQB4sH')
+_NO_ADDR = (b'\0\0\0\0', 0)
+_PREFIX = 'journal-'
+_SUFFIX = '.evj'
+
+
+def segment_paths(directory):
+    # Segmentos del diario en orden de escritura
+    try: names = os.listdir(directory)
+    except FileNotFoundError: return []
+    return [os.path.join(directory, n) for n in sorted(names) if n.startswith(_PREFIX) and n.endswith(_SUFFIX)]
+
+
+_addr_cache = {}  # (ip, puerto) -> (4 bytes, puerto)
+
+
+def _pack_addr(addr):
+    r = _addr_cache.get(addr)
+    if r is None:
+        try: r = (socket.inet_aton(addr[0]), addr[1])
+        except (OSError, TypeError, IndexError): r = (b'\0\0\0\0', 0)
+        if len(_addr_cache) >= 65536: _addr_cache.clear()
+        _addr_cache[addr] = r
+    return r
+
+
+class EventJournal:
+    # last_ns: t_ns del último registro ya existente (los nuevos serán mayores aunque el reloj retroceda)
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS, last_ns=0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.records = 0
+        self.bytes_written = 0
+        self.rotations = 0
+        self._last_ns = last_ns
+        self._f = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        segs = segment_paths(directory)
+        self._seq = int(os.path.basename(segs[-1])[len(_PREFIX):-len(_SUFFIX)]) + 1 if segs else 0
+        self._open_segment()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{_PREFIX}{self._seq:08d}{_SUFFIX}")
+        self._seq += 1
+        self._f = open(path, 'wb', buffering=WRITE_BUFFER)
+        self._f.write(_HEADER.pack(MAGIC, VERSION)); self._size = _HEADER.size
+        segs = segment_paths(self.directory)
+        for old in segs[:max(0, len(segs) - self.max_segments)]:
+            try: os.remove(old)
+            except OSError: pass
+
+    def _rotate(self):
+        self._f.close(); self.rotations += 1
+        self._open_segment()
+
+    def append(self, frame, addr, direction=IN):
+        # frame: bytes de la trama; no bloquea (buffer en memoria)
+        t = time.time_ns()
+        if t <= self._last_ns: t = self._last_ns + 1
+        self._last_ns = t
+        ip, port = _pack_addr(addr) if addr else _NO_ADDR
+        w = self._f.write
+        w(_REC.pack(len(frame), t, direction, ip, port)); w(frame)
+        n = _REC.size + len(frame)
+        self._size += n; self.records += 1; self.bytes_written += n
+        if self._size >= self.segment_bytes: self._rotate()
+
+    @property
+    def last_ns(self): # t_ns del último registro escrito (los siguientes serán mayores)
+        return self._last_ns
+
+    def append_event(self, ev, addr):
+        self.append(encode_event(ev), addr, IN)
+
+    def flush(self):
+        if self._f is not None: self._f.flush()
+
+    def close(self):
+        if self._f is not None: self._f.close(); self._f = None
+
+    def stats(self):
+        return {'records': self.records, 'bytes': self.bytes_written, 'rotations': self.rotations,
+                'segments': len(segment_paths(self.directory))}
+
+
+def read_segment(path, use_mmap=False):
+    # Genera (t_ns, dirección, addr, trama) de un segmento; se detiene en un registro truncado
+    with open(path, 'rb') as f:
+        if use_mmap:
+            if os.fstat(f.fileno()).st_size == 0: return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+        try:
+            if len(buf) < _HEADER.size: return
+            magic, version = _HEADER.unpack_from(buf, 0)
+            if magic != MAGIC or version != VERSION: raise ValueError(f"{path}: no es un segmento de diario v{VERSION}")
+            off = _HEADER.size; end = len(buf); rec = _REC.size; unpack = _REC.unpack_from
+            while off + rec <= end:
+                n, t, direction, ip, port = unpack(buf, off)
+                a = off + rec; off = a + n
+                if off > end: break
+                yield t, direction, (socket.inet_ntoa(ip), port) if port else None, buf[a:off]
+        finally:
+            if use_mmap: buf.close()
+
+
+def _first_ns(path):
+    # t_ns del primer registro del segmento (None si no tiene ninguno)
+    try:
+        with open(path, 'rb') as f: head = f.read(_HEADER.size + _REC.size)
+    except OSError: return None
+    if len(head) < _HEADER.size + _REC.size: return None
+    return _REC.unpack_from(head, _HEADER.size)[1]
+
+
+def read_journal(directory, use_mmap=False, since_ns=0):
+    paths = segment_paths(directory)
+    for k, path in enumerate(paths):
+        if since_ns and k + 1 < len(paths): # Segmento entero anterior a since_ns: ni se abre
+            nxt = _first_ns(paths[k + 1])
+            if nxt is not None and nxt <= since_ns: continue
+        for r in read_segment(path, use_mmap):
+            if r[0] >= since_ns: yield r
+
+
+def rebuild(handler, directory, use_mmap=True, since_ns=0):
+    # Pasa los eventos recibidos por handler(lote de (trama, addr)); devuelve (eventos, último t_ns)
+    batch = []; n = 0; last = 0
+    for t, direction, addr, frame in read_journal(directory, use_mmap, since_ns):
+        last = t
+        if direction != IN: continue
+        batch.append((frame, addr)); n += 1
+        if len(batch) >= REPLAY_BATCH: handler(batch); batch = []
+    if batch: handler(batch)
+    return n, last
+
+
+def replay(directory, target, speed=1.0, use_mmap=True, sock=None):
+    # Reenvía por UDP los eventos recibidos respetando los tiempos originales / speed (0 = sin esperas)
+    s = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0; t0_rec = None; t0 = time.perf_counter()
+    for t, direction, _, frame in read_journal(directory, use_mmap):
+        if direction != IN: continue
+        if t0_rec is None: t0_rec = t
+        if speed > 0:
+            wait = (t - t0_rec) / 1e9 / speed - (time.perf_counter() - t0)
+            if wait > 0: time.sleep(wait)
+        try: s.sendto(frame, target); sent += 1
+        except BlockingIOError: pass
+    if sock is None: s.close()
+    return sent, time.perf_counter() - t0
+
+
+def info(directory):
+    counts = {IN: 0, OUT: 0}; kinds = {}; first = last = None; size = 0
+    for path in segment_paths(directory): size += os.path.getsize(path)
+    for t, direction, _, frame in read_journal(directory, use_mmap=True):
+        counts[direction] = counts.get(direction, 0) + 1
+        if first is None: first = t
+        last = t
+        if direction == IN:
+            for ev in parse_events(frame):
+                k = getattr(ev, 'cmd', None) or type(ev).__name__
+                kinds[k] = kinds.get(k, 0) + 1
+    return {'segments': len(segment_paths(directory)), 'bytes': size, 'in': counts[IN], 'out': counts[OUT],
+            'first_ns': first, 'last_ns': last, 'kinds': kinds}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Diario de eventos del monitor ESP-NOW")
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('info'); p.add_argument('directory')
+    p = sub.add_parser('replay'); p.add_argument('directory')
+    p.add_argument('--speed', type=float, default=1.0, help="N veces la velocidad original (0 = sin esperas)")
+    p.add_argument('--target', default='127.0.0.1:12345')
+    p.add_argument('--no-mmap', action='store_true')
+    args = ap.parse_args()
+    if args.cmd == 'info':
+        st = info(args.directory)
+        span = (st['last_ns'] - st['first_ns']) / 1e9 if st['first_ns'] is not None else 0.0
+        print(f"[i] {st['segments']} segmentos, {st['bytes'] / 1024:.0f} KiB, {st['in']} eventos recibidos, "
+              f"{st['out']} comandos enviados, {span:.1f} s")
+        for k, v in sorted(st['kinds'].items(), key=lambda kv: -kv[1]): print(f"    {k:24s} {v}")
+        return 0
+    host, port = args.target.rsplit(':', 1)
+    sent, elapsed = replay(args.directory, (host, int(port)), args.speed, not args.no_mmap)
+    print(f"[i] Reproducidos {sent} eventos en {elapsed:.2f} s ({sent / max(elapsed, 1e-9):,.0f}/s, x{args.speed:g})")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
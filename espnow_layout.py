@@ -0,0 +1,236 @@
+# --- espnow_layout: layout incremental en segundo plano ---
+#
+# Sustituye a nx.spring_layout / nx.kamada_kawai_layout sobre el grafo
+# completo. Las posiciones viven en arrays NumPy; cuando llega un nodo nuevo
+# se coloca junto a sus vecinos ya posicionados y solo los nodos "calientes"
+# (recién llegados) se mueven durante un número acotado de iteraciones de
+# fuerzas vectorizadas (Fruchterman-Reingold). Los nodos ya asentados no se
+# mueven, así el mapa no salta con cada JOIN.
+#
+# Todo el cálculo ocurre en un hilo propio. update_graph() solo deja el
+# cambio pendiente y positions() devuelve el último diccionario publicado:
+# el hilo de la animación nunca espera al layout.
+#
+# initial: posiciones conocidas de antemano (p. ej. de un checkpoint). Esos
+# nodos entran ya asentados en su sitio: no se recalcula nada al arrancar.
+#
+# metrics (espnow_metrics.Metrics, opcional): layout_step_seconds por
+# iteración de fuerzas.
+
+import threading, time
+import numpy as np
+
+ITERATIONS_PER_CHANGE = 60    # iteraciones máximas tras cada cambio del grafo
+PUBLISH_EVERY = 5             # publicar posiciones cada N iteraciones
+INITIAL_TEMPERATURE = 0.1     # desplazamiento máximo por iteración de un nodo nuevo
+COOLING = 0.93
+BARNES_HUT_THRESHOLD = 2000   # a partir de aquí la repulsión se aproxima por celdas
+GRID_CELLS = 32
+EXACT_CHUNK = 256             # nodos activos por bloque en la repulsión exacta
+
+
+class IncrementalLayout:
+    # fixed: {nodo: (x, y)} nodos anclados (p. ej. 'ALL'); nunca se mueven.
+    # initial: {nodo: (x, y)} posiciones de partida de nodos ya asentados (pueden moverse si llegan vecinos nuevos)
+    # metrics: espnow_metrics.Metrics opcional (histograma layout_step_seconds)
+    def __init__(self, fixed=None, k=None, seed=7, initial=None, metrics=None):
+        self.fixed = dict(fixed or {})
+        self.initial = dict(initial or {})
+        self.k = k
+        self._rng = np.random.default_rng(seed)
+        self._nodes = []                 # índice -> nodo
+        self._index = {}                 # nodo -> índice
+        self._pos = np.zeros((0, 2))
+        self._temp = np.zeros(0)         # "temperatura" por nodo; 0 = asentado
+        self._pinned = np.zeros(0, dtype=bool)
+        self._edges = np.zeros((0, 2), dtype=np.intp)
+        self._published = {}
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self.iterations_run = 0
+        self._h_step = metrics.histogram('layout_step_seconds', "Una iteración de fuerzas del layout") if metrics is not None else None
+
+    # --- API para los demás hilos (no bloquean) ---
+
+    def update_graph(self, nodes, edges):
+        # nodes/edges: iterables del grafo actual; se copian y se procesan en el hilo del layout
+        with self._pending_lock:
+            self._pending = (list(nodes), list(edges))
+        self._wake.set()
+
+    def positions(self):
+        # Último diccionario publicado {nodo: (x, y)}; no se modifica nunca después de publicarse
+        return self._published
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="layout", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread: self._thread.join(timeout=2.0)
+
+    # --- Hilo del layout ---
+
+    def _run(self):
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running: break
+            self._apply_pending()
+            self._publish()  # los nodos nuevos aparecen ya en su posición inicial
+            for it in range(ITERATIONS_PER_CHANGE):
+                if self._wake.is_set():
+                    # Llegó otro cambio: incorporarlo sin perder el trabajo hecho
+                    self._wake.clear(); self._apply_pending()
+                t0 = time.perf_counter_ns()
+                if not self._step(): break
+                if self._h_step is not None: self._h_step.record_ns(time.perf_counter_ns() - t0)
+                if it % PUBLISH_EVERY == PUBLISH_EVERY - 1: self._publish()
+            # Presupuesto agotado: todos quedan asentados y no se moverán en el próximo cambio
+            self._temp[:] = 0.0
+            self._publish()
+
+    def _apply_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            self._apply_fixed()
+            return
+        nodes, edges = pending
+        old_index, old_pos, old_temp = self._index, self._pos, self._temp
+        n = len(nodes)
+        index = {v: i for i, v in enumerate(nodes)}
+        pos = np.empty((n, 2)); temp = np.zeros(n); known = np.zeros(n, dtype=bool)
+        initial = self.initial
+        for i, v in enumerate(nodes):
+            j = old_index.get(v)
+            if j is not None:
+                pos[i] = old_pos[j]; temp[i] = old_temp[j]; known[i] = True
+            elif v in initial:
+                pos[i] = initial[v]; known[i] = True # Asentado (temperatura 0)
+        e = np.array([(index[u], index[v]) for u, v in edges if u in index and v in index and u != v],
+                     dtype=np.intp).reshape(-1, 2)
+        self._nodes, self._index, self._pos, self._temp, self._edges = nodes, index, pos, temp, e
+        self._pinned = np.zeros(n, dtype=bool)
+        self._apply_fixed()
+        known |= self._pinned
+        self._place_new(np.flatnonzero(~known), known)
+
+    def _apply_fixed(self):
+        for v, xy in self.fixed.items():
+            i = self._index.get(v)
+            if i is not None:
+                self._pos[i] = xy; self._pinned[i] = True; self._temp[i] = 0.0
+
+    def _ideal_distance(self):
+        if self.k is not None: return self.k
+        return 1.0 / np.sqrt(max(len(self._nodes), 1))
+
+    def _place_new(self, new_idx, known):
+        # Cada nodo nuevo aparece en el centroide de sus vecinos ya colocados
+        # (más un pequeño desplazamiento); si no tiene ninguno, alrededor del
+        # centro de masas. Se repite para que las cadenas de nodos nuevos
+        # también se agrupen.
+        if len(new_idx) == 0: return
+        k = self._ideal_distance()
+        pos = self._pos
+        if known.any(): center = pos[known].mean(axis=0)
+        else: center = np.array([0.5, 0.5])
+        spread = 0.5 if not known.any() else k
+        placed = known.copy()
+        remaining = set(new_idx.tolist())
+        nbrs = [[] for _ in range(len(self._nodes))]
+        for a, b in self._edges:
+            nbrs[a].append(b); nbrs[b].append(a)
+        for _ in range(3):
+            progressed = []
+            for i in remaining:
+                anchored = [j for j in nbrs[i] if placed[j]]
+                if anchored:
+                    pos[i] = pos[anchored].mean(axis=0) + self._rng.normal(0, k * 0.5, 2)
+                    progressed.append(i)
+            for i in progressed: placed[i] = True; remaining.discard(i)
+            if not progressed: break
+        for i in remaining:
+            pos[i] = center + self._rng.uniform(-spread, spread, 2)
+        self._temp[new_idx] = INITIAL_TEMPERATURE
+        self._temp[self._pinned] = 0.0
+
+    def _step(self):
+        # Una iteración de fuerzas sobre los nodos calientes. Devuelve False si no hay ninguno.
+        active = np.flatnonzero(self._temp > 1e-4)
+        if len(active) == 0: return False
+        pos = self._pos; k = self._ideal_distance()
+        disp = self._repulsion(active, k)
+        if len(self._edges):
+            # Atracción a lo largo de las aristas que tocan algún nodo activo
+            is_active = np.zeros(len(pos), dtype=bool); is_active[active] = True
+            e = self._edges[is_active[self._edges[:, 0]] | is_active[self._edges[:, 1]]]
+            if len(e):
+                delta = pos[e[:, 0]] - pos[e[:, 1]]
+                dist = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 1e-9)
+                f = (delta * (dist / k)[:, None])
+                full = np.zeros_like(pos)
+                np.add.at(full, e[:, 0], -f)
+                np.add.at(full, e[:, 1], f)
+                disp += full[active]
+        length = np.maximum(np.hypot(disp[:, 0], disp[:, 1]), 1e-9)
+        t = self._temp[active]
+        pos[active] += disp * (np.minimum(length, t) / length)[:, None]
+        self._temp[active] *= COOLING
+        self.iterations_run += 1
+        return True
+
+    def _repulsion(self, active, k):
+        pos = self._pos
+        if len(pos) <= BARNES_HUT_THRESHOLD:
+            out = np.empty((len(active), 2))
+            for a in range(0, len(active), EXACT_CHUNK):  # acota la memoria de la matriz (a, n, 2)
+                idx = active[a:a + EXACT_CHUNK]
+                delta = pos[idx, None, :] - pos[None, :, :]
+                d2 = np.maximum((delta ** 2).sum(axis=2), 1e-9)
+                out[a:a + EXACT_CHUNK] = (delta * (k * k / d2)[:, :, None]).sum(axis=1)
+            return out
+        # Aproximación tipo Barnes-Hut de un nivel: cada celda lejana actúa como
+        # una masa en su centroide; la propia celda y las 8 vecinas se suman
+        # exactas. Se recorre por celdas, no por nodos.
+        g = GRID_CELLS
+        lo = pos.min(axis=0); span = np.maximum(pos.max(axis=0) - lo, 1e-9)
+        cell = np.minimum((((pos - lo) / span) * g).astype(np.intp), g - 1)
+        cid = cell[:, 0] * g + cell[:, 1]
+        order = np.argsort(cid, kind='stable')
+        bounds = np.searchsorted(cid[order], np.arange(g * g + 1))
+        counts = np.diff(bounds).astype(float)
+        sx = np.bincount(cid, weights=pos[:, 0], minlength=g * g)
+        sy = np.bincount(cid, weights=pos[:, 1], minlength=g * g)
+        occupied = np.flatnonzero(counts)
+        cent = np.stack([sx[occupied], sy[occupied]], axis=1) / counts[occupied, None]
+        mass = counts[occupied]
+        ocx, ocy = occupied // g, occupied % g
+        out = np.zeros((len(active), 2))
+        act_cid = cid[active]
+        for c in np.unique(act_cid):
+            rows = np.flatnonzero(act_cid == c)
+            p = pos[active[rows]]
+            cx, cy = divmod(int(c), g)
+            near = (np.abs(ocx - cx) <= 1) & (np.abs(ocy - cy) <= 1)
+            delta = p[:, None, :] - cent[~near][None, :, :]
+            d2 = np.maximum((delta ** 2).sum(axis=2), 1e-9)
+            f = (delta * (mass[~near] * k * k / d2)[:, :, None]).sum(axis=1)
+            members = np.concatenate([order[bounds[o]:bounds[o + 1]] for o in occupied[near]])
+            delta = p[:, None, :] - pos[members][None, :, :]
+            d2 = np.maximum((delta ** 2).sum(axis=2), 1e-9)
+            f += (delta * (k * k / d2)[:, :, None]).sum(axis=1)
+            out[rows] = f
+        return out
+
+    def _publish(self):
+        self._published = dict(zip(self._nodes, map(tuple, self._pos.tolist())))
@@ -0,0 +1,80 @@
+# --- espnow_linkstats: calidad de enlace por arista y coste ETX ---
+#
+# Cada arista de TopologyStore lleva una tasa de éxito EWMA (ok_ratio), el
+# número de muestras, el último instante en que se vio (last_seen) y una
+# latencia por salto EWMA. Las muestras salen de los reportes del firmware:
+#   éxito: ACK_ROUTE_ESPNOW_SENT, UNICAST_RECV, ROUTE_DELIVERED
+#   fallo: FAIL_ROUTE_ESPNOW_SENT, SEND_FAIL_TO
+# La latencia de un salto a->b es el tiempo desde el ACK_ROUTE_STEP_RECEIVED
+# de `a` hasta el ACK_ROUTE_ESPNOW_SENT de `a` o, en el último salto, hasta
+# el ROUTE_DELIVERED en `b` (esta prevalece).
+#
+# etx(u, v) = 1 / ok_ratio: número esperado de transmisiones. Sumado a lo
+# largo de un camino (RoutingIndex.weighted_path) prefiere dos saltos buenos
+# a uno que falla la mitad de las veces.
+#
+# Sin lock propio: usar con el lock del grafo tomado.
+
+from collections import OrderedDict
+import time
+from espnow_topology import PRIOR_RATIO
+
+ALPHA = 0.2            # peso de cada muestra nueva en la tasa de éxito
+LATENCY_ALPHA = 0.3    # peso de cada muestra nueva en la latencia
+MIN_RATIO = 0.05       # cota inferior de ok_ratio para el coste (ETX máximo 20)
+STEP_TIMES_MAX = 8192  # ACKs de paso pendientes de emparejar (msg_id, nodo)
+
+
+class LinkStats:
+    def __init__(self, topo, clock=time.monotonic, wall_clock=time.time):
+        self.topo = topo
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._step_times = OrderedDict()  # (msg_id, nodo) -> instante del ACK de paso
+
+    def observe(self, u, v, ok):
+        # Muestra de éxito/fallo del enlace u-v; devuelve la nueva tasa o None si no existe la arista
+        r = self.topo.edge(u, v)
+        if r is None: return None
+        e = self.topo.edges
+        e.ok_ratio[r] = (1.0 - ALPHA) * e.ok_ratio[r] + (ALPHA if ok else 0.0)
+        e.samples[r] += 1
+        e.last_seen[r] = self.wall_clock()
+        return float(e.ok_ratio[r])
+
+    def seen(self, u, v):
+        # El enlace dio señales de vida (p. ej. BROADCAST_RECV) sin ser un intento de envío
+        r = self.topo.edge(u, v)
+        if r is not None: self.topo.edges.last_seen[r] = self.wall_clock()
+
+    def step_acked(self, msg_id, node):
+        st = self._step_times
+        st[(msg_id, node)] = self.clock()
+        if len(st) > STEP_TIMES_MAX: st.popitem(last=False)
+
+    def hop_done(self, msg_id, node, u, v, final=False):
+        # Cierra la medida del salto u-v que comandó `node`; devuelve la latencia (s) o None.
+        # Con final=False la marca se conserva por si llega después el ROUTE_DELIVERED.
+        t0 = self._step_times.pop((msg_id, node), None) if final else self._step_times.get((msg_id, node))
+        r = self.topo.edge(u, v)
+        if t0 is None or r is None: return None
+        lat = self.clock() - t0
+        e = self.topo.edges
+        old = e.latency[r]
+        e.latency[r] = lat if old != old else (1.0 - LATENCY_ALPHA) * old + LATENCY_ALPHA * lat  # old != old: NaN
+        return lat
+
+    def ratio(self, u, v):
+        r = self.topo.edge(u, v)
+        return PRIOR_RATIO if r is None else float(self.topo.edges.ok_ratio[r])
+
+    def etx(self, u, v):
+        r = self.topo.edge(u, v)
+        p = PRIOR_RATIO if r is None else float(self.topo.edges.ok_ratio[r])
+        return 1.0 / max(p, MIN_RATIO)
+
+    def latency(self, u, v):
+        r = self.topo.edge(u, v)
+        if r is None: return None
+        lat = float(self.topo.edges.latency[r])
+        return None if lat != lat else lat
@@ -0,0 +1,205 @@
+# --- espnow_liveness: envejecimiento de nodos y aristas por latido ---
+#
+# Los nodos entraban en la topología con cualquier línea CMD: y no salían
+# nunca: un ESP32 apagado seguía en el mapa, las rutas pasaban por él y
+# todos los bucles por nodo/arista crecían sin límite. LivenessTracker anota
+# last_seen (reloj de pared, columnas de TopologyStore) con cada señal de
+# vida y envejece:
+#   nodo   sin señales stale_after       -> inactivo: gris en la GUI y fuera del índice de rutas
+#          sin señales evict_after       -> se quita de la topología (con sus aristas)
+#   arista sin señales edge_stale_after  -> vuelve a 'base' (deja de usarse para rutas)
+#          sin señales edge_evict_after  -> se quita
+# Señales de vida de un nodo: cualquier evento que envía (el firmware repite
+# su CMD:JOIN cada HEARTBEAT_MS como latido) y ser el emisor de un *_RECV que
+# otro nodo oyó. De una arista: las que ya anota LinkStats (ACKs, fallos,
+# BROADCAST_RECV) y su creación. Las aristas con 'ALL' no envejecen: se van
+# con su nodo.
+#
+# Sin barridos: cada nodo y cada arista tiene UNA entrada en ExpiryScheduler
+# para su próximo vencimiento. Un latido solo escribe last_seen (O(1)); al
+# vencer, la entrada compara con last_seen y, si hubo señales, se reprograma
+# al nuevo vencimiento. Un nodo activo cuesta una operación del montículo
+# por stale_after, no una por latido. Las expulsiones se agrupan
+# (EVICT_BATCH) y se aplican compactando las columnas una sola vez.
+#
+# Tras arrancar (o cargar un checkpoint) la edad se cuenta como mínimo desde
+# el arranque: todos tienen un plazo completo para volver a dar señales. Lo
+# cargado comparte ese vencimiento, así que lleva una sola entrada común que
+# al vencer revisa (por tandas) solo lo que no dio señales desde entonces.
+# Un umbral a 0 desactiva ese paso.
+#
+# Sin lock propio: usar con el lock del grafo tomado (los vencimientos llegan
+# por ExpiryScheduler, que ya lo toma).
+
+import time
+import numpy as np
+from espnow_state import EDGE_BASE
+
+NODE_STALE_AFTER = 30.0    # segundos sin señales para marcar un nodo inactivo (3 latidos perdidos)
+NODE_EVICT_AFTER = 300.0   # segundos sin señales para quitar el nodo
+EDGE_STALE_AFTER = 300.0   # segundos sin señales para devolver una arista a 'base'
+EDGE_EVICT_AFTER = 900.0   # segundos sin señales para quitar la arista
+EVICT_BATCH = 1.0          # segundos para juntar expulsiones en una sola compactación
+LOADED_CHUNK = 2000        # nodos/aristas del checkpoint revisados por toma del lock
+PROTECTED = frozenset(('ALL',))
+
+
+class LivenessTracker:
+    # on_stale(nodo) / on_alive(nodo): un nodo pasa a inactivo / vuelve a dar señales
+    # on_edge_stale(u, v): arista sin señales que no estaba en 'base' (el motor la devuelve a 'base')
+    # on_evict(nodos, aristas): lote a quitar de la topología (set de nodos, lista de (u, v))
+    def __init__(self, topo, expiry, on_stale=None, on_alive=None, on_edge_stale=None, on_evict=None,
+                 stale_after=NODE_STALE_AFTER, evict_after=NODE_EVICT_AFTER, edge_stale_after=EDGE_STALE_AFTER,
+                 edge_evict_after=EDGE_EVICT_AFTER, wall_clock=time.time):
+        self.topo = topo
+        self.expiry = expiry
+        self.on_stale = on_stale
+        self.on_alive = on_alive
+        self.on_edge_stale = on_edge_stale
+        self.on_evict = on_evict
+        self.stale_after = stale_after
+        self.evict_after = evict_after
+        self.edge_stale_after = edge_stale_after
+        self.edge_evict_after = edge_evict_after
+        self.wall_clock = wall_clock
+        self.since = wall_clock()   # la edad nunca cuenta desde antes de este instante
+        self.stale = set()          # nodos inactivos
+        self._evict_nodes = set()
+        self._evict_edges = set()
+        self.counts = {'stale': 0, 'revived': 0, 'evicted': 0, 'edges_stale': 0, 'edges_evicted': 0}
+
+    # --- Señales de vida ---
+
+    def node_seen(self, name):
+        # El nodo envió algo (o otro nodo lo oyó): last_seen = ahora
+        i = self.topo.index(name)
+        if i is None or name in PROTECTED: return
+        now = self.wall_clock()
+        self.topo.nodes.last_seen[i] = now
+        if name in self.stale:
+            self.stale.discard(name); self.counts['revived'] += 1
+            self._schedule_node(name, now + self.stale_after)
+            if self.on_alive is not None: self.on_alive(name)
+        elif self.expiry.deadline(('node_age', name)) is None:
+            self._schedule_node(name, now + self.stale_after)
+
+    def track_node(self, name):
+        # Nodo mencionado sin ser señal de vida suya (p. ej. destino de SEND_FAIL_TO): solo se vigila
+        i = self.topo.index(name)
+        if i is None or name in PROTECTED or self.expiry.deadline(('node_age', name)) is not None: return
+        ls = self.topo.nodes.last_seen
+        if not ls[i]: ls[i] = self.wall_clock()
+        self._schedule_node(name, max(float(ls[i]), self.since) + self.stale_after)
+
+    def track_edges(self, first_row):
+        # Aristas nuevas (filas first_row..n_edges): su creación cuenta como señal
+        topo = self.topo; e = topo.edges; now = self.wall_clock()
+        pairs = topo.edge_pairs()
+        for r in range(first_row, topo.n_edges):
+            u, v = pairs[r]
+            if u in PROTECTED or v in PROTECTED: continue
+            if not e.last_seen[r]: e.last_seen[r] = now
+            if self.expiry.deadline(('edge_age', u, v)) is None:
+                self._schedule_edge(u, v, max(float(e.last_seen[r]), self.since) + self.edge_stale_after)
+
+    def track_all(self):
+        # Tras cargar un checkpoint todos vencen a la vez (since + umbral): en vez de una entrada por
+        # nodo/arista, una común que revisa solo los que no tienen entrada propia (no dieron señales)
+        self.since = now = self.wall_clock()
+        self.stale.clear(); self._evict_nodes.clear(); self._evict_edges.clear()
+        topo = self.topo
+        if self.stale_after:
+            names = [v for v in topo.node_names() if v not in PROTECTED]
+            self.expiry.schedule(self.stale_after, self._check_loaded, 'node_age', names, 0, key=('loaded', 'node_age'))
+        if self.edge_stale_after:
+            m = topo.n_edges; e = topo.edges
+            ls = e.last_seen[:m]; ls[ls == 0] = now
+            skip = np.zeros(topo.n_nodes, bool)
+            for v in PROTECTED:
+                i = topo.index(v)
+                if i is not None: skip[i] = True
+            pairs = topo.edge_pairs()
+            items = [pairs[r] for r in np.flatnonzero(~(skip[e.eu[:m]] | skip[e.ev[:m]])).tolist()]
+            self.expiry.schedule(self.edge_stale_after, self._check_loaded, 'edge_age', items, 0, key=('loaded', 'edge_age'))
+
+    def usable(self, u, v):
+        # La arista u-v puede entrar en el índice de rutas (ningún extremo inactivo)
+        return u not in self.stale and v not in self.stale
+
+    # --- Vencimientos (ExpiryScheduler, con el lock tomado) ---
+
+    def _schedule_node(self, name, deadline):
+        if not self.stale_after: return
+        self.expiry.schedule(max(deadline - self.wall_clock(), 0.0), self._check_node, name, key=('node_age', name))
+
+    def _schedule_edge(self, u, v, deadline):
+        if not self.edge_stale_after: return
+        self.expiry.schedule(max(deadline - self.wall_clock(), 0.0), self._check_edge, u, v, key=('edge_age', u, v))
+
+    def _age(self, last_seen, now):
+        return now - max(float(last_seen), self.since)
+
+    def _check_node(self, name):
+        i = self.topo.index(name)
+        if i is None: return
+        now = self.wall_clock(); age = self._age(self.topo.nodes.last_seen[i], now)
+        if age < self.stale_after: # Hubo señales desde que se programó: siguiente vencimiento
+            self._schedule_node(name, now - age + self.stale_after); return
+        if name not in self.stale:
+            self.stale.add(name); self.counts['stale'] += 1
+            if self.on_stale is not None: self.on_stale(name)
+        if not self.evict_after: return
+        if age >= self.evict_after: self._queue_evict(node=name)
+        else: self._schedule_node(name, now - age + self.evict_after)
+
+    def _check_loaded(self, kind, items, start):
+        # Vencimiento común de lo cargado, por tandas de LOADED_CHUNK (el lock se suelta entre tandas)
+        deadline = self.expiry.deadline; end = start + LOADED_CHUNK
+        if kind == 'node_age':
+            for v in items[start:end]:
+                if deadline(('node_age', v)) is None: self._check_node(v)
+        else:
+            for u, v in items[start:end]:
+                if deadline(('edge_age', u, v)) is None: self._check_edge(u, v)
+        if end < len(items): self.expiry.schedule(0.0, self._check_loaded, kind, items, end, key=('loaded', kind))
+
+    def _check_edge(self, u, v):
+        r = self.topo.edge(u, v)
+        if r is None: return # Ya se fue con uno de sus nodos
+        e = self.topo.edges; now = self.wall_clock(); age = self._age(e.last_seen[r], now)
+        if age < self.edge_stale_after:
+            self._schedule_edge(u, v, now - age + self.edge_stale_after); return
+        if e.status[r] != EDGE_BASE:
+            self.counts['edges_stale'] += 1
+            if self.on_edge_stale is not None: self.on_edge_stale(u, v)
+        if not self.edge_evict_after: return
+        if age >= self.edge_evict_after: self._queue_evict(edge=(u, v))
+        else: self._schedule_edge(u, v, now - age + self.edge_evict_after)
+
+    def _queue_evict(self, node=None, edge=None):
+        if node is not None: self._evict_nodes.add(node)
+        if edge is not None: self._evict_edges.add(edge)
+        if self.expiry.deadline(('evict',)) is None: self.expiry.schedule(EVICT_BATCH, self._flush_evictions, key=('evict',))
+
+    def _flush_evictions(self):
+        # Solo los que siguen sin señales (pudieron volver durante EVICT_BATCH)
+        topo = self.topo; now = self.wall_clock()
+        nodes = set()
+        for name in self._evict_nodes:
+            i = topo.index(name)
+            if i is not None and self._age(topo.nodes.last_seen[i], now) >= self.evict_after: nodes.add(name)
+        edges = []
+        for u, v in self._evict_edges:
+            r = topo.edge(u, v)
+            if r is None or u in nodes or v in nodes: continue
+            age = self._age(topo.edges.last_seen[r], now)
+            if age >= self.edge_evict_after: edges.append((u, v))
+            else: self._schedule_edge(u, v, now - age + self.edge_stale_after) # Volvió (node_seen ya reprograma los nodos)
+        self._evict_nodes = set(); self._evict_edges = set()
+        if not nodes and not edges: return
+        self.stale -= nodes
+        self.counts['evicted'] += len(nodes); self.counts['edges_evicted'] += len(edges)
+        if self.on_evict is not None: self.on_evict(nodes, edges)
+
+    def stats(self):
+        return dict(self.counts, stale_now=len(self.stale))
@@ -0,0 +1,84 @@
+# --- espnow_log: logging por niveles con límite de ritmo ---
+#
+# Sustituye a los print del camino caliente (v6 imprimía cada datagrama
+# [UDP_RX ...], y un print por evento cuesta más que procesarlo). Los
+# módulos piden get_logger('engine') y registran con formato diferido:
+#   log.debug("[UDP_RX %s] %s", addr, linea)
+# Si el nivel está desactivado no se formatea nada. Los mensajes conservan
+# las etiquetas de siempre ([!], [i], [+]...) y por defecto salen por stdout
+# sin prefijos, como los print.
+#
+# RateLimitFilter deja pasar como mucho `limit` registros de cada plantilla
+# (mismo logger y mismo texto sin formatear) por ventana de `window`
+# segundos; el último que pasa lo avisa y el primero de la ventana siguiente
+# indica cuántos se omitieron.
+# Una tormenta de JOIN o de fallos ya no inunda la consola.
+#
+# Uso: setup_logging('DEBUG') desde el script principal (--log-level), o
+#      ESPNOW_LOG_LEVEL=DEBUG python monitor_espnow6.py
+
+import logging, os, sys, threading, time
+
+LOG_LEVEL = os.environ.get('ESPNOW_LOG_LEVEL', 'INFO') # nivel por defecto (scripts sin argumentos, como v6)
+RATE_LIMIT = 10       # registros por plantilla y ventana
+RATE_WINDOW = 5.0     # segundos
+LOG_FORMAT = '%(message)s'
+ROOT = 'espnow'
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit=RATE_LIMIT, window=RATE_WINDOW, clock=time.monotonic):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.suppressed = 0
+        self._slots = {}      # (logger, plantilla) -> [inicio de ventana, emitidos, omitidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit: return True
+        key = (record.name, record.msg); now = self.clock()
+        with self._lock:
+            s = self._slots.get(key)
+            if s is None or now - s[0] >= self.window:
+                dropped = s[2] if s is not None else 0
+                self._slots[key] = [now, 1, 0]
+                if len(self._slots) > 4096: self._slots = {key: self._slots[key]}
+                if dropped:
+                    record.msg = f"{record.getMessage()} (+{dropped} iguales omitidos en {self.window:g}s)"; record.args = None
+                return True
+            if s[1] < self.limit:
+                s[1] += 1
+                if s[1] == self.limit: # Último de la ventana: avisa de que los siguientes se omiten
+                    record.msg = f"{record.getMessage()} (límite de {self.limit} iguales cada {self.window:g}s)"; record.args = None
+                return True
+            s[2] += 1; self.suppressed += 1
+            return False
+
+
+def get_logger(name):
+    return logging.getLogger(f'{ROOT}.{name}')
+
+
+def setup_logging(level=LOG_LEVEL, limit=RATE_LIMIT, window=RATE_WINDOW, stream=None):
+    # Configura el logger 'espnow' (una sola vez; llamadas siguientes solo cambian nivel y límites)
+    root = logging.getLogger(ROOT)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    for h in root.handlers:
+        for f in h.filters:
+            if isinstance(f, RateLimitFilter): f.limit = limit; f.window = window
+        return root
+    h = logging.StreamHandler(stream or sys.stdout)
+    h.setFormatter(logging.Formatter(LOG_FORMAT))
+    h.addFilter(RateLimitFilter(limit, window))
+    root.addHandler(h)
+    return root
+
+
+def add_arguments(ap):
+    ap.add_argument('--log-level', default=LOG_LEVEL.upper(), type=str.upper, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    ap.add_argument('--log-rate', type=int, default=RATE_LIMIT, metavar='N',
+                    help=f"como mucho N mensajes iguales cada {RATE_WINDOW:g}s (0 = sin límite)")
+    return ap
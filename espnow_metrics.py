@@ -0,0 +1,253 @@
+# --- espnow_metrics: instrumentación del camino caliente y endpoint Prometheus ---
+#
+# Hasta ahora la única señal de dónde se iba el tiempo eran los print (que
+# a su vez costaban rendimiento). Metrics reúne, con poco coste por muestra:
+#   - Histogram: histograma log-lineal al estilo HDR. Cada muestra es un
+#     entero (ns) que cae en un cubo de anchura relativa < 1/HALF
+#     (~3 %), sin asignar memoria: un bit_length, un desplazamiento y una
+#     suma. Percentiles y exportación Prometheus salen de los cubos.
+#   - contadores con etiqueta (p. ej. eventos por comando) en dicts.
+#   - gauges que se evalúan al leer (nodos, profundidad de cola...).
+#   - TimedLock: RLock que mide la espera y la retención del acquire más
+#     externo de cada hilo (los reentrantes no cuentan).
+# MetricsServer sirve /metrics en formato de texto Prometheus desde un hilo
+# propio (http.server) en 127.0.0.1.
+#
+# Las muestras se escriben sin lock desde varios hilos: con el GIL una
+# muestra concurrente puede perderse muy de vez en cuando; para medir basta.
+#
+# Uso: MonitorEngine(metrics_port=9108) o python espnow_engine.py --metrics-port 9108
+#      curl -s 127.0.0.1:9108/metrics
+
+import threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BITS = 6                 # 64 sub-cubos por potencia de dos (error relativo < 1/32)
+SUB_BUCKETS = 1 << SUB_BITS
+HALF = SUB_BUCKETS >> 1
+MAX_NS = 1 << 40             # ~18 minutos; lo que pase de aquí cae en el último cubo
+N_BUCKETS = ((40 - SUB_BITS + 1) << (SUB_BITS - 1)) + SUB_BUCKETS
+# Límites 'le' (segundos) de la exportación Prometheus: 10 us .. 10 s
+PROM_BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+METRICS_PORT = 9108
+
+
+def bucket_index(v):
+    # v: entero >= 0 (ns) -> índice de cubo
+    if v < SUB_BUCKETS: return v
+    if v >= MAX_NS: v = MAX_NS - 1
+    shift = v.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (v >> shift)
+
+
+def bucket_low(i):
+    # Menor valor (ns) que cae en el cubo i
+    if i < SUB_BUCKETS: return i
+    shift = (i >> (SUB_BITS - 1)) - 1
+    return (i - (shift << (SUB_BITS - 1))) << shift
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'labels', 'counts', 'count', 'sum_ns', 'max_ns')
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def record_ns(self, v, n=1):
+        # n: muestras con el mismo valor (p. ej. todos los datagramas de una tanda)
+        if v < 0: v = 0
+        self.counts[bucket_index(v)] += n
+        self.count += n; self.sum_ns += v * n
+        if v > self.max_ns: self.max_ns = v
+
+    def record(self, seconds):
+        self.record_ns(int(seconds * 1e9))
+
+    def quantile(self, q):
+        # Segundos (centro del cubo: error relativo < 1/64); None sin muestras
+        if not self.count: return None
+        target = max(1, int(q * self.count + 0.5)); seen = 0
+        for i, c in enumerate(self.counts):
+            if c:
+                seen += c
+                if seen >= target: return min((bucket_low(i) + bucket_low(i + 1)) / 2, self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+    def cumulative(self, bounds=PROM_BOUNDS):
+        # Cuentas acumuladas <= cada límite (s) para la exportación 'le'
+        out = []; seen = 0; i = 0; counts = self.counts
+        for b in bounds:
+            limit = bucket_index(int(b * 1e9))
+            while i <= limit and i < N_BUCKETS: seen += counts[i]; i += 1
+            out.append(seen)
+        return out
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.sum_ns / self.count / 1e9 if self.count else None,
+                'max': self.max_ns / 1e9, **{f'p{q * 100:g}': self.quantile(q) for q in QUANTILES}}
+
+
+class TimedLock:
+    # RLock con histogramas de espera (acquire más externo) y de retención (hasta el release que lo suelta)
+    def __init__(self, wait, hold, lock=None):
+        self._lock = lock if lock is not None else threading.RLock()
+        self.wait = wait
+        self.hold = hold
+        self._owner = None
+        self._depth = 0
+        self._t_acquired = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        me = threading.get_ident()
+        if self._owner == me: # Reentrante: ya lo tiene este hilo
+            self._lock.acquire(); self._depth += 1; return True
+        t0 = time.perf_counter_ns()
+        if not self._lock.acquire(blocking, timeout): return False
+        t1 = time.perf_counter_ns()
+        self._owner = me; self._depth = 1; self._t_acquired = t1
+        self.wait.record_ns(t1 - t0)
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth:
+            self._lock.release(); return
+        held = time.perf_counter_ns() - self._t_acquired
+        self._owner = None
+        self._lock.release()
+        self.hold.record_ns(held)
+
+    def __enter__(self):
+        self.acquire(); return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _fmt_labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    def __init__(self, prefix='espnow'):
+        self.prefix = prefix
+        self.histograms = {}     # (nombre, etiquetas ordenadas) -> Histogram
+        self.counters = {}       # nombre -> {valor de etiqueta: cuenta}
+        self._counter_meta = {}  # nombre -> (etiqueta, ayuda)
+        self.gauges = {}         # nombre -> (función, ayuda)
+        self._help = {}
+
+    def histogram(self, name, help='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = Histogram(name, help, labels)
+            if help: self._help[name] = help
+        return h
+
+    def counter(self, name, label='kind', help=''):
+        # dict {valor de etiqueta: cuenta}: se incrementa directamente (c[k] = c.get(k, 0) + 1)
+        c = self.counters.get(name)
+        if c is None:
+            c = self.counters[name] = {}; self._counter_meta[name] = (label, help)
+        return c
+
+    def gauge(self, name, fn, help=''):
+        # fn() -> número, o dict {valor de etiqueta: número} (etiqueta 'kind')
+        self.gauges[name] = (fn, help)
+
+    def timed_lock(self, name='graph_lock', lock=None):
+        return TimedLock(self.histogram(f'{name}_wait_seconds', f"Espera para tomar {name} (acquire más externo)"),
+                         self.histogram(f'{name}_hold_seconds', f"Tiempo con {name} tomado"), lock)
+
+    def render_prometheus(self):
+        p = self.prefix; out = []
+        by_name = {}
+        for (name, _), h in self.histograms.items(): by_name.setdefault(name, []).append(h)
+        for name, hs in sorted(by_name.items()):
+            full = f'{p}_{name}'
+            if name in self._help: out.append(f'# HELP {full} {self._help[name]}')
+            out.append(f'# TYPE {full} histogram')
+            for h in hs:
+                cum = h.cumulative()
+                for b, c in zip(PROM_BOUNDS, cum):
+                    out.append(f'{full}_bucket{_fmt_labels({**h.labels, "le": f"{b:g}"})} {c}')
+                out.append(f'{full}_bucket{_fmt_labels({**h.labels, "le": "+Inf"})} {h.count}')
+                out.append(f'{full}_sum{_fmt_labels(h.labels)} {h.sum_ns / 1e9:.9f}')
+                out.append(f'{full}_count{_fmt_labels(h.labels)} {h.count}')
+        for name, c in sorted(self.counters.items()):
+            label, help = self._counter_meta[name]; full = f'{p}_{name}_total'
+            if help: out.append(f'# HELP {full} {help}')
+            out.append(f'# TYPE {full} counter')
+            for k, v in sorted(list(c.items()), key=lambda kv: str(kv[0])):
+                out.append(f'{full}{_fmt_labels({label: k})} {v}')
+        for name, (fn, help) in sorted(self.gauges.items()):
+            full = f'{p}_{name}'
+            try: v = fn()
+            except Exception as e: out.append(f'# {full}: {e}'); continue
+            if help: out.append(f'# HELP {full} {help}')
+            out.append(f'# TYPE {full} gauge')
+            if isinstance(v, dict):
+                for k, x in sorted(v.items()): out.append(f'{full}{_fmt_labels({"kind": k})} {x:g}')
+            else:
+                out.append(f'{full} {v:g}')
+        return '\n'.join(out) + '\n'
+
+    def summary(self):
+        # {nombre[etiquetas]: resumen} de los histogramas con muestras (para informes sin Prometheus)
+        out = {}
+        for (name, labels), h in self.histograms.items():
+            if h.count: out[name + (_fmt_labels(dict(labels)) if labels else '')] = h.summary()
+        return out
+
+
+def format_summary(metrics):
+    # Tabla de texto con p50 / p99 / máx (ms) por histograma, para el informe final sin Prometheus
+    rows = sorted(metrics.summary().items())
+    if not rows: return "[i] Sin muestras de latencia"
+    w = max(len(k) for k, _ in rows)
+    out = ["[i] Latencias por etapa (ms):", f"    {'':{w}s} {'muestras':>9s} {'p50':>9s} {'p99':>9s} {'máx':>8s}"]
+    for k, v in rows:
+        out.append(f"    {k:{w}s} {v['count']:9d} {v['p50'] * 1e3:9.3f} {v['p99'] * 1e3:9.3f} {v['max'] * 1e3:8.2f}")
+    return '\n'.join(out)
+
+
+class MetricsServer:
+    # GET /metrics -> texto Prometheus; cada petición en su hilo (ThreadingHTTPServer)
+    def __init__(self, metrics, port=METRICS_PORT, bind='127.0.0.1'):
+        self.metrics = metrics
+        m = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404); return
+                body = m.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers(); self.wfile.write(body)
+
+            def log_message(self, *args): pass # Sin una línea por petición
+
+        self.httpd = ThreadingHTTPServer((bind, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown(); self.httpd.server_close()
+        if self._thread: self._thread.join(timeout=2.0)
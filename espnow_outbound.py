@@ -0,0 +1,288 @@
+# --- espnow_outbound: planificador de comandos salientes con ritmo por nodo ---
+#
+# Los comandos (ROUTE_STEP, UNICAST, BROADCAST, ROUTE_MSG_ACKNOWLEDGED) salían
+# con un sock.sendto cada uno, desde el hilo que los generara, sin mirar a
+# quién. El firmware (sketch_Join.ino) atiende UDP una vez por loop():
+# parsePacket() lee UN datagrama a un único incomingPacket[256], imprime por
+# Serial y hace delay(10); lo que llega mientras tanto espera en el buzón UDP
+# de lwIP (unos 6 datagramas) y el resto se pierde sin aviso. Una ráfaga de
+# comandos a un mismo nodo (un lote en estrella, reintentos, los
+# ROUTE_MSG_ACKNOWLEDGED de una ruta larga) se perdía así en silencio.
+#
+# CommandScheduler pone cada comando en la cola de su destino (dirección
+# UDP = nodo) y UN hilo los envía:
+#   - cubo de fichas por destino: `rate` comandos/s sostenidos y ráfagas de
+#     hasta `burst` (NODE_RATE / NODE_BURST, por debajo de lo que el loop()
+#     del firmware drena y del buzón de lwIP). Un nodo saturado no frena a
+#     los demás: cada cola avanza a su ritmo.
+#   - en cada vuelta se juntan los comandos listos de TODOS los destinos y,
+#     si son al menos MMSG_MIN, salen con una sola llamada sendmmsg(2)
+#     (ctypes sobre la libc; cabeceras rellenadas con NumPy). Medido en
+#     loopback con 1 CPU, por datagrama: sendto ~8-9 µs; sendmmsg ~80 µs con 1,
+#     ~29 con 4, ~10 con 16-64 y ~7 con 128-256 (el coste fijo de montar las
+#     cabeceras desde Python solo se amortiza en tandas grandes). Por debajo
+#     del umbral, o donde no hay sendmmsg, un sendto por comando.
+#   - ROUTE_STEP con nodo conocido: si en step_timeout segundos desde que
+#     salió no llega su ACK_ROUTE_STEP_RECEIVED (ack_step), se vuelve a
+#     encolar, hasta step_retries veces. El firmware contesta al leerlo, así
+#     que este plazo es mucho más corto que el del salto completo del
+#     RouteDispatcher (HOP_TIMEOUT), que sigue ahí por encima.
+# held(): mientras un hilo lo tiene (el listener durante un lote de ingesta),
+# send() solo encola; al soltarlo ese mismo hilo manda de una vez todo lo que
+# tenga ficha. Así los comandos que provoca un lote (el
+# siguiente ROUTE_STEP de cada ruta, los ROUTE_MSG_ACKNOWLEDGED) salen juntos
+# y sin esperar a que el hilo del planificador consiga el GIL; lo que no
+# tiene ficha sigue en su cola para el hilo.
+# Una cola llena (max_queue) descarta el comando nuevo y lo cuenta
+# ('overflow'): el nodo no lo habría podido leer de todos modos.
+#
+# Métricas (metrics, opcional): outbound_wait_seconds (cola -> envío) y el
+# gauge 'outbound' con los contadores de stats().
+
+import collections, contextlib, ctypes, heapq, itertools, os, socket, struct, threading, time
+import numpy as np
+from espnow_log import get_logger
+
+log = get_logger('outbound')
+
+NODE_RATE = 50.0        # comandos/s por nodo: el loop() del firmware lee uno por vuelta (delay(10) + Serial a 115200)
+NODE_BURST = 4          # ráfaga máxima por nodo (el buzón UDP de lwIP guarda ~6 datagramas)
+MAX_QUEUE = 256         # comandos pendientes por nodo antes de descartar
+STEP_ACK_TIMEOUT = 0.25 # segundos sin ACK_ROUTE_STEP_RECEIVED antes de repetir el ROUTE_STEP
+STEP_RETRIES = 2
+MAX_BATCH = 1024        # datagramas por llamada a sendmmsg (UIO_MAXIOV)
+MMSG_MIN = 128          # tanda mínima para usar sendmmsg en vez de sendto (ver arriba)
+
+
+# --- sendmmsg por ctypes (Linux); None si no está disponible ---
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32), ('msg_iov', ctypes.c_void_p),
+                ('msg_iovlen', ctypes.c_size_t), ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    try:
+        f = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    f.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]; f.restype = ctypes.c_int
+    return f
+
+_sendmmsg = _load_sendmmsg()
+
+
+# Las cabeceras se rellenan con NumPy (campos en las posiciones de las estructuras de ctypes):
+# asignar campo a campo desde Python costaba más que las llamadas al sistema que se ahorran
+_MMSG = np.dtype({'names': ['name', 'namelen', 'iov', 'iovlen'], 'formats': [np.uintp, np.uint32, np.uintp, np.uintp],
+                  'offsets': [_MsgHdr.msg_name.offset, _MsgHdr.msg_namelen.offset, _MsgHdr.msg_iov.offset, _MsgHdr.msg_iovlen.offset],
+                  'itemsize': ctypes.sizeof(_MMsgHdr)})
+_IOV = np.dtype({'names': ['base', 'len'], 'formats': [np.uintp, np.uintp],
+                 'offsets': [_IoVec.iov_base.offset, _IoVec.iov_len.offset], 'itemsize': ctypes.sizeof(_IoVec)})
+
+
+class MMsgSender:
+    # Varios datagramas (a destinos IPv4 distintos) por llamada al sistema
+    def __init__(self, sock):
+        if _sendmmsg is None: raise OSError("sendmmsg no disponible")
+        self.fd = sock.fileno()
+        self._names = {}  # (ip, puerto) -> (sockaddr_in, dirección)
+
+    def _name(self, addr):
+        n = self._names.get(addr)
+        if n is None:
+            if len(self._names) > 65536: self._names.clear()
+            buf = ctypes.create_string_buffer(struct.pack('=H', socket.AF_INET) + struct.pack('!H', addr[1]) +
+                                              socket.inet_aton(addr[0]) + bytes(8), 16)
+            n = self._names[addr] = (buf, ctypes.addressof(buf))
+        return n[1]
+
+    def send(self, items):
+        # items: [(bytes, (ip, puerto))]; devuelve (enviados, llamadas, errores). Un datagrama que falla se salta (como sendto)
+        n = len(items); datas = [d for d, _ in items]
+        blob = np.frombuffer(b''.join(datas), np.uint8) # Todos los datagramas seguidos: un iovec por trozo
+        lens = np.fromiter(map(len, datas), np.uintp, n)
+        iov = np.zeros(n, _IOV); iov['len'] = lens; iov['base'] = blob.ctypes.data + np.cumsum(lens) - lens
+        msgs = np.zeros(n, _MMSG); msgs['namelen'] = 16; msgs['iovlen'] = 1
+        msgs['name'] = np.fromiter((self._name(a) for _, a in items), np.uintp, n)
+        msgs['iov'] = iov.ctypes.data + np.arange(n, dtype=np.uintp) * _IOV.itemsize
+        sent = calls = errors = 0; i = 0; mbase = msgs.ctypes.data; msize = _MMSG.itemsize
+        while i < n:
+            r = _sendmmsg(self.fd, mbase + i * msize, min(n - i, MAX_BATCH), 0); calls += 1
+            if r < 0: # Falla el primero de lo que queda: se salta y se sigue
+                errors += 1; i += 1
+                if errors == 1: log.debug("[!] sendmmsg: %s", os.strerror(ctypes.get_errno()))
+            else: sent += r; i += r
+        return sent, calls, errors
+
+
+class _Dest:
+    __slots__ = ('queue', 'tokens', 'stamp', 'scheduled')
+    def __init__(self, tokens, now):
+        self.queue = collections.deque(); self.tokens = tokens; self.stamp = now; self.scheduled = False
+
+
+class CommandScheduler:
+    # sock: socket UDP por el que salen los comandos (el del monitor, con SO_BROADCAST)
+    # rate/burst: cubo de fichas por destino (rate <= 0: sin ritmo, solo agrupado)
+    # batch: True/False/None (None = sendmmsg si el sistema lo tiene); batch_min: tanda mínima para usarlo
+    # metrics: espnow_metrics.Metrics opcional
+    def __init__(self, sock, rate=NODE_RATE, burst=NODE_BURST, max_queue=MAX_QUEUE, step_timeout=STEP_ACK_TIMEOUT,
+                 step_retries=STEP_RETRIES, batch=None, batch_min=MMSG_MIN, metrics=None, clock=time.monotonic):
+        self.sock = sock
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.step_timeout = step_timeout
+        self.step_retries = step_retries
+        self.clock = clock
+        self.batch_min = max(1, batch_min)
+        self._mmsg = None
+        if batch or (batch is None and _sendmmsg is not None):
+            try: self._mmsg = MMsgSender(sock)
+            except OSError as e:
+                if batch: raise
+                log.debug("[i] Sin sendmmsg (%s): un sendto por comando", e)
+        self._cond = threading.Condition()
+        self._dests = {}          # (ip, puerto) -> _Dest
+        self._ready = []          # montículo (instante, seq, destino) de colas con algo que enviar
+        self._steps = {}          # (nodo, msg_id) -> [datos, destino, intentos, seq del último envío]
+        self._deadlines = []      # montículo (plazo, seq, clave de _steps)
+        self._seq = itertools.count()
+        self._running = False
+        self._thread = None
+        self._holds = 0           # hilos dentro de held()
+        self._h_wait = metrics.histogram('outbound_wait_seconds', "Espera de un comando en su cola hasta salir") if metrics is not None else None
+        self.counts = {'queued': 0, 'sent': 0, 'send_errors': 0, 'overflow': 0, 'syscalls': 0, 'rounds': 0,
+                       'step_acked': 0, 'step_retries': 0, 'step_unacked': 0}
+        if metrics is not None: metrics.gauge('outbound', self.stats, "Comandos salientes: enviados, llamadas, reintentos y descartes")
+
+    # --- API ---
+
+    def send(self, data, addr, node=None):
+        # Encola el comando para addr; node (MAC) permite reintentar un ROUTE_STEP hasta su ACK. False si la cola está llena
+        key = None
+        if node is not None and data.startswith(b'ROUTE_STEP '):
+            p = data.split(b' ', 4)
+            if len(p) >= 4: key = (node, p[3].decode('ascii', 'replace'))
+        with self._cond:
+            if key is not None: self._steps[key] = [data, addr, 0, None] # Un reintento del dispatcher sustituye al anterior
+            return self._enqueue(data, addr, key, self.clock())
+
+    @contextlib.contextmanager
+    def held(self):
+        # Agrupa lo que se envíe dentro del bloque y lo manda este hilo al salir
+        with self._cond: self._holds += 1
+        try: yield self
+        finally:
+            with self._cond:
+                self._holds -= 1
+                out = self._take_ready(self.clock()) # También lo que encolaron otros hilos que siguen dentro
+                if self._ready: self._cond.notify() # Lo que no tenía ficha: al hilo
+            if out: self._flush(out)
+
+    def ack_step(self, node, msg_id):
+        # ACK_ROUTE_STEP_RECEIVED: el nodo leyó el ROUTE_STEP; no se repite más
+        with self._cond:
+            if self._steps.pop((node, msg_id), None) is not None: self.counts['step_acked'] += 1
+
+    def wait_idle(self, timeout=None):
+        # Espera a que no quede nada en las colas (pruebas y bancos); True si se vaciaron
+        with self._cond: return self._cond.wait_for(lambda: not self._ready, timeout)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counts, pending=sum(len(d.queue) for d in self._dests.values()), unacked_steps=len(self._steps),
+                        destinations=len(self._dests), batched=self._mmsg is not None)
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False; self._cond.notify_all()
+        if self._thread: self._thread.join(timeout=2.0)
+
+    # --- Internos (con self._cond tomado) ---
+
+    def _enqueue(self, data, addr, key, now):
+        d = self._dests.get(addr)
+        if d is None: d = self._dests[addr] = _Dest(self.burst, now)
+        if len(d.queue) >= self.max_queue:
+            self.counts['overflow'] += 1; return False
+        d.queue.append((data, now, key)); self.counts['queued'] += 1
+        if not d.scheduled:
+            d.scheduled = True; heapq.heappush(self._ready, (now, next(self._seq), addr))
+            if self._ready[0][2] == addr and not self._holds: self._cond.notify()
+        return True
+
+    def _take_ready(self, now):
+        # Comandos que ya tienen ficha, de todos los destinos listos
+        out = []; ready = self._ready; rate = self.rate; burst = self.burst
+        while ready and ready[0][0] <= now:
+            _, _, addr = heapq.heappop(ready); d = self._dests[addr]; q = d.queue
+            if rate > 0:
+                d.tokens = min(burst, d.tokens + (now - d.stamp) * rate); d.stamp = now
+                k = min(int(d.tokens), len(q)); d.tokens -= k
+            else: k = len(q)
+            for _ in range(k): out.append((q.popleft(), addr))
+            if q: heapq.heappush(ready, (now + (1.0 - d.tokens) / rate, next(self._seq), addr))
+            else: d.scheduled = False
+        return out
+
+    def _expire_steps(self, now):
+        dl = self._deadlines
+        while dl and dl[0][0] <= now:
+            _, seq, key = heapq.heappop(dl); st = self._steps.get(key)
+            if st is None or st[3] != seq: continue # Ya confirmado o sustituido
+            if st[2] >= self.step_retries:
+                del self._steps[key]; self.counts['step_unacked'] += 1; continue # El plazo del salto (RouteDispatcher) decide
+            st[2] += 1; self.counts['step_retries'] += 1
+            self._enqueue(st[0], st[1], key, now)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    now = self.clock()
+                    nxt = min(self._ready[0][0] if self._ready else float('inf'), self._deadlines[0][0] if self._deadlines else float('inf'))
+                    if nxt <= now: break
+                    self._cond.wait(None if nxt == float('inf') else nxt - now)
+                if not self._running: break
+                self._expire_steps(now)
+                out = self._take_ready(now)
+                if not self._ready: self._cond.notify_all() # wait_idle
+            if out: self._flush(out)
+
+    def _flush(self, out):
+        items = [(data, addr) for (data, _, _), addr in out]
+        if self._mmsg is not None and len(items) >= self.batch_min: sent, calls, errors = self._mmsg.send(items)
+        else:
+            sent = errors = 0; sendto = self.sock.sendto
+            for data, addr in items:
+                try: sendto(data, addr); sent += 1
+                except OSError: errors += 1
+            calls = len(items)
+        now = self.clock()
+        if self._h_wait is not None:
+            for (_, t, _), _ in out: self._h_wait.record(now - t)
+        with self._cond:
+            c = self.counts; c['sent'] += sent; c['send_errors'] += errors; c['syscalls'] += calls; c['rounds'] += 1
+            dl = self._deadlines; head = dl[0] if dl else None
+            for (data, _, key), _ in out:
+                if key is None: continue
+                st = self._steps.get(key)
+                if st is None or st[0] is not data: continue
+                st[3] = seq = next(self._seq); heapq.heappush(dl, (now + self.step_timeout, seq, key))
+            if dl and dl[0] is not head: self._cond.notify() # Plazo más cercano nuevo: el hilo puede estar en wait(None) (envío desde held())
@@ -0,0 +1,574 @@
+# --- espnow_protocol: parser de una sola pasada del protocolo UDP del firmware ---
+#
+# Clasifica cada datagrama por su token inicial con una tabla de despacho, en
+# vez de probar hasta cinco regex en cascada con `search` sobre la línea
+# decodificada. Las líneas con la forma exacta que escribe el firmware (un
+# espacio entre campos, MAC de 17 bytes) se cortan por posiciones fijas, sin
+# regex: la MAC se busca en la caché bytes->str (una MAC que ya está en la
+# caché ya se validó) y solo una MAC nueva pasa por una regex corta. Cualquier
+# otra cosa (espacios repetidos, campos raros) cae a UNA regex anclada del
+# tipo elegido, con la misma gramática de siempre. Solo se decodifican los
+# campos: el payload se decodifica aparte.
+#
+# Líneas que envía sketch_Join.ino:
+#   <MAC> CMD:<TIPO> [MAC_OBJETIVO] [payload]
+#   ACK_ROUTE_STEP_RECEIVED <mac> <msg_id>
+#   ACK_ROUTE_ESPNOW_SENT <mac> <mac_siguiente> <msg_id>
+#   FAIL_ROUTE_ESPNOW_SENT <mac> <mac_siguiente> <msg_id> ERR:<código>
+#   ROUTE_DELIVERED <mac_destino> <mac_salto_previo> <msg_id> <payload>
+# y, de versiones anteriores del firmware:
+#   JOIN <mac>
+#   RECEIVED <mac_receptor> <mac_emisor>
+#
+# Formato binario opcional (USE_BINARY_WIRE en el firmware), versión 1:
+#   0xE5 | versión u8 | opcode u8 | campos
+# con MAC en 6 bytes crudos, msg_id como u32 big-endian (los msg_id del
+# monitor son 8 dígitos hex: uuid4()[:8]) y payload con prefijo de longitud
+# u8. Un reporte BROADCAST_RECV pasa de ~75 bytes de texto a ~35. Se decodifica
+# con struct.unpack_from directamente sobre el buffer recibido (bytes o
+# memoryview), sin copiar el datagrama; solo el payload se copia al pasarlo a
+# str. 0xE5 nunca empieza una línea de texto: ambos formatos conviven.
+#
+# Datagramas agrupados: un nodo puede juntar varios reportes en un datagrama
+# (UDP_COALESCE_MS en el firmware). En texto son líneas separadas por '\n';
+# en binario, una trama OP_BATCH cuyo cuerpo es una secuencia de
+# (longitud u16 | trama completa). parse_events() devuelve siempre la lista
+# de eventos del datagrama, tenga uno o muchos.
+
+import re, struct
+
+_MAC_CACHE_MAX = 65536
+_mac_cache = {}   # bytes -> str
+
+
+def _intern_mac(b):
+    s = _mac_cache.get(b)
+    if s is None:
+        if len(_mac_cache) >= _MAC_CACHE_MAX: _mac_cache.clear()
+        s = _mac_cache[b] = b.decode('ascii')
+    return s
+
+
+def _text(b):
+    try: return b.decode('ascii')
+    except UnicodeDecodeError: return b.decode('utf-8', 'replace')
+
+
+class CmdEvent:
+    # <mac> CMD:<cmd> [target] [payload]
+    __slots__ = ('mac', 'cmd', 'target', 'payload')
+    def __init__(self, mac, cmd, target=None, payload=None):
+        self.mac = mac; self.cmd = cmd; self.target = target; self.payload = payload
+    def __repr__(self): return f"CmdEvent({self.mac}, {self.cmd}, {self.target}, {self.payload!r})"
+
+
+class AckRouteStep:
+    # ACK_ROUTE_STEP_RECEIVED: `node` recibió el ROUTE_STEP por UDP
+    __slots__ = ('node', 'msg_id')
+    def __init__(self, node, msg_id):
+        self.node = node; self.msg_id = msg_id
+    def __repr__(self): return f"AckRouteStep({self.node}, {self.msg_id})"
+
+
+class AckEspnowSent:
+    # ACK_ROUTE_ESPNOW_SENT: `sender` encoló el ESP-NOW hacia `sent_to`
+    __slots__ = ('sender', 'sent_to', 'msg_id')
+    def __init__(self, sender, sent_to, msg_id):
+        self.sender = sender; self.sent_to = sent_to; self.msg_id = msg_id
+    def __repr__(self): return f"AckEspnowSent({self.sender}, {self.sent_to}, {self.msg_id})"
+
+
+class FailEspnowSent:
+    # FAIL_ROUTE_ESPNOW_SENT: esp_now_send() devolvió error en `sender`
+    __slots__ = ('sender', 'sent_to', 'msg_id', 'error')
+    def __init__(self, sender, sent_to, msg_id, error=None):
+        self.sender = sender; self.sent_to = sent_to; self.msg_id = msg_id; self.error = error
+    def __repr__(self): return f"FailEspnowSent({self.sender}, {self.sent_to}, {self.msg_id}, {self.error})"
+
+
+class RouteDelivered:
+    # ROUTE_DELIVERED: la ruta `msg_id` llegó a `final_dest` desde `prev_hop`
+    __slots__ = ('final_dest', 'prev_hop', 'msg_id', 'payload')
+    def __init__(self, final_dest, prev_hop, msg_id, payload=''):
+        self.final_dest = final_dest; self.prev_hop = prev_hop; self.msg_id = msg_id; self.payload = payload
+    def __repr__(self): return f"RouteDelivered({self.final_dest}, {self.prev_hop}, {self.msg_id}, {self.payload!r})"
+
+
+class JoinEvent:
+    # "JOIN <mac>" simple (firmware antiguo)
+    __slots__ = ('mac',)
+    def __init__(self, mac):
+        self.mac = mac
+    def __repr__(self): return f"JoinEvent({self.mac})"
+
+
+class ReceivedEvent:
+    # "RECEIVED <receptor> <emisor>" (firmware antiguo)
+    __slots__ = ('receiver', 'sender')
+    def __init__(self, receiver, sender):
+        self.receiver = receiver; self.sender = sender
+    def __repr__(self): return f"ReceivedEvent({self.receiver}, {self.sender})"
+
+
+_MAC = rb'([0-9A-F:]{17})'
+_ID = rb'([\w-]+)'
+
+_re_cmd = re.compile(rb'<' + _MAC + rb'>\s+CMD:(\w+)(?:\s+' + _MAC + rb'(?![0-9A-F:]))?(?:\s+(.*))?', re.S)
+_re_ack_step = re.compile(rb'\s+' + _MAC + rb'\s+' + _ID)
+_re_ack_sent = re.compile(rb'\s+' + _MAC + rb'\s+' + _MAC + rb'\s+' + _ID)
+_re_fail_sent = re.compile(rb'\s+' + _MAC + rb'\s+' + _MAC + rb'\s+' + _ID + rb'(?:\s+ERR:(-?\d+))?')
+_re_delivered = re.compile(rb'\s+' + _MAC + rb'\s+' + _MAC + rb'\s+' + _ID + rb'(?:\s+(.*))?', re.S)
+_re_join = re.compile(rb'\s+' + _MAC)
+_re_received = re.compile(rb'\s+' + _MAC + rb'\s+' + _MAC)
+
+
+def _parse_cmd(line, start):
+    m = _re_cmd.match(line)
+    if m is None: return None
+    mac, cmd, target, payload = m.groups()
+    return CmdEvent(_intern_mac(mac), cmd.decode('ascii'),
+                    _intern_mac(target) if target else None,
+                    _text(payload) if payload is not None else None)
+
+
+def _parse_ack_step(line, start):
+    m = _re_ack_step.match(line, start)
+    if m is None: return None
+    return AckRouteStep(_intern_mac(m[1]), m[2].decode('ascii'))
+
+
+def _parse_ack_sent(line, start):
+    m = _re_ack_sent.match(line, start)
+    if m is None: return None
+    return AckEspnowSent(_intern_mac(m[1]), _intern_mac(m[2]), m[3].decode('ascii'))
+
+
+def _parse_fail_sent(line, start):
+    m = _re_fail_sent.match(line, start)
+    if m is None: return None
+    return FailEspnowSent(_intern_mac(m[1]), _intern_mac(m[2]), m[3].decode('ascii'),
+                          int(m[4]) if m[4] is not None else None)
+
+
+def _parse_delivered(line, start):
+    m = _re_delivered.match(line, start)
+    if m is None: return None
+    return RouteDelivered(_intern_mac(m[1]), _intern_mac(m[2]), m[3].decode('ascii'),
+                          _text(m[4]) if m[4] is not None else '')
+
+
+def _parse_join(line, start):
+    m = _re_join.match(line, start)
+    return JoinEvent(_intern_mac(m[1])) if m else None
+
+
+def _parse_received(line, start):
+    m = _re_received.match(line, start)
+    return ReceivedEvent(_intern_mac(m[1]), _intern_mac(m[2])) if m else None
+
+
+# --- Camino rápido: posiciones fijas; None = la línea no tiene la forma exacta (la trata la regex) ---
+# Los eventos se crean con object.__new__ y se rellenan aquí: sin el marco de __init__ (~40 % del coste de crearlos).
+
+_re_mac17 = re.compile(rb'[0-9A-F:]{17}\Z')
+_re_word = re.compile(rb'\w+\Z')
+_cmd_cache = {}   # bytes -> str del nombre de comando (CMD:<TIPO>)
+_new = object.__new__
+
+
+def _mac_new(b):
+    return _intern_mac(b) if _re_mac17.match(b) else None
+
+
+def _fast_cmd(line):
+    # <MAC> CMD:<tipo>[ <MAC>][ payload]: MAC en [1:18], ' CMD:' hasta 24
+    if line[18:24] != b'> CMD:': return None
+    b = line[1:18]; mac = _mac_cache.get(b) or _mac_new(b)
+    if mac is None: return None
+    sp = line.find(b' ', 24); n = len(line)
+    b = line[24:sp] if sp >= 0 else line[24:]
+    cmd = _cmd_cache.get(b)
+    if cmd is None:
+        if not _re_word.match(b): return None
+        if len(_cmd_cache) >= 256: _cmd_cache.clear()
+        cmd = _cmd_cache[b] = b.decode('ascii')
+    ev = _new(CmdEvent); ev.mac = mac; ev.cmd = cmd; ev.target = ev.payload = None
+    if sp < 0: return ev
+    i = sp + 1
+    if i >= n or line[i] <= 32: return None
+    if i + 17 <= n: # 17 bytes que no son todos [0-9A-F:] no pueden ser MAC: son payload
+        b = line[i:i + 17]; target = _mac_cache.get(b) or _mac_new(b)
+        if target is not None:
+            ev.target = target
+            if i + 17 == n: return ev
+            i += 18
+            if line[i - 1] != 32 or i >= n or line[i] <= 32: return None
+    ev.payload = _text(line[i:])
+    return ev
+
+
+def _fast_ack_step(line):
+    # ACK_ROUTE_STEP_RECEIVED <mac> <id>: MAC en [24:41], id desde 42
+    if line[11:24] != b'TEP_RECEIVED ' or line[41:42] != b' ': return None
+    b = line[24:41]; mac = _mac_cache.get(b) or _mac_new(b)
+    b = line[42:]
+    if mac is None or not b.isalnum(): return None # msg_id con '-' o '_': la regex
+    ev = _new(AckRouteStep); ev.node = mac; ev.msg_id = b.decode('ascii')
+    return ev
+
+
+def _fast_ack_sent(line):
+    # ACK_ROUTE_ESPNOW_SENT <mac> <mac> <id>: MAC en [22:39] y [40:57], id desde 58
+    if line[11:22] != b'SPNOW_SENT ' or line[39:40] != b' ' or line[57:58] != b' ': return None
+    b = line[22:39]; m1 = _mac_cache.get(b) or _mac_new(b)
+    b = line[40:57]; m2 = _mac_cache.get(b) or _mac_new(b)
+    b = line[58:]
+    if m1 is None or m2 is None or not b.isalnum(): return None
+    ev = _new(AckEspnowSent); ev.sender = m1; ev.sent_to = m2; ev.msg_id = b.decode('ascii')
+    return ev
+
+
+def _fast_fail_sent(line):
+    # FAIL_ROUTE_ESPNOW_SENT <mac> <mac> <id>[ ERR:<código>]: MAC en [23:40] y [41:58], id desde 59
+    if line[11:23] != b'ESPNOW_SENT ' or line[40:41] != b' ' or line[58:59] != b' ': return None
+    b = line[23:40]; m1 = _mac_cache.get(b) or _mac_new(b)
+    b = line[41:58]; m2 = _mac_cache.get(b) or _mac_new(b)
+    if m1 is None or m2 is None: return None
+    e = line.find(b' ', 59)
+    b = line[59:e] if e >= 0 else line[59:]
+    if not b.isalnum(): return None
+    ev = _new(FailEspnowSent); ev.sender = m1; ev.sent_to = m2; ev.msg_id = b.decode('ascii'); ev.error = None
+    if e < 0: return ev
+    if line[e:e + 5] != b' ERR:': return None
+    b = line[e + 5:]
+    if not (b[1:] if b[:1] == b'-' else b).isdigit(): return None # int() admitiría ' 5', '+5' o '1_2'
+    ev.error = int(b)
+    return ev
+
+
+def _fast_delivered(line):
+    # ROUTE_DELIVERED <mac> <mac> <id>[ payload]: MAC en [16:33] y [34:51], id desde 52
+    if line[11:16] != b'ERED ' or line[33:34] != b' ' or line[51:52] != b' ': return None
+    b = line[16:33]; m1 = _mac_cache.get(b) or _mac_new(b)
+    b = line[34:51]; m2 = _mac_cache.get(b) or _mac_new(b)
+    if m1 is None or m2 is None: return None
+    e = line.find(b' ', 52)
+    b = line[52:e] if e >= 0 else line[52:]
+    if not b.isalnum(): return None
+    ev = _new(RouteDelivered); ev.final_dest = m1; ev.prev_hop = m2; ev.msg_id = b.decode('ascii'); ev.payload = ''
+    if e < 0: return ev
+    if line[e + 1:e + 2] <= b' ': return None
+    ev.payload = _text(line[e + 1:])
+    return ev
+
+
+# token inicial -> parser(línea, posición tras el token)
+DISPATCH = {
+    b'ACK_ROUTE_STEP_RECEIVED': _parse_ack_step,
+    b'ACK_ROUTE_ESPNOW_SENT': _parse_ack_sent,
+    b'FAIL_ROUTE_ESPNOW_SENT': _parse_fail_sent,
+    b'ROUTE_DELIVERED': _parse_delivered,
+    b'JOIN': _parse_join,
+    b'RECEIVED': _parse_received,
+}
+_MAX_HEAD = max(len(k) for k in DISPATCH)
+FAST = {  # 11 primeros bytes -> parser de posiciones fijas (que comprueba el resto del token); JOIN y RECEIVED, del
+          # firmware antiguo, van siempre por regex
+    b'ACK_ROUTE_S': _fast_ack_step,
+    b'ACK_ROUTE_E': _fast_ack_sent,
+    b'FAIL_ROUTE_': _fast_fail_sent,
+    b'ROUTE_DELIV': _fast_delivered,
+}
+
+
+def parse_datagram(data):
+    # bytes -> evento tipado, o None si la línea no es del protocolo
+    if not data: return None
+    c = data[0]
+    if c == WIRE_MAGIC: return parse_binary(data)
+    line = data.rstrip() if data[-1] <= 32 else data # println() del firmware: '\r\n' al final
+    fast = _fast_cmd if c == 60 else FAST.get(line[:11])
+    if fast is not None:
+        ev = fast(line)
+        if ev is not None: return ev
+    return _parse_slow(data)
+
+
+def _parse_slow(data):
+    line = data.strip()
+    if line[:1] == b'<':
+        return _parse_cmd(line, 0)
+    sp = line.find(b' ', 0, _MAX_HEAD + 1)
+    if sp <= 0: return None
+    parser = DISPATCH.get(line[:sp])
+    return parser(line, sp) if parser else None
+
+
+# --- Formato binario ---
+
+WIRE_MAGIC = 0xE5
+WIRE_VERSION = 1
+
+OP_JOIN = 0x01               # mac
+OP_BROADCAST_RECV = 0x02     # mac, origen, payload
+OP_UNICAST_RECV = 0x03       # mac, origen, payload
+OP_JOIN_ESPNOW_RECV = 0x04   # mac, origen, payload
+OP_ROUTED_DATA_RECV = 0x05   # mac, origen, payload
+OP_SEND_FAIL_TO = 0x06       # mac, destino
+OP_CMD = 0x0F                # mac, cmd (u8 long. + texto), flag objetivo u8, [objetivo], payload
+OP_ACK_ROUTE_STEP = 0x10     # mac, msg_id
+OP_ACK_ESPNOW_SENT = 0x11    # mac, siguiente, msg_id
+OP_FAIL_ESPNOW_SENT = 0x12   # mac, siguiente, msg_id, error i32
+OP_ROUTE_DELIVERED = 0x13    # destino, salto previo, msg_id, payload
+OP_BATCH = 0x20              # (longitud u16 | trama)*
+
+_RECV_OPS = {OP_BROADCAST_RECV: 'BROADCAST_RECV', OP_UNICAST_RECV: 'UNICAST_RECV',
+             OP_JOIN_ESPNOW_RECV: 'JOIN_ESPNOW_RECV', OP_ROUTED_DATA_RECV: 'ROUTED_DATA_RECV'}
+_RECV_CODES = {v: k for k, v in _RECV_OPS.items()}
+
+# Una MAC son 6 bytes: se lee como u16 + u32 (enteros, sin crear bytes) y se pasa a texto con caché.
+# Cada Struct incluye la cabecera de 3 bytes: un solo unpack_from por trama, leyendo en el propio buffer.
+_S_MAC = struct.Struct('>3xHI')
+_S_MAC2 = struct.Struct('>3xHIHI')
+_S_MAC_ID = struct.Struct('>3xHII')
+_S_MAC2_ID = struct.Struct('>3xHIHII')
+_S_MAC2_ID_ERR = struct.Struct('>3xHIHIIi')
+_HEAD = 3
+
+_bin_mac_cache = {}   # entero de 48 bits -> 'AA:BB:CC:DD:EE:FF'
+
+
+def _mac48_miss(k):
+    if len(_bin_mac_cache) >= _MAC_CACHE_MAX: _bin_mac_cache.clear()
+    h = f"{k:012X}"
+    s = _bin_mac_cache[k] = ':'.join((h[0:2], h[2:4], h[4:6], h[6:8], h[8:10], h[10:12]))
+    return s
+
+
+def _mac48(hi, lo):
+    k = hi << 32 | lo
+    return _bin_mac_cache.get(k) or _mac48_miss(k)
+
+
+def _payload(data, off):
+    # Último campo: u8 de longitud + texto. Solo se copian esos n bytes (bytes() de un bytes no copia)
+    n = data[off]
+    return _text(bytes(data[off + 1:off + 1 + n])) if n else ''
+
+
+def _bin_recv(data, op):
+    a, b, c, d = _S_MAC2.unpack_from(data)
+    return CmdEvent(_mac48(a, b), _RECV_OPS[op], _mac48(c, d), _payload(data, 15))
+
+
+def _bin_join(data, op):
+    a, b = _S_MAC.unpack_from(data)
+    return CmdEvent(_mac48(a, b), 'JOIN')
+
+
+def _bin_send_fail(data, op):
+    a, b, c, d = _S_MAC2.unpack_from(data)
+    return CmdEvent(_mac48(a, b), 'SEND_FAIL_TO', _mac48(c, d))
+
+
+def _bin_cmd(data, op):
+    a, b = _S_MAC.unpack_from(data)
+    off = _HEAD + 6; n = data[off]
+    cmd = bytes(data[off + 1:off + 1 + n]).decode('ascii'); off += 1 + n
+    target = None
+    if data[off]:
+        target = _mac48(*struct.unpack_from('>HI', data, off + 1)); off += 6
+    off += 1
+    return CmdEvent(_mac48(a, b), cmd, target, _payload(data, off) if off < len(data) else None)
+
+
+def _bin_ack_step(data, op):
+    a, b, mid = _S_MAC_ID.unpack_from(data)
+    return AckRouteStep(_mac48(a, b), f"{mid:08x}")
+
+
+def _bin_ack_sent(data, op):
+    a, b, c, d, mid = _S_MAC2_ID.unpack_from(data)
+    return AckEspnowSent(_mac48(a, b), _mac48(c, d), f"{mid:08x}")
+
+
+def _bin_fail_sent(data, op):
+    a, b, c, d, mid, err = _S_MAC2_ID_ERR.unpack_from(data)
+    return FailEspnowSent(_mac48(a, b), _mac48(c, d), f"{mid:08x}", err)
+
+
+def _bin_delivered(data, op):
+    a, b, c, d, mid = _S_MAC2_ID.unpack_from(data)
+    return RouteDelivered(_mac48(a, b), _mac48(c, d), f"{mid:08x}", _payload(data, 19))
+
+
+BIN_DISPATCH = {OP_JOIN: _bin_join, OP_SEND_FAIL_TO: _bin_send_fail, OP_CMD: _bin_cmd,
+                OP_ACK_ROUTE_STEP: _bin_ack_step, OP_ACK_ESPNOW_SENT: _bin_ack_sent,
+                OP_FAIL_ESPNOW_SENT: _bin_fail_sent, OP_ROUTE_DELIVERED: _bin_delivered}
+for _op in _RECV_OPS: BIN_DISPATCH[_op] = _bin_recv
+
+
+def parse_binary(data):
+    # Trama binaria (bytes, bytearray o memoryview) -> evento tipado, o None si es de otra versión,
+    # opcode desconocido o está truncada
+    if len(data) < _HEAD or data[1] != WIRE_VERSION: return None
+    op = data[2]
+    fn = BIN_DISPATCH.get(op)
+    if fn is None: return None
+    try:
+        return fn(data, op)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        return None
+
+
+_S_LEN = struct.Struct('>H')
+
+
+def _parse_binary_batch(data):
+    # Las subtramas se leen con memoryview: ni la trama ni las subtramas se copian
+    mv = memoryview(data); end = len(mv); off = _HEAD; out = []
+    try:
+        while off + 2 <= end:
+            n, = _S_LEN.unpack_from(mv, off); off += 2
+            ev = parse_binary(mv[off:off + n]) if off + n <= end else None
+            if ev is not None: out.append(ev)
+            off += n
+    except struct.error:
+        pass
+    return out
+
+
+def parse_events(data):
+    # Datagrama -> lista de eventos (vacía si nada es del protocolo); admite datagramas agrupados
+    if data and data[0] == WIRE_MAGIC:
+        if len(data) >= _HEAD and data[2] == OP_BATCH and data[1] == WIRE_VERSION: return _parse_binary_batch(data)
+        ev = parse_binary(data)
+        return [ev] if ev is not None else []
+    if b'\n' not in data.rstrip():
+        ev = parse_datagram(data)
+        return [ev] if ev is not None else []
+    out = []
+    for line in data.split(b'\n'):
+        if line and not line.isspace():
+            ev = parse_datagram(line)
+            if ev is not None: out.append(ev)
+    return out
+
+
+# --- Codificadores (simulador, pruebas y referencia para el firmware) ---
+
+_mac_bytes_cache = {}  # 'AA:BB:CC:DD:EE:FF' -> 6 bytes
+
+
+def _mac_bytes(mac):
+    b = _mac_bytes_cache.get(mac)
+    if b is None:
+        if len(mac) != 17 or mac[2::3] != ':::::': raise ValueError(f"MAC no canónica: {mac!r}")
+        if len(_mac_bytes_cache) >= _MAC_CACHE_MAX: _mac_bytes_cache.clear()
+        b = _mac_bytes_cache[mac] = bytes.fromhex(mac.replace(':', ''))
+    return b
+
+
+def _msg_id_u32(msg_id):
+    return int(msg_id, 16) & 0xFFFFFFFF
+
+
+def _pbytes(payload):
+    b = (payload or '').encode('utf-8')[:255]
+    return bytes((len(b),)) + b
+
+
+def _frame(op, body):
+    return bytes((WIRE_MAGIC, WIRE_VERSION, op)) + body
+
+
+_E_MAC2 = struct.Struct('>BBB6s6s')
+_E_MAC_ID = struct.Struct('>BBB6sI')
+_E_MAC2_ID = struct.Struct('>BBB6s6sI')
+_E_MAC2_ID_ERR = struct.Struct('>BBB6s6sIi')
+
+
+def encode_cmd(mac, cmd, target=None, payload=None):
+    if cmd == 'JOIN' and target is None: return _frame(OP_JOIN, _mac_bytes(mac))
+    if cmd == 'SEND_FAIL_TO' and target is not None: return _frame(OP_SEND_FAIL_TO, _mac_bytes(mac) + _mac_bytes(target))
+    op = _RECV_CODES.get(cmd)
+    if op is not None and target is not None:
+        return _E_MAC2.pack(WIRE_MAGIC, WIRE_VERSION, op, _mac_bytes(mac), _mac_bytes(target)) + _pbytes(payload)
+    c = cmd.encode('ascii')
+    t = b'\x01' + _mac_bytes(target) if target is not None else b'\x00'
+    return _frame(OP_CMD, _mac_bytes(mac) + bytes((len(c),)) + c + t + (_pbytes(payload) if payload is not None else b''))
+
+
+def encode_ack_route_step(node, msg_id):
+    return _E_MAC_ID.pack(WIRE_MAGIC, WIRE_VERSION, OP_ACK_ROUTE_STEP, _mac_bytes(node), _msg_id_u32(msg_id))
+
+
+def encode_ack_espnow_sent(sender, sent_to, msg_id):
+    return _E_MAC2_ID.pack(WIRE_MAGIC, WIRE_VERSION, OP_ACK_ESPNOW_SENT, _mac_bytes(sender), _mac_bytes(sent_to),
+                           _msg_id_u32(msg_id))
+
+
+def encode_fail_espnow_sent(sender, sent_to, msg_id, error):
+    return _E_MAC2_ID_ERR.pack(WIRE_MAGIC, WIRE_VERSION, OP_FAIL_ESPNOW_SENT, _mac_bytes(sender), _mac_bytes(sent_to),
+                               _msg_id_u32(msg_id), error)
+
+
+def encode_route_delivered(final_dest, prev_hop, msg_id, payload=''):
+    return _E_MAC2_ID.pack(WIRE_MAGIC, WIRE_VERSION, OP_ROUTE_DELIVERED, _mac_bytes(final_dest), _mac_bytes(prev_hop),
+                           _msg_id_u32(msg_id)) + _pbytes(payload)
+
+
+def encode_batch(frames):
+    # Varias tramas binarias en un solo datagrama
+    return _frame(OP_BATCH, b''.join(_S_LEN.pack(len(f)) + f for f in frames))
+
+
+# --- Evento -> datagrama (diario de eventos, espnow_journal) ---
+
+_re_hex_id = re.compile(r'[0-9a-f]{8}\Z')
+
+
+def format_event(ev):
+    # Evento -> línea de texto equivalente (bytes), la que parse_datagram volvería a leer igual
+    t = type(ev)
+    if t is CmdEvent:
+        return (f"<{ev.mac}> CMD:{ev.cmd}" + (f" {ev.target}" if ev.target else "")
+                + (f" {ev.payload}" if ev.payload is not None else "")).encode('utf-8')
+    if t is AckRouteStep: return f"ACK_ROUTE_STEP_RECEIVED {ev.node} {ev.msg_id}".encode()
+    if t is AckEspnowSent: return f"ACK_ROUTE_ESPNOW_SENT {ev.sender} {ev.sent_to} {ev.msg_id}".encode()
+    if t is FailEspnowSent:
+        return (f"FAIL_ROUTE_ESPNOW_SENT {ev.sender} {ev.sent_to} {ev.msg_id}"
+                + (f" ERR:{ev.error}" if ev.error is not None else "")).encode()
+    if t is RouteDelivered:
+        return f"ROUTE_DELIVERED {ev.final_dest} {ev.prev_hop} {ev.msg_id} {ev.payload}".encode('utf-8')
+    if t is JoinEvent: return f"JOIN {ev.mac}".encode()
+    if t is ReceivedEvent: return f"RECEIVED {ev.receiver} {ev.sender}".encode()
+    raise TypeError(f"Evento desconocido: {ev!r}")
+
+
+def _fits(payload):
+    return payload is None or len(payload) <= 255 and len(payload.encode('utf-8')) <= 255
+
+
+def encode_event(ev):
+    # Evento -> trama binaria si se puede sin perder nada (msg_id de 8 hex, payload <= 255 bytes);
+    # si no, la línea de texto. parse_events() lee ambas.
+    t = type(ev)
+    try:
+        if t is CmdEvent:
+            if _fits(ev.payload) and not (ev.cmd in ('JOIN', 'SEND_FAIL_TO') and ev.payload is not None) \
+                    and not (ev.cmd in _RECV_CODES and ev.target and ev.payload is None):
+                return encode_cmd(ev.mac, ev.cmd, ev.target, ev.payload)
+        elif t is AckRouteStep:
+            if _re_hex_id.match(ev.msg_id): return encode_ack_route_step(ev.node, ev.msg_id)
+        elif t is AckEspnowSent:
+            if _re_hex_id.match(ev.msg_id): return encode_ack_espnow_sent(ev.sender, ev.sent_to, ev.msg_id)
+        elif t is FailEspnowSent:
+            if ev.error is not None and _re_hex_id.match(ev.msg_id):
+                return encode_fail_espnow_sent(ev.sender, ev.sent_to, ev.msg_id, ev.error)
+        elif t is RouteDelivered:
+            if _fits(ev.payload) and _re_hex_id.match(ev.msg_id):
+                return encode_route_delivered(ev.final_dest, ev.prev_hop, ev.msg_id, ev.payload)
+    except (ValueError, UnicodeEncodeError, struct.error):
+        pass  # MAC o campo no representable en binario: va como texto
+    return format_event(ev)
@@ -0,0 +1,169 @@
+# --- espnow_render: renderizado por lotes con artistas persistentes ---
+#
+# En vez de ax.cla() + un draw_networkx_edges por arista en cada frame, se
+# crean UNA PathCollection para los nodos, UNA LineCollection para las
+# aristas y los textos de las etiquetas una sola vez. En cada frame solo se
+# actualizan offsets, segmentos, colores y anchos a partir de arrays NumPy.
+# Si nada cambió, update() devuelve False y el llamador no redibuja.
+#
+# Los colores llegan ya como arrays RGBA: el llamador los saca de tablas
+# indexadas por código de estado (style_table / edge_style), sin bucle por
+# arista. La estructura solo se relee cuando cambia su versión
+# (snap.topology_version). set_linewidths() de matplotlib recorre las aristas
+# en Python (escala los guiones de cada una), así que la LineCollection
+# principal tiene un ancho fijo y las pocas aristas con otro ancho (visuales
+# temporales) se dibujan encima en una segunda colección pequeña.
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+
+LABELS_MAX_NODES = 150   # con más nodos las etiquetas se ocultan (el texto es lo más caro de dibujar)
+NODE_SIZE_MANY = 60      # tamaño de nodo sin etiquetas: los círculos de 700 pt² dominan el rasterizado
+MARGIN = 0.08            # margen relativo alrededor de los nodos al ajustar los límites
+
+_rgba_cache = {}
+
+
+def rgba(color, alpha=None):
+    # to_rgba() con caché: los colores son siempre los mismos pocos nombres
+    key = (color, alpha)
+    c = _rgba_cache.get(key)
+    if c is None:
+        c = _rgba_cache[key] = to_rgba(color, alpha)
+    return c
+
+
+def style_table(styles):
+    # {código: (color, ancho, alpha)} -> (rgba (k, 4), anchos (k,)); los estilos de un frame son tabla[códigos]
+    k = max(styles) + 1 if styles else 0
+    colors = np.zeros((k, 4)); widths = np.zeros(k)
+    for code, (c, w, a) in styles.items():
+        colors[code] = rgba(c, a); widths[code] = w
+    return colors, widths
+
+
+def edge_style(status, table, stale=None, stale_style=None, temps=None, temp_alpha=0.95):
+    # status: códigos por arista (snap.edge_status); table: style_table(); stale: máscara bool por arista
+    # (extremo inactivo) con estilo stale_style; temps: {índice de arista: (color, ancho)} (snap.temp_visuals)
+    colors = table[0][status]; widths = table[1][status]
+    if stale is not None and stale.any():
+        c, w, a = stale_style
+        colors[stale] = rgba(c, a); widths[stale] = w
+    if temps:
+        m = len(widths)
+        for i, (c, w) in temps.items():
+            if i < m: colors[i] = rgba(c, temp_alpha); widths[i] = w
+    return colors, widths
+
+
+class GraphRenderer:
+    def __init__(self, ax, node_size=700, edge_width=2.0, font_size=8, font_weight='bold',
+                 labels_max_nodes=LABELS_MAX_NODES, node_size_many=NODE_SIZE_MANY):
+        self.ax = ax
+        self.node_size = node_size
+        self.node_size_many = node_size_many
+        self.edge_width = edge_width   # ancho de la LineCollection principal; los demás van a la de encima
+        self.font_size = font_size
+        self.font_weight = font_weight
+        self.labels_max_nodes = labels_max_nodes
+        self.edges_coll = LineCollection(np.zeros((0, 2, 2)), zorder=1, capstyle='round', linewidths=edge_width)
+        ax.add_collection(self.edges_coll)
+        self.wide_coll = LineCollection(np.zeros((0, 2, 2)), zorder=1, capstyle='round')
+        ax.add_collection(self.wide_coll)
+        self.nodes_coll = ax.scatter([], [], s=node_size, edgecolors='black', linewidths=1.0, zorder=2)
+        self._labels = {}          # nodo -> Text
+        self._topology = None
+        self._nodes = ()
+        self._eu = self._ev = np.zeros(0, dtype=np.intp)
+        self._has = None           # máscara de nodos con posición
+        self._node_keep = self._edge_keep = np.zeros(0, dtype=np.intp)
+        self._segments = np.zeros((0, 2, 2))
+        self._pos = None
+        self._node_colors = None
+        self._edge_colors = None
+        self._edge_widths = None
+        self._wide = np.zeros(0, dtype=np.intp)
+        self._limits = None
+        self.frames_drawn = 0
+
+    def update(self, topology, nodes, edge_u, edge_v, pos, node_colors, edge_colors, edge_widths):
+        # topology: versión de la estructura (snap.topology_version); nodes / edge_u / edge_v solo se leen si cambia
+        # nodes: ids de nodo; edge_u / edge_v: índices en nodes de los extremos de cada arista
+        # pos: dict {nodo: (x, y)}; se compara por identidad (el layout publica uno nuevo en cada cambio).
+        #      Los nodos sin posición, y sus aristas, no se dibujan
+        # node_colors (n, 4) / edge_colors (m, 4): RGBA alineados con nodes / aristas; edge_widths (m,)
+        changed = False
+        structure = topology != self._topology
+        if structure:
+            self._topology = topology; self._nodes = tuple(nodes)
+            self._eu = np.asarray(edge_u, dtype=np.intp); self._ev = np.asarray(edge_v, dtype=np.intp)
+        keep = False
+        if structure or pos is not self._pos:
+            self._pos = pos
+            nan = (np.nan, np.nan)
+            xy = np.array([pos.get(v, nan) for v in self._nodes], dtype=float).reshape(-1, 2)
+            has = ~np.isnan(xy[:, 0])
+            if structure or not np.array_equal(has, self._has):
+                self._has = has; keep = True
+                self._node_keep = np.flatnonzero(has)
+                self._edge_keep = np.flatnonzero(has[self._eu] & has[self._ev])
+                self._sync_labels()
+            xy_k = xy[self._node_keep]
+            self.nodes_coll.set_offsets(xy_k)
+            ek = self._edge_keep
+            self._segments = np.stack((xy[self._eu[ek]], xy[self._ev[ek]]), axis=1)
+            self.edges_coll.set_segments(self._segments)
+            if self._labels:
+                nodes = self._nodes
+                for i, (x, y) in zip(self._node_keep.tolist(), xy_k.tolist()):
+                    t = self._labels.get(nodes[i])
+                    if t is not None: t.set_position((x, y))
+            self._autoscale(xy_k)
+            self._wide = None # Segmentos nuevos: la colección de encima se rehace
+            changed = True
+        nc = np.asarray(node_colors, dtype=float).reshape(-1, 4)[self._node_keep]
+        if keep or not np.array_equal(nc, self._node_colors):
+            self._node_colors = nc
+            self.nodes_coll.set_facecolors(nc)
+            changed = True
+        ek = self._edge_keep
+        ec = np.asarray(edge_colors, dtype=float).reshape(-1, 4)[ek]
+        ew = np.asarray(edge_widths, dtype=float)[ek]
+        if self._wide is None or not np.array_equal(ec, self._edge_colors) or not np.array_equal(ew, self._edge_widths):
+            self._edge_colors = ec; self._edge_widths = ew
+            wide = np.flatnonzero(ew != self.edge_width)
+            base = ec
+            if len(wide):
+                base = ec.copy(); base[wide, 3] = 0.0 # Debajo de la de encima: transparentes
+            self.edges_coll.set_colors(base)
+            if self._wide is None or not np.array_equal(wide, self._wide):
+                self.wide_coll.set_segments(self._segments[wide])
+            self.wide_coll.set_linewidths(ew[wide]); self.wide_coll.set_colors(ec[wide])
+            self._wide = wide
+            changed = True
+        if changed: self.frames_drawn += 1
+        return changed
+
+    def _sync_labels(self):
+        shown = [self._nodes[i] for i in self._node_keep.tolist()]
+        few = len(shown) <= self.labels_max_nodes
+        self.nodes_coll.set_sizes([self.node_size if few else self.node_size_many])
+        wanted = set(shown) if few else set()
+        for v in [v for v in self._labels if v not in wanted]:
+            self._labels.pop(v).remove()
+        for v in shown:
+            if v in wanted and v not in self._labels:
+                self._labels[v] = self.ax.text(0, 0, str(v), fontsize=self.font_size, fontweight=self.font_weight,
+                                               ha='center', va='center', zorder=3, clip_on=True)
+
+    def _autoscale(self, xy):
+        # Las colecciones añadidas a mano no ajustan los límites; solo se
+        # tocan si los nodos se salen de la vista actual (evita "zoom" continuo).
+        if len(xy) == 0: return
+        lo = xy.min(axis=0); hi = xy.max(axis=0)
+        pad = np.maximum((hi - lo) * MARGIN, 0.1)
+        lim = self._limits
+        if lim is not None and (lo >= lim[0]).all() and (hi <= lim[1]).all(): return
+        self._limits = (lo - pad, hi + pad)
+        self.ax.set_xlim(self._limits[0][0], self._limits[1][0])
+        self.ax.set_ylim(self._limits[0][1], self._limits[1][1])
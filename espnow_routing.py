@@ -0,0 +1,179 @@
+# --- espnow_routing: índice de rutas mantenido de forma incremental ---
+#
+# Sustituye a reconstruir G_est (o copiar el subgrafo) y lanzar
+# nx.shortest_path / nx.bfs_path en cada clic. La adyacencia de las aristas
+# utilizables se mantiene al vuelo con set_edge(); los árboles BFS por
+# origen se calculan bajo demanda y se guardan (LRU). Al cambiar una arista
+# solo se invalidan los árboles a los que afecta:
+#   - arista nueva u-v: si en ese árbol |dist(u) - dist(v)| > 1 (o solo uno
+#     de los dos es alcanzable); si no, los caminos mínimos no cambian.
+#   - arista quitada u-v: solo si es arista del árbol (padre de u o de v).
+# Una consulta con el árbol en caché es recorrer padres: O(longitud).
+# weighted_path() (Dijkstra con coste por arista, p. ej. ETX) no se cachea:
+# los pesos cambian con cada ACK.
+#
+# Sin lock propio: usar con el lock del grafo tomado.
+
+import heapq
+from collections import OrderedDict, deque
+import numpy as np
+
+MAX_TREES = 256  # árboles BFS en caché (uno por origen)
+
+
+class RoutingIndex:
+    def __init__(self, max_trees=MAX_TREES):
+        self.max_trees = max_trees
+        self._adj = {}                 # nodo -> set de vecinos (lista tras load_rows, hasta que cambie)
+        self._trees = OrderedDict()    # origen -> (dist, parent), LRU
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __contains__(self, node): return node in self._adj
+
+    def neighbors(self, node):
+        return self._adj.get(node, ())
+
+    def number_of_edges(self):
+        return sum(len(s) for s in self._adj.values()) // 2
+
+    def set_edge(self, u, v, present):
+        # Añade (present=True) o quita la arista u-v. Devuelve True si cambió algo.
+        if u == v: return False
+        adj = self._adj
+        if present:
+            su = adj.get(u)
+            if su is not None and v in su: return False
+            self._neighbor_set(u).add(v); self._neighbor_set(v).add(u)
+            self._invalidate_added(u, v)
+        else:
+            su = adj.get(u)
+            if su is None or v not in su: return False
+            su = self._neighbor_set(u); sv = self._neighbor_set(v)
+            su.discard(v); sv.discard(u)
+            if not su: del adj[u]
+            if not sv: del adj[v]
+            self._invalidate_removed(u, v)
+        return True
+
+    def _neighbor_set(self, node):
+        # Vecinos como set para modificarlos: tras load_rows son listas hasta el primer cambio
+        s = self._adj.get(node)
+        if s is None: s = self._adj[node] = set()
+        elif type(s) is not set: s = self._adj[node] = set(s)
+        return s
+
+    def load_edges(self, pairs):
+        # Carga masiva (checkpoint): sustituye la adyacencia y vacía la caché de árboles
+        adj = {}
+        for u, v in pairs:
+            if u == v: continue
+            adj.setdefault(u, set()).add(v); adj.setdefault(v, set()).add(u)
+        self._adj = adj; self._trees.clear()
+
+    def load_rows(self, names, eu, ev):
+        # Igual que load_edges con columnas de índices (TopologyStore), aristas sin repetir: agrupa por
+        # origen con numpy y los vecinos de cada nodo son un trozo de lista (sin crear un set por nodo)
+        na = np.empty(len(names), object); na[:] = names
+        a = np.concatenate((eu, ev)); b = np.concatenate((ev, eu))
+        keep = a != b; a = a[keep]; b = b[keep]
+        order = np.argsort(a); a = a[order] # El orden dentro de cada grupo da igual
+        starts = np.flatnonzero(np.r_[True, a[1:] != a[:-1]]) if len(a) else np.zeros(0, np.int64)
+        bounds = starts.tolist() + [len(a)]; nb = na[b[order]].tolist()
+        self._adj = dict(zip(na[a[starts]].tolist(), map(nb.__getitem__, map(slice, bounds[:-1], bounds[1:]))))
+        self._trees.clear()
+
+    def remove_node(self, node):
+        for v in list(self._adj.get(node, ())): self.set_edge(node, v, False)
+        self._trees.pop(node, None)
+
+    def clear(self):
+        self._adj.clear(); self._trees.clear()
+
+    def _invalidate_added(self, u, v):
+        stale = []
+        for src, (dist, _) in self._trees.items():
+            du = dist.get(u); dv = dist.get(v)
+            if du is None and dv is None: continue
+            if du is None or dv is None or abs(du - dv) > 1: stale.append(src)
+        for src in stale: del self._trees[src]
+        self.invalidations += len(stale)
+
+    def _invalidate_removed(self, u, v):
+        stale = [src for src, (_, parent) in self._trees.items() if parent.get(v) == u or parent.get(u) == v]
+        for src in stale: del self._trees[src]
+        self.invalidations += len(stale)
+
+    def _tree(self, src):
+        t = self._trees.get(src)
+        if t is not None:
+            self._trees.move_to_end(src); self.hits += 1
+            return t
+        self.misses += 1
+        dist = {src: 0}; parent = {src: None}
+        adj = self._adj; q = deque([src])
+        while q:
+            x = q.popleft(); dx = dist[x] + 1
+            for y in adj.get(x, ()):
+                if y not in dist:
+                    dist[y] = dx; parent[y] = x; q.append(y)
+        t = self._trees[src] = (dist, parent)
+        if len(self._trees) > self.max_trees: self._trees.popitem(last=False)
+        return t
+
+    def path(self, src, dst):
+        # Camino mínimo en saltos [src, ..., dst] o None si no hay
+        if src not in self._adj or dst not in self._adj: return None
+        if src == dst: return [src]
+        dist, parent = self._tree(src)
+        if dst not in dist: return None
+        p = [dst]
+        while p[-1] != src: p.append(parent[p[-1]])
+        p.reverse()
+        return p
+
+    def distance(self, src, dst):
+        if src not in self._adj or dst not in self._adj: return None
+        return self._tree(src)[0].get(dst)
+
+    def dfs_path(self, src, dst):
+        # Camino encontrado por búsqueda en profundidad (no mínimo); no se cachea
+        adj = self._adj
+        if src not in adj or dst not in adj: return None
+        if src == dst: return [src]
+        parent = {src: None}; stack = [src]
+        while stack:
+            x = stack.pop()
+            if x == dst:
+                p = [x]
+                while parent[p[-1]] is not None: p.append(parent[p[-1]])
+                p.reverse()
+                return p
+            for y in adj[x]:
+                if y not in parent: parent[y] = x; stack.append(y)
+        return None
+
+    def weighted_path(self, src, dst, weight):
+        # Camino de coste mínimo con Dijkstra; weight(u, v) -> coste > 0. Devuelve (camino, coste) o (None, None)
+        adj = self._adj
+        if src not in adj or dst not in adj: return None, None
+        if src == dst: return [src], 0.0
+        dist = {src: 0.0}; parent = {src: None}; done = set()
+        heap = [(0.0, 0, src)]; tie = 1
+        while heap:
+            d, _, x = heapq.heappop(heap)
+            if x in done: continue
+            if x == dst: break
+            done.add(x)
+            for y in adj[x]:
+                if y in done: continue
+                nd = d + weight(x, y)
+                if nd < dist.get(y, float('inf')):
+                    dist[y] = nd; parent[y] = x
+                    heapq.heappush(heap, (nd, tie, y)); tie += 1
+        if dst not in parent: return None, None
+        p = [dst]
+        while p[-1] != src: p.append(parent[p[-1]])
+        p.reverse()
+        return p, dist[dst]
@@ -0,0 +1,298 @@
+# --- espnow_shm: estado visible publicado en memoria compartida (seqlock) ---
+#
+# Con el motor en otro proceso (espnow_split) la GUI no puede leer
+# engine.store: ShmPublisher copia cada instantánea nueva (y las posiciones
+# del layout) a un segmento de multiprocessing.shared_memory y ShmReader la
+# reconstruye en el proceso de la GUI, sin pickle ni sockets.
+#
+#   control (lo crea el lector): b'ESPS' | versión u32 | seq u64 | generación u32 | ack u32 | nombre del segmento de datos
+#   datos (los crea el escritor): cabecera (capacidades, versiones, tamaños, estadísticas de ingesta) y columnas
+#     pos f64[n,2] (NaN = sin posición) | eu, ev i32[m] | temp_width f32[m] | flags u8[n] | status u8[m]
+#     temp_color u8[m] (0 = sin visual; si no, índice+1 en la paleta) | nombres utf-8 separados por '\n' | paleta
+#
+# seq es un seqlock: el escritor lo pone impar antes de escribir y par al
+# terminar; el lector copia las columnas (memcpy de NumPy, O(n + m)) y
+# repite si seq cambió entretanto. Nunca se bloquean el uno al otro. Los
+# nombres y las aristas (u, v) solo se escriben y se decodifican cuando
+# cambia topology_version. Si el grafo no cabe, el escritor crea un segmento
+# mayor (generación + 1) y borra el anterior cuando el lector confirma (ack)
+# que ya no lo usa.
+#
+# Las escrituras de seq son de 8 bytes alineados: atómicas en x86/ARM64,
+# que es donde corre la pasarela. Lector y escritor deben compartir el
+# resource_tracker de multiprocessing (proceso hijo lanzado con spawn/fork):
+# así cada segmento se borra una sola vez, lo borre quien lo creó.
+
+import struct, threading, time
+from multiprocessing import shared_memory
+import numpy as np
+from espnow_state import Snapshot, EMPTY_SNAPSHOT, PUBLISH_INTERVAL
+from espnow_log import get_logger
+
+log = get_logger('shm')
+
+MAGIC = b'ESPS'
+VERSION = 1
+INITIAL_NODES = 1024
+INITIAL_EDGES = 8192
+NAME_BYTES = 24           # bytes reservados por nombre de nodo (una MAC son 17)
+PALETTE_BYTES = 256
+STATS_INTERVAL = 0.5      # segundos: las estadísticas de ingesta se refrescan aunque el grafo no cambie
+READ_RETRIES = 8
+
+F_STALE, F_ACTIVE, F_SELECTED = 1, 2, 4
+
+_CTRL = struct.Struct('<4sIQII64s')
+_SEQ = struct.Struct('<Q'); _SEQ_OFF = 8
+_ACK = struct.Struct('<I'); _ACK_OFF = 20
+# cap_nodes, cap_edges, cap_names, version, topology_version, pos_version, n_nodes, n_edges,
+# names_len, palette_len, active_count, queue_depth, dropped
+_HDR = struct.Struct('<13Q')
+HDR_SIZE = 128
+
+
+def _columns(cap_nodes, cap_edges, cap_names):
+    # {columna: (offset, dtype, forma)} y tamaño total del segmento de datos (columnas alineadas a 8)
+    off = HDR_SIZE; out = {}
+    for name, dtype, shape in (('pos', np.float64, (cap_nodes, 2)), ('eu', np.int32, (cap_edges,)), ('ev', np.int32, (cap_edges,)),
+                               ('temp_width', np.float32, (cap_edges,)), ('flags', np.uint8, (cap_nodes,)),
+                               ('status', np.uint8, (cap_edges,)), ('temp_color', np.uint8, (cap_edges,)),
+                               ('names', np.uint8, (cap_names,)), ('palette', np.uint8, (PALETTE_BYTES,))):
+        out[name] = (off, dtype, shape)
+        off += (int(np.prod(shape)) * np.dtype(dtype).itemsize + 7) & ~7
+    return out, off
+
+
+def _views(buf, cols):
+    return {k: np.ndarray(shape, dtype, buffer=buf, offset=off) for k, (off, dtype, shape) in cols.items()}
+
+
+class ShmPublisher:
+    # ctrl_name: segmento de control (ShmReader.name)
+    # store: espnow_state.StateStore; positions: función -> {nodo: (x, y)} o None
+    # stats: función -> dict con 'queue_depth' y 'dropped' (IngestEngine.stats) o None
+    # on_topology(snap): llamado al cambiar la estructura (p. ej. layout.update_graph)
+    def __init__(self, ctrl_name, store, positions=None, stats=None, on_topology=None, interval=PUBLISH_INTERVAL, metrics=None):
+        self.ctrl = shared_memory.SharedMemory(ctrl_name)
+        magic, version, seq, gen, _, _ = _CTRL.unpack_from(self.ctrl.buf)
+        if magic != MAGIC or version != VERSION: raise ValueError(f"{ctrl_name}: no es un segmento de control v{VERSION}")
+        self.ctrl_name = ctrl_name
+        self.store = store
+        self.positions = positions
+        self.stats = stats
+        self.on_topology = on_topology
+        self.interval = interval
+        self.writes = 0
+        self._h_write = metrics.histogram('shm_write_seconds', "Escritura de una instantánea en memoria compartida") if metrics is not None else None
+        self._seq = seq
+        self._gen = gen
+        self.data = None; self._v = None; self._caps = (0, 0, 0)
+        self._old = []            # (generación que lo sustituye, segmento) hasta que el lector confirme
+        self._topology = -1
+        self._names = b''; self._index = {}
+        self._pos_src = None; self._pos = np.zeros((0, 2)); self._pos_version = 0
+        self._palette = {}; self._palette_bytes = b''
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="shm-publisher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread: self._thread.join(timeout=2.0)
+        for _, shm in self._old: self._free(shm)
+        self._old = []
+        if self.data is not None:
+            self._v = None; self._free(self.data); self.data = None
+        self.ctrl.close()
+
+    def _free(self, shm):
+        shm.close()
+        try: shm.unlink()
+        except FileNotFoundError: pass
+
+    def _run(self):
+        last_snap = last_pos = None; last_stats = 0.0
+        while self._running:
+            try:
+                snap = self.store.snapshot(); pos = self.positions() if self.positions is not None else None
+                now = time.monotonic()
+                if snap is not last_snap or pos is not last_pos or now - last_stats >= STATS_INTERVAL:
+                    if self.on_topology is not None and (last_snap is None or snap.topology_version != last_snap.topology_version):
+                        self.on_topology(snap)
+                    self.publish(snap, pos)
+                    last_snap = snap; last_pos = pos; last_stats = now
+                if self._old: self._reap()
+            except Exception as e:
+                log.exception("[!] Excepción publicando en memoria compartida: %s", e)
+            time.sleep(self.interval)
+
+    def _color(self, color):
+        i = self._palette.get(color)
+        if i is None:
+            blob = self._palette_bytes + (b'\n' if self._palette else b'') + color.encode()
+            if len(self._palette) >= 255 or len(blob) > PALETTE_BYTES: return 0 # Paleta llena: sin visual
+            i = self._palette[color] = len(self._palette) + 1; self._palette_bytes = blob
+        return i
+
+    def _grow(self, n, m, names_len):
+        cn, ce, cs = self._caps
+        caps = (max(cn, INITIAL_NODES, 2 * n) if n > cn else cn, max(ce, INITIAL_EDGES, 2 * m) if m > ce else ce,
+                max(cs, INITIAL_NODES * NAME_BYTES, 2 * names_len) if names_len > cs else cs)
+        cols, size = _columns(*caps)
+        self._gen += 1
+        shm = shared_memory.SharedMemory(f"{self.ctrl_name}-{self._gen}", create=True, size=size)
+        if self.data is not None: self._v = None; self._old.append((self._gen, self.data))
+        self.data = shm; self._v = _views(shm.buf, cols); self._caps = caps
+
+    def _reap(self):
+        ack = _ACK.unpack_from(self.ctrl.buf, _ACK_OFF)[0]
+        keep = []
+        for gen, shm in self._old:
+            if ack >= gen: self._free(shm)
+            else: keep.append((gen, shm))
+        self._old = keep
+
+    def publish(self, snap, pos=None):
+        t0 = time.perf_counter_ns()
+        nodes = snap.nodes; n = len(nodes); m = len(snap.edges)
+        topo = snap.topology_version != self._topology
+        if topo:
+            self._names = '\n'.join(nodes).encode(); self._index = {v: i for i, v in enumerate(nodes)}
+        cn, ce, cs = self._caps; grew = n > cn or m > ce or len(self._names) > cs
+        if grew: self._grow(n, m, len(self._names))
+        full = topo or grew
+        if full or pos is not self._pos_src:
+            p = np.full((n, 2), np.nan)
+            if pos:
+                for i, v in enumerate(nodes):
+                    xy = pos.get(v)
+                    if xy is not None: p[i] = xy
+            self._pos = p; self._pos_src = pos; self._pos_version += 1; new_pos = True
+        else:
+            new_pos = False
+        index = self._index; flags = np.zeros(n, np.uint8)
+        for bit, names in ((F_STALE, snap.stale), (F_ACTIVE, snap.active_nodes), (F_SELECTED, snap.selected)):
+            for v in names:
+                i = index.get(v)
+                if i is not None: flags[i] |= bit
+        tc = np.zeros(m, np.uint8); tw = np.zeros(m, np.float32)
+        for i, (color, width) in snap.temp_visuals.items():
+            if i < m: tc[i] = self._color(color); tw[i] = width
+        st = self.stats() if self.stats is not None else {}
+        v = self._v; buf = self.ctrl.buf
+        self._seq += 1; _SEQ.pack_into(buf, _SEQ_OFF, self._seq) # Impar: escribiendo
+        if grew: _CTRL.pack_into(buf, 0, MAGIC, VERSION, self._seq, self._gen, _ACK.unpack_from(buf, _ACK_OFF)[0], self.data.name.encode())
+        if full:
+            v['names'][:len(self._names)] = np.frombuffer(self._names, np.uint8)
+            v['eu'][:m] = snap.edge_u; v['ev'][:m] = snap.edge_v
+        if new_pos: v['pos'][:n] = self._pos
+        v['status'][:m] = snap.edge_status; v['temp_color'][:m] = tc; v['temp_width'][:m] = tw; v['flags'][:n] = flags
+        pal = self._palette_bytes; v['palette'][:len(pal)] = np.frombuffer(pal, np.uint8)
+        _HDR.pack_into(self.data.buf, 0, *self._caps, snap.version, snap.topology_version, self._pos_version, n, m,
+                       len(self._names), len(pal), snap.active_count, st.get('queue_depth', 0), st.get('dropped', 0))
+        self._seq += 1; _SEQ.pack_into(buf, _SEQ_OFF, self._seq) # Par: consistente
+        self._topology = snap.topology_version; self.writes += 1
+        if self._h_write is not None: self._h_write.record_ns(time.perf_counter_ns() - t0)
+
+
+class ShmReader:
+    # Crea el segmento de control; poll() devuelve (Snapshot, {nodo: (x, y)}) sin bloquear al escritor.
+    # Mientras nada cambie devuelve los mismos objetos (la GUI compara por identidad).
+    def __init__(self):
+        self.ctrl = shared_memory.SharedMemory(create=True, size=_CTRL.size)
+        _CTRL.pack_into(self.ctrl.buf, 0, MAGIC, VERSION, 0, 0, 0, b'')
+        self.name = self.ctrl.name
+        self.snap = EMPTY_SNAPSHOT
+        self.pos = {}
+        self.stats = {'queue_depth': 0, 'dropped': 0}
+        self.reads = 0
+        self.retries = 0
+        self._seq = 0
+        self._gen = 0
+        self.data = None; self._v = None
+        self._pos_version = 0
+        self._topology = -1; self._nodes = (); self._edges = (); self._eu = self._ev = None
+        self._palette_len = -1; self._palette = ()
+
+    def close(self):
+        self._v = None
+        if self.data is not None: self.data.close(); self.data = None
+        self.ctrl.close()
+        try: self.ctrl.unlink()
+        except FileNotFoundError: pass
+
+    def _attach(self, gen, name):
+        shm = shared_memory.SharedMemory(name.rstrip(b'\0').decode())
+        caps = _HDR.unpack_from(shm.buf, 0)[:3]
+        self._v = None
+        if self.data is not None: self.data.close()
+        self.data = shm; self._v = _views(shm.buf, _columns(*caps)[0]); self._gen = gen
+        self._topology = -1; self._palette_len = -1; self._pos_version = 0
+        _ACK.pack_into(self.ctrl.buf, _ACK_OFF, gen) # El escritor ya puede borrar el segmento anterior
+
+    def poll(self):
+        buf = self.ctrl.buf
+        for _ in range(READ_RETRIES):
+            s1 = _SEQ.unpack_from(buf, _SEQ_OFF)[0]
+            if s1 == self._seq: break
+            if s1 & 1: self.retries += 1; time.sleep(0); continue
+            _, _, _, gen, _, name = _CTRL.unpack_from(buf)
+            attached = gen != self._gen
+            try:
+                if attached: self._attach(gen, name)
+                raw = self._copy()
+            except (FileNotFoundError, ValueError, IndexError): # Segmento ya sustituido o a medio escribir: se relee
+                raw = None
+            if raw is None or _SEQ.unpack_from(buf, _SEQ_OFF)[0] != s1:
+                self.retries += 1
+                if attached: self._gen = -1 # Se adjuntó en plena escritura: volver a adjuntar al releer
+                continue
+            self._seq = s1; self.reads += 1
+            self._build(*raw)
+            break
+        return self.snap, self.pos
+
+    def _copy(self):
+        # Copia de la cabecera y las columnas; se valida con seq antes de usarla
+        hdr = _HDR.unpack_from(self.data.buf, 0); v = self._v
+        _, _, _, version, topology, pos_version, n, m, names_len, palette_len = hdr[:10]
+        topo = None
+        if topology != self._topology:
+            topo = (bytes(v['names'][:names_len]), v['eu'][:m].copy(), v['ev'][:m].copy())
+        pal = bytes(v['palette'][:palette_len]) if palette_len != self._palette_len else None
+        pos = v['pos'][:n].copy() if pos_version != self._pos_version else None
+        cols = None
+        if version != self.snap.version or topo is not None:
+            cols = (v['status'][:m].copy(), v['flags'][:n].copy(), v['temp_color'][:m].copy(), v['temp_width'][:m].copy())
+        return hdr, topo, pal, pos, cols
+
+    def _build(self, hdr, topo, pal, pos, cols):
+        _, _, _, version, topology, pos_version, n, m, names_len, palette_len, active_count, qd, dropped = hdr
+        self.stats = {'queue_depth': qd, 'dropped': dropped}
+        if topo is not None:
+            names, eu, ev = topo
+            nodes = tuple(names.decode().split('\n')) if n else ()
+            self._nodes = nodes; self._eu = eu; self._ev = ev
+            self._edges = tuple(zip([nodes[i] for i in eu.tolist()], [nodes[i] for i in ev.tolist()]))
+            self._topology = topology
+        if pal is not None:
+            self._palette = (None,) + tuple(pal.decode().split('\n')) if pal else (None,); self._palette_len = palette_len
+        nodes = self._nodes
+        if pos is not None:
+            ok = ~np.isnan(pos[:, 0])
+            self.pos = {nodes[i]: (x, y) for i, x, y in zip(np.flatnonzero(ok).tolist(), pos[ok, 0].tolist(), pos[ok, 1].tolist())}
+            self._pos_version = pos_version
+        if cols is not None:
+            status, flags, tc, tw = cols
+            pal = self._palette
+            temps = {i: (pal[c], w) for i, c, w in zip(np.flatnonzero(tc).tolist(), tc[tc > 0].tolist(), tw[tc > 0].tolist())}
+            names_with = lambda bit: [nodes[i] for i in np.flatnonzero(flags & bit).tolist()]
+            self.snap = Snapshot(version, topology, nodes, self._edges, self._eu, self._ev, status, temps,
+                                 frozenset(names_with(F_ACTIVE)), active_count, tuple(names_with(F_SELECTED)),
+                                 frozenset(names_with(F_STALE)))
@@ -0,0 +1,405 @@
+# --- espnow_sim: flota de nodos ESP32 virtuales que hablan el protocolo UDP del monitor ---
+#
+# Sin ESP32 físicos no se podía probar nada. Cada nodo virtual tiene su propio
+# socket UDP en loopback (el monitor le contesta al puerto de origen, como a
+# un ESP32 real) y reproduce el comportamiento de sketch_Join.ino:
+#   - al arrancar: "<MAC> CMD:JOIN" al servidor y JOIN_ESPNOW por broadcast
+#   - UDP "BROADCAST txt"  -> ESP-NOW broadcast; los vecinos informan CMD:BROADCAST_RECV
+#   - UDP "UNICAST mac txt" -> ESP-NOW al destino; este informa CMD:UNICAST_RECV y,
+#                              si el envío falla (fuera de alcance o pérdida), el
+#                              emisor informa CMD:SEND_FAIL_TO (callback onSent)
+#   - UDP "ROUTE_STEP sig fin id payload" -> ACK_ROUTE_STEP_RECEIVED, ROUTED_DATA por
+#                              ESP-NOW y ACK_ROUTE_ESPNOW_SENT (o FAIL_ROUTE_ESPNOW_SENT
+#                              si esp_now_send no lo encola); el destino final
+#                              informa ROUTE_DELIVERED
+#   - UDP "ROUTE_MSG_ACKNOWLEDGED id" -> apaga el "LED" de ruta
+# Todo ESP-NOW recibido se informa como "<MAC> CMD:<COMANDO>_RECV <origen> <texto>".
+#
+# Los enlaces ESP-NOW virtuales dependen de la distancia en el cuadrado
+# unidad: hay enlace si d <= range; cada trama se pierde con probabilidad
+# loss + edge_loss * (d / range)^2 y tarda latency +- jitter segundos.
+#
+# Con coalesce > 0 cada nodo junta sus reportes durante `coalesce` segundos y
+# los manda en un solo datagrama (líneas con '\n' o trama OP_BATCH), como
+# UDP_COALESCE_MS en el firmware. flood(rate, seconds) simula una tormenta de
+# descubrimiento: cada nodo emite `rate` ESP-NOW broadcasts por segundo.
+# heartbeat(interval) repite el CMD:JOIN de cada nodo (HEARTBEAT_MS del
+# firmware) y power_off(k) apaga k nodos al azar: dejan de contestar y de
+# informar, para probar el envejecimiento del monitor (espnow_liveness).
+#
+# Con udp_loop > 0 cada nodo atiende UDP como el loop() del firmware: un
+# datagrama por vuelta de udp_loop segundos (delay(10)); lo que llega entre
+# tanto espera en un buzón de `mailbox` datagramas (el de lwIP) y lo que no
+# cabe se pierde ('udp_dropped'). Sirve para ver cuántos comandos pierde una
+# ráfaga sin ritmo por nodo (espnow_outbound, bench_outbound.py).
+#
+# Un solo hilo con selectors (epoll) atiende todos los sockets y un heap de
+# eventos temporizados hace de aire: miles de nodos en un proceso.
+#
+# Uso: python espnow_sim.py [--nodes 200] [--range 0.15] [--loss 0.02] [--latency 0.004]
+#                           [--server 127.0.0.1:12345] [--join-rate 500] [--seed-links] [--binary]
+#                           [--coalesce 0.02] [--flood 5 --flood-seconds 10]
+#                           [--heartbeat 10] [--power-off 20 --power-off-after 60]
+#                           [--firmware-loop 0.01 --mailbox 6]
+
+import argparse, collections, errno, heapq, math, random, selectors, socket, threading, time
+from espnow_protocol import (encode_cmd, encode_ack_route_step, encode_ack_espnow_sent, encode_fail_espnow_sent,
+                             encode_route_delivered, encode_batch)
+
+SERVER = ('127.0.0.1', 12345)
+RANGE = 0.15            # alcance ESP-NOW en el cuadrado unidad
+LOSS = 0.02             # probabilidad de pérdida base por trama
+EDGE_LOSS = 0.2         # pérdida extra en el límite del alcance (crece con (d/range)^2)
+LATENCY = 0.004         # segundos por trama ESP-NOW
+JITTER = 0.002          # +- segundos
+QUEUE_FAIL = 0.0        # probabilidad de que esp_now_send no encole (FAIL_ROUTE_ESPNOW_SENT)
+JOIN_RATE = 500.0       # JOINs por segundo al arrancar (no desbordar el socket del monitor)
+ESP_ERR_ESPNOW_NO_MEM = 12393
+RECV_BATCH = 64         # datagramas por socket y vuelta del bucle
+REPORT_INTERVAL = 5.0   # segundos entre líneas de estado (modo script)
+COALESCE_MAX_BYTES = 1400  # un datagrama agrupado no pasa de aquí (cabe en una trama Ethernet)
+FD_MARGIN = 64          # descriptores además de un socket por nodo (stdio, selector, ficheros)
+UDP_LOOP = 0.01         # segundos por vuelta del loop() del firmware (delay(10)) con --firmware-loop
+MAILBOX = 6             # datagramas que guarda el buzón UDP de lwIP
+
+
+def sim_mac(i):
+    return f"24:0A:C4:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}"
+
+
+class SimNode:
+    __slots__ = ('idx', 'mac', 'x', 'y', 'sock', 'neighbors', 'route_led', 'joined', 'outbuf', 'outlen', 'powered', 'mailbox', 'busy')
+    def __init__(self, idx, mac, x, y, sock):
+        self.idx = idx; self.mac = mac; self.x = x; self.y = y; self.sock = sock
+        self.neighbors = {}     # idx vecino -> distancia
+        self.route_led = None   # msg_id de la ruta de la que es intermedio (LED2 del firmware)
+        self.joined = False
+        self.outbuf = []        # reportes pendientes de agrupar (coalesce > 0)
+        self.outlen = 0
+        self.powered = True     # False: apagado (no recibe ni informa nada)
+        self.mailbox = None     # deque de datagramas por leer (udp_loop > 0)
+        self.busy = False       # hay una vuelta del loop() programada
+
+
+def ensure_fd_limit(n):
+    # Un socket UDP por nodo: si el límite blando de RLIMIT_NOFILE no basta se sube hasta el duro.
+    # Si ni así caben, OSError(EMFILE) con cuántos hacen falta (antes de abrir ninguno)
+    need = n + FD_MARGIN
+    try: import resource
+    except ImportError: return # Sin RLIMIT_NOFILE (Windows)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= need: return
+    try: resource.setrlimit(resource.RLIMIT_NOFILE, (need if hard == resource.RLIM_INFINITY else hard, hard))
+    except (ValueError, OSError): pass
+    soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft != resource.RLIM_INFINITY and soft < need:
+        raise OSError(errno.EMFILE, f"{n} nodos virtuales necesitan {need} descriptores (un socket por nodo + {FD_MARGIN}) "
+                                    f"y el límite es {soft}: súbelo (ulimit -n {need}) o usa menos --nodes")
+
+
+class SimFleet:
+    def __init__(self, n, server=SERVER, range_=RANGE, loss=LOSS, edge_loss=EDGE_LOSS, latency=LATENCY,
+                 jitter=JITTER, queue_fail=QUEUE_FAIL, join_rate=JOIN_RATE, seed=None, bind_ip='127.0.0.1', binary=False,
+                 coalesce=0.0, udp_loop=0.0, mailbox=MAILBOX):
+        self.server = server
+        self.range = range_
+        self.loss = loss
+        self.edge_loss = edge_loss
+        self.latency = latency
+        self.jitter = jitter
+        self.queue_fail = queue_fail
+        self.join_rate = join_rate
+        self.binary = binary    # reportes en el formato binario de espnow_protocol (USE_BINARY_WIRE del firmware)
+        self.coalesce = coalesce  # segundos que un nodo agrupa reportes antes de enviarlos (0 = uno por datagrama)
+        self.udp_loop = udp_loop  # segundos por datagrama leído (0 = se atiende todo al llegar)
+        self.mailbox = mailbox
+        self.rng = random.Random(seed)
+        self.sel = selectors.DefaultSelector()
+        self.nodes = []
+        self.by_mac = {}
+        self._heap = []; self._seq = 0
+        self._lock = threading.Lock()   # solo para schedule() desde otros hilos
+        self._stop = threading.Event()
+        self._thread = None
+        self.counts = {'udp_rx': 0, 'udp_tx': 0, 'espnow_tx': 0, 'espnow_lost': 0, 'espnow_out_of_range': 0,
+                       'route_steps': 0, 'delivered': 0, 'queue_fail': 0, 'reports': 0, 'udp_dropped': 0}
+        ensure_fd_limit(n)
+        for i in range(n):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind((bind_ip, 0)); s.setblocking(False)
+            node = SimNode(i, sim_mac(i), self.rng.random(), self.rng.random(), s)
+            if udp_loop > 0: node.mailbox = collections.deque()
+            self.nodes.append(node); self.by_mac[node.mac] = node
+            self.sel.register(s, selectors.EVENT_READ, node)
+        self._link_neighbors()
+
+    def _link_neighbors(self):
+        # Rejilla de celdas de lado `range`: solo se comparan nodos de celdas vecinas
+        r = self.range; cells = {}
+        for nd in self.nodes: cells.setdefault((int(nd.x / r), int(nd.y / r)), []).append(nd)
+        for (cx, cy), members in cells.items():
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for b in cells.get((cx + dx, cy + dy), ()):
+                        for a in members:
+                            if a.idx < b.idx:
+                                d = math.hypot(a.x - b.x, a.y - b.y)
+                                if d <= r: a.neighbors[b.idx] = d; b.neighbors[a.idx] = d
+
+    def links(self):
+        return [(a.mac, self.nodes[j].mac) for a in self.nodes for j in a.neighbors if a.idx < j]
+
+    # --- Eventos temporizados ---
+
+    def schedule(self, delay, fn, *args):
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, fn, args))
+
+    def _run_due(self):
+        now = time.monotonic(); h = self._heap
+        while True:
+            with self._lock:
+                if not h or h[0][0] > now: return (h[0][0] - now) if h else None
+                _, _, fn, args = heapq.heappop(h)
+            fn(*args)
+
+    # --- UDP ---
+
+    def _udp(self, node, line):
+        # line: str (protocolo de texto) o bytes (trama binaria de espnow_protocol)
+        data = line if isinstance(line, bytes) else line.encode()
+        self.counts['reports'] += 1
+        if self.coalesce <= 0: return self._sendto(node, data)
+        if node.outlen + len(data) + 2 > COALESCE_MAX_BYTES: self._flush_out(node)
+        if not node.outbuf: self.schedule(self.coalesce, self._flush_out, node)
+        node.outbuf.append(data); node.outlen += len(data) + 2
+
+    def _flush_out(self, node):
+        buf = node.outbuf
+        if not buf: return
+        node.outbuf = []; node.outlen = 0
+        if len(buf) == 1: data = buf[0]
+        elif self.binary: data = encode_batch(buf)
+        else: data = b'\n'.join(buf)
+        self._sendto(node, data)
+
+    def _sendto(self, node, data):
+        try: node.sock.sendto(data, self.server); self.counts['udp_tx'] += 1
+        except OSError: pass  # Buffer lleno: el ESP32 real también pierde el paquete
+
+    def _mailbox(self, node, data):
+        # Llega un datagrama con udp_loop > 0: se lee en esta vuelta si el loop() está libre, si no espera en el buzón
+        if not node.powered: return
+        if node.busy:
+            if len(node.mailbox) >= self.mailbox: self.counts['udp_dropped'] += 1
+            else: node.mailbox.append(data)
+            return
+        node.busy = True; self.schedule(self.udp_loop, self._loop_tick, node)
+        self._on_udp(node, data)
+
+    def _loop_tick(self, node):
+        if node.mailbox: self.schedule(self.udp_loop, self._loop_tick, node); self._on_udp(node, node.mailbox.popleft())
+        else: node.busy = False
+
+    def _on_udp(self, node, data):
+        if not node.powered: return
+        self.counts['udp_rx'] += 1
+        cmd = data.decode('utf-8', 'replace').strip()
+        if cmd.startswith('ROUTE_STEP '):
+            p = cmd.split(' ', 4)
+            if len(p) < 5: return
+            _, nxt, fin, msg_id, payload = p
+            self.counts['route_steps'] += 1
+            self._udp(node, encode_ack_route_step(node.mac, msg_id) if self.binary else f"ACK_ROUTE_STEP_RECEIVED {node.mac} {msg_id}")
+            if node.mac != fin: node.route_led = msg_id
+            if self.rng.random() < self.queue_fail:
+                self.counts['queue_fail'] += 1
+                self._udp(node, encode_fail_espnow_sent(node.mac, nxt, msg_id, ESP_ERR_ESPNOW_NO_MEM) if self.binary
+                          else f"FAIL_ROUTE_ESPNOW_SENT {node.mac} {nxt} {msg_id} ERR:{ESP_ERR_ESPNOW_NO_MEM}")
+                return
+            self._espnow(node, nxt, 'ROUTED_DATA', f"{fin} {msg_id} {payload}")
+            self._udp(node, encode_ack_espnow_sent(node.mac, nxt, msg_id) if self.binary else f"ACK_ROUTE_ESPNOW_SENT {node.mac} {nxt} {msg_id}")
+        elif cmd.startswith('UNICAST '):
+            p = cmd.split(' ', 2)
+            if len(p) == 3: self._espnow(node, p[1], 'UNICAST', p[2])
+        elif cmd.startswith('BROADCAST '):
+            self._espnow(node, None, 'BROADCAST', cmd.split(' ', 1)[1])
+        elif cmd.startswith('ROUTE_MSG_ACKNOWLEDGED '):
+            if node.route_led == cmd.split(' ', 1)[1]: node.route_led = None
+
+    # --- ESP-NOW virtual ---
+
+    def _delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def _lost(self, d):
+        return self.rng.random() < self.loss + self.edge_loss * (d / self.range) ** 2
+
+    def _espnow(self, src, dst_mac, command, text):
+        self.counts['espnow_tx'] += 1
+        if dst_mac is None: # Broadcast: sin ACK de capa MAC, onSent siempre con éxito
+            for j, d in src.neighbors.items():
+                if not self._lost(d): self.schedule(self._delay(), self._on_espnow, self.nodes[j], src, command, text)
+            return
+        dst = self.by_mac.get(dst_mac)
+        d = src.neighbors.get(dst.idx) if dst is not None else None
+        if d is None:
+            self.counts['espnow_out_of_range'] += 1
+            self.schedule(self._delay(), self._on_sent, src, dst_mac, False)
+        elif self._lost(d) or not dst.powered:
+            self.counts['espnow_lost'] += 1
+            self.schedule(self._delay(), self._on_sent, src, dst_mac, False)
+        else:
+            dl = self._delay()
+            self.schedule(dl, self._on_espnow, dst, src, command, text)
+            self.schedule(dl, self._on_sent, src, dst_mac, True)
+
+    def _on_sent(self, src, dst_mac, ok):
+        if not ok: self._udp(src, encode_cmd(src.mac, 'SEND_FAIL_TO', dst_mac) if self.binary else f"<{src.mac}> CMD:SEND_FAIL_TO {dst_mac}")
+
+    def _on_espnow(self, node, src, command, text):
+        if not node.powered: return
+        self._udp(node, encode_cmd(node.mac, f"{command}_RECV", src.mac, text) if self.binary
+                  else f"<{node.mac}> CMD:{command}_RECV {src.mac} {text}")
+        if command == 'ROUTED_DATA':
+            p = text.split(' ', 2)
+            if len(p) == 3 and p[0] == node.mac:
+                self.counts['delivered'] += 1
+                self._udp(node, encode_route_delivered(node.mac, src.mac, p[1], p[2]) if self.binary
+                          else f"ROUTE_DELIVERED {node.mac} {src.mac} {p[1]} {p[2]}")
+                if node.route_led == p[1]: node.route_led = None
+
+    # --- Arranque ---
+
+    def _join(self, node):
+        node.joined = True
+        self._udp(node, encode_cmd(node.mac, 'JOIN') if self.binary else f"<{node.mac}> CMD:JOIN")
+        self._espnow(node, None, 'JOIN_ESPNOW', node.mac)
+
+    def _heartbeat(self, node, interval):
+        if self._stop.is_set() or not node.powered: return
+        self._udp(node, encode_cmd(node.mac, 'JOIN') if self.binary else f"<{node.mac}> CMD:JOIN")
+        self.schedule(interval, self._heartbeat, node, interval)
+
+    def heartbeat(self, interval, delay=0.0):
+        # Cada nodo repite su CMD:JOIN cada `interval` segundos (fase al azar)
+        if interval <= 0: return
+        for node in self.nodes: self.schedule(delay + self.rng.random() * interval, self._heartbeat, node, interval)
+
+    def power_off(self, k):
+        # Apaga k nodos encendidos al azar; devuelve sus MAC
+        on = [nd for nd in self.nodes if nd.powered]
+        off = self.rng.sample(on, min(k, len(on)))
+        for nd in off: nd.powered = False; nd.outbuf = []; nd.outlen = 0
+        return [nd.mac for nd in off]
+
+    def join_all(self):
+        # JOIN escalonados a join_rate por segundo; devuelve los segundos que tardarán
+        step = 1.0 / self.join_rate if self.join_rate else 0.0
+        for k, node in enumerate(self.nodes): self.schedule(k * step, self._join, node)
+        return len(self.nodes) * step
+
+    def seed_links(self, delay=0.0):
+        # Informa un UNICAST_RECV por cada enlace en alcance, como si ya se hubiera probado:
+        # el monitor los marca 'established' y hay rutas desde el principio. No lo hace el firmware.
+        step = 1.0 / self.join_rate if self.join_rate else 0.0
+        pairs = [(a, self.nodes[j]) for a in self.nodes for j in a.neighbors if a.idx < j]
+        for k, (a, b) in enumerate(pairs):
+            line = encode_cmd(b.mac, 'UNICAST_RECV', a.mac, 'seed') if self.binary else f"<{b.mac}> CMD:UNICAST_RECV {a.mac} seed"
+            self.schedule(delay + k * step, self._udp, b, line)
+        return len(pairs) * step
+
+    def flood(self, rate, seconds, delay=0.0):
+        # Tormenta de descubrimiento: cada nodo emite `rate` broadcasts/s durante `seconds`, con fase al azar
+        if rate <= 0: return 0.0
+        period = 1.0 / rate
+        for node in self.nodes:
+            t = delay + self.rng.random() * period
+            while t < delay + seconds:
+                self.schedule(t, self._espnow, node, None, 'BROADCAST', 'ping'); t += period
+        return delay + seconds
+
+    # --- Bucle ---
+
+    def run(self):
+        while not self._stop.is_set():
+            wait = self._run_due()
+            for key, _ in self.sel.select(0.05 if wait is None else min(wait, 0.05)):
+                node, s = key.data, key.fileobj
+                on_udp = self._mailbox if node.mailbox is not None else self._on_udp
+                for _ in range(RECV_BATCH):
+                    try: data = s.recv(2048)
+                    except (BlockingIOError, InterruptedError): break
+                    except OSError: break
+                    on_udp(node, data)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True, name='espnow-sim')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join(2.0)
+        for nd in self.nodes:
+            try: self.sel.unregister(nd.sock)
+            except (KeyError, ValueError): pass
+            nd.sock.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Flota de nodos ESP32 virtuales para el monitor ESP-NOW")
+    ap.add_argument('--nodes', type=int, default=200)
+    ap.add_argument('--range', type=float, default=RANGE, help="alcance ESP-NOW (cuadrado unidad)")
+    ap.add_argument('--loss', type=float, default=LOSS)
+    ap.add_argument('--edge-loss', type=float, default=EDGE_LOSS)
+    ap.add_argument('--latency', type=float, default=LATENCY)
+    ap.add_argument('--jitter', type=float, default=JITTER)
+    ap.add_argument('--queue-fail', type=float, default=QUEUE_FAIL)
+    ap.add_argument('--server', default=f"{SERVER[0]}:{SERVER[1]}")
+    ap.add_argument('--join-rate', type=float, default=JOIN_RATE)
+    ap.add_argument('--seed-links', action='store_true', help="informar UNICAST_RECV de cada enlace al arrancar")
+    ap.add_argument('--binary', action='store_true', help="reportes en formato binario (espnow_protocol)")
+    ap.add_argument('--coalesce', type=float, default=0.0, metavar='S', help="agrupar los reportes de cada nodo durante S segundos")
+    ap.add_argument('--flood', type=float, default=0.0, metavar='R', help="tormenta de broadcasts: R por nodo y segundo")
+    ap.add_argument('--flood-seconds', type=float, default=10.0)
+    ap.add_argument('--heartbeat', type=float, default=0.0, metavar='S', help="repetir CMD:JOIN cada S segundos")
+    ap.add_argument('--power-off', type=int, default=0, metavar='N', help="apagar N nodos al azar tras --power-off-after")
+    ap.add_argument('--power-off-after', type=float, default=30.0, metavar='S')
+    ap.add_argument('--firmware-loop', type=float, default=0.0, metavar='S', nargs='?', const=UDP_LOOP,
+                    help=f"leer un datagrama UDP cada S segundos por nodo (sin valor: {UDP_LOOP})")
+    ap.add_argument('--mailbox', type=int, default=MAILBOX, help="datagramas en el buzón UDP con --firmware-loop")
+    ap.add_argument('--duration', type=float, default=0.0, help="segundos (0 = hasta Ctrl+C)")
+    ap.add_argument('--seed', type=int, default=None)
+    args = ap.parse_args()
+    host, port = args.server.rsplit(':', 1)
+    try:
+        fleet = SimFleet(args.nodes, (host, int(port)), args.range, args.loss, args.edge_loss, args.latency,
+                         args.jitter, args.queue_fail, args.join_rate, args.seed, binary=args.binary,
+                         coalesce=args.coalesce, udp_loop=args.firmware_loop, mailbox=args.mailbox)
+    except OSError as e:
+        print(f"[!] {e.strerror if e.errno == errno.EMFILE else e}"); return 1
+    n_links = sum(len(nd.neighbors) for nd in fleet.nodes) // 2
+    print(f"[i] {args.nodes} nodos virtuales, {n_links} enlaces en alcance "
+          f"(grado medio {2 * n_links / max(args.nodes, 1):.1f}) -> {args.server}")
+    fleet.start()
+    t_join = fleet.join_all()
+    if args.seed_links: fleet.seed_links(t_join + 0.5)
+    if args.flood: fleet.flood(args.flood, args.flood_seconds, t_join + 0.5)
+    if args.heartbeat: fleet.heartbeat(args.heartbeat, t_join)
+    if args.power_off:
+        fleet.schedule(args.power_off_after, lambda: print(f"[i] Apagados {args.power_off} nodos: {fleet.power_off(args.power_off)[:3]}..."))
+    t0 = time.monotonic(); end = t0 + args.duration if args.duration else None
+    try:
+        while end is None or time.monotonic() < end:
+            time.sleep(REPORT_INTERVAL if end is None else max(0.0, min(REPORT_INTERVAL, end - time.monotonic())))
+            print(f"[i] {time.monotonic() - t0:.0f}s {fleet.counts}")
+    except KeyboardInterrupt:
+        pass
+    fleet.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
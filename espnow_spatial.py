@@ -0,0 +1,148 @@
+# --- espnow_spatial: índice espacial de las posiciones del layout (clic, caja y lazo) ---
+#
+# on_click() recorría todos los nodos de `pos` en cada clic (y la v6 se
+# quedaba con el primero dentro del radio, no con el más cercano). GridIndex
+# reparte los nodos en una rejilla uniforme de celdas (diccionario
+# celda -> conjunto de índices) con ~1 nodo por celda:
+#   nearest(x, y, radius, skip): busca por anillos de celdas alrededor del punto y
+#       para en cuanto ningún anillo más lejano puede mejorar al mejor; coste
+#       independiente del número de nodos con densidad uniforme (O(1), sin
+#       el O(log n) de un KD-tree; scipy no es dependencia del monitor).
+#   in_box(x0, y0, x1, y1) / in_polygon(poly): selección por caja o lazo;
+#       solo se prueban los nodos de las celdas que cubre la caja (o la caja
+#       envolvente del lazo), con el test vectorizado en NumPy.
+#
+# update(pos) recibe el diccionario publicado por el layout (inmutable: uno
+# nuevo en cada publicación). Si es el mismo objeto no hace nada; si solo se
+# añadieron nodos al final o se movieron algunos (el layout solo mueve los
+# nodos calientes), compara las coordenadas de golpe con NumPy y recoloca en
+# la rejilla solo los que cambiaron de celda. Si desaparecen nodos o el
+# número de nodos se duplica desde la última reconstrucción (el tamaño de
+# celda ya no encaja), se reconstruye entero. Se llama al consultar (en el
+# clic), no en cada publicación del layout.
+#
+# No es seguro entre hilos: cada GUI usa el suyo desde su hilo.
+
+import itertools, math
+import numpy as np
+
+MIN_CELL = 1e-4       # tamaño mínimo de celda (todos los nodos casi en el mismo punto)
+
+
+class GridIndex:
+    # cell: tamaño fijo de celda; None = según la extensión y el número de nodos en cada reconstrucción
+    def __init__(self, cell=None):
+        self.fixed_cell = cell
+        self.cell = cell or 0.05
+        self.names = []
+        self.xy = np.zeros((0, 2))
+        self._cells = {}          # (cx, cy) -> set de índices en names
+        self._key = []            # índice -> celda actual
+        self._source = None       # último diccionario indexado
+        self._built_n = 0
+        self.counts = {'rebuilds': 0, 'updates': 0, 'moved': 0}
+
+    def __len__(self):
+        return len(self.names)
+
+    # --- Mantenimiento ---
+
+    def update(self, pos):
+        # pos: {nodo: (x, y)}; devuelve el nº de nodos recolocados (o añadidos)
+        if pos is self._source: return 0
+        names = list(pos); n0 = len(self.names)
+        xy = np.fromiter(itertools.chain.from_iterable(pos.values()), np.float64, 2 * len(names)).reshape(-1, 2) # ~3x más rápido que np.array(lista de tuplas)
+        self._source = pos
+        if not n0 or len(names) < n0 or len(names) > 2 * self._built_n or names[:n0] != self.names:
+            self._rebuild(names, xy); return len(names)
+        moved = np.flatnonzero((xy[:n0] != self.xy).any(axis=1)).tolist()
+        cells = self._cells; key = self._key; c = self.cell
+        for i in moved:
+            k = (int(xy[i, 0] // c), int(xy[i, 1] // c))
+            if k != key[i]:
+                cells[key[i]].discard(i); cells.setdefault(k, set()).add(i); key[i] = k
+        for i in range(n0, len(names)):
+            k = (int(xy[i, 0] // c), int(xy[i, 1] // c))
+            cells.setdefault(k, set()).add(i); key.append(k)
+        self.names = names; self.xy = xy
+        self.counts['updates'] += 1; self.counts['moved'] += len(moved)
+        return len(moved) + len(names) - n0
+
+    def _rebuild(self, names, xy):
+        n = len(names)
+        if self.fixed_cell: c = self.fixed_cell
+        elif n: # ~1 nodo por celda sobre la caja envolvente
+            span = float(max(np.ptp(xy[:, 0]), np.ptp(xy[:, 1]), 0.0))
+            c = max(span / math.sqrt(n), MIN_CELL)
+        else: c = self.cell
+        self.cell = c; self.names = names; self.xy = xy; self._built_n = max(n, 1)
+        cells = {}; key = []
+        for i, (cx, cy) in enumerate(np.floor_divide(xy, c).astype(np.int64).tolist()):
+            k = (cx, cy); cells.setdefault(k, set()).add(i); key.append(k)
+        self._cells = cells; self._key = key
+        self.counts['rebuilds'] += 1
+
+    # --- Consultas ---
+
+    def nearest(self, x, y, radius, skip=()):
+        # Nodo más cercano a (x, y) a distancia < radius (sin contar los de skip), o None
+        c = self.cell; names = self.names; cells = self._cells; xy = self.xy
+        rings = int(radius // c) + 2
+        if (2 * rings - 1) ** 2 > 4 * len(cells): # Radio grande frente a la celda (o pocos nodos): una pasada vectorizada
+            d = ((xy - (x, y)) ** 2).sum(axis=1)
+            for i in np.argsort(d).tolist():
+                if d[i] >= radius * radius: return None
+                if not skip or names[i] not in skip: return names[i]
+            return None
+        cx, cy = int(x // c), int(y // c)
+        best = None; best_d = radius * radius
+        for k in range(rings):
+            if best is not None and (k - 1) * c >= math.sqrt(best_d): break # Ningún nodo del anillo k puede estar más cerca
+            if k == 0: ring = ((cx, cy),)
+            else:
+                ring = [(cx + i, cy - k) for i in range(-k, k + 1)] + [(cx + i, cy + k) for i in range(-k, k + 1)]
+                ring += [(cx - k, cy + j) for j in range(-k + 1, k)] + [(cx + k, cy + j) for j in range(-k + 1, k)]
+            for cell in ring:
+                for i in cells.get(cell, ()):
+                    dx = xy[i, 0] - x; dy = xy[i, 1] - y; d = dx * dx + dy * dy
+                    if d < best_d and (not skip or names[i] not in skip): best, best_d = i, d
+        return None if best is None else names[best]
+
+    def _candidates(self, x0, y0, x1, y1):
+        # Índices de los nodos en las celdas que tocan la caja (o todos si la caja cubre más celdas que nodos)
+        c = self.cell
+        cx0, cx1 = int(min(x0, x1) // c), int(max(x0, x1) // c)
+        cy0, cy1 = int(min(y0, y1) // c), int(max(y0, y1) // c)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            return np.arange(len(self.names))
+        cells = self._cells; out = []
+        for i in range(cx0, cx1 + 1):
+            for j in range(cy0, cy1 + 1):
+                s = cells.get((i, j))
+                if s: out.extend(s)
+        return np.array(out, dtype=np.intp)
+
+    def in_box(self, x0, y0, x1, y1):
+        # Nodos dentro de la caja (en el orden del layout)
+        idx = self._candidates(x0, y0, x1, y1)
+        if not len(idx): return []
+        p = self.xy[idx]
+        inside = ((p[:, 0] >= min(x0, x1)) & (p[:, 0] <= max(x0, x1)) &
+                  (p[:, 1] >= min(y0, y1)) & (p[:, 1] <= max(y0, y1)))
+        return [self.names[i] for i in np.sort(idx[inside]).tolist()]
+
+    def in_polygon(self, poly):
+        # Nodos dentro del lazo poly [(x, y), ...] (regla par-impar, vectorizada sobre los candidatos)
+        poly = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+        if len(poly) < 3: return []
+        idx = self._candidates(poly[:, 0].min(), poly[:, 1].min(), poly[:, 0].max(), poly[:, 1].max())
+        if not len(idx): return []
+        px = self.xy[idx, 0]; py = self.xy[idx, 1]
+        inside = np.zeros(len(idx), dtype=bool)
+        xs = poly[:, 0]; ys = poly[:, 1]; j = len(poly) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(len(poly)):
+                crosses = (ys[i] > py) != (ys[j] > py)
+                inside ^= crosses & (px < (xs[j] - xs[i]) * (py - ys[i]) / (ys[j] - ys[i]) + xs[i])
+                j = i
+        return [self.names[i] for i in np.sort(idx[inside]).tolist()]
@@ -0,0 +1,157 @@
+# --- espnow_split: motor (ingesta, topología, layout) en un proceso aparte de la GUI ---
+#
+# En modo hilos el drenado UDP, los manejadores, el layout y el update() de
+# matplotlib comparten un GIL: un frame caro de la GUI retrasa la ingesta.
+# Con --split la GUI lanza engine_process() en otro proceso (spawn) y se
+# queda solo con el render:
+#
+#   proceso del motor: MonitorEngine + IncrementalLayout + ShmPublisher (espnow_shm)
+#   proceso de la GUI: RemoteEngine -> ShmReader (instantáneas y posiciones, sin copias de pickle)
+#
+# Lo que va de la GUI al motor (selección, lanzar una ruta) son peticiones
+# cortas por un Pipe; los mensajes de estado (on_message) vuelven por otro.
+# RemoteEngine expone lo que monitor_espnow11 usa de MonitorEngine (store,
+# ingest.stats(), select, select_many, launch_interaction, launch_batch,
+# cancel_batch, metrics, stop), así la GUI es la misma en los dos modos.
+# Las métricas del motor las sirve su proceso en --metrics-port; las de la
+# GUI (frame_seconds), en el puerto siguiente.
+#
+# Uso: python monitor_espnow11.py --split
+
+import multiprocessing as mp, threading
+from espnow_engine import MonitorEngine
+from espnow_shm import ShmReader, ShmPublisher
+from espnow_metrics import Metrics, MetricsServer
+from espnow_log import get_logger, setup_logging
+
+log = get_logger('split')
+
+START_TIMEOUT = 30.0   # segundos para que el proceso del motor arranque (carga de checkpoint/diario incluida)
+STOP_TIMEOUT = 5.0
+
+
+def engine_process(ctrl_name, engine_kwargs, fixed, rpc, messages, log_level, log_rate):
+    # Punto de entrada del proceso del motor: publica en ctrl_name y atiende peticiones por rpc hasta 'stop'
+    from espnow_layout import IncrementalLayout
+    setup_logging(log_level, log_rate)
+    send_lock = threading.Lock()
+    def on_message(text):
+        with send_lock:
+            try: messages.send(text)
+            except (OSError, EOFError): pass
+    engine = MonitorEngine(on_message=on_message, **engine_kwargs).start()
+    layout = IncrementalLayout(fixed=fixed, initial=engine.topo.positions(), metrics=engine.metrics).start()
+    engine.positions_source = layout.positions
+    pub = ShmPublisher(ctrl_name, engine.store, layout.positions, engine.ingest.stats,
+                       on_topology=lambda snap: layout.update_graph(snap.nodes, snap.edges), metrics=engine.metrics).start()
+    rpc.send(('ready', engine.port))
+    try:
+        while True:
+            try: req = rpc.recv()
+            except (EOFError, OSError): break # La GUI se cerró sin avisar
+            op = req[0]
+            if op == 'stop': break
+            try:
+                if op == 'select': r = engine.select(req[1])
+                elif op == 'launch': r = engine.launch_interaction(*req[1:])
+                elif op == 'select_many': r = engine.select_many(*req[1:])
+                elif op == 'batch': r = engine.launch_batch(*req[1:])
+                elif op == 'cancel_batch': r = engine.cancel_batch()
+                elif op == 'stats': r = dict(engine.ingest.stats(), **engine.ingest_counts)
+                else: r = None
+            except Exception as e:
+                log.exception("[!] Excepción en petición %s: %s", op, e); r = None
+            rpc.send(r)
+    finally:
+        pub.stop(); layout.stop(); engine.stop()
+        try: rpc.send(('stopped',))
+        except (OSError, EOFError): pass
+
+
+class _ReaderStore: # engine.store en la GUI: la instantánea sale de la memoria compartida
+    def __init__(self, reader): self.reader = reader
+    def snapshot(self): return self.reader.poll()[0]
+    def touch(self, topology=False): pass
+
+
+class _ReaderLayout: # El layout corre en el proceso del motor; aquí solo se leen sus posiciones publicadas
+    def __init__(self, reader): self.reader = reader
+    def positions(self): return self.reader.pos
+    def update_graph(self, nodes, edges): pass
+    def stop(self): pass
+
+
+class _ReaderIngest:
+    def __init__(self, reader): self.reader = reader
+    def stats(self): return self.reader.stats
+
+
+class RemoteEngine:
+    # engine_kwargs: argumentos de MonitorEngine (sin on_message); fixed: nodos anclados del layout
+    # on_message(texto): como en MonitorEngine, llamado desde otro hilo
+    def __init__(self, engine_kwargs, fixed=None, on_message=None, log_level='INFO', log_rate=10):
+        self.on_message = on_message
+        self.reader = ShmReader()
+        self.store = _ReaderStore(self.reader)
+        self.layout = _ReaderLayout(self.reader)
+        self.ingest = _ReaderIngest(self.reader)
+        self.metrics = Metrics() # Solo las de este proceso (frame_seconds)
+        self.metrics_server = None
+        self.metrics_port = engine_kwargs.get('metrics_port')
+        self.port = engine_kwargs.get('port')
+        ctx = mp.get_context('spawn') # Sin fork: este proceso ya tiene hilos y matplotlib
+        self._rpc, child_rpc = ctx.Pipe()
+        self._messages, child_messages = ctx.Pipe(duplex=False)
+        self._rpc_lock = threading.Lock()
+        # Con --workers el motor lanza sus propios procesos (un proceso daemon no puede); sin daemon sale igual al cerrarse el Pipe
+        self.proc = ctx.Process(target=engine_process, name="espnow-engine", daemon=not engine_kwargs.get('workers'),
+                                args=(self.reader.name, engine_kwargs, fixed, child_rpc, child_messages, log_level, log_rate))
+        self._listener = None
+
+    def start(self):
+        self.proc.start()
+        try:
+            if not self._rpc.poll(START_TIMEOUT): raise RuntimeError("el proceso del motor no arrancó a tiempo")
+            _, self.port = self._rpc.recv()
+        except (EOFError, RuntimeError) as e: # Murió al arrancar (p. ej. puerto UDP ocupado): su traza ya salió por stderr
+            if self.proc.is_alive(): self.proc.terminate()
+            self.reader.close()
+            raise RuntimeError(f"el proceso del motor no arrancó: {e or 'terminó'}") from None
+        self._listener = threading.Thread(target=self._listen, name="engine-messages", daemon=True)
+        self._listener.start()
+        if self.metrics_port is not None:
+            try: self.metrics_server = MetricsServer(self.metrics, self.metrics_port + 1).start()
+            except OSError as e: log.warning("[!] No se pudo abrir el puerto de métricas de la GUI: %s", e)
+        return self
+
+    def _listen(self):
+        while True:
+            try: text = self._messages.recv()
+            except (EOFError, OSError): return
+            if self.on_message is not None: self.on_message(text)
+
+    def _call(self, *req):
+        with self._rpc_lock:
+            self._rpc.send(req); return self._rpc.recv()
+
+    def select(self, node): return self._call('select', node)
+    def launch_interaction(self, s1, s2, msg_id): return self._call('launch', s1, s2, msg_id)
+    def select_many(self, nodes, add=False): return self._call('select_many', list(nodes), add)
+    def launch_batch(self, nodes, mode='all-pairs', source=None): return self._call('batch', list(nodes), mode, source)
+    def cancel_batch(self): return self._call('cancel_batch')
+    def stats(self): return self._call('stats')
+
+    def stop(self):
+        if self.metrics_server is not None: self.metrics_server.stop(); self.metrics_server = None
+        if self.proc.is_alive():
+            with self._rpc_lock:
+                try:
+                    self._rpc.send(('stop',))
+                    if self._rpc.poll(STOP_TIMEOUT): self._rpc.recv()
+                except (OSError, EOFError): pass
+            self.proc.join(STOP_TIMEOUT)
+            if self.proc.is_alive(): self.proc.terminate()
+        self.reader.close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
@@ -0,0 +1,109 @@
+# --- espnow_state: estado versionado con instantáneas inmutables ---
+#
+# El listener muta el grafo y solo incrementa un contador de versión
+# (touch()). Un hilo publicador, cada PUBLISH_INTERVAL, comprueba si la
+# versión cambió y, solo entonces, toma el lock el tiempo justo para
+# construir una instantánea compacta (ids de nodo, índices de extremos de
+# arista, códigos de estado) y la publica cambiando una referencia.
+#
+# El hilo de render lee snapshot() sin lock: si la versión no cambió recibe
+# exactamente el mismo objeto, sin copias ni asignaciones.
+
+import threading, time
+import numpy as np
+from espnow_log import get_logger
+
+log = get_logger('state')
+
+PUBLISH_INTERVAL = 0.05  # segundos entre comprobaciones de versión
+
+EDGE_BASE, EDGE_ESTABLISHED, EDGE_FAILED = 0, 1, 2
+EDGE_STATUS_CODES = {'base': EDGE_BASE, 'established': EDGE_ESTABLISHED, 'failed': EDGE_FAILED}
+
+
+class Snapshot:
+    # Instantánea inmutable (por convenio) del estado visible
+    __slots__ = ('version', 'topology_version', 'nodes', 'edges', 'edge_u', 'edge_v', 'edge_status',
+                 'temp_visuals', 'active_nodes', 'active_count', 'selected', 'stale', 'published_at')
+
+    def __init__(self, version, topology_version, nodes, edges, edge_u, edge_v, edge_status,
+                 temp_visuals, active_nodes, active_count, selected, stale=frozenset()):
+        self.version = version
+        self.topology_version = topology_version
+        self.nodes = nodes                # tuple de ids de nodo
+        self.edges = edges                # tuple de (u, v), alineada con edge_u/edge_v/edge_status
+        self.edge_u = edge_u              # np.int32: índice en nodes del extremo u
+        self.edge_v = edge_v
+        self.edge_status = edge_status    # np.uint8: EDGE_BASE / EDGE_ESTABLISHED / EDGE_FAILED
+        self.temp_visuals = temp_visuals  # {índice de arista: (color, width)}
+        self.active_nodes = active_nodes  # frozenset de nodos en comunicaciones pendientes
+        self.active_count = active_count
+        self.selected = selected          # tuple
+        self.stale = stale                # frozenset de nodos inactivos (espnow_liveness)
+        self.published_at = time.monotonic()
+
+
+EMPTY_SNAPSHOT = Snapshot(-1, -1, (), (), np.zeros(0, np.int32), np.zeros(0, np.int32),
+                          np.zeros(0, np.uint8), {}, frozenset(), 0, ())
+
+
+def snapshot_from_topology(version, topology_version, topo, active_nodes=(), active_count=0, selected=(), stale=()):
+    # Construye una Snapshot a partir de un espnow_topology.TopologyStore.
+    # Llamar con el lock del grafo tomado. Las tuplas de nombres se reutilizan
+    # mientras no cambie la estructura; las columnas se copian (O(aristas) en NumPy).
+    n = topo.n_edges; e = topo.edges
+    return Snapshot(version, topology_version, topo.node_names(), topo.edge_pairs(),
+                    e.eu[:n].copy(), e.ev[:n].copy(), e.status[:n].copy(),
+                    topo.temp_visuals(), frozenset(active_nodes), active_count, tuple(selected), frozenset(stale))
+
+
+class StateStore:
+    # lock: lock del grafo (el mismo que toman los escritores).
+    # build(version, topology_version): devuelve una Snapshot; se llama con `lock` tomado.
+    def __init__(self, lock, build, interval=PUBLISH_INTERVAL):
+        self.lock = lock
+        self.build = build
+        self.interval = interval
+        self.version = 0
+        self.topology_version = 0
+        self.publishes = 0
+        self._snapshot = EMPTY_SNAPSHOT
+        self._running = False
+        self._thread = None
+
+    def touch(self, topology=False):
+        # Marca un cambio. topology=True si cambió el conjunto de nodos/aristas (el layout lo necesita).
+        self.version += 1
+        if topology: self.topology_version += 1
+
+    def snapshot(self):
+        # Sin lock: lectura de una referencia; la instantánea no se modifica después de publicarse
+        return self._snapshot
+
+    def publish_now(self):
+        with self.lock:
+            v = self.version
+            if v == self._snapshot.version: return self._snapshot
+            snap = self.build(v, self.topology_version)
+        self._snapshot = snap
+        self.publishes += 1
+        return snap
+
+    def start(self):
+        if self._running: return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="state-publisher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread: self._thread.join(timeout=2.0)
+
+    def _run(self):
+        while self._running:
+            try:
+                if self.version != self._snapshot.version: self.publish_now()
+            except Exception as e:
+                log.exception("[!] Excepción publicando estado: %s", e)
+            time.sleep(self.interval)
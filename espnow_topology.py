@@ -0,0 +1,331 @@
+# --- espnow_topology: topología compacta en columnas NumPy ---
+#
+# Sustituye al networkx.Graph con claves MAC de 17 caracteres y dicts de
+# atributos por arista (más los dicts paralelos mac_ip, edge_colors,
+# edge_temp_visuals y pos). Cada MAC se interna una vez a un índice denso;
+# los datos por nodo y por arista viven en columnas tipadas que crecen por
+# duplicación. Las aristas se indexan por una clave entera empaquetada
+# (min << 32 | max) en vez de tuple(sorted((u, v))).
+#
+# Al cargar un checkpoint (from_columns) no se recorre nada fila a fila en
+# Python: las direcciones se quedan en las columnas ip/port y addr() las
+# decodifica la primera vez que se piden, y el índice de aristas es un array
+# de claves ordenado (argsort) en el que se busca con searchsorted; cada
+# arista encontrada pasa al dict, así que las que se usan cuestan lo mismo.
+#
+# networkx solo se usa bajo demanda (to_networkx) para algoritmos de grafos.
+
+import socket
+import numpy as np
+from espnow_state import EDGE_BASE, EDGE_STATUS_CODES
+
+STATUS_NAMES = {code: name for name, code in EDGE_STATUS_CODES.items()}
+INITIAL_NODES = 256
+INITIAL_EDGES = 1024
+NO_COLOR = 0  # código de color "sin visual temporal"
+PRIOR_RATIO = 0.75  # tasa de éxito supuesta de un enlace sin muestras
+_UNDECODED = object()  # dirección aún en las columnas ip/port (from_columns)
+
+# columna -> (dtype, valor inicial)
+NODE_COLUMNS = {'mac48': (np.uint64, 0), 'ip': (np.uint32, 0), 'port': (np.uint16, 0),
+                'last_seen': (np.float64, 0.0), 'x': (np.float64, np.nan), 'y': (np.float64, np.nan)}
+EDGE_COLUMNS = {'eu': (np.int32, 0), 'ev': (np.int32, 0), 'status': (np.uint8, EDGE_BASE),
+                'color': (np.uint8, NO_COLOR), 'width': (np.float32, 0.0), 'until': (np.float64, 0.0),
+                'last_seen': (np.float64, 0.0),
+                # estadísticas de enlace (espnow_linkstats): tasa de éxito EWMA, nº de muestras, latencia EWMA (s)
+                'ok_ratio': (np.float32, PRIOR_RATIO), 'samples': (np.uint32, 0), 'latency': (np.float32, np.nan)}
+
+
+def mac_to_int(mac):
+    # 'AA:BB:CC:DD:EE:FF' -> entero de 48 bits; -1 si no es una MAC (p. ej. 'ALL')
+    if len(mac) != 17: return -1
+    try: return int(mac.replace(':', ''), 16)
+    except ValueError: return -1
+
+
+def int_to_mac(x):
+    return ':'.join(f'{x >> s & 0xFF:02X}' for s in range(40, -8, -8))
+
+
+def edge_key(i, j):
+    # Clave de arista no dirigida a partir de dos índices de nodo
+    return (i << 32) | j if i < j else (j << 32) | i
+
+
+class _Columns:
+    # Conjunto de arrays paralelos con capacidad que se duplica al llenarse
+    def __init__(self, spec, capacity):
+        self.spec = spec
+        self.capacity = capacity
+        for name, (dtype, fill) in spec.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+    def ensure(self, n):
+        if n <= self.capacity: return
+        cap = self.capacity
+        while cap < n: cap *= 2
+        for name, (dtype, fill) in self.spec.items():
+            old = getattr(self, name)
+            new = np.full(cap, fill, dtype=dtype); new[:len(old)] = old
+            setattr(self, name, new)
+        self.capacity = cap
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.spec)
+
+
+def _compact(cols, keep, n):
+    # Desplaza al principio las filas [0, n) con keep=True; devuelve cuántas quedan
+    k = int(keep.sum())
+    for name, (dtype, fill) in cols.spec.items():
+        a = getattr(cols, name)
+        a[:k] = a[:n][keep]; a[k:n] = fill
+    return k
+
+
+class TopologyStore:
+    def __init__(self, node_capacity=INITIAL_NODES, edge_capacity=INITIAL_EDGES):
+        self._names = []      # índice -> nombre de nodo (str)
+        self._addrs = []      # índice -> (ip, puerto) listo para sendto(); la fuente es ip/port
+        self._index = {}      # nombre -> índice
+        self.nodes = _Columns(NODE_COLUMNS, node_capacity)
+        self.n_nodes = 0
+        self._edge_row = {}   # clave empaquetada -> fila (aristas nuevas y las ya buscadas en _keys)
+        self._keys = np.zeros(0, np.int64)   # claves ordenadas de la última reconstrucción...
+        self._rows = np.zeros(0, np.intp)    # ...y su fila
+        self.edges = _Columns(EDGE_COLUMNS, edge_capacity)
+        self.n_edges = 0
+        self._palette = [None]           # código -> nombre de color
+        self._palette_index = {None: 0}
+        self._names_cache = None         # tuple de nombres (se invalida al añadir nodos)
+        self._pairs_cache = None         # tuple de (u, v) por fila (se invalida al añadir aristas)
+
+    # --- Nodos ---
+
+    def __contains__(self, name): return name in self._index
+    def __len__(self): return self.n_nodes
+
+    def index(self, name):
+        return self._index.get(name)
+
+    def node(self, name):
+        # Índice del nodo, creándolo si no existe
+        i = self._index.get(name)
+        if i is None:
+            i = self.n_nodes
+            self.nodes.ensure(i + 1)
+            self._index[name] = i; self._names.append(name); self._addrs.append(None)
+            m = mac_to_int(name)
+            if m >= 0: self.nodes.mac48[i] = m
+            self.n_nodes = i + 1
+            self._names_cache = None
+        return i
+
+    def name(self, i): return self._names[i]
+
+    def node_names(self):
+        if self._names_cache is None: self._names_cache = tuple(self._names)
+        return self._names_cache
+
+    def set_addr(self, name, addr):
+        # addr: (ip, puerto) tal y como lo devuelve recvfrom
+        i = self.node(name)
+        if self._addrs[i] != addr:
+            self.nodes.ip[i] = int.from_bytes(socket.inet_aton(addr[0]), 'big'); self.nodes.port[i] = addr[1]
+            self._addrs[i] = (addr[0], addr[1])
+        return i
+
+    def addr(self, name):
+        i = self._index.get(name)
+        if i is None: return None
+        a = self._addrs[i]
+        if a is _UNDECODED:
+            p = int(self.nodes.port[i])
+            a = self._addrs[i] = (socket.inet_ntoa(int(self.nodes.ip[i]).to_bytes(4, 'big')), p) if p else None
+        return a
+
+    def set_positions(self, pos):
+        # pos: {nodo: (x, y)}; los nodos desconocidos se ignoran
+        idx = self._index; c = self.nodes
+        for v, (x, y) in pos.items():
+            i = idx.get(v)
+            if i is not None: c.x[i] = x; c.y[i] = y
+
+    def positions(self):
+        c = self.nodes; n = self.n_nodes
+        ok = np.flatnonzero(~np.isnan(c.x[:n]))
+        return {self._names[i]: (x, y) for i, x, y in zip(ok.tolist(), c.x[ok].tolist(), c.y[ok].tolist())}
+
+    # --- Aristas ---
+
+    def edge(self, u, v):
+        # Fila de la arista u-v o None
+        i = self._index.get(u); j = self._index.get(v)
+        if i is None or j is None: return None
+        return self._row(edge_key(i, j))
+
+    def has_edge(self, u, v): return self.edge(u, v) is not None
+
+    def status(self, u, v):
+        # Código de estado (EDGE_*) o None si no existe la arista
+        r = self.edge(u, v)
+        return None if r is None else int(self.edges.status[r])
+
+    def set_edge_status(self, u, v, code):
+        # Crea la arista si hace falta. Devuelve (estructural, cambió): estructural=True
+        # si se añadió algún nodo o la arista; cambió=True si solo cambió el estado.
+        n0 = self.n_nodes
+        i = self.node(u); j = self.node(v)
+        k = edge_key(i, j)
+        r = self._row(k)
+        if r is None:
+            r = self._add_edge_row(k, i, j)
+            self.edges.status[r] = code
+            return True, False
+        if self.edges.status[r] != code:
+            self.edges.status[r] = code
+            return self.n_nodes != n0, True
+        return self.n_nodes != n0, False
+
+    def _row(self, k):
+        # Fila de la clave k o None; las que están en _keys pasan al dict la primera vez
+        r = self._edge_row.get(k)
+        if r is None and len(self._keys):
+            p = int(self._keys.searchsorted(k))
+            if p < len(self._keys) and self._keys[p] == k: r = self._edge_row[k] = int(self._rows[p])
+        return r
+
+    def _add_edge_row(self, k, i, j):
+        r = self.n_edges
+        self.edges.ensure(r + 1)
+        self.edges.eu[r] = i; self.edges.ev[r] = j
+        self._edge_row[k] = r
+        self.n_edges = r + 1
+        self._pairs_cache = None
+        return r
+
+    def edge_pairs(self):
+        # tuple de (u, v) por fila, con los nombres de nodo
+        if self._pairs_cache is None:
+            n = self.n_edges; names = self._names
+            self._pairs_cache = tuple(zip([names[i] for i in self.edges.eu[:n].tolist()],
+                                          [names[j] for j in self.edges.ev[:n].tolist()]))
+        return self._pairs_cache
+
+    def rows_with_status(self, code):
+        return np.flatnonzero(self.edges.status[:self.n_edges] == code)
+
+    def node_edge_rows(self, name):
+        # Filas de las aristas que tocan el nodo (recorrido vectorizado de eu/ev)
+        i = self._index.get(name)
+        if i is None: return np.zeros(0, np.intp)
+        m = self.n_edges; e = self.edges
+        return np.flatnonzero((e.eu[:m] == i) | (e.ev[:m] == i))
+
+    # --- Expulsión (espnow_liveness) ---
+
+    def remove(self, nodes=(), pairs=()):
+        # Quita los nodos (con sus aristas) y las aristas (u, v) dadas compactando las columnas.
+        # Los índices de nodo y las filas de arista cambian: devuelve fila antigua -> fila nueva (-1 = quitada).
+        n = self.n_nodes; m = self.n_edges; e = self.edges
+        node_keep = np.ones(n, bool); edge_keep = np.ones(m, bool)
+        for v in nodes:
+            i = self._index.get(v)
+            if i is not None: node_keep[i] = False
+        for u, v in pairs:
+            r = self.edge(u, v)
+            if r is not None: edge_keep[r] = False
+        edge_keep &= node_keep[e.eu[:m]] & node_keep[e.ev[:m]]
+        row_map = np.full(m, -1, np.int64); kept = np.flatnonzero(edge_keep); row_map[kept] = np.arange(len(kept))
+        if node_keep.all() and edge_keep.all(): return row_map
+        remap = np.cumsum(node_keep) - 1
+        n2 = _compact(self.nodes, node_keep, n); m2 = _compact(e, edge_keep, m)
+        e.eu[:m2] = remap[e.eu[:m2]]; e.ev[:m2] = remap[e.ev[:m2]]
+        keep = node_keep.tolist()
+        self._names = [v for v, k in zip(self._names, keep) if k]
+        self._addrs = [a for a, k in zip(self._addrs, keep) if k]
+        self._index = {v: i for i, v in enumerate(self._names)}
+        self.n_nodes = n2; self.n_edges = m2; self._rebuild_edge_index()
+        self._names_cache = None; self._pairs_cache = None
+        return row_map
+
+    # --- Visuales temporales por arista ---
+
+    def color_code(self, color):
+        c = self._palette_index.get(color)
+        if c is None:
+            c = self._palette_index[color] = len(self._palette); self._palette.append(color)
+        return c
+
+    def color_name(self, code): return self._palette[code]
+
+    def set_temp(self, u, v, color, width, until):
+        # Resalta la arista u-v hasta `until`; la crea (estado base) si no existe
+        i = self.node(u); j = self.node(v)
+        k = edge_key(i, j)
+        r = self._row(k)
+        if r is None: r = self._add_edge_row(k, i, j)
+        e = self.edges
+        e.color[r] = self.color_code(color); e.width[r] = width; e.until[r] = until
+        return r
+
+    def clear_temp(self, row):
+        # Quita el visual temporal de una fila (lo llama el planificador de caducidades)
+        self.edges.color[row] = NO_COLOR
+
+    def temp_visuals(self):
+        # {fila: (color, ancho)} de los visuales temporales vigentes
+        n = self.n_edges; e = self.edges
+        rows = np.flatnonzero(e.color[:n] != NO_COLOR)
+        pal = self._palette
+        return {r: (pal[c], w) for r, c, w in zip(rows.tolist(), e.color[rows].tolist(), e.width[rows].tolist())}
+
+    # --- Columnas para el checkpoint (espnow_checkpoint) ---
+
+    def export_columns(self):
+        # {'nodes.<col>': array, 'edges.<col>': array} recortadas y copiadas (se pueden escribir sin lock)
+        # más la lista de nombres. Los visuales temporales no se guardan.
+        n = self.n_nodes; m = self.n_edges
+        cols = {f'nodes.{c}': getattr(self.nodes, c)[:n].copy() for c in NODE_COLUMNS}
+        cols.update({f'edges.{c}': getattr(self.edges, c)[:m].copy() for c in EDGE_COLUMNS
+                     if c not in ('color', 'width', 'until')})
+        return list(self._names), cols
+
+    @classmethod
+    def from_columns(cls, names, cols):
+        # Inversa de export_columns; las columnas que falten toman su valor inicial
+        n = len(names); m = len(cols['edges.eu'])
+        t = cls(max(INITIAL_NODES, n), max(INITIAL_EDGES, m))
+        for c in NODE_COLUMNS:
+            if f'nodes.{c}' in cols: getattr(t.nodes, c)[:n] = cols[f'nodes.{c}']
+        for c in EDGE_COLUMNS:
+            if f'edges.{c}' in cols: getattr(t.edges, c)[:m] = cols[f'edges.{c}']
+        t._names = list(names); t._index = dict(zip(t._names, range(n))); t.n_nodes = n
+        t._addrs = [_UNDECODED] * n # Se decodifican en addr()
+        t.n_edges = m; t._rebuild_edge_index()
+        return t
+
+    def _rebuild_edge_index(self):
+        # Claves ordenadas en NumPy; el dict se vuelve a llenar con las aristas que se usen
+        m = self.n_edges
+        eu = self.edges.eu[:m].astype(np.int64); ev = self.edges.ev[:m].astype(np.int64)
+        keys = (np.minimum(eu, ev) << 32) | np.maximum(eu, ev)
+        order = np.argsort(keys)
+        self._keys = keys[order]; self._rows = order; self._edge_row = {}
+
+    # --- Exportación ---
+
+    def to_networkx(self, status=None):
+        # Grafo networkx con atributo 'status' (nombre); status=código filtra las aristas
+        import networkx as nx
+        G = nx.Graph()
+        n = self.n_edges; e = self.edges; names = self._names
+        rows = range(n) if status is None else self.rows_with_status(status).tolist()
+        if status is None: G.add_nodes_from(names)
+        eu = e.eu[:n].tolist(); ev = e.ev[:n].tolist(); st = e.status[:n].tolist()
+        G.add_edges_from((names[eu[r]], names[ev[r]], {'status': STATUS_NAMES.get(st[r], 'base')}) for r in rows)
+        return G
+
+    def nbytes(self):
+        # Memoria de las columnas (sin contar los dicts de índices)
+        return self.nodes.nbytes() + self.edges.nbytes()
@@ -0,0 +1,211 @@
+# --- espnow_traffic: generador de tráfico sin GUI y medida de rendimiento ---
+#
+# Hasta ahora el único modo de generar tráfico era hacer clic en dos nodos:
+# una ruta o un UNICAST cada vez. TrafficGenerator mantiene `concurrency`
+# comunicaciones en vuelo (bucle cerrado: en cuanto una termina se lanza la
+# siguiente) eligiendo parejas origen/destino de la topología actual:
+#   uniform   : origen y destino al azar
+#   hotspot   : con probabilidad hot_fraction el destino es uno de unos pocos
+#               nodos "calientes" (fijos durante la prueba)
+#   all-pairs : recorre todas las parejas ordenadas, una tras otra (dos índices
+#               sobre la lista actual, sin materializar las n² parejas; si
+#               entran o salen nodos sigue desde el mismo origen)
+#   batch     : lote fijo (`pairs`: p. ej. una selección por caja o lazo en la
+#               GUI, todas las parejas o estrella desde un origen); cada
+#               pareja se lanza una vez y run() acaba al agotarlas. Un solo
+#               hilo (el que llama a run) para todo el lote, con como mucho
+#               `concurrency` en vuelo, en vez de un hilo por pareja
+# Los envíos van por el camino normal del monitor (ROUTE_STEP / UNICAST),
+# con la función launch(src, dst, msg_id) -> bool (False si no se lanzó).
+# El resultado de cada comunicación llega por on_record(CommRecord) desde el
+# CommTracker: la latencia es created -> updated del registro entregado, es
+# decir, hasta el ROUTE_DELIVERED (o UNICAST_RECV) que lo cerró.
+#
+# Lock propio (Condition) solo para el contador de vuelos; launch() se llama
+# siempre sin él, así que no se anida con el lock del grafo.
+
+import itertools, random, threading, time, uuid
+from espnow_comms import DELIVERED, FAILED, TIMEOUT, TERMINAL
+from espnow_dispatch import percentile
+
+PATTERNS = ('uniform', 'hotspot', 'all-pairs', 'batch')
+BATCH_MODES = ('all-pairs', 'star')
+HOT_FRACTION = 0.8      # parte del tráfico que va a los nodos calientes (hotspot)
+HOT_NODES = 1           # nº de nodos calientes
+REPORT_INTERVAL = 5.0   # segundos entre informes parciales
+IDLE_WAIT = 0.5         # espera cuando no hay parejas posibles (menos de 2 nodos)
+DRAIN_TIMEOUT = 30.0    # espera máxima al final por las comunicaciones aún en vuelo
+
+
+def batch_pairs(nodes, mode='all-pairs', source=None):
+    # Lote sobre una selección: 'all-pairs' = cada pareja no ordenada una vez; 'star' = desde source (o el primero) a los demás
+    # -> (iterador de parejas, nº de parejas)
+    nodes = list(dict.fromkeys(v for v in nodes if v != 'ALL'))
+    if mode == 'star':
+        src = source if source in nodes else (nodes[0] if nodes else None)
+        return iter([(src, v) for v in nodes if v != src]), max(len(nodes) - 1, 0)
+    if mode == 'all-pairs':
+        return itertools.combinations(nodes, 2), len(nodes) * (len(nodes) - 1) // 2
+    raise ValueError(f"Modo de lote desconocido: {mode} (opciones: {', '.join(BATCH_MODES)})")
+
+
+def new_msg_id():
+    return str(uuid.uuid4())[:8]  # Mismo formato que los clics del monitor (el firmware admite hasta 11)
+
+
+class TrafficGenerator:
+    # nodes(): secuencia de nodos candidatos (se vuelve a leer en cada elección; si devuelve el mismo
+    #          objeto mientras no cambia, como MonitorEngine.live_nodes, no se recorre de nuevo)
+    # launch(src, dst, msg_id): lanza la comunicación; False si no se pudo
+    # pairs: iterable de parejas del lote (implica pattern='batch'); total: su número, si se conoce (informes)
+    def __init__(self, nodes, launch, pattern='uniform', concurrency=4, hot_fraction=HOT_FRACTION,
+                 hot_nodes=HOT_NODES, seed=None, clock=time.monotonic, pairs=None, total=None):
+        if pairs is not None: pattern = 'batch'
+        if pattern not in PATTERNS: raise ValueError(f"Patrón desconocido: {pattern} (opciones: {', '.join(PATTERNS)})")
+        self.nodes = nodes
+        self.launch = launch
+        self.pattern = pattern
+        self.concurrency = max(1, concurrency)
+        self.hot_fraction = hot_fraction
+        self.hot_nodes = hot_nodes
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self._cond = threading.Condition()
+        self._mine = {}           # msg_id -> instante de lanzamiento (solo las de este generador)
+        self._hot = None
+        self._raw = None          # último resultado de nodes() y su lista de candidatos
+        self._ns = []
+        self._ap = [0, 0, None, None] # all-pairs: [índice origen, siguiente índice destino, nodo origen, último destino]
+        self._batch = iter(pairs) if pairs is not None else None
+        self.total = total
+        self.latencies = []
+        self.counts = {'launched': 0, 'not_launched': 0, DELIVERED: 0, FAILED: 0, TIMEOUT: 0}
+        self.reasons = {}
+        self.started = self.finished = None
+        self._stop = threading.Event()
+
+    # --- Elección de parejas ---
+
+    def _candidates(self):
+        raw = self.nodes()
+        if raw is not self._raw:
+            self._raw = raw; self._ns = [n for n in raw if n != 'ALL']
+            if self.pattern == 'all-pairs': self._remap_pairs()
+        return self._ns
+
+    def _remap_pairs(self):
+        # Origen y último destino a sus nuevas posiciones. Si se fue el origen, su índice pasa al nodo que ocupa
+        # su sitio, desde el primer destino; si se fue el destino, se sigue por el índice que tenía
+        ap = self._ap; ns = self._ns
+        if ap[2] is None: return
+        try: ap[0] = ns.index(ap[2])
+        except ValueError: ap[1] = 0; return
+        try: ap[1] = ns.index(ap[3]) + 1
+        except ValueError: pass
+
+    def _next_all_pairs(self, ns):
+        ap = self._ap; n = len(ns); i, j = ap[0], ap[1]
+        if i >= n: i, j = 0, 0
+        while True:
+            if j >= n:
+                i += 1; j = 0
+                if i >= n: i = 0 # Vuelta completa: se empieza otra
+            if j != i: break
+            j += 1
+        ap[0], ap[1], ap[2], ap[3] = i, j + 1, ns[i], ns[j]
+        return ns[i], ns[j]
+
+    def next_pair(self):
+        if self._batch is not None: return next(self._batch, None)
+        ns = self._candidates()
+        if len(ns) < 2: return None
+        rng = self.rng
+        if self.pattern == 'uniform':
+            return tuple(rng.sample(ns, 2))
+        if self.pattern == 'hotspot':
+            if self._hot is None or any(h not in ns for h in self._hot):
+                self._hot = rng.sample(ns, min(self.hot_nodes, len(ns) - 1))
+            if rng.random() < self.hot_fraction:
+                dst = rng.choice(self._hot)
+                src = rng.choice(ns)
+                while src == dst: src = rng.choice(ns)
+                return src, dst
+            return tuple(rng.sample(ns, 2))
+        return self._next_all_pairs(ns)
+
+    # --- Resultados (desde CommTracker.on_change, con el lock del grafo tomado) ---
+
+    def on_record(self, r):
+        if r.state not in TERMINAL: return
+        with self._cond:
+            t0 = self._mine.pop(r.msg_id, None)
+            if t0 is None: return
+            self.counts[r.state] += 1
+            if r.state == DELIVERED: self.latencies.append(r.updated - r.created)
+            else: self.reasons[r.reason or r.state] = self.reasons.get(r.reason or r.state, 0) + 1
+            self._cond.notify()
+
+    # --- Bucle ---
+
+    def stop(self):
+        self._stop.set()
+        with self._cond: self._cond.notify_all()
+
+    def run(self, duration, report_interval=REPORT_INTERVAL, report=print, drain=DRAIN_TIMEOUT):
+        # Bloquea `duration` segundos (None: sin límite, p. ej. un lote) manteniendo `concurrency` comunicaciones en vuelo; devuelve summary()
+        self.started = self.clock(); end = self.started + duration if duration is not None else float('inf')
+        next_report = self.started + report_interval
+        while not self._stop.is_set():
+            now = self.clock()
+            if now >= end: break
+            if report and now >= next_report:
+                report(self.format(self.summary(now))); next_report += report_interval
+            with self._cond:
+                if len(self._mine) >= self.concurrency:
+                    until = min(end, next_report) if report else end # Sin informes no hay que despertar para ellos
+                    self._cond.wait(until - now if until != float('inf') else None)
+                    continue
+            pair = self.next_pair()
+            if pair is None:
+                if self._batch is not None: break # Lote agotado: solo queda esperar a las que siguen en vuelo
+                self._stop.wait(IDLE_WAIT); continue
+            msg_id = new_msg_id()
+            with self._cond: # Se registra antes de lanzar: el resultado puede llegar antes de que launch() vuelva
+                self._mine[msg_id] = now; self.counts['launched'] += 1
+            ok = self.launch(pair[0], pair[1], msg_id)
+            if not ok:
+                with self._cond:
+                    if self._mine.pop(msg_id, None) is not None: # No llegó a crear comunicación
+                        self.counts['launched'] -= 1; self.counts['not_launched'] += 1
+                self._stop.wait(0.01)  # Sin camino ni IP: no girar en vacío
+        self.finished = self.clock()
+        if drain: # Se espera a las que siguen en vuelo (acaban por entrega o por plazo del tracker)
+            with self._cond:
+                self._cond.wait_for(lambda: not self._mine or self._stop.is_set(), timeout=drain)
+        return self.summary(self.finished)
+
+    def summary(self, now=None):
+        with self._cond:
+            now = self.clock() if now is None else now
+            elapsed = max(now - (self.started or now), 1e-9)
+            c = dict(self.counts); lat = sorted(self.latencies)
+            in_flight = len(self._mine)
+            reasons = dict(self.reasons)
+        done = c[DELIVERED] + c[FAILED] + c[TIMEOUT]
+        return {'pattern': self.pattern, 'concurrency': self.concurrency, 'elapsed': elapsed, 'total': self.total,
+                'launched': c['launched'], 'not_launched': c['not_launched'], 'in_flight': in_flight,
+                'delivered': c[DELIVERED], 'failed': c[FAILED], 'timeout': c[TIMEOUT], 'reasons': reasons,
+                'delivered_per_s': c[DELIVERED] / elapsed,
+                'failure_rate': (c[FAILED] + c[TIMEOUT]) / done if done else 0.0,
+                'p50': percentile(lat, 0.50), 'p95': percentile(lat, 0.95), 'p99': percentile(lat, 0.99)}
+
+    @staticmethod
+    def format(s):
+        ms = lambda x: '-' if x is None else f"{x * 1e3:.0f}"
+        line = (f"[i] Tráfico {s['pattern']} x{s['concurrency']} {s['elapsed']:.1f}s: "
+                f"lanzadas {s['launched']}{'/%d' % s['total'] if s.get('total') is not None else ''} entregadas {s['delivered']} ({s['delivered_per_s']:.1f}/s) "
+                f"fallos {s['failed']} plazos {s['timeout']} ({s['failure_rate'] * 100:.1f}%) "
+                f"en vuelo {s['in_flight']} | latencia ms p50 {ms(s['p50'])} p95 {ms(s['p95'])} p99 {ms(s['p99'])}")
+        if s['not_launched']: line += f" | sin lanzar {s['not_launched']}"
+        if s['reasons']: line += " | motivos " + ", ".join(f"{k}:{v}" for k, v in sorted(s['reasons'].items()))
+        return line
@@ -0,0 +1,687 @@
+# --- espnow_web: flujo de deltas por WebSocket para ver la red desde navegadores ---
+#
+# La ventana de matplotlib redibuja el grafo entero y solo la ve quien está
+# delante. WebServer sirve en 127.0.0.1 (web_bind para la LAN):
+#   GET  /          página con un cliente canvas mínimo (CLIENT_HTML)
+#   GET  /ws        WebSocket: una instantánea inicial y después deltas
+#   GET  /snapshot  la instantánea actual en JSON (herramientas, depuración)
+#   POST /route?src=MAC&dst=MAC   lanza una ruta (lo mismo que {"op": "route"} por el WebSocket)
+# La orden de ruta sustituye a los dos clics de on_click: un único hilo
+# (web-route) las lanza en orden con launch_interaction, que ya no bloquea, y
+# el resultado vuelve al que la pidió.
+# Las órdenes envían UDP a nodos físicos: /route solo por POST (un enlace o un
+# <img> no la disparan) y tanto /route como la apertura de /ws se rechazan
+# (403) si traen un Origin que no es el propio servidor (la cabecera Host).
+# Sin Origin (curl, WsClient) se aceptan. Contra el DNS rebinding (una página
+# cuyo nombre pasa a resolver a esta máquina: Origin y Host coinciden) toda
+# petición con un Host que no esté en la lista (la dirección de escucha,
+# 127.0.0.1, localhost, ::1, el nombre de la máquina y los que se den con
+# hosts / --web-host) recibe 403. src y dst tienen que ser MACs de nodos
+# ya conocidos (400 si no son MAC, 404 si el nodo no existe): una orden no
+# crea nodos ni aristas. Con web_bind en la LAN no hay más
+# autenticación que esa: quien llega al puerto puede lanzar rutas.
+#
+# Deltas: cada TICK se compara la instantánea publicada (espnow_state, la
+# misma que lee la GUI) con la del tick anterior. Las instantáneas son
+# inmutables y reutilizan sus tuplas mientras la estructura no cambia, así
+# que el coste es el de los cambios:
+#   - altas de nodos y aristas: la cola de las tuplas (solo crecen, salvo expulsión)
+#   - estados de arista: una comparación NumPy de la columna (microsegundos con miles de aristas)
+#   - visuales temporales, inactivos, activos y selección: diferencias de dicts / conjuntos
+#   - posiciones: solo cuando el layout publica, y solo las que se mueven más de POS_QUANTUM
+#   - rutas: transiciones de CommTracker (engine.web_server.on_record), la última por msg_id
+# Todo lo de un tick va en un solo mensaje que se codifica una vez y se
+# comparte entre todos los clientes. Una expulsión (espnow_liveness compacta
+# la topología) manda una instantánea nueva a todos.
+#
+# Mensajes (JSON, claves cortas; los nodos viajan por id numérico estable):
+#   {"t":"snap","v":versión,"n":[[id,mac,x,y,flags]],"e":[[u,v,estado]],"tv":[[u,v,color,ancho]],"r":[[msg_id,tipo,estado,[ids],motivo]]}
+#   {"t":"d","v":versión, "nj":[[id,mac,x,y,flags]], "ea":[[u,v,estado]], "es":[[u,v,estado]],
+#    "tv":[...], "tc":[[u,v]], "nf":[[id,flags]], "p":[[id,x,y]], "r":[...]}   (solo las claves con cambios)
+#   {"t":"route","id":msg_id,"ok":bool,"msg":texto}   respuesta a una orden de ruta
+# flags: F_STALE / F_ACTIVE / F_SELECTED de espnow_shm; estado de arista: EDGE_* de espnow_state.
+#
+# Un solo hilo (selectors) atiende todas las conexiones y el tick. Un cliente
+# lento no frena a los demás: si su cola pasa de MAX_BACKLOG bytes se le
+# descartan los mensajes pendientes y recibe una instantánea nueva al vaciarla.
+#
+# WsClient y DeltaModel son el cliente de referencia (el mismo modelo que
+# mantiene la página) y sirven para pruebas de rendimiento:
+#   python espnow_engine.py --web-port 8766
+#   python espnow_web.py --url ws://127.0.0.1:8766/ws --clients 20 --seconds 10
+#   python espnow_web.py --url ws://127.0.0.1:8766/ws --route 24:A1:60:00:00:01 24:A1:60:00:00:02
+
+import argparse, base64, hashlib, json, os, re, selectors, socket, struct, threading, time, uuid
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from espnow_shm import F_STALE, F_ACTIVE, F_SELECTED
+from espnow_log import get_logger
+
+log = get_logger('web')
+
+WEB_PORT = 8766
+WEB_BIND = '127.0.0.1'
+TICK = 0.1                    # segundos entre deltas (los cambios de un tick van juntos)
+POS_QUANTUM = 1e-3            # desplazamiento mínimo (unidades del layout) para reenviar una posición
+MAX_BACKLOG = 1 << 20         # bytes en cola por cliente antes de pasar a instantánea
+MAX_REQUEST = 16384           # bytes de cabecera HTTP / mensaje entrante
+ROUTE_RETENTION = 5.0         # segundos que una ruta terminada sigue en las instantáneas nuevas
+_MAC_RE = re.compile(r'[0-9A-F]{2}(?::[0-9A-F]{2}){5}\Z')
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_CONT, OP_TEXT, OP_BIN, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def ws_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + _WS_GUID).digest()).decode()
+
+
+def ws_frame(payload, opcode=OP_TEXT, mask=False):
+    # Trama completa (FIN); los clientes enmascaran (RFC 6455), el servidor no
+    n = len(payload); head = bytearray([0x80 | opcode])
+    m = 0x80 if mask else 0
+    if n < 126: head.append(m | n)
+    elif n < 65536: head.append(m | 126); head += struct.pack('>H', n)
+    else: head.append(m | 127); head += struct.pack('>Q', n)
+    if not mask: return bytes(head) + payload
+    key = os.urandom(4); head += key
+    return bytes(head) + _unmask(payload, key)
+
+
+def _unmask(data, key):
+    if not data: return b''
+    k = np.frombuffer((key * (len(data) // 4 + 1))[:len(data)], np.uint8)
+    return (np.frombuffer(data, np.uint8) ^ k).tobytes()
+
+
+def ws_parse(buf):
+    # -> (fin, opcode, payload, bytes consumidos) o None si la trama aún no está completa
+    if len(buf) < 2: return None
+    b0, b1 = buf[0], buf[1]; n = b1 & 0x7F; off = 2
+    if n == 126:
+        if len(buf) < 4: return None
+        n = struct.unpack_from('>H', buf, 2)[0]; off = 4
+    elif n == 127:
+        if len(buf) < 10: return None
+        n = struct.unpack_from('>Q', buf, 2)[0]; off = 10
+    key = None
+    if b1 & 0x80:
+        if len(buf) < off + 4: return None
+        key = bytes(buf[off:off + 4]); off += 4
+    if len(buf) < off + n: return None
+    payload = bytes(buf[off:off + n])
+    return bool(b0 & 0x80), b0 & 0x0F, _unmask(payload, key) if key else payload, off + n
+
+
+def _dumps(obj): return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class _Conn:
+    __slots__ = ('sock', 'addr', 'inbuf', 'out', 'sent', 'queued', 'ws', 'resync', 'close_after', 'frag')
+    def __init__(self, sock, addr):
+        self.sock = sock; self.addr = addr
+        self.inbuf = bytearray()
+        self.out = deque(); self.sent = 0; self.queued = 0   # tramas pendientes, bytes ya enviados de la primera, bytes en cola
+        self.ws = False; self.resync = False; self.close_after = False
+        self.frag = None
+
+
+class WebServer:
+    # engine: MonitorEngine (store, launch_interaction, positions_source, lock, topo)
+    # port: 0 = el sistema elige; bind: WEB_BIND por defecto (solo local)
+    # hosts: nombres o IPs extra aceptados en la cabecera Host (p. ej. la IP de la LAN con bind 0.0.0.0)
+    # metrics: espnow_metrics.Metrics opcional (web_tick_seconds, clientes y bytes enviados)
+    def __init__(self, engine, port=WEB_PORT, bind=WEB_BIND, tick=TICK, metrics=None, hosts=()):
+        self.engine = engine
+        self.hosts = {h.lower().strip('[]') for h in (bind, '127.0.0.1', 'localhost', '::1', socket.gethostname(), *hosts) if h}
+        self.hosts.discard('0.0.0.0')
+        self.tick = tick
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((bind, port)); self.listener.listen(64); self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self.conns = set()
+        self.counts = {'ticks': 0, 'deltas': 0, 'snapshots': 0, 'bytes_out': 0, 'resyncs': 0, 'routes': 0}
+        self.cpu_seconds = 0.0        # CPU del hilo del servidor (time.thread_time)
+        self._snap = None             # última instantánea enviada
+        self._pos = None              # último diccionario de posiciones enviado
+        self._qpos = {}               # nodo -> (x, y) cuantizado enviado
+        self._ids = {}                # nodo -> id en el cable (estable; no se reutiliza)
+        self._next_id = 0
+        self._wid = np.zeros(0, np.int64) # índice de nodo en la instantánea -> id en el cable
+        self._wid_nodes = ()          # tupla de nodos a la que corresponde _wid
+        self._routes = deque()        # transiciones de CommTracker pendientes (on_record, con el lock del grafo)
+        self._route_state = {}        # msg_id -> [msg_id, tipo, estado, [ids], motivo, terminado_en]
+        self._replies = deque()       # (conexión, mensaje) de las órdenes de ruta terminadas
+        self._orders = deque()        # (conexión, src, dst, msg_id) pendientes para el hilo web-route
+        self._orders_cond = threading.Condition()
+        self._route_thread = None
+        self._snap_cache = (None, None)
+        self._layout = None           # Sin GUI: layout propio para las posiciones
+        self._running = False
+        self._thread = None
+        self._h_tick = None
+        if metrics is not None:
+            self._h_tick = metrics.histogram('web_tick_seconds', "Delta de un tick: diferencia, codificación y encolado")
+            metrics.gauge('web', lambda: {'clients': sum(c.ws for c in self.conns), 'bytes_out': self.counts['bytes_out']},
+                          "WebSocket: clientes y bytes enviados")
+
+    def start(self):
+        if self._running: return self
+        self.sel.register(self.listener, selectors.EVENT_READ, 'accept')
+        self.sel.register(self._wake_r, selectors.EVENT_READ, 'wake')
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="web-server", daemon=True)
+        self._thread.start()
+        self._route_thread = threading.Thread(target=self._route_worker, name="web-route", daemon=True)
+        self._route_thread.start()
+        return self
+
+    def stop(self):
+        self._running = False; self._wake()
+        with self._orders_cond: self._orders_cond.notify()
+        if self._thread: self._thread.join(timeout=2.0)
+        if self._route_thread: self._route_thread.join(timeout=2.0)
+        for c in list(self.conns): self._drop(c)
+        self.sel.close(); self.listener.close(); self._wake_r.close(); self._wake_w.close()
+        if self._layout is not None: self._layout.stop(); self._layout = None
+
+    def on_record(self, r): # CommTracker.on_change (vía MonitorEngine), con el lock del grafo tomado: solo se encola
+        self._routes.append((r.msg_id, r.kind, r.state, r.nodes, r.reason))
+
+    def _wake(self):
+        try: self._wake_w.send(b'\0')
+        except OSError: pass
+
+    # --- Bucle ---
+
+    def _run(self):
+        next_tick = time.monotonic()
+        t_cpu = time.thread_time()
+        while self._running:
+            for key, mask in self.sel.select(max(0.0, next_tick - time.monotonic())):
+                if key.data == 'accept': self._accept()
+                elif key.data == 'wake':
+                    try: self._wake_r.recv(4096)
+                    except OSError: pass
+                else:
+                    c = key.data
+                    if mask & selectors.EVENT_READ: self._read(c)
+                    if mask & selectors.EVENT_WRITE and c in self.conns: self._flush(c)
+            while self._replies:
+                c, msg = self._replies.popleft()
+                if c in self.conns: self._send(c, ws_frame(_dumps(msg)) if c.ws else msg)
+            if time.monotonic() >= next_tick:
+                next_tick += self.tick
+                if next_tick < time.monotonic(): next_tick = time.monotonic() + self.tick # Sin ráfagas de ticks atrasados
+                try: self._do_tick()
+                except Exception as e: log.exception("[!] Excepción en el tick web: %s", e)
+            now_cpu = time.thread_time(); self.cpu_seconds += now_cpu - t_cpu; t_cpu = now_cpu
+
+    def _accept(self):
+        while True:
+            try: sock, addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError): return
+            sock.setblocking(False); sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            c = _Conn(sock, addr); self.conns.add(c)
+            self.sel.register(sock, selectors.EVENT_READ, c)
+
+    def _drop(self, c):
+        if c not in self.conns: return
+        self.conns.discard(c)
+        try: self.sel.unregister(c.sock)
+        except (KeyError, ValueError): pass
+        c.sock.close()
+
+    def _read(self, c):
+        try: data = c.sock.recv(65536)
+        except (BlockingIOError, InterruptedError): return
+        except OSError: data = b''
+        if not data: self._drop(c); return
+        c.inbuf += data
+        if len(c.inbuf) > MAX_REQUEST * 4: self._drop(c); return
+        if c.ws: self._read_frames(c)
+        else: self._read_http(c)
+
+    def _send(self, c, data):
+        c.out.append(data); c.queued += len(data)
+        self._flush(c)
+
+    def _flush(self, c):
+        sock = c.sock
+        while c.out:
+            head = c.out[0]
+            try: n = sock.send(memoryview(head)[c.sent:])
+            except (BlockingIOError, InterruptedError): n = 0
+            except OSError: self._drop(c); return
+            self.counts['bytes_out'] += n; c.sent += n; c.queued -= n
+            if c.sent < len(head): break
+            c.out.popleft(); c.sent = 0
+        if c.out: self.sel.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, c)
+        else:
+            if c.close_after: self._drop(c); return
+            self.sel.modify(sock, selectors.EVENT_READ, c)
+
+    # --- HTTP ---
+
+    def _read_http(self, c):
+        end = c.inbuf.find(b'\r\n\r\n')
+        if end < 0:
+            if len(c.inbuf) > MAX_REQUEST: self._drop(c)
+            return
+        head = bytes(c.inbuf[:end]).decode('latin-1'); del c.inbuf[:end + 4]
+        lines = head.split('\r\n'); parts = lines[0].split(' ')
+        if len(parts) < 2: self._drop(c); return
+        method, target = parts[0], parts[1]
+        hdr = {k.strip().lower(): v.strip() for k, _, v in (l.partition(':') for l in lines[1:])}
+        url = urlsplit(target); q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not self._host_allowed(hdr):
+            log.warning("[!] %s rechazado: Host %s desde %s", url.path, hdr.get('host'), c.addr[0])
+            self._http(c, 403, b'{"error":"host no permitido"}', 'application/json')
+        elif url.path in ('/ws', '/route') and not self._same_origin(hdr):
+            log.warning("[!] %s rechazado: Origin %s desde %s", url.path, hdr.get('origin'), c.addr[0])
+            self._http(c, 403, b'{"error":"origen no permitido"}', 'application/json')
+        elif url.path == '/ws' and hdr.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in hdr:
+            self._send(c, (f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Accept: {ws_accept(hdr['sec-websocket-key'])}\r\n\r\n").encode())
+            c.ws = True; c.resync = True # La instantánea sale en el próximo tick
+            if c.inbuf: self._read_frames(c)
+        elif url.path == '/route':
+            if method == 'POST': self._route(c, q.get('src'), q.get('dst'), q.get('id'))
+            else: self._http(c, 405, b'{"error":"solo POST"}', 'application/json', 'Allow: POST\r\n')
+        elif url.path == '/snapshot' and method == 'GET':
+            self._http(c, 200, self._snapshot_bytes(), 'application/json')
+        elif url.path in ('/', '/index.html') and method == 'GET':
+            self._http(c, 200, CLIENT_HTML.encode(), 'text/html; charset=utf-8')
+        else:
+            self._http(c, 404, b'{"error":"no encontrado"}', 'application/json')
+
+    def _http(self, c, status, body, ctype, extra=''):
+        reason = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed'}[status]
+        c.close_after = True
+        self._send(c, f"HTTP/1.1 {status} {reason}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                      f"{extra}Connection: close\r\n\r\n".encode() + body)
+
+    def _host_allowed(self, hdr):
+        # Nombre de la cabecera Host (sin puerto) en la lista; sin Host (HTTP/1.0, herramientas) se acepta: un navegador siempre la manda
+        host = hdr.get('host')
+        if host is None: return True
+        return (urlsplit('//' + host).hostname or '') in self.hosts
+
+    @staticmethod
+    def _same_origin(hdr):
+        # Sin Origin: cliente que no es un navegador. Con Origin: su host:puerto tiene que ser el Host de la petición
+        origin = hdr.get('origin')
+        if origin is None: return True
+        host = hdr.get('host', '').lower()
+        return bool(host) and urlsplit(origin).netloc.lower() == host
+
+    def _http_reply(self, msg): # Respuesta HTTP de /route (se envía cuando termina launch_interaction)
+        body = _dumps(msg)
+        return (f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n").encode() + body
+
+    # --- WebSocket ---
+
+    def _read_frames(self, c):
+        while True:
+            r = ws_parse(c.inbuf)
+            if r is None: return
+            fin, op, payload, used = r; del c.inbuf[:used]
+            if op == OP_CLOSE:
+                c.close_after = True; self._send(c, ws_frame(payload[:2], OP_CLOSE)); return
+            if op == OP_PING: self._send(c, ws_frame(payload, OP_PONG)); continue
+            if op == OP_PONG: continue
+            if op in (OP_TEXT, OP_BIN): c.frag = bytearray(payload)
+            elif op == OP_CONT and c.frag is not None: c.frag += payload
+            else: continue
+            if len(c.frag) > MAX_REQUEST: self._drop(c); return
+            if not fin: continue
+            data, c.frag = bytes(c.frag), None
+            try: msg = json.loads(data)
+            except ValueError: continue
+            if isinstance(msg, dict) and msg.get('op') == 'route':
+                self._route(c, msg.get('src'), msg.get('dst'), msg.get('id'))
+
+    def _route(self, c, src, dst, msg_id=None):
+        # src/dst llegan de fuera: MAC normalizada (mayúsculas) y nodo ya conocido; ni 'ALL' ni nodos nuevos
+        src = str(src or '').strip().upper(); dst = str(dst or '').strip().upper()
+        if not src or not dst: return self._route_error(c, msg_id, 400, "Faltan src y dst")
+        for v in (src, dst):
+            if not _MAC_RE.match(v): return self._route_error(c, msg_id, 400, f"MAC no válida {v[:32]}")
+            if v not in self.engine.topo: return self._route_error(c, msg_id, 404, f"Nodo desconocido {v}")
+        msg_id = str(msg_id or uuid.uuid4())[:8]; self.counts['routes'] += 1
+        if not c.ws: c.close_after = True
+        with self._orders_cond:
+            self._orders.append((c, src, dst, msg_id)); self._orders_cond.notify()
+
+    def _route_error(self, c, msg_id, status, text):
+        msg = {'t': 'route', 'id': msg_id, 'ok': False, 'msg': text}
+        if c.ws: self._send(c, ws_frame(_dumps(msg)))
+        else: self._http(c, status, _dumps(msg), 'application/json')
+
+    def _route_worker(self): # Hilo web-route: launch_interaction toma el lock del grafo, que el bucle web no debe esperar
+        while True:
+            with self._orders_cond:
+                while self._running and not self._orders: self._orders_cond.wait()
+                if not self._running: return
+                order = self._orders.popleft()
+            self._launch(*order)
+
+    def _launch(self, c, src, dst, msg_id):
+        try: ok, text = self.engine.launch_interaction(src, dst, msg_id)
+        except Exception as e:
+            log.exception("[!] Excepción lanzando ruta %s->%s: %s", src, dst, e); ok, text = False, str(e)
+        self.engine.message(text)
+        msg = {'t': 'route', 'id': msg_id, 'ok': ok, 'msg': text}
+        self._replies.append((c, msg if c.ws else self._http_reply(msg))); self._wake()
+
+    # --- Estado -> mensajes ---
+
+    def _positions(self):
+        src = self.engine.positions_source
+        if src is not None: return src()
+        if self._layout is None: # Motor sin GUI: layout propio, arrancado con las posiciones conocidas (checkpoint)
+            from espnow_layout import IncrementalLayout
+            with self.engine.lock: initial = self.engine.topo.positions()
+            self._layout = IncrementalLayout(fixed={'ALL': (0.5, 0.1)}, initial=initial).start()
+        return self._layout.positions()
+
+    def _wire_ids(self, snap):
+        # Ids en el cable de snap.nodes; si la tupla solo creció, se calculan solo los nuevos
+        nodes = snap.nodes; prev = self._wid_nodes
+        if nodes is prev: return self._wid
+        k = len(prev) if len(nodes) >= len(prev) and nodes[:len(prev)] == prev else 0
+        ids = self._ids; tail = []
+        for v in nodes[k:]:
+            w = ids.get(v)
+            if w is None: w = ids[v] = self._next_id; self._next_id += 1
+            tail.append(w)
+        self._wid = np.concatenate((self._wid[:k], np.array(tail, np.int64))); self._wid_nodes = nodes
+        return self._wid
+
+    def _quantized(self, snap, pos):
+        q = POS_QUANTUM; out = {}
+        for v in snap.nodes:
+            xy = pos.get(v)
+            if xy is not None: out[v] = (round(xy[0] / q) * q, round(xy[1] / q) * q)
+        return out
+
+    def _flags(self, snap, v):
+        return (F_STALE if v in snap.stale else 0) | (F_ACTIVE if v in snap.active_nodes else 0) | (F_SELECTED if v in snap.selected else 0)
+
+    def _take_routes(self, now):
+        # Transiciones pendientes, una por msg_id (la última); actualiza el estado que ven las instantáneas nuevas
+        out = {}; ids = self._ids; st = self._route_state
+        while self._routes:
+            mid, kind, state, nodes, reason = self._routes.popleft()
+            out[mid] = st[mid] = [mid, kind, state, [ids[v] for v in nodes if v in ids], reason, now]
+        for mid in [m for m, r in st.items() if r[2] in ('delivered', 'failed', 'timeout') and now - r[5] > ROUTE_RETENTION]:
+            del st[mid]
+        return [r[:5] for r in out.values()]
+
+    def _snapshot_msg(self, snap, pos):
+        wid = self._wire_ids(snap); eu = wid[snap.edge_u].tolist(); ev = wid[snap.edge_v].tolist()
+        qpos = self._quantized(snap, pos); nodes = []
+        for w, v in zip(wid.tolist(), snap.nodes):
+            xy = qpos.get(v)
+            nodes.append([w, v, xy[0] if xy else None, xy[1] if xy else None, self._flags(snap, v)])
+        return {'t': 'snap', 'v': snap.version, 'n': nodes,
+                'e': [[u, v, s] for u, v, s in zip(eu, ev, snap.edge_status.tolist())],
+                'tv': [[eu[r], ev[r], c, w] for r, (c, w) in snap.temp_visuals.items()],
+                'r': [r[:5] for r in self._route_state.values()]}
+
+    def _snapshot_bytes(self, snap=None, pos=None):
+        if snap is None: snap = self.engine.store.snapshot(); pos = self._positions()
+        key, data = self._snap_cache
+        if key != (snap.version, id(pos)):
+            data = _dumps(self._snapshot_msg(snap, pos)); self._snap_cache = ((snap.version, id(pos)), data)
+        return data
+
+    def _delta(self, old, snap, pos):
+        # Cambios entre dos instantáneas sin expulsiones de por medio; None si hay que mandar una instantánea
+        d = {}
+        m0 = len(old.edges)
+        if snap.topology_version != old.topology_version:
+            n0 = len(old.nodes)
+            if len(snap.nodes) < n0 or len(snap.edges) < m0 or snap.nodes[:n0] != old.nodes or snap.edges[:m0] != old.edges:
+                return None # Expulsión: las filas se compactaron
+        wid = self._wire_ids(snap)
+        q = POS_QUANTUM; qpos = self._qpos
+        if len(snap.nodes) > len(old.nodes):
+            nj = []
+            for i in range(len(old.nodes), len(snap.nodes)):
+                v = snap.nodes[i]; xy = pos.get(v)
+                if xy is not None: xy = qpos[v] = (round(xy[0] / q) * q, round(xy[1] / q) * q)
+                nj.append([int(wid[i]), v, xy[0] if xy else None, xy[1] if xy else None, self._flags(snap, v)])
+            d['nj'] = nj
+        if len(snap.edges) > m0:
+            d['ea'] = [[u, v, s] for u, v, s in zip(wid[snap.edge_u[m0:]].tolist(), wid[snap.edge_v[m0:]].tolist(),
+                                                     snap.edge_status[m0:].tolist())]
+        if snap.edge_status is not old.edge_status and m0:
+            rows = np.flatnonzero(snap.edge_status[:m0] != old.edge_status)
+            if len(rows):
+                d['es'] = [[u, v, s] for u, v, s in zip(wid[snap.edge_u[rows]].tolist(), wid[snap.edge_v[rows]].tolist(),
+                                                         snap.edge_status[rows].tolist())]
+        ot, nt = old.temp_visuals, snap.temp_visuals
+        if ot or nt:
+            eu, ev = snap.edge_u, snap.edge_v
+            tv = [[int(wid[eu[r]]), int(wid[ev[r]]), c, w] for r, (c, w) in nt.items() if ot.get(r) != (c, w)]
+            tc = [[int(wid[eu[r]]), int(wid[ev[r]])] for r in ot if r not in nt]
+            if tv: d['tv'] = tv
+            if tc: d['tc'] = tc
+        changed = (old.stale ^ snap.stale) | (old.active_nodes ^ snap.active_nodes) | \
+                  (frozenset(old.selected) ^ frozenset(snap.selected))
+        if changed:
+            ids = self._ids
+            nf = [[ids[v], self._flags(snap, v)] for v in changed if v in ids]
+            if nf: d['nf'] = nf
+        if pos is not self._pos:
+            ids = self._ids; p = []
+            for v, (x, y) in pos.items():
+                w = ids.get(v)
+                if w is None: continue
+                xy = (round(x / q) * q, round(y / q) * q)
+                if qpos.get(v) != xy: qpos[v] = xy; p.append([w, xy[0], xy[1]])
+            if p: d['p'] = p
+        return d
+
+    def _do_tick(self):
+        t0 = time.perf_counter_ns()
+        self.counts['ticks'] += 1
+        snap = self.engine.store.snapshot(); pos = self._positions(); now = time.monotonic()
+        if snap.topology_version != (self._snap.topology_version if self._snap is not None else None) and self._layout is not None:
+            self._layout.update_graph(snap.nodes, snap.edges)
+        clients = [c for c in self.conns if c.ws]
+        old = self._snap
+        if old is None:
+            delta = None
+        elif snap is old and pos is self._pos and not self._routes:
+            delta = {}
+        else:
+            delta = self._delta(old, snap, pos)
+        routes = self._take_routes(now)
+        if delta is not None and routes: delta['r'] = routes
+        self._snap, self._pos = snap, pos
+        if delta is None: # Primera vez o expulsión: instantánea para todos
+            for c in clients: c.resync = True
+            self._qpos = self._quantized(snap, pos)
+        frame = None
+        if delta:
+            delta['t'] = 'd'; delta['v'] = snap.version
+            frame = ws_frame(_dumps(delta)); self.counts['deltas'] += 1
+        snap_frame = None
+        for c in clients:
+            if c.queued > MAX_BACKLOG: # Cliente lento: fuera lo pendiente (salvo la trama a medio enviar) e instantánea al vaciar
+                keep = c.out.popleft() if c.sent else None
+                c.out.clear(); c.queued = 0
+                if keep is not None: c.out.append(keep); c.queued = len(keep) - c.sent
+                c.resync = True; self.counts['resyncs'] += 1
+            if c.resync:
+                if c.queued: continue
+                if snap_frame is None: snap_frame = ws_frame(self._snapshot_bytes(snap, pos)); self.counts['snapshots'] += 1
+                c.resync = False; self._send(c, snap_frame)
+            elif frame is not None:
+                self._send(c, frame)
+        if self._h_tick is not None and (frame is not None or snap_frame is not None): self._h_tick.record_ns(time.perf_counter_ns() - t0)
+
+    def stats(self):
+        return dict(self.counts, clients=sum(c.ws for c in self.conns), cpu_seconds=self.cpu_seconds)
+
+
+# --- Cliente de referencia ---
+
+class WsClient:
+    # Cliente WebSocket bloqueante mínimo (sin extensiones ni subprotocolos)
+    def __init__(self, url, timeout=10.0):
+        u = urlsplit(url)
+        self.sock = socket.create_connection((u.hostname, u.port or 80), timeout=timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((f"GET {u.path or '/'} HTTP/1.1\r\nHost: {u.hostname}:{u.port}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        self.buf = bytearray()
+        while b'\r\n\r\n' not in self.buf:
+            data = self.sock.recv(4096)
+            if not data: raise ConnectionError("conexión cerrada durante el handshake")
+            self.buf += data
+        end = self.buf.find(b'\r\n\r\n'); head = bytes(self.buf[:end]).decode('latin-1'); del self.buf[:end + 4]
+        if ' 101 ' not in head.split('\r\n')[0] or ws_accept(key) not in head:
+            raise ConnectionError(f"handshake rechazado: {head.splitlines()[0]}")
+        self.bytes_in = 0
+
+    def recv(self):
+        # Siguiente mensaje de texto decodificado (dict); None si el servidor cerró
+        while True:
+            r = ws_parse(self.buf)
+            if r is None:
+                data = self.sock.recv(65536)
+                if not data: return None
+                self.bytes_in += len(data); self.buf += data; continue
+            fin, op, payload, used = r; del self.buf[:used]
+            if op == OP_CLOSE: return None
+            if op == OP_PING: self.sock.sendall(ws_frame(payload, OP_PONG, mask=True)); continue
+            if op == OP_TEXT: return json.loads(payload)
+
+    def send(self, obj): self.sock.sendall(ws_frame(_dumps(obj), mask=True))
+
+    def route(self, src, dst, msg_id=None):
+        self.send({'op': 'route', 'src': src, 'dst': dst, 'id': msg_id})
+
+    def close(self):
+        try: self.sock.sendall(ws_frame(struct.pack('>H', 1000), OP_CLOSE, mask=True))
+        except OSError: pass
+        self.sock.close()
+
+
+class DeltaModel:
+    # El estado de la red tal y como lo reconstruye un cliente a partir del flujo
+    def __init__(self):
+        self.version = -1
+        self.nodes = {}    # id -> [mac, x, y, flags]
+        self.edges = {}    # (u, v) -> estado
+        self.temps = {}    # (u, v) -> (color, ancho)
+        self.routes = {}   # msg_id -> [tipo, estado, [ids], motivo]
+        self.counts = {'snap': 0, 'd': 0, 'route': 0}
+
+    def apply(self, m):
+        t = m.get('t'); self.counts[t] = self.counts.get(t, 0) + 1
+        if t == 'snap':
+            self.nodes = {w: [v, x, y, f] for w, v, x, y, f in m['n']}
+            self.edges = {(u, v): s for u, v, s in m['e']}
+            self.temps = {(u, v): (c, w) for u, v, c, w in m['tv']}
+            self.routes = {r[0]: r[1:] for r in m['r']}
+        elif t == 'd':
+            for w, v, x, y, f in m.get('nj', ()): self.nodes[w] = [v, x, y, f]
+            for u, v, s in m.get('ea', ()): self.edges[(u, v)] = s
+            for u, v, s in m.get('es', ()): self.edges[(u, v)] = s
+            for u, v, c, w in m.get('tv', ()): self.temps[(u, v)] = (c, w)
+            for u, v in m.get('tc', ()): self.temps.pop((u, v), None)
+            for w, f in m.get('nf', ()):
+                if w in self.nodes: self.nodes[w][3] = f
+            for w, x, y in m.get('p', ()):
+                if w in self.nodes: self.nodes[w][1] = x; self.nodes[w][2] = y
+            for r in m.get('r', ()): self.routes[r[0]] = r[1:]
+        else:
+            return m
+        self.version = m['v']
+        return None
+
+
+def _client_thread(url, seconds, out):
+    c = WsClient(url); model = DeltaModel(); end = time.monotonic() + seconds
+    c.sock.settimeout(0.5)
+    try:
+        while time.monotonic() < end:
+            try: m = c.recv()
+            except socket.timeout: continue
+            if m is None: break
+            model.apply(m)
+    finally:
+        c.close()
+    out.append((c.bytes_in, model))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cliente de prueba del flujo WebSocket del monitor")
+    ap.add_argument('--url', default=f"ws://127.0.0.1:{WEB_PORT}/ws")
+    ap.add_argument('--clients', type=int, default=1)
+    ap.add_argument('--seconds', type=float, default=10.0)
+    ap.add_argument('--route', nargs=2, metavar=('ORIGEN', 'DESTINO'), help="lanzar una ruta y esperar la respuesta")
+    args = ap.parse_args()
+    if args.route:
+        c = WsClient(args.url); c.route(*args.route)
+        while True:
+            m = c.recv()
+            if m is None or m.get('t') == 'route': print(f"[i] {m}"); break
+        c.close(); return 0
+    out = []; threads = [threading.Thread(target=_client_thread, args=(args.url, args.seconds, out)) for _ in range(args.clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    total = sum(b for b, _ in out)
+    for b, m in out[:1]:
+        print(f"[i] Modelo: {len(m.nodes)} nodos, {len(m.edges)} aristas, {len(m.temps)} resaltadas, {len(m.routes)} rutas; "
+              f"mensajes {m.counts}")
+    print(f"[i] {len(out)} clientes, {total / max(args.seconds, 1e-9) / max(len(out), 1) / 1024:.1f} KiB/s por cliente")
+    return 0
+
+
+CLIENT_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>Red ESP-NOW</title>
+<style>body{margin:0;font:13px sans-serif}#bar{padding:4px 8px;background:#eee}canvas{display:block}</style></head>
+<body><div id="bar">Origen <input id="src" size="18"> Destino <input id="dst" size="18"> <button id="go">Ruta</button>
+<span id="st">conectando...</span></div><canvas id="c"></canvas><script>
+const C=document.getElementById('c'),X=C.getContext('2d'),st=document.getElementById('st');
+let N=new Map(),E=new Map(),T=new Map(),R=new Map(),dirty=true,ws;
+const EC=['lightgray','lightblue','red'],k=(u,v)=>u+','+v;
+function apply(m){
+ if(m.t=='snap'){N=new Map(m.n.map(a=>[a[0],a.slice(1)]));E=new Map(m.e.map(a=>[k(a[0],a[1]),a]));
+  T=new Map(m.tv.map(a=>[k(a[0],a[1]),a]));R=new Map(m.r.map(a=>[a[0],a]));}
+ else if(m.t=='d'){(m.nj||[]).forEach(a=>N.set(a[0],a.slice(1)));(m.ea||[]).concat(m.es||[]).forEach(a=>E.set(k(a[0],a[1]),a));
+  (m.tv||[]).forEach(a=>T.set(k(a[0],a[1]),a));(m.tc||[]).forEach(a=>T.delete(k(a[0],a[1])));
+  (m.nf||[]).forEach(a=>{const n=N.get(a[0]);if(n)n[3]=a[1]});(m.p||[]).forEach(a=>{const n=N.get(a[0]);if(n){n[1]=a[1];n[2]=a[2]}});
+  (m.r||[]).forEach(a=>R.set(a[0],a));}
+ else if(m.t=='route'){st.textContent=m.msg;return}
+ st.textContent=`Nodos: ${N.size-1} | Aristas: ${E.size} | Rutas: ${[...R.values()].filter(r=>!['delivered','failed','timeout'].includes(r[2])).length}`;
+ dirty=true}
+function xy(n){return [20+n[1]*(C.width-40),C.height-20-n[2]*(C.height-40)]}
+function draw(){if(dirty){dirty=false;C.width=innerWidth;C.height=innerHeight-30;X.clearRect(0,0,C.width,C.height);
+ for(const [key,e] of E){const a=N.get(e[0]),b=N.get(e[1]);if(!a||!b||a[1]==null||b[1]==null)continue;const t=T.get(key);
+  X.strokeStyle=t?t[2]:EC[e[2]];X.lineWidth=t?t[3]:1;X.beginPath();X.moveTo(...xy(a));X.lineTo(...xy(b));X.stroke()}
+ for(const n of N.values()){if(n[1]==null)continue;const [x,y]=xy(n);
+  X.fillStyle=n[3]&4?'yellow':n[3]&1?'darkgray':n[3]&2?'orange':n[0]=='ALL'?'lightgreen':'skyblue';X.fillRect(x-3,y-3,6,6)}}
+ requestAnimationFrame(draw)}
+C.onclick=ev=>{let best=null,bd=100;for(const n of N.values()){if(n[1]==null)continue;const [x,y]=xy(n),d=(x-ev.offsetX)**2+(y-ev.offsetY)**2;
+ if(d<bd){bd=d;best=n[0]}}if(best){const f=document.getElementById(document.getElementById('src').value?'dst':'src');f.value=best}};
+document.getElementById('go').onclick=()=>{ws.send(JSON.stringify({op:'route',src:document.getElementById('src').value,
+ dst:document.getElementById('dst').value}));document.getElementById('src').value='';document.getElementById('dst').value=''};
+function connect(){ws=new WebSocket(`ws://${location.host}/ws`);ws.onmessage=e=>apply(JSON.parse(e.data));
+ ws.onclose=()=>{st.textContent='desconectado; reintentando...';setTimeout(connect,2000)}}
+connect();draw();
+</script></body></html>
+"""
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,307 @@
+# --- espnow_workers: ingesta UDP repartida en N procesos con fusión ordenada ---
+#
+# Con varios puntos de acceso reenviando informes de miles de nodos, un solo
+# proceso no da abasto: la decodificación y el GIL limitan a un núcleo.
+# ShardedIngest lanza N procesos trabajadores (spawn) que escuchan el mismo
+# puerto con SO_REUSEPORT (el kernel reparte por origen ip:puerto, así que
+# cada pasarela cae siempre en el mismo trabajador) o, con port_range, el
+# trabajador i en port+i (una pasarela por puerto; también sirve donde no
+# hay SO_REUSEPORT, como Windows).
+#
+# Cada trabajador drena su socket, decodifica (parse_events) y reduce:
+#   - sello por datagrama: instante de llegada del kernel (SO_TIMESTAMPNS,
+#     CLOCK_REALTIME, común a todos los procesos) o, sin él, el del drenado.
+#     El firmware no numera sus informes: este sello hace de secuencia por nodo
+#   - JOIN repetidos del mismo nodo y BROADCAST_RECV repetidos de la misma
+#     pareja (y misma dirección) dentro de la ventana `window` no se envían,
+#     solo se cuentan: es la misma ventana que MonitorEngine aplica a los
+#     BROADCAST_RECV (broadcast_window). El last_seen de un latido puede
+#     retrasarse hasta `window` segundos (los umbrales de espnow_liveness
+#     son de decenas de segundos)
+# y manda al proceso principal, por un Pipe, tandas de registros
+# (sello, tipo, campos, dirección) ordenadas por sello junto con su marca de
+# agua: ningún registro posterior de ese trabajador tendrá un sello menor.
+#
+# La fusión (un hilo del proceso principal) junta las tandas y entrega al
+# manejador, con el lock del grafo tomado una vez por lote, los registros con
+# sello <= mínima marca de agua de los trabajadores vivos, en orden de sello
+# (heapq.merge de los flujos de cada trabajador). Así los informes de un
+# mismo nodo que llegan por pasarelas distintas se aplican en el orden en que
+# llegaron al host. Si aun así llega un registro más antiguo que el último
+# aplicado de su nodo (retraso del kernel mayor que MARK_SLACK), un JOIN o
+# BROADCAST_RECV se descarta (su información ya es vieja) y el resto se
+# aplica igualmente; ambos se cuentan en stats()['late'].
+#
+# Interfaz de IngestEngine (start/stop/stats) para que MonitorEngine los
+# use indistintamente; el manejador recibe (registros, plegados, datagramas).
+#
+# Uso: python espnow_engine.py --workers 4 [--port-range]
+
+import multiprocessing as mp, heapq, selectors, socket, struct, sys, threading, time
+from collections import deque
+from multiprocessing.connection import wait
+from espnow_protocol import (parse_events, CmdEvent, AckRouteStep, AckEspnowSent, FailEspnowSent, RouteDelivered,
+                             JoinEvent, ReceivedEvent)
+from espnow_ingest import RECV_BUFSIZE, SOCKET_RCVBUF, BATCH_MAX, POLL_INTERVAL
+from espnow_log import get_logger, setup_logging
+
+log = get_logger('workers')
+
+FLUSH_INTERVAL = 0.01    # segundos: cada trabajador envía su tanda (o solo su marca de agua) al menos con este periodo
+MARK_SLACK = 1000000     # ns restados a la marca de agua: margen entre el sello del kernel y la cola del socket
+REDUCE_WINDOW = 0.5      # segundos por defecto de la ventana de JOIN/BROADCAST_RECV repetidos
+START_TIMEOUT = 10.0
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35) if sys.platform.startswith('linux') else None
+FOLDED = frozenset(('JOIN', 'BROADCAST_RECV')) # Comandos que el trabajador agrupa en la ventana
+
+# Tipos de evento por código (los registros viajan como tuplas, no como objetos)
+EVENT_TYPES = (CmdEvent, AckRouteStep, AckEspnowSent, FailEspnowSent, RouteDelivered, JoinEvent, ReceivedEvent)
+_CODES = {cls: i for i, cls in enumerate(EVENT_TYPES)}
+_CMD = _CODES[CmdEvent]
+_timespec = struct.Struct('@qq')
+
+
+# El nodo al que pertenece un registro es siempre el primer campo (mac, node, sender, final_dest, receiver)
+def event_of(code, fields): return EVENT_TYPES[code](*fields)
+
+
+def _open_socket(bind, port, reuseport):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuseport: sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    else: sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try: sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+    except OSError: pass
+    sock.bind((bind, port))
+    return sock
+
+
+def worker_main(bind, port, reuseport, window, conn, log_level):
+    # Proceso trabajador: drena, decodifica, reduce y envía tandas hasta que el principal cierre su extremo del Pipe
+    setup_logging(log_level)
+    try: sock = _open_socket(bind, port, reuseport)
+    except OSError as e:
+        conn.send(('error', f"{bind or '*'}:{port}: {e}")); return
+    stamped = False
+    if SO_TIMESTAMPNS is not None:
+        try: sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1); stamped = True
+        except OSError: pass
+    sock.setblocking(False)
+    conn.send(('ready', sock.getsockname()[1]))
+    sel = selectors.DefaultSelector(); sel.register(sock, selectors.EVENT_READ)
+    recvmsg = sock.recvmsg; recvfrom = sock.recvfrom; unpack = _timespec.unpack; clock = time.time_ns
+    codes = _CODES; folded_cmds = FOLDED; window_ns = int(window * 1e9)
+    recent = set(); window_end = 0
+    records = []; folded = {}; datagrams = 0; last_flush = time.monotonic(); mark = 0
+    try:
+        while True:
+            t = clock() # Antes de comprobar el socket: lo que llegue después tendrá un sello mayor
+            if sel.select(max(0.0, FLUSH_INTERVAL - (time.monotonic() - last_flush))):
+                while len(records) < BATCH_MAX:
+                    t = clock()
+                    try:
+                        if stamped:
+                            data, anc, _, addr = recvmsg(RECV_BUFSIZE, 64)
+                            if anc: sec, nsec = unpack(anc[0][2]); stamp = sec * 1000000000 + nsec
+                            else: stamp = t
+                        else:
+                            data, addr = recvfrom(RECV_BUFSIZE); stamp = t
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionResetError: continue
+                    datagrams += 1
+                    try: events = parse_events(data)
+                    except Exception as e:
+                        log.warning("[!] Datagrama no decodificable de %s: %s", addr, e); continue
+                    if window_ns and stamp >= window_end: recent.clear(); window_end = stamp + window_ns
+                    for ev in events:
+                        code = codes.get(type(ev))
+                        if code is None: continue
+                        if code == _CMD and window_ns and ev.cmd in folded_cmds:
+                            key = (ev.mac, ev.cmd, ev.target, addr)
+                            if key in recent: folded[ev.cmd] = folded.get(ev.cmd, 0) + 1; continue
+                            recent.add(key)
+                        records.append((stamp, code, tuple([getattr(ev, f) for f in ev.__slots__]), addr))
+                else:
+                    t = 0 # Tanda llena con datos pendientes: la marca solo llega al último sello leído
+            if t - MARK_SLACK > mark: mark = t - MARK_SLACK
+            now = time.monotonic()
+            if len(records) >= BATCH_MAX or now - last_flush >= FLUSH_INTERVAL:
+                if records:
+                    records.sort(key=lambda r: r[0]) # Sellos del kernel de un mismo socket: casi siempre ya en orden
+                    if records[-1][0] > mark: mark = records[-1][0]
+                conn.send((mark, datagrams, folded, records))
+                records = []; folded = {}; datagrams = 0; last_flush = now
+    except (BrokenPipeError, EOFError, OSError):
+        pass # El principal se cerró o paró la ingesta
+    finally:
+        sel.close(); sock.close()
+
+
+class ShardedIngest:
+    # port, bind: dirección de escucha (port=0: la elige el sistema); workers: número de procesos
+    # handler(registros, plegados, datagramas): registros (sello, código, campos, dirección) en orden de sello;
+    #   plegados {comando: n} descartados por la ventana en los trabajadores
+    # lock: como en IngestEngine, se toma una vez alrededor de cada llamada a handler
+    # port_range: el trabajador i escucha en port+i (sin SO_REUSEPORT)
+    # window: ventana de JOIN/BROADCAST_RECV repetidos (0 = se envían todos)
+    def __init__(self, port, handler, workers=2, bind='', lock=None, port_range=False, window=REDUCE_WINDOW,
+                 metrics=None, log_level='INFO'):
+        if not port_range and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("este sistema no tiene SO_REUSEPORT: use port_range (--port-range)")
+        self.port = port
+        self.bind = bind
+        self.handler = handler
+        self.n_workers = workers
+        self.lock = lock
+        self.port_range = port_range
+        self.window = window
+        self.log_level = log_level
+        self.ports = []
+        self.received = 0
+        self.folded = 0
+        self.late = 0
+        self.dropped = 0
+        self.batches = 0
+        self.handler_errors = 0
+        self.max_depth = 0
+        self.started_at = None
+        self._h_queue = self._h_batch = None
+        if metrics is not None:
+            self._h_queue = metrics.histogram('ingest_queue_seconds', "De la llegada al kernel a la aplicación (incluye la espera de la fusión)")
+            self._h_batch = metrics.histogram('ingest_batch_seconds', "Manejador por lote (con el lock del grafo)")
+            metrics.gauge('ingest_workers', lambda: sum(p.is_alive() for p in self._procs), "Trabajadores de ingesta vivos")
+        self._procs = []
+        self._conns = []
+        self._pending = []       # por trabajador: deque de registros recibidos aún por encima de la marca común
+        self._marks = []
+        self._last = {}          # nodo -> sello del último registro aplicado
+        self._depth = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running: return self
+        ctx = mp.get_context('spawn')
+        probe = None
+        if not self.port_range and self.port == 0: # Puerto común para todos: se reserva con un socket que se cierra al final
+            probe = _open_socket(self.bind, 0, True); self.port = probe.getsockname()[1]
+        try:
+            for i in range(self.n_workers):
+                mine, theirs = ctx.Pipe(duplex=False)
+                port = (self.port + i if self.port else 0) if self.port_range else self.port
+                p = ctx.Process(target=worker_main, name=f"espnow-ingest-{i}", daemon=True,
+                                args=(self.bind, port, not self.port_range, self.window, theirs, self.log_level))
+                p.start(); theirs.close()
+                self._procs.append(p); self._conns.append(mine)
+            for i, c in enumerate(self._conns):
+                if not c.poll(START_TIMEOUT): raise RuntimeError(f"el trabajador {i} no arrancó a tiempo")
+                kind, val = c.recv()
+                if kind == 'error': raise RuntimeError(f"el trabajador {i} no pudo abrir el puerto {val}")
+                self.ports.append(val)
+        except (RuntimeError, EOFError) as e:
+            self._kill()
+            raise RuntimeError(f"ingesta repartida: {e or 'un trabajador terminó al arrancar'}") from None
+        finally:
+            if probe is not None: probe.close()
+        self.port = self.ports[0]
+        self._pending = [deque() for _ in self._conns]; self._marks = [0] * len(self._conns)
+        self._running = True
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._merge_loop, name="ingest-merge", daemon=True)
+        self._thread.start()
+        log.info("[i] Ingesta repartida en %d procesos (%s)", self.n_workers,
+                 f"puertos {self.ports[0]}-{self.ports[-1]}" if self.port_range else f"SO_REUSEPORT en {self.port}")
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread(): self._thread.join(timeout=2.0)
+        self._thread = None
+        self._kill()
+
+    def _kill(self):
+        for c in self._conns: c.close() # El trabajador sale al fallar su siguiente send()
+        for p in self._procs:
+            p.join(timeout=1.0)
+            if p.is_alive(): p.terminate(); p.join(timeout=1.0)
+        self._procs = []; self._conns = []
+
+    def _merge_loop(self):
+        conns = list(self._conns); index = {c: i for i, c in enumerate(conns)}
+        live = set(range(len(conns))); pending = self._pending; marks = self._marks
+        datagrams = 0; folded = {}
+        while self._running and live:
+            for c in wait([conns[i] for i in live], POLL_INTERVAL):
+                i = index[c]
+                try: mark, n, fd, recs = c.recv()
+                except (EOFError, OSError):
+                    if self._running: log.error("[!] El trabajador de ingesta %d terminó", i)
+                    live.discard(i); continue
+                if mark > marks[i]: marks[i] = mark
+                if recs: pending[i].extend(recs); self._depth += len(recs)
+                datagrams += n
+                for k, v in fd.items(): folded[k] = folded.get(k, 0) + v
+            if self._depth > self.max_depth: self.max_depth = self._depth
+            common = min((marks[i] for i in live), default=float('inf'))
+            runs = []
+            for i, q in enumerate(pending): # Prefijo de cada flujo por debajo de la marca común (los de un trabajador muerto, todos)
+                if not q: continue
+                k = 0; lim = common if i in live else float('inf')
+                for r in q:
+                    if r[0] > lim: break
+                    k += 1
+                if k: runs.append([q.popleft() for _ in range(k)])
+            if not runs and not datagrams and not folded: continue
+            batch = list(heapq.merge(*runs, key=lambda r: r[0])) if len(runs) > 1 else (runs[0] if runs else [])
+            self._depth -= len(batch)
+            self._deliver(self._order(batch), folded, datagrams)
+            datagrams = 0; folded = {}
+
+    def _order(self, batch):
+        # Secuencia por nodo: un registro más antiguo que el último aplicado de su nodo llega tarde
+        last = self._last; out = []
+        for r in batch:
+            node = r[2][0]; prev = last.get(node)
+            if prev is not None and r[0] < prev:
+                self.late += 1
+                if r[1] == _CMD and r[2][1] in FOLDED: self.dropped += 1; continue
+            else:
+                last[node] = r[0]
+            out.append(r)
+        if len(last) > 65536: # Nodos que ya no informan: las marcas de agua han superado de sobra su último sello
+            cut = min(self._marks) - int(60e9); self._last = {k: v for k, v in last.items() if v >= cut}
+        return out
+
+    def _deliver(self, batch, folded, datagrams):
+        self.received += datagrams; self.folded += sum(folded.values())
+        if batch: self.batches += 1
+        h = self._h_batch
+        try:
+            if self.lock is not None:
+                with self.lock: self._apply(batch, folded, datagrams, h)
+            else:
+                self._apply(batch, folded, datagrams, h)
+        except Exception as e:
+            self.handler_errors += 1
+            log.exception("[!] Excepción en manejador de ingesta: %s", e)
+
+    def _apply(self, batch, folded, datagrams, h):
+        if h is None: self.handler(batch, folded, datagrams); return
+        t0 = time.perf_counter_ns()
+        if batch: # Espera de cada registro: reloj de pared, el mismo que los sellos del kernel
+            now = time.time_ns(); rq = self._h_queue.record_ns
+            for r in batch: rq(now - r[0])
+        self.handler(batch, folded, datagrams); h.record_ns(time.perf_counter_ns() - t0)
+
+    def stats(self):
+        elapsed = (time.monotonic() - self.started_at) if self.started_at else 0.0
+        return {'received': self.received,
+                'dropped': self.dropped,
+                'queue_depth': self._depth,
+                'queue_max_depth': self.max_depth,
+                'batches': self.batches,
+                'handler_errors': self.handler_errors,
+                'rate': self.received / elapsed if elapsed > 0 else 0.0,
+                'workers': sum(p.is_alive() for p in self._procs),
+                'folded': self.folded,
+                'late': self.late}
@@ -1,264 +1,163 @@
 # --- monitor_espnow_sim_blend (Revisado v8) ---
-
-import socket, re, threading, time, uuid
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+# GUI de matplotlib sobre espnow_engine.MonitorEngine (socket, listener, topología y rutas).
+# Sin pantalla: python monitor_espnow11.py --headless (o python espnow_engine.py); --traffic implica --headless.
+# Motor en otro proceso (la GUI solo renderiza; estado por memoria compartida): python monitor_espnow11.py --split
+# Teclas (libres en el keymap de matplotlib): b = selección por caja, n = por lazo (cientos de nodos); con varios
+#   seleccionados un clic fija el origen; a = lote todas las parejas, e = lote en estrella desde el origen
+#   (un solo planificador: engine.launch_batch), x = cancelar el lote, Esc = vaciar la selección y volver al clic
+
+import argparse, time, uuid
 import numpy as np
-
-# --- UDP ---
-UDP_PORT = 12345
-pattern_cmd = re.compile(r'<([0-9A-F:]{17})>\s+CMD:(\w+)(?:\s+([0-9A-F:]{17}))?(?:\s+(.*))?')
-pattern_route_delivered = re.compile(r'ROUTE_DELIVERED\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)\s+(.*)')
-pattern_ack_route_step_rcvd = re.compile(r'ACK_ROUTE_STEP_RECEIVED\s+([0-9A-F:]{17})\s+([\w-]+)')
-pattern_ack_route_espnow_sent = re.compile(r'ACK_ROUTE_ESPNOW_SENT\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)')
+from espnow_engine import MonitorEngine, add_arguments, run_headless, COLOR_EDGE_FAIL, STYLE_NORMAL
+from espnow_log import setup_logging
+from espnow_spatial import GridIndex
+from espnow_state import EDGE_BASE, EDGE_ESTABLISHED, EDGE_FAILED
 
 # --- Colores y Estilos ---
 COLOR_NODE_DEFAULT = 'skyblue'
 COLOR_NODE_ALL = 'lightgreen'
 COLOR_NODE_SELECTED = 'yellow'
 COLOR_NODE_TEMP_HIGHLIGHT = 'orange'
+COLOR_NODE_STALE = 'darkgray' # Sin señales (espnow_liveness): fuera de las rutas
 COLOR_EDGE_BASE = 'lightgray'      
 COLOR_EDGE_ESTABLISHED = 'lightblue'
-COLOR_EDGE_ATTEMPT = 'black'       
-COLOR_EDGE_VIA_ESTABLISHED = 'green'
-COLOR_EDGE_FAIL = 'red'            
-COLOR_EDGE_TEMP_SUCCESS = 'lime'   
-STYLE_THIN = 1.5; STYLE_NORMAL = 2.0; STYLE_THICK = 3.0
-TEMPORARY_VISUALIZATION_SECONDS = 5.0
 NODE_CLICK_RADIUS_SQ = 0.0025 
 
-# --- Grafo y estado ---
-G = nx.Graph()
-lock = threading.Lock()
-mac_ip = {}; edge_temp_visuals = {}; pos = {}
-recompute_layout = True; selected_nodes = []; active_communications = {}
-G.add_node('ALL'); pos['ALL'] = (0.5, 0.1) 
-
-# --- Socket UDP ---
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-sock.bind(('', UDP_PORT))
-
-def get_edge_key(u, v): return tuple(sorted((u, v)))
-
-def set_edge_status_in_G(u, v, status_str): # Sin cambios
-    global recompute_layout
-    edge_key = get_edge_key(u,v)
-    with lock:
-        nodes_added = False
-        if u not in G: G.add_node(u); nodes_added = True
-        if v not in G: G.add_node(v); nodes_added = True
-        if nodes_added: recompute_layout = True
-        edge_structural_change = False
-        if not G.has_edge(u,v): G.add_edge(u,v, status=status_str); edge_structural_change=True
-        elif G.edges[edge_key].get('status') != status_str: G.edges[edge_key]['status'] = status_str
-        if edge_structural_change and not nodes_added: recompute_layout = True
-
-def apply_temp_visual(ek_list, color, width=STYLE_THICK, duration=TEMPORARY_VISUALIZATION_SECONDS): # Sin cambios
-    global edge_temp_visuals
-    # ek_list DEBE ser una lista de tuplas de aristas, ej: [('N1','N2'), ('N2','N3')]
-    # O una sola tupla de arista, ej: ('N1','N2'), que se convertirá en lista.
-    if not isinstance(ek_list, list): 
-        ek_list = [ek_list] # Si se pasa una sola tupla ('N1','N2'), se convierte en [('N1','N2')]
-    
-    exp_time = time.time() + duration
-    with lock:
-        for u_node,v_node in ek_list: # Ahora u_node y v_node se desempaquetan correctamente de cada tupla en ek_list
-            edge_temp_visuals[get_edge_key(u_node,v_node)] = {'color':color,'width':width,'expires':exp_time}
-
-def clear_expired_temp_visuals(): # Sin cambios
-    global edge_temp_visuals; now=time.time(); changed=False
-    with lock:
-        keys_del=[k for k,v in edge_temp_visuals.items() if v['expires']<=now]
-        for k in keys_del: del edge_temp_visuals[k]; changed=True
-    return changed 
-
-def on_click(event): # Sin cambios
-    global recompute_layout, selected_nodes, pos
-    if event.inaxes != ax_main or event.xdata is None or event.ydata is None: return
-    clicked_node = None; min_d_sq = NODE_CLICK_RADIUS_SQ
-    with lock: current_p_copy = dict(pos); g_nodes_copy = list(G.nodes())
-    for n in g_nodes_copy:
-        if n in current_p_copy:
-            xn,yn=current_p_copy[n]
-            if abs(xn-event.xdata)<NODE_CLICK_RADIUS_SQ**0.5 and abs(yn-event.ydata)<NODE_CLICK_RADIUS_SQ**0.5:
-                d_sq=(xn-event.xdata)**2+(yn-event.ydata)**2
-                if d_sq<min_d_sq: clicked_node=n; min_d_sq=d_sq
-    if clicked_node:
-        action=False
-        with lock:
-            if clicked_node not in selected_nodes:
-                if len(selected_nodes)<2: selected_nodes.append(clicked_node); action=True
-            else: selected_nodes.remove(clicked_node); action=True
-            if len(selected_nodes)==2:
-                s_nodes=list(selected_nodes);selected_nodes.clear();recompute_layout=True
-                threading.Thread(target=initiate_simulation_interaction,args=(s_nodes[0],s_nodes[1]),daemon=True).start()
-                action=True
-            elif action: recompute_layout=True
-        s_msg = f"Seleccionados: {selected_nodes}" if selected_nodes else "Seleccione nodo"
-        if clicked_node and not action and len(selected_nodes)==2: s_msg = f"Ya hay 2 seleccionados: {selected_nodes}"
-        elif clicked_node and action: s_msg = f"{'Seleccionado' if clicked_node in selected_nodes else 'Deseleccionado'} {clicked_node}. {s_msg}"
-        update_figure_title(s_msg)
-
-def initiate_simulation_interaction(s1, s2): # Sin cambios
-    global active_communications, mac_ip
-    msg_id=str(uuid.uuid4())[:8]; payload=f"data_{msg_id[:4]}"
-    update_figure_title(f"Procesando {s1}->{s2}...")
-    G_est=nx.Graph(); path_via_est=None
-    with lock:
-        for u,v,d in G.edges(data=True):
-            if d.get('status')=='established': G_est.add_edge(u,v)
-    if G_est.has_node(s1) and G_est.has_node(s2):
-        try: path_via_est=nx.shortest_path(G_est,source=s1,target=s2)
-        except (nx.NetworkXNoPath,nx.NodeNotFound):pass
-    if path_via_est and len(path_via_est)>1:
-        p_edges=[(path_via_est[i],path_via_est[i+1]) for i in range(len(path_via_est)-1)]
-        with lock:active_communications[msg_id]={'type':'route_via_established','path_edges':[get_edge_key(u,v) for u,v in p_edges],'path_nodes':path_via_est,'status':'pending'}
-        apply_temp_visual(p_edges,COLOR_EDGE_VIA_ESTABLISHED,STYLE_THICK) # p_edges ya es una lista de tuplas
-        for i in range(len(path_via_est)-1):
-            snd,rcv,fdest=path_via_est[i],path_via_est[i+1],path_via_est[-1]
-            if snd not in mac_ip:print(f"[!]No IP:{snd}");return
-            sock.sendto(f"ROUTE_STEP {rcv} {fdest} {msg_id} {payload}\n".encode(),mac_ip[snd]);time.sleep(0.1)
-        update_figure_title(f"Ruta Verde {s1}->{s2}")
-    elif s1!=s2:
-        ek_dir=get_edge_key(s1,s2) # ek_dir es una tupla
-        with lock:active_communications[msg_id]={'type':'direct_attempt','path_edges':[ek_dir],'path_nodes':[s1,s2],'status':'pending'}
-        apply_temp_visual([(s1,s2)],COLOR_EDGE_ATTEMPT,STYLE_NORMAL) # Se pasa una lista conteniendo la tupla de arista
-        if s1 not in mac_ip:
-            set_edge_status_in_G(s1,s2,'failed');apply_temp_visual([(s1,s2)],COLOR_EDGE_FAIL,duration=0.2)
-            with lock:
-                if msg_id in active_communications:active_communications[msg_id]['status']='failed_no_ip'
-            update_figure_title(f"FALLO IP {s1}");return
-        sock.sendto(f"UNICAST {s2} {payload}\n".encode(),mac_ip[s1])
-        update_figure_title(f"Intento UNICAST {s1}->{s2}")
-    else:update_figure_title("Origen y destino iguales.")
-
-def listener(): # Cambio en el manejo de ROUTE_DELIVERED
-    global recompute_layout, G, mac_ip, active_communications
-    while True:
-        try:
-            data,addr=sock.recvfrom(1024);line=data.decode().strip(); # print(f"[UDP_RX {addr}]{line}") # Comentado para reducir log spam si funciona
-            m_cmd=pattern_cmd.search(line)
-            if m_cmd:
-                mac_o,cmd_t,mac_t,_=m_cmd.groups();mac_ip[mac_o]=addr
-                with lock:
-                    added=False
-                    if mac_o not in G:G.add_node(mac_o);print(f"[+]Nodo:{mac_o}");added=True
-                    if mac_t and mac_t not in G:G.add_node(mac_t);print(f"[+]Nodo(tgt):{mac_t}");added=True
-                    if added:recompute_layout=True
-                ek_inv=get_edge_key(mac_o,mac_t) if mac_t else None
-                if cmd_t=="JOIN":set_edge_status_in_G(mac_o,'ALL','base')
-                elif cmd_t=="BROADCAST_RECV" and ek_inv:
-                    with lock:cur_stat=G.edges[ek_inv].get('status') if G.has_edge(*ek_inv) else None
-                    if cur_stat!='established':set_edge_status_in_G(mac_o,mac_t,'base')
-                elif cmd_t=="UNICAST_RECV" and ek_inv:
-                    set_edge_status_in_G(mac_t,mac_o,'established');apply_temp_visual([ek_inv],COLOR_EDGE_TEMP_SUCCESS,STYLE_THICK,TEMPORARY_VISUALIZATION_SECONDS)
-                    mid_res=None
-                    with lock:
-                        for mid,cdata in active_communications.items():
-                            if cdata['type']=='direct_attempt' and cdata['path_edges'][0]==ek_inv and cdata['path_nodes'][0]==mac_t and cdata['path_nodes'][1]==mac_o:
-                                cdata['status']='success';mid_res=mid;break
-                    if mid_res:update_figure_title(f"UNICAST {mac_t[:5]}->{mac_o[:5]} OK!")
-                elif cmd_t=="SEND_FAIL_TO" and ek_inv:
-                    set_edge_status_in_G(mac_o,mac_t,'failed');apply_temp_visual([ek_inv],COLOR_EDGE_FAIL,STYLE_THICK,0.5)
-                    update_figure_title(f"FALLO {mac_o[:5]}->{mac_t[:5]}")
-                    with lock:
-                        for mid,cdata in active_communications.items():
-                            if ek_inv in cdata.get('path_edges',[]):
-                                if(cdata['type']=='direct_attempt' and cdata['path_nodes'][0]==mac_o)or cdata['type']=='route_via_established':
-                                    cdata['status']='failed';break
-            m_ack=pattern_ack_route_espnow_sent.match(line)
-            if m_ack:s,st,mid=m_ack.groups();apply_temp_visual(get_edge_key(s,st),COLOR_EDGE_TEMP_SUCCESS,STYLE_NORMAL,1.5) # get_edge_key devuelve tupla, se envuelve en lista por apply_temp_visual
-            
-            m_del=pattern_route_delivered.match(line)
-            if m_del:fdest,_,mid,_=m_del.groups()
-            if m_del and mid in active_communications and active_communications[mid]['type']=='route_via_established':
-                C=active_communications[mid];C['status']='success'
-                # C['path_edges'] es una lista de tuplas de aristas (edge_keys)
-                # apply_temp_visual espera una lista de tuplas de aristas (u,v)
-                # Como C['path_edges'] ya es una lista de estas tuplas, se puede pasar directamente.
-                apply_temp_visual(C['path_edges'], COLOR_EDGE_TEMP_SUCCESS, STYLE_THICK, 2.0)
-                for e_key in C['path_edges']: # e_key es una tupla (u,v)
-                    set_edge_status_in_G(e_key[0], e_key[1], 'established') # Asegurar que todas las aristas de la ruta son azules
-                update_figure_title(f"Ruta {mid[:4]} OK!")
-        except Exception as e:print(f"[!]ExListener:{e}");import traceback;traceback.print_exc()
-
-threading.Thread(target=listener,daemon=True).start()
-def broadcaster():sock.sendto(b'BROADCAST ping_servidor_python\n',('255.255.255.255',UDP_PORT));threading.Timer(20,broadcaster).start()
-# broadcaster()
-
-fig=plt.figure(figsize=(13,9));ax_main=fig.add_axes([0.05,0.08,0.9,0.88]);ax_main.set_axis_off()
-fig.canvas.mpl_connect('button_press_event',on_click);_figure_title_ax_main=ax_main
-
-def update_figure_title(message_override=None): # Sin cambios
-    ax=_figure_title_ax_main;num_n,sel_s,act_s=0,"",""
-    with lock:
-        num_n=len([n for n in G.nodes() if n!='ALL']);sel_c=list(selected_nodes)
-        if sel_c:sel_s=f" (Seleccionados: {', '.join(sel_c)})"
-        act_c=sum(1 for c in active_communications.values() if c.get('status','').startswith('pending'))
-        if act_c>0:act_s=f" | Comms activas: {act_c}"
-    title=message_override if message_override else f"Red ESP-NOW — Nodos: {num_n}{sel_s}{act_s}"
-    ax.set_title(title,fontsize=10)
-
-def update(frame): # Sin cambios mayores en la lógica de layout, solo limpieza
-    global pos, recompute_layout
-    if clear_expired_temp_visuals(): pass
-        
-    with lock:
-        current_G_copy=G.copy();current_pos_copy=dict(pos);current_selected_copy=list(selected_nodes)
-        current_temp_visuals_copy=dict(edge_temp_visuals);current_active_comms_copy=dict(active_communications)
-    ax_main.cla();ax_main.set_axis_off();update_figure_title()
-    nodes_in_G=list(current_G_copy.nodes())
-    layout_needed=recompute_layout or not all(n in current_pos_copy for n in nodes_in_G) or \
-                  (nodes_in_G and len(current_pos_copy)!=len(nodes_in_G))
-
-    if not nodes_in_G:
-        with lock:pos.clear();current_pos_copy.clear();recompute_layout=False
-    elif layout_needed:
-        try:
-            layout_input_G=current_G_copy
-            pos_arg_for_spring={k:v for k,v in current_pos_copy.items() if k in layout_input_G} if current_pos_copy else {}
-            fixed_nodes_list=None
-            if 'ALL' in layout_input_G:
-                if 'ALL' not in pos_arg_for_spring:pos_arg_for_spring['ALL']=pos.get('ALL',(0.5,0.1))
-                fixed_nodes_list=['ALL']
-            if layout_input_G.number_of_nodes()==1:
-                 node_s=list(layout_input_G.nodes())[0]
-                 if node_s not in pos_arg_for_spring:pos_arg_for_spring[node_s]=(0.5,0.5)
-                 new_positions=pos_arg_for_spring
-            elif layout_input_G.number_of_nodes()>0:
-                new_positions=nx.spring_layout(layout_input_G,pos=pos_arg_for_spring if pos_arg_for_spring else None,
-                                               fixed=fixed_nodes_list,k=0.7,iterations=50,seed=7)
-            else:new_positions={}
-            with lock:pos.update(new_positions)
-            recompute_layout=False;current_pos_copy=pos.copy()
-        except Exception as e:print(f"[!]ErrorLayout:{e}");import traceback;traceback.print_exc()
-    
-    if not current_G_copy.nodes() or not current_pos_copy:fig.canvas.draw_idle();return
-    drawable_nodes=[n for n in current_G_copy.nodes() if n in current_pos_copy]
-    if not drawable_nodes:fig.canvas.draw_idle();return
-    node_colors_list=[]
-    for node_id in drawable_nodes:
-        is_act_node=False
-        with lock:is_act_node=any(node_id in c.get('path_nodes',[]) for c in active_communications.values() if c.get('status','').startswith('pending'))
-        if node_id in current_selected_copy:node_colors_list.append(COLOR_NODE_SELECTED)
-        elif is_act_node and node_id not in current_selected_copy:node_colors_list.append(COLOR_NODE_TEMP_HIGHLIGHT)
-        elif node_id=='ALL':node_colors_list.append(COLOR_NODE_ALL)
-        else:node_colors_list.append(COLOR_NODE_DEFAULT)
-    nx.draw_networkx_nodes(current_G_copy,current_pos_copy,ax=ax_main,nodelist=drawable_nodes,node_color=node_colors_list,node_size=700,alpha=0.9,edgecolors='black',linewidths=1.0)
-    labels_draw={n:str(n) for n in drawable_nodes}
-    nx.draw_networkx_labels(current_G_copy,current_pos_copy,ax=ax_main,labels=labels_draw,font_size=8,font_weight='bold')
-    for u,v,data in current_G_copy.edges(data=True):
-        ek=get_edge_key(u,v)
-        if not all(n in current_pos_copy for n in ek):continue
-        stat=data.get('status','base');col,wid,alp=COLOR_EDGE_BASE,STYLE_NORMAL,0.5
-        if stat=='established':col,wid,alp=COLOR_EDGE_ESTABLISHED,STYLE_NORMAL,0.8
-        elif stat=='failed':col,wid,alp=COLOR_EDGE_FAIL,STYLE_NORMAL,0.7
-        if ek in current_temp_visuals_copy:tmp=current_temp_visuals_copy[ek];col,wid,alp=tmp['color'],tmp['width'],0.95
-        nx.draw_networkx_edges(current_G_copy,current_pos_copy,ax=ax_main,edgelist=[(u,v)],edge_color=col,width=wid,alpha=alp)
-    fig.canvas.draw_idle()
-
-ani=FuncAnimation(fig,update,interval=300,cache_frame_data=False)
-plt.show()
\ No newline at end of file
+# --- Estado de la GUI (el de la red vive en engine) ---
+engine = None
+pos = {'ALL': (0.5, 0.1)}
+layout = None
+render_dirty = True # Solo para mensajes de título desde otros hilos; los cambios del grafo llegan por engine.store
+fig = ax_main = renderer = timer = None
+_h_frame = None # engine.metrics: frame_seconds (update() de cada tick)
+_figure_title_ax_main = None
+_index = GridIndex() # Índice espacial de `pos` (espnow_spatial): se pone al día en cada consulta, solo con lo que movió el layout
+_selectors = {}; _select_mode = None; _star_source = None # Caja/lazo de matplotlib.widgets y origen del lote en estrella
+SELECT_KEYS = {'b': 'box', 'n': 'lasso'}
+
+def on_click(event): # Nodo más cercano por índice espacial (antes se recorrían todos los nodos)
+    global _star_source
+    if _select_mode or event.inaxes != ax_main or event.xdata is None or event.ydata is None: return
+    _index.update(pos);clicked_node=_index.nearest(event.xdata,event.ydata,NODE_CLICK_RADIUS_SQ**0.5)
+    snap=engine.store.snapshot() # Inmutable: sin lock ni copias
+    if clicked_node is None or clicked_node not in snap.nodes: return
+    if len(snap.selected)>2: # Selección por caja/lazo: el clic elige el origen del lote en estrella
+        _star_source=clicked_node;update_figure_title(f"Origen de la estrella: {clicked_node} ({len(snap.selected)} seleccionados; 'e' lanza el lote)");return
+    action,pair,sel=engine.select(clicked_node) # Con dos seleccionados el motor vacía la selección y devuelve la pareja
+    if pair: # launch_interaction no bloquea (saltos por ACK en el dispatcher): sin hilo por pareja
+        update_figure_title(engine.launch_interaction(pair[0],pair[1],str(uuid.uuid4())[:8])[1]);return
+    s_msg = f"Seleccionados: {list(sel)}" if sel else "Seleccione nodo"
+    if not action and len(sel)==2: s_msg = f"Ya hay 2 seleccionados: {list(sel)}"
+    elif action: s_msg = f"{'Seleccionado' if clicked_node in sel else 'Deseleccionado'} {clicked_node}. {s_msg}"
+    update_figure_title(s_msg)
+
+def on_select_box(press, release): # RectangleSelector: nodos dentro de la caja
+    _index.update(pos);_select_nodes(_index.in_box(press.xdata,press.ydata,release.xdata,release.ydata))
+
+def on_select_lasso(verts): # LassoSelector: nodos dentro del lazo
+    _index.update(pos);_select_nodes(_index.in_polygon(verts))
+
+def _select_nodes(nodes):
+    global _star_source
+    sel=engine.select_many([v for v in nodes if v!='ALL']);_star_source=sel[0] if sel else None
+    update_figure_title(f"{len(sel)} seleccionados: a = todas las parejas, e = estrella desde {_star_source} (clic para cambiar el origen), Esc = vaciar" if sel else "Ningún nodo en la selección")
+
+def on_key(event): # Modos de selección y lotes sobre la selección
+    global _select_mode, _star_source
+    if event.key in SELECT_KEYS:
+        _select_mode=None if _select_mode==SELECT_KEYS[event.key] else SELECT_KEYS[event.key]
+        for mode,w in _selectors.items():w.set_active(mode==_select_mode)
+        update_figure_title(f"Modo {'caja' if _select_mode=='box' else 'lazo'}: arrastre para seleccionar" if _select_mode else "Modo clic")
+    elif event.key=='escape':
+        _select_mode=None;_star_source=None
+        for w in _selectors.values():w.set_active(False)
+        engine.select_many([]);update_figure_title("Selección vacía")
+    elif event.key in ('a','e'):
+        sel=engine.store.snapshot().selected
+        ok,msg=engine.launch_batch(sel,'all-pairs' if event.key=='a' else 'star',_star_source)
+        if ok:engine.select_many([]);_star_source=None
+        update_figure_title(msg)
+    elif event.key=='x':update_figure_title("Lote cancelado" if engine.cancel_batch() else "No hay lote en marcha")
+
+def update_figure_title(message_override=None):
+    global render_dirty
+    ax=_figure_title_ax_main;sel_s,act_s="",""
+    if ax is None:return # Aún sin figura
+    snap=engine.store.snapshot() # Sin lock
+    num_n=len(snap.nodes)-('ALL' in snap.nodes);stale_s=f" ({len(snap.stale)} inactivos)" if snap.stale else ""
+    if snap.selected:sel_s=f" (Seleccionados: {', '.join(snap.selected)})" if len(snap.selected)<=4 else f" ({len(snap.selected)} seleccionados)"
+    if snap.active_count>0:act_s=f" | Comms activas: {snap.active_count}"
+    ing=engine.ingest.stats();ing_s=f" | Cola UDP: {ing['queue_depth']}" + (f" Descartes: {ing['dropped']}" if ing['dropped'] else "")
+    title=message_override if message_override else f"Red ESP-NOW — Nodos: {num_n}{stale_s}{sel_s}{act_s}{ing_s}"
+    if ax.get_title()!=title:
+        ax.set_title(title,fontsize=10)
+        if message_override:render_dirty=True # Mensaje desde otro hilo: forzar el siguiente redibujado
+
+# Estilo base por código de estado de arista (espnow_state): (color, ancho, alpha); en build_gui pasan a tablas RGBA
+EDGE_STYLE={EDGE_BASE:(COLOR_EDGE_BASE,STYLE_NORMAL,0.5),EDGE_ESTABLISHED:(COLOR_EDGE_ESTABLISHED,STYLE_NORMAL,0.8),EDGE_FAILED:(COLOR_EDGE_FAIL,STYLE_NORMAL,0.7)}
+EDGE_STYLE_STALE=(COLOR_EDGE_BASE,STYLE_NORMAL,0.2) # Aristas de nodos inactivos
+NODE_DEFAULT,NODE_ALL,NODE_ACTIVE,NODE_STALE,NODE_SELECTED=range(5) # Código de color de nodo: a más alto, más prioridad
+NODE_STYLE={NODE_DEFAULT:(COLOR_NODE_DEFAULT,0,0.9),NODE_ALL:(COLOR_NODE_ALL,0,0.9),NODE_ACTIVE:(COLOR_NODE_TEMP_HIGHLIGHT,0,0.9),
+            NODE_STALE:(COLOR_NODE_STALE,0,0.9),NODE_SELECTED:(COLOR_NODE_SELECTED,0,0.9)}
+_edge_table=_node_table=None;_drawn_snap=None;_layout_topology=-1;_node_index={}
+
+def update(frame): # Lee la instantánea publicada sin lock; devuelve True si hay que redibujar
+    global pos, render_dirty, _drawn_snap, _layout_topology, _node_index
+    snap=engine.store.snapshot() # Mismo objeto mientras la versión no cambie: sin copias
+    if snap.topology_version!=_layout_topology: # El layout incremental corre en su propio hilo; aquí solo se le avisa
+        layout.update_graph(snap.nodes,snap.edges);_layout_topology=snap.topology_version
+        _node_index={v:i for i,v in enumerate(snap.nodes)}
+    current_pos_copy=layout.positions() # Último layout publicado (nunca se espera al cálculo)
+    if snap is _drawn_snap and current_pos_copy is pos and not render_dirty:return False # Nada cambió
+    pos=current_pos_copy;_drawn_snap=snap;render_dirty=False
+    update_figure_title()
+    idx=_node_index;codes=np.zeros(len(snap.nodes),np.uint8) # Códigos por nodo y colores por tabla: sin bucle por arista
+    for code,names in ((NODE_ALL,('ALL',)),(NODE_ACTIVE,snap.active_nodes),(NODE_STALE,snap.stale),(NODE_SELECTED,snap.selected)):
+        codes[[idx[v] for v in names if v in idx]]=code
+    stale=None
+    if snap.stale:stale_n=np.zeros(len(codes),bool);stale_n[[idx[v] for v in snap.stale if v in idx]]=True;stale=stale_n[snap.edge_u]|stale_n[snap.edge_v]
+    e_cols,e_wids=edge_style(snap.edge_status,_edge_table,stale,EDGE_STYLE_STALE,snap.temp_visuals)
+    renderer.update(snap.topology_version,snap.nodes,snap.edge_u,snap.edge_v,current_pos_copy,_node_table[0][codes],e_cols,e_wids)
+    return True
+
+def _tick(): # Sustituye a FuncAnimation: solo se pide redibujar si update() detectó cambios
+    t0=time.perf_counter_ns();changed=update(None);_h_frame.record_ns(time.perf_counter_ns()-t0)
+    if changed:fig.canvas.draw_idle()
+
+def build_gui(args): # Arranca el motor y crea la figura; matplotlib solo se importa aquí
+    global engine, layout, fig, ax_main, renderer, timer, _figure_title_ax_main, _h_frame, edge_style, _edge_table, _node_table
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import RectangleSelector, LassoSelector
+    from espnow_render import GraphRenderer, style_table, edge_style # edge_style queda global: la usa update()
+    from espnow_layout import IncrementalLayout
+    kw=dict(port=args.port,routing_mode=args.routing,broadcast_interval=args.broadcast,journal_dir=args.journal,
+            checkpoint=args.checkpoint,checkpoint_interval=args.checkpoint_interval,
+            stale_after=args.stale_after,evict_after=args.evict_after,edge_stale_after=args.edge_stale_after,edge_evict_after=args.edge_evict_after,
+            metrics_port=args.metrics_port,workers=args.workers,port_range=args.port_range,
+            web_port=args.web_port,web_bind=args.web_bind,node_rate=args.node_rate,node_burst=args.node_burst,web_hosts=args.web_host)
+    if getattr(args,'split',False): # Motor, ingesta y layout en otro proceso (espnow_split)
+        from espnow_split import RemoteEngine
+        engine=RemoteEngine(kw,fixed={'ALL':pos['ALL']},on_message=update_figure_title,log_level=args.log_level,log_rate=args.log_rate).start()
+        layout=engine.layout
+    else:
+        engine=MonitorEngine(on_message=update_figure_title,**kw).start()
+        layout=IncrementalLayout(fixed={'ALL':pos['ALL']},initial=engine.topo.positions(),metrics=engine.metrics).start() # Posiciones del checkpoint: sin recalcular el layout
+        engine.positions_source=layout.positions
+    _h_frame=engine.metrics.histogram('frame_seconds',"update() de la GUI por tick (instantánea -> renderer)")
+    fig=plt.figure(figsize=(13,9));ax_main=fig.add_axes([0.05,0.08,0.9,0.88]);ax_main.set_axis_off()
+    fig.canvas.mpl_connect('button_press_event',on_click);fig.canvas.mpl_connect('key_press_event',on_key);_figure_title_ax_main=ax_main
+    _selectors['box']=RectangleSelector(ax_main,on_select_box,useblit=True,interactive=False);_selectors['lasso']=LassoSelector(ax_main,on_select_lasso,useblit=True)
+    for w in _selectors.values():w.set_active(False) # Se activan con 'b' / 'n'
+    renderer=GraphRenderer(ax_main,node_size=700,edge_width=STYLE_NORMAL,font_size=8);_edge_table=style_table(EDGE_STYLE);_node_table=style_table(NODE_STYLE)
+    timer=fig.canvas.new_timer(interval=300);timer.add_callback(_tick);timer.start()
+    return plt
+
+if __name__=='__main__':
+    _ap=add_arguments(argparse.ArgumentParser(description="Monitor ESP-NOW"))
+    _ap.add_argument('--headless',action='store_true',help="sin GUI: no se importa matplotlib")
+    _ap.add_argument('--split',action='store_true',help="motor e ingesta en otro proceso (estado por memoria compartida)")
+    ARGS=_ap.parse_args() # Como espnow_engine: una opción mal escrita es un error, no se ignora
+    if ARGS.headless or ARGS.traffic:raise SystemExit(run_headless(ARGS))
+    setup_logging(ARGS.log_level,ARGS.log_rate)
+    build_gui(ARGS).show()
+    layout.stop();engine.stop()
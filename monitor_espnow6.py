@@ -1,53 +1,77 @@
 # --- monitor_espnow6 ---
 
-import socket, re, threading, time, uuid
+import logging, socket, threading, uuid
 import networkx as nx
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib.widgets import Button
+from espnow_ingest import IngestEngine
+from espnow_layout import IncrementalLayout
+from espnow_expiry import ExpiryScheduler
+from espnow_routing import RoutingIndex
+from espnow_dispatch import RouteDispatcher
+from espnow_comms import CommTracker, STEP_RCVD, ESPNOW_SENT, DELIVERED, FAILED, TIMEOUT
+from espnow_log import get_logger, setup_logging
+from espnow_spatial import GridIndex
+from espnow_outbound import CommandScheduler
+from espnow_protocol import (parse_events, CmdEvent, AckRouteStep, AckEspnowSent, FailEspnowSent,
+                             RouteDelivered, JoinEvent, ReceivedEvent)
+
+# --- Logging (ESPNOW_LOG_LEVEL=DEBUG: cada datagrama y cada comando enviado, como los print de antes) ---
+setup_logging()
+log = get_logger('v6')
 
 # --- UDP ---
-UDP_PORT = 12345
-pattern_cmd = re.compile(r'<([0-9A-F:]{17})>\s+CMD:(\w+)(?:\s+([0-9A-F:]{17}))?(?:\s+(.*))?')
-pattern_recv = re.compile(r'RECEIVED\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})')
-pattern_route_delivered = re.compile(r'ROUTE_DELIVERED\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)\s+(.*)') # final_dest prev_hop msg_id payload
-pattern_ack_route_step_rcvd = re.compile(r'ACK_ROUTE_STEP_RECEIVED\s+([0-9A-F:]{17})\s+([\w-]+)') # self_mac msg_id
-pattern_ack_route_espnow_sent = re.compile(r'ACK_ROUTE_ESPNOW_SENT\s+([0-9A-F:]{17})\s+([0-9A-F:]{17})\s+([\w-]+)') # self_mac sent_to_mac msg_id
-
+UDP_PORT = 12345 # Formato de las líneas: ver espnow_protocol.py
 
 # --- Grafo y estado ---
 G = nx.Graph()
-lock = threading.Lock()
+lock = threading.RLock() # Reentrante: IngestEngine lo retiene durante todo el lote
 mac_ip = {}      # MAC -> (ip,port)
 edge_colors = {} # (u,v)->color
 pos = {}
 recompute = True
 selected = []
-active_routes_viz = {} # msg_id -> {'path': [(u,v), ...], 'color': 'purple', 'status': 'pending'}
+pick_index = GridIndex() # Nodo bajo el clic sin recorrer todos (solo lo usa on_click, en el hilo de la GUI)
+ROUTE_COLORS = {DELIVERED: 'lime', FAILED: 'maroon', TIMEOUT: 'maroon'} # Estados sin entrada: 'purple' (en curso)
 
 # Inicializar nodo ALL
 G.add_node('ALL')
+layout = IncrementalLayout().start()
+expiry = ExpiryScheduler(lock=lock).start() # Un solo hilo para las limpiezas diferidas (antes un threading.Timer por evento)
+routing = RoutingIndex() # Adyacencia entre nodos ESP (sin 'ALL') + árboles BFS en caché para DFS/BFS
+routes = CommTracker(expiry, retention=10.0) # Antes active_routes_viz: las rutas terminadas se pintan 10 s y se retiran
 
 # --- Socket UDP ---
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 sock.bind(('', UDP_PORT))
+outbound = CommandScheduler(sock).start() # Cola y ritmo por nodo (el firmware lee un datagrama por loop()); un solo hilo envía
+
+def add_edge(u, v):
+    # G.add_edge + índice de rutas; las aristas hacia 'ALL' no cuentan para las rutas
+    G.add_edge(u, v)
+    if u != 'ALL' and v != 'ALL': routing.set_edge(u, v, True)
+
+def remove_edge(u, v):
+    G.remove_edge(u, v)
+    routing.set_edge(u, v, False)
 
 def handle_interaction(src, dst):
     if src not in mac_ip:
-        print(f"[!] No conozco la IP de {src}")
+        log.warning("[!] No conozco la IP de %s", src)
         return
     cmd = f"UNICAST {dst} datos_test\n".encode()
-    sock.sendto(cmd, mac_ip[src])
+    outbound.send(cmd, mac_ip[src])
     with lock:
         if G.has_node(src) and G.has_node(dst):
-            G.add_edge(src, dst)
+            add_edge(src, dst)
             edge_colors[tuple(sorted((src, dst)))] = 'black' # Usar tupla ordenada
             # edge_colors[(dst, src)] = 'black' # No es necesario para grafos no dirigidos si la clave es ordenada
-            print(f"[>] Intentando enviar datos de {src} a {dst}. Arista negra añadida.")
+            log.info("[>] Intentando enviar datos de %s a %s. Arista negra añadida.", src, dst)
         else:
-            print(f"[!] Error: Nodos {src} o {dst} no encontrados.")
+            log.warning("[!] Error: Nodos %s o %s no encontrados.", src, dst)
 
 
 def on_click(event):
@@ -57,28 +81,21 @@ def on_click(event):
     if event.inaxes is None or event.inaxes != ax_main:
         return
 
-    clicked_node = None
-    with lock:
-        current_pos = dict(pos)
-    min_dist_sq = 0.0025
-    for n, (x_node, y_node) in current_pos.items():
-        if n == 'ALL': continue
-        if event.xdata is None or event.ydata is None:
-            continue
-        dist_sq = (x_node - event.xdata)**2 + (y_node - event.ydata)**2
-        if dist_sq < min_dist_sq:
-            clicked_node = n
-            break
+    if event.xdata is None or event.ydata is None:
+        return
+    # El más cercano dentro del radio (antes el primero que apareciera), por índice espacial
+    pick_index.update(pos) # pos es el diccionario publicado por el layout: inmutable
+    clicked_node = pick_index.nearest(event.xdata, event.ydata, 0.0025 ** 0.5, skip=('ALL',))
     if clicked_node:
         if clicked_node not in selected:
             if len(selected) < 2:
                 selected.append(clicked_node)
-                print("Seleccionado:", clicked_node, "- Nodos seleccionados:", selected)
+                log.info("Seleccionado: %s - Nodos seleccionados: %s", clicked_node, selected)
             else:
-                print(f"Ya hay 2 nodos seleccionados: {selected}. Deselecciona o inicia ruta.")
+                log.info("Ya hay 2 nodos seleccionados: %s. Deselecciona o inicia ruta.", selected)
         else:
             selected.remove(clicked_node)
-            print("Deseleccionado:", clicked_node, "- Nodos seleccionados:", selected)
+            log.info("Deseleccionado: %s - Nodos seleccionados: %s", clicked_node, selected)
         recompute = True
 
 
@@ -86,25 +103,20 @@ def remove_edge_or_mark_failed(u, v, failed=False, msg_id=None):
     global recompute
     with lock:
         if not G.has_node(u) or not G.has_node(v):
-            print(f"[!] Intento de operar en arista ({u}-{v}) pero uno o ambos nodos no existen en G.")
+            log.warning("[!] Intento de operar en arista (%s-%s) pero uno o ambos nodos no existen en G.", u, v)
             return
         if not G.has_edge(u,v):
-            G.add_edge(u,v)
-            print(f"[i] Arista ({u}-{v}) no existía, añadida para marcar estado.")
+            add_edge(u,v)
+            log.debug("[i] Arista (%s-%s) no existía, añadida para marcar estado.", u, v)
 
         color = 'red' if failed else 'green'
         edge_colors[tuple(sorted((u,v)))] = color
         status_msg = "Falló" if failed else "Éxito"
-        print(f"[{'+' if not failed else '-'}] {status_msg} en comunicación entre {u} y {v}.")
+        log.info("[%s] %s en comunicación entre %s y %s.", '-' if failed else '+', status_msg, u, v)
         if not failed:
-            is_part_of_active_route = False
-            for route_id, route_data in active_routes_viz.items():
-                if isinstance(route_data, dict) and 'path' in route_data:
-                    if tuple(sorted((u,v))) in route_data['path']:
-                        is_part_of_active_route = True
-                        break
+            is_part_of_active_route = bool(routes.on_edge(tuple(sorted((u,v)))))
             if not is_part_of_active_route:
-                threading.Timer(1.0, lambda: _remove_successful_edge(u,v)).start()
+                expiry.schedule(1.0, _remove_successful_edge, u, v, key=('success_edge', tuple(sorted((u,v)))))
         recompute = True
 
 def _remove_successful_edge(u,v):
@@ -112,121 +124,80 @@ def _remove_successful_edge(u,v):
     edge_key = tuple(sorted((u,v)))
     with lock:
         if G.has_edge(u,v) and edge_colors.get(edge_key) == 'green':
-            G.remove_edge(u,v)
+            remove_edge(u,v)
             edge_colors.pop(edge_key, None)
-            print(f"[–] Arista removida entre {u} y {v} tras confirmación.")
+            log.debug("[–] Arista removida entre %s y %s tras confirmación.", u, v)
             recompute = True
 
 
 def _execute_routed_send(path, msg_id, payload, route_type="DFS"):
-    global active_routes_viz, recompute
-    print(f"Ejecutando ruta {route_type} ID: {msg_id}, Path: {path}, Payload: {payload}")
+    global recompute
+    log.info("Ejecutando ruta %s ID: %s, Path: %s, Payload: %s", route_type, msg_id, path, payload)
     path_edges_for_viz = []
     for i in range(len(path) - 1):
         path_edges_for_viz.append(tuple(sorted((path[i], path[i+1]))))
+    # Solo se manda el primer ROUTE_STEP; los siguientes los lanza el dispatcher al llegar cada ACK_ROUTE_ESPNOW_SENT
     with lock:
-        active_routes_viz[msg_id] = {'path': path_edges_for_viz, 'color': 'purple', 'status': 'pending', 'steps_acked': 0}
+        routes.start(msg_id, route_type, path, path_edges_for_viz, timeout=dispatcher.budget(len(path)))
+        dispatcher.start(msg_id, path, payload)
         recompute = True
-    for i in range(len(path) - 1):
-        sender_mac = path[i]
-        receiver_mac = path[i+1]
-        final_dest_mac = path[-1]
-        if sender_mac not in mac_ip:
-            print(f"[!] Error en ruta {msg_id}: No conozco la IP de {sender_mac}. Abortando ruta.")
-            with lock:
-                if msg_id in active_routes_viz: # Chequear si aún existe
-                    active_routes_viz[msg_id]['status'] = 'failed_no_ip'
-                    active_routes_viz[msg_id]['color'] = 'maroon'
-                recompute = True
-            return
-        cmd_for_udp = f"ROUTE_STEP {receiver_mac} {final_dest_mac} {msg_id} {payload}\n".encode()
-        print(f"[ROUTE {msg_id}] Enviando UDP a {sender_mac} ({mac_ip.get(sender_mac)}) para que envíe a {receiver_mac} (Destino final: {final_dest_mac})")
-        sock.sendto(cmd_for_udp, mac_ip[sender_mac])
-        time.sleep(0.2)
+
+
+def _send_to_node(node, cmd_for_udp):
+    if node not in mac_ip:
+        log.warning("[!] No conozco la IP de %s. No se puede enviar: %s", node, cmd_for_udp.decode().strip())
+        return False
+    if log.isEnabledFor(logging.DEBUG): log.debug("[ROUTE] Enviando UDP a %s (%s): %s", node, mac_ip[node], cmd_for_udp.decode().strip())
+    outbound.send(cmd_for_udp, mac_ip[node], node) # ROUTE_STEP: se repite si no llega su ACK_ROUTE_STEP_RECEIVED
+    return True
+
+
+def _on_route_done(msg_id, ok, info):
+    # Fin de una ruta en el dispatcher: ok -> info es la latencia (s); si no, el motivo del fallo
+    global recompute
+    if ok:
+        log.info("[ROUTE %s] Entregada en %.0f ms", msg_id, info * 1000)
+        return
+    log.warning("[!] Ruta %s fallida: %s", msg_id, info)
+    if routes.advance(msg_id, FAILED, reason=info):
+        recompute = True
+
+
+def _on_route_retry(msg_id, hop, attempt):
+    log.info("[i] Ruta %s: reintento %s del salto %s", msg_id, attempt, hop)
+
+
+dispatcher = RouteDispatcher(_send_to_node, expiry, on_done=_on_route_done, on_retry=_on_route_retry)
 
 
 def handle_route_request(route_type_name):
-    global selected, recompute, G
+    global selected, recompute
     if len(selected) != 2:
-        print(f"[!] Para ruta {route_type_name}, selecciona un nodo de INICIO y uno de FIN.")
+        log.warning("[!] Para ruta %s, selecciona un nodo de INICIO y uno de FIN.", route_type_name)
         return
 
     start_node, end_node = selected[0], selected[1]
-    print(f"Calculando ruta {route_type_name} de {start_node} a {end_node}...")
-    print(f"NOTA: Si experimentas 'AttributeError' para dfs_path o bfs_path, considera actualizar networkx: pip install --upgrade networkx")
-
-    path = None
-    pathfinding_exception = None
+    log.info("Calculando ruta %s de %s a %s...", route_type_name, start_node, end_node)
 
     with lock:
-        current_G_nodes = [n for n in G.nodes() if n != 'ALL']
-        if not current_G_nodes or start_node not in current_G_nodes or end_node not in current_G_nodes:
-            print("[!] Nodos de inicio o fin no válidos o no hay nodos ESP en el grafo actual.")
+        if start_node == 'ALL' or end_node == 'ALL' or not G.has_node(start_node) or not G.has_node(end_node):
+            log.warning("[!] Nodos de inicio o fin no válidos o no hay nodos ESP en el grafo actual.")
             selected.clear()
             recompute = True
             return
-        H = G.subgraph(current_G_nodes).copy()
-
-    # --- Bloque de Depuración para el subgrafo H ---
-    print(f"\n--- [DEBUG RUTA {route_type_name}] ---")
-    print(f"Subgrafo H para ruta de {start_node} a {end_node}:")
-    print(f"Nodos en H: {list(H.nodes())}")
-    print(f"Aristas en H: {list(H.edges())}")
-    if H.has_node(start_node) and H.has_node(end_node):
-        print(f"Chequeo general nx.has_path(H, {start_node}, {end_node}): {nx.has_path(H, start_node, end_node)}")
-    else:
-        print(f"Start_node ({start_node}) o end_node ({end_node}) no está en H.")
-    print(f"--- [FIN DEBUG RUTA {route_type_name}] ---\n")
-    # --- Fin Bloque de Depuración ---
-
-    try:
-        if not H.has_node(start_node):
-            raise nx.NodeNotFound(f"Nodo de inicio {start_node} no encontrado en el subgrafo de nodos ESP.")
-        if not H.has_node(end_node):
-            raise nx.NodeNotFound(f"Nodo de fin {end_node} no encontrado en el subgrafo de nodos ESP.")
-
+        # Índice incremental: BFS usa el árbol en caché del origen; DFS recorre la adyacencia
         if route_type_name == "DFS":
-            try:
-                path = nx.dfs_path(H, source=start_node, target=end_node)
-            except AttributeError:
-                print("[i] nx.dfs_path no encontrado, usando alternativa basada en predecesores (NetworkX < 2.6).")
-                if start_node == end_node:
-                    path = [start_node]
-                else:
-                    pred = nx.dfs_predecessors(H, source=start_node)
-                    if end_node not in pred and end_node != start_node :
-                         raise nx.NetworkXNoPath(f"No hay camino DFS de {start_node} a {end_node} (end_node no en predecesores).")
-                    path_reconstructed = [end_node]
-                    curr = end_node
-                    while curr != start_node:
-                        if curr not in pred:
-                            raise nx.NetworkXNoPath(f"Camino DFS interrumpido al reconstruir desde {end_node} a {start_node} en {curr}.")
-                        curr = pred[curr]
-                        path_reconstructed.append(curr)
-                    path = path_reconstructed[::-1]
-        elif route_type_name == "BFS":
-            try:
-                path = nx.bfs_path(H, source=start_node, target=end_node)
-            except AttributeError:
-                print("[i] nx.bfs_path no encontrado, usando nx.shortest_path como alternativa (NetworkX < 2.6).")
-                path = nx.shortest_path(H, source=start_node, target=end_node)
-    except nx.NetworkXNoPath as e:
-        pathfinding_exception = e
-        print(f"[!] No se encontró ruta {route_type_name} entre {start_node} y {end_node}: {e}")
-    except nx.NodeNotFound as e:
-        pathfinding_exception = e
-        print(f"[!] Nodo no encontrado en el subgrafo para la ruta {route_type_name}: {e}")
-    except Exception as e:
-        pathfinding_exception = e
-        print(f"[!] Error inesperado al calcular la ruta {route_type_name}: {e}")
+            path = routing.dfs_path(start_node, end_node)
+        else:
+            path = routing.path(start_node, end_node)
 
     if path:
-        print(f"[*] Ruta {route_type_name} encontrada: {path}")
+        log.info("[*] Ruta %s encontrada: %s", route_type_name, path)
         msg_id = str(uuid.uuid4())[:8]
         payload = f"Ruta{route_type_name}_{msg_id[:4]}"
-        threading.Thread(target=_execute_routed_send, args=(path, msg_id, payload, route_type_name), daemon=True).start()
+        _execute_routed_send(path, msg_id, payload, route_type_name) # Ya no bloquea: sin hilo por ruta
     else:
-        print(f"[i] No se pudo enviar la ruta {route_type_name} debido a errores previos o no se encontró camino.")
+        log.info("[i] No se pudo enviar la ruta %s debido a errores previos o no se encontró camino.", route_type_name)
     selected.clear()
     recompute = True
 
@@ -238,152 +209,173 @@ def on_bfs_button_clicked(event):
     handle_route_request("BFS")
 
 
-def listener():
-    global recompute, G, mac_ip, edge_colors, active_routes_viz
-    while True:
-        try:
-            data, addr = sock.recvfrom(1024)
-            line = data.decode().strip()
-            print(f"[UDP_RX from {addr}] {line}")
-
-            m_ack_step_rcvd = pattern_ack_route_step_rcvd.match(line)
-            if m_ack_step_rcvd:
-                node_mac, msg_id = m_ack_step_rcvd.groups()
-                print(f"[ROUTE_ACK_UDP] Nodo {node_mac} recibió comando para ruta {msg_id}")
-                with lock:
-                    if msg_id in active_routes_viz:
-                        active_routes_viz[msg_id]['status'] = f'step_rcvd_by_{node_mac}'
-                continue
-
-            m_ack_espnow_sent = pattern_ack_route_espnow_sent.match(line)
-            if m_ack_espnow_sent:
-                sender_mac, sent_to_mac, msg_id = m_ack_espnow_sent.groups()
-                print(f"[ROUTE_ACK_ESPNOW] Nodo {sender_mac} envió ESP-NOW a {sent_to_mac} para ruta {msg_id}")
-                edge_key = tuple(sorted((sender_mac, sent_to_mac)))
-                with lock:
-                    if msg_id in active_routes_viz:
-                        active_routes_viz[msg_id]['status'] = f'espnow_sent_{sender_mac}_to_{sent_to_mac}'
-                        active_routes_viz[msg_id]['steps_acked'] = active_routes_viz[msg_id].get('steps_acked',0) + 1
-                        if G.has_edge(sender_mac, sent_to_mac): # Asegurarse que la arista existe
-                                edge_colors[edge_key] = 'cyan'
-                        else: # Si no existe, añadirla para colorear
-                            G.add_edge(sender_mac,sent_to_mac)
-                            edge_colors[edge_key] = 'cyan'
-                        recompute = True
-                continue
-
-            m_route_delivered = pattern_route_delivered.match(line)
-            if m_route_delivered:
-                final_dest, prev_hop, msg_id, payload = m_route_delivered.groups()
-                print(f"[ROUTE_DELIVERED] Mensaje {msg_id} llegó a {final_dest} desde {prev_hop}. Payload: {payload}")
-                edge_key = tuple(sorted((prev_hop, final_dest)))
-                with lock:
-                    if msg_id in active_routes_viz:
-                        active_routes_viz[msg_id]['status'] = 'delivered'
-                        active_routes_viz[msg_id]['color'] = 'lime'
-                        if G.has_edge(prev_hop, final_dest): # Asegurarse que la arista existe
-                            edge_colors[edge_key] = 'lime'
-                        else: # Si no existe, añadirla para colorear
-                            G.add_edge(prev_hop, final_dest)
-                            edge_colors[edge_key] = 'lime'
-                        recompute = True
-                        # Limpiar la ruta de la visualización después de un tiempo
-                        threading.Timer(10.0, lambda mid: active_routes_viz.pop(mid, None), args=[msg_id]).start()
-                continue
-
-            m_recv = pattern_recv.match(line)
-            if m_recv:
-                receiver_mac, original_sender_mac = m_recv.groups()
-                print(f"[<] Confirmación UNICAST: {receiver_mac} recibió de {original_sender_mac}")
-                remove_edge_or_mark_failed(original_sender_mac, receiver_mac, failed=False)
-                continue
-
-            m_cmd = pattern_cmd.search(line)
-            if m_cmd:
-                mac_origin, cmd_type, target_mac_info, cmd_payload = m_cmd.groups()
-                mac_ip[mac_origin] = addr
-
-                with lock:
-                    if not G.has_node(mac_origin):
-                        G.add_node(mac_origin)
-                        print(f"[+] Nuevo nodo añadido: {mac_origin} (IP: {addr})")
-                        recompute = True
-                    
-                    # Si target_mac_info (ej. el emisor de un broadcast ESP-NOW) está presente, añadirlo también si no existe
-                    if target_mac_info and not G.has_node(target_mac_info):
-                         G.add_node(target_mac_info)
-                         print(f"[+] Nuevo nodo (desde target_mac_info) añadido: {target_mac_info}")
-                         recompute = True
-
-                    if cmd_type == "JOIN":
-                        if not G.has_edge(mac_origin, 'ALL'):
-                            G.add_edge(mac_origin, 'ALL')
-                            edge_colors[tuple(sorted((mac_origin, 'ALL')))] = 'gray'
-                            print(f"[*] Nodo {mac_origin} se unió (conectado a ALL).")
-                            recompute = True
-                    elif cmd_type == "BROADCAST_RECV" and target_mac_info:
-                        # mac_origin es el nodo que recibió el broadcast ESP-NOW y está reportando vía UDP.
-                        # target_mac_info es el nodo que originalmente emitió el broadcast ESP-NOW.
-                        print(f"[*] Nodo {mac_origin} recibió broadcast ESP-NOW de {target_mac_info} (Payload: {cmd_payload})")
-                        # Conectar mac_origin a 'ALL' (ya que participó en un broadcast)
-                        if not G.has_edge(mac_origin, 'ALL'):
-                            G.add_edge(mac_origin, 'ALL')
-                            edge_colors[tuple(sorted((mac_origin, 'ALL')))] = 'gray'
-                            recompute = True
-                        # Añadir arista de vecindad entre el receptor y el emisor del broadcast ESP-NOW
-                        if mac_origin != target_mac_info: # Evitar auto-bucles
-                            edge = tuple(sorted((mac_origin, target_mac_info)))
-                            if not G.has_edge(edge[0], edge[1]):
-                                G.add_edge(edge[0], edge[1])
-                                edge_colors[edge] = 'lightsteelblue' # Color para aristas descubiertas
-                                print(f"[*] Arista de vecindad (por broadcast ESP-NOW) añadida: {edge[0]} <-> {edge[1]}")
-                                recompute = True
-                    elif cmd_type == "SEND_FAIL_TO" and target_mac_info:
-                        print(f"[!] {mac_origin} reporta FALLO ESP-NOW a {target_mac_info}")
-                        if not G.has_node(target_mac_info): G.add_node(target_mac_info)
-                        remove_edge_or_mark_failed(mac_origin, target_mac_info, failed=True)
-                    elif cmd_type == "UNICAST_RECV" and target_mac_info:
-                        # mac_origin es el que recibió el UNICAST ESP-NOW.
-                        # target_mac_info es el que envió el UNICAST ESP-NOW.
-                        print(f"[<] {mac_origin} reporta UNICAST_RECV de {target_mac_info}")
-                        edge_key = tuple(sorted((mac_origin, target_mac_info)))
-                        if not G.has_edge(mac_origin, target_mac_info):
-                            G.add_edge(mac_origin, target_mac_info)
-                            edge_colors[edge_key] = 'blue' # Arista por unicast exitoso
-                            recompute = True
-                continue
-
-            # Manejo de JOIN simple (si aún se usa, aunque el CMD:JOIN es más robusto)
-            if line.startswith("JOIN "):
-                parts = line.split()
-                if len(parts) > 1:
-                    mac = parts[1]
-                    mac_ip[mac] = addr
-                    with lock:
-                        if not G.has_node(mac):
-                            G.add_node(mac); recompute = True
-                            print(f"[+] Nuevo nodo (JOIN simple): {mac}")
-                        if not G.has_edge(mac,'ALL'):
-                            G.add_edge(mac,'ALL')
-                            edge_colors[tuple(sorted((mac,'ALL')))] = 'gray'
-                            print(f"[*] Nodo {mac} se unió (JOIN simple, conectado a ALL).")
-                            recompute = True
-        except UnicodeDecodeError:
-            print(f"[!] Error de decodificación UDP de {addr}")
-        except ConnectionResetError:
-            print(f"[!] Conexión reseteada por el peer: {addr}")
-        except Exception as e:
-            print(f"[!] Excepción en listener: {e} (tipo: {type(e)}) (linea: {line if 'line' in locals() else 'N/A'})")
-
-
-threading.Thread(target=listener, daemon=True).start()
+def _on_ack_route_step(ev, addr):
+    log.debug("[ROUTE_ACK_UDP] Nodo %s recibió comando para ruta %s", ev.node, ev.msg_id)
+    with lock:
+        routes.advance(ev.msg_id, STEP_RCVD, detail=ev.node)
+        dispatcher.on_step_ack(ev.msg_id, ev.node)
+    outbound.ack_step(ev.node, ev.msg_id)
+
+
+def _on_ack_espnow_sent(ev, addr):
+    global recompute
+    sender_mac, sent_to_mac, msg_id = ev.sender, ev.sent_to, ev.msg_id
+    log.debug("[ROUTE_ACK_ESPNOW] Nodo %s envió ESP-NOW a %s para ruta %s", sender_mac, sent_to_mac, msg_id)
+    edge_key = tuple(sorted((sender_mac, sent_to_mac)))
+    with lock:
+        dispatcher.on_espnow_sent(msg_id, sender_mac, sent_to_mac) # Siguiente salto
+        if routes.advance(msg_id, ESPNOW_SENT, detail=sender_mac):
+            if G.has_edge(sender_mac, sent_to_mac): # Asegurarse que la arista existe
+                    edge_colors[edge_key] = 'cyan'
+            else: # Si no existe, añadirla para colorear
+                add_edge(sender_mac,sent_to_mac)
+                edge_colors[edge_key] = 'cyan'
+            recompute = True
+
+
+def _on_fail_espnow_sent(ev, addr):
+    # El firmware no pudo encolar el ESP-NOW de un salto (esp_now_send != ESP_OK)
+    global recompute
+    log.warning("[ROUTE_FAIL_ESPNOW] Nodo %s no pudo enviar ESP-NOW a %s para ruta %s (ERR:%s)", ev.sender, ev.sent_to, ev.msg_id, ev.error)
+    with lock:
+        if not dispatcher.on_espnow_failed(ev.msg_id, ev.sender, ev.sent_to): # Si la ruta sigue en vuelo se reintenta el salto
+            routes.advance(ev.msg_id, FAILED, detail=ev.sender, reason='espnow')
+        if G.has_node(ev.sender) and G.has_node(ev.sent_to):
+            remove_edge_or_mark_failed(ev.sender, ev.sent_to, failed=True)
+        recompute = True
+
+
+def _on_route_delivered(ev, addr):
+    global recompute
+    final_dest, prev_hop, msg_id, payload = ev.final_dest, ev.prev_hop, ev.msg_id, ev.payload
+    log.info("[ROUTE_DELIVERED] Mensaje %s llegó a %s desde %s. Payload: %s", msg_id, final_dest, prev_hop, payload)
+    edge_key = tuple(sorted((prev_hop, final_dest)))
+    with lock:
+        dispatcher.on_delivered(msg_id, final_dest, prev_hop) # Avisa a los intermedios (ROUTE_MSG_ACKNOWLEDGED)
+        if routes.advance(msg_id, DELIVERED, detail=final_dest): # La retirada tras 10 s la hace el tracker
+            if G.has_edge(prev_hop, final_dest): # Asegurarse que la arista existe
+                edge_colors[edge_key] = 'lime'
+            else: # Si no existe, añadirla para colorear
+                add_edge(prev_hop, final_dest)
+                edge_colors[edge_key] = 'lime'
+            recompute = True
+
+
+def _on_received(ev, addr):
+    log.debug("[<] Confirmación UNICAST: %s recibió de %s", ev.receiver, ev.sender)
+    remove_edge_or_mark_failed(ev.sender, ev.receiver, failed=False)
+
+
+def _on_cmd(ev, addr):
+    global recompute
+    mac_origin, cmd_type, target_mac_info, cmd_payload = ev.mac, ev.cmd, ev.target, ev.payload
+    mac_ip[mac_origin] = addr
+
+    with lock:
+        if not G.has_node(mac_origin):
+            G.add_node(mac_origin)
+            log.info("[+] Nuevo nodo añadido: %s (IP: %s)", mac_origin, addr)
+            recompute = True
+        
+        # Si target_mac_info (ej. el emisor de un broadcast ESP-NOW) está presente, añadirlo también si no existe
+        if target_mac_info and not G.has_node(target_mac_info):
+             G.add_node(target_mac_info)
+             log.info("[+] Nuevo nodo (desde target_mac_info) añadido: %s", target_mac_info)
+             recompute = True
+
+        if cmd_type == "JOIN":
+            if not G.has_edge(mac_origin, 'ALL'):
+                add_edge(mac_origin, 'ALL')
+                edge_colors[tuple(sorted((mac_origin, 'ALL')))] = 'gray'
+                log.info("[*] Nodo %s se unió (conectado a ALL).", mac_origin)
+                recompute = True
+        elif cmd_type == "BROADCAST_RECV" and target_mac_info:
+            # mac_origin es el nodo que recibió el broadcast ESP-NOW y está reportando vía UDP.
+            # target_mac_info es el nodo que originalmente emitió el broadcast ESP-NOW.
+            log.debug("[*] Nodo %s recibió broadcast ESP-NOW de %s (Payload: %s)", mac_origin, target_mac_info, cmd_payload)
+            # Conectar mac_origin a 'ALL' (ya que participó en un broadcast)
+            if not G.has_edge(mac_origin, 'ALL'):
+                add_edge(mac_origin, 'ALL')
+                edge_colors[tuple(sorted((mac_origin, 'ALL')))] = 'gray'
+                recompute = True
+            # Añadir arista de vecindad entre el receptor y el emisor del broadcast ESP-NOW
+            if mac_origin != target_mac_info: # Evitar auto-bucles
+                edge = tuple(sorted((mac_origin, target_mac_info)))
+                if not G.has_edge(edge[0], edge[1]):
+                    add_edge(edge[0], edge[1])
+                    edge_colors[edge] = 'lightsteelblue' # Color para aristas descubiertas
+                    log.info("[*] Arista de vecindad (por broadcast ESP-NOW) añadida: %s <-> %s", edge[0], edge[1])
+                    recompute = True
+        elif cmd_type == "SEND_FAIL_TO" and target_mac_info:
+            log.warning("[!] %s reporta FALLO ESP-NOW a %s", mac_origin, target_mac_info)
+            if not G.has_node(target_mac_info): G.add_node(target_mac_info)
+            remove_edge_or_mark_failed(mac_origin, target_mac_info, failed=True)
+        elif cmd_type == "UNICAST_RECV" and target_mac_info:
+            # mac_origin es el que recibió el UNICAST ESP-NOW.
+            # target_mac_info es el que envió el UNICAST ESP-NOW.
+            log.debug("[<] %s reporta UNICAST_RECV de %s", mac_origin, target_mac_info)
+            edge_key = tuple(sorted((mac_origin, target_mac_info)))
+            if not G.has_edge(mac_origin, target_mac_info):
+                add_edge(mac_origin, target_mac_info)
+                edge_colors[edge_key] = 'blue' # Arista por unicast exitoso
+                recompute = True
+
+
+def _on_join(ev, addr):
+    # Manejo de JOIN simple (si aún se usa, aunque el CMD:JOIN es más robusto)
+    global recompute
+    mac = ev.mac
+    mac_ip[mac] = addr
+    with lock:
+        if not G.has_node(mac):
+            G.add_node(mac); recompute = True
+            log.info("[+] Nuevo nodo (JOIN simple): %s", mac)
+        if not G.has_edge(mac,'ALL'):
+            add_edge(mac,'ALL')
+            edge_colors[tuple(sorted((mac,'ALL')))] = 'gray'
+            log.info("[*] Nodo %s se unió (JOIN simple, conectado a ALL).", mac)
+            recompute = True
+
+
+# Tabla de despacho: tipo de evento (ver espnow_protocol.py) -> manejador
+EVENT_HANDLERS = {
+    AckRouteStep: _on_ack_route_step,
+    AckEspnowSent: _on_ack_espnow_sent,
+    FailEspnowSent: _on_fail_espnow_sent,
+    RouteDelivered: _on_route_delivered,
+    ReceivedEvent: _on_received,
+    CmdEvent: _on_cmd,
+    JoinEvent: _on_join,
+}
+
+
+def procesar_datagrama(data, addr):
+    try:
+        if log.isEnabledFor(logging.DEBUG): log.debug("[UDP_RX from %s] %s", addr, data.decode('utf-8', 'replace').strip())
+        for ev in parse_events(data):  # Un datagrama agrupado trae varios eventos
+            handler = EVENT_HANDLERS.get(type(ev))
+            if handler:
+                handler(ev, addr)
+    except ConnectionResetError:
+        log.warning("[!] Conexión reseteada por el peer: %s", addr)
+    except Exception as e:
+        log.error("[!] Excepción en listener: %s (tipo: %s) (datagrama: %r)", e, type(e), data)
+
+
+def procesar_lote(batch):
+    # IngestEngine llama aquí con `lock` ya tomado: un solo acquire por lote
+    for data, addr in batch:
+        procesar_datagrama(data, addr)
+
+
+ingest = IngestEngine(sock, procesar_lote, lock=lock).start()
 
 def broadcaster():
     # Este broadcaster es para que los ESPs sepan la IP del servidor Python
     # y puedan enviar sus mensajes JOIN o de estado.
-    print("[i] Enviando broadcast ping UDP para descubrimiento del servidor...")
-    sock.sendto(b'BROADCAST ping_servidor_python\n', ('255.255.255.255', UDP_PORT))
-    threading.Timer(15, broadcaster).start() # Aumentado a 15 segundos para reducir spam
+    log.debug("[i] Enviando broadcast ping UDP para descubrimiento del servidor...")
+    outbound.send(b'BROADCAST ping_servidor_python\n', ('255.255.255.255', UDP_PORT))
+    expiry.schedule(15, broadcaster, key=('broadcast',)) # Antes un threading.Timer nuevo (no daemon) por vuelta: el proceso no acababa al cerrar la ventana
 broadcaster() # Iniciar el broadcaster
 
 # --- Configuración de la Figura y Axes (FUERA de update) ---
@@ -417,31 +409,13 @@ def update(frame):
             dfs_button.ax.set_visible(False)
             bfs_button.ax.set_visible(False)
 
-        if current_G.number_of_nodes() == 0:
-            pos = {}
-        elif recompute or not pos or not all(n in pos for n in current_G.nodes()) or \
-             any(n not in current_G.nodes() for n in pos if len(pos) != len(current_G.nodes())):
-            try:
-                if len(current_G.nodes()) == 1:
-                    pos = {list(current_G.nodes())[0]: (0.5,0.5)}
-                else:
-                    seed_pos = {k: v for k, v in pos.items() if k in current_G.nodes()}
-                    if not seed_pos or len(seed_pos) < len(current_G.nodes()) / 2 : seed_pos = None
-                    if current_G.number_of_nodes() > 1:
-                        pos = nx.kamada_kawai_layout(current_G, pos=seed_pos, dim=2)
-                    elif seed_pos:
-                        pos = seed_pos
-                    else:
-                        pos = {list(current_G.nodes())[0]: (0.5,0.5)}
-                print("[i] Recalculando layout.")
-            except Exception as e_layout:
-                print(f"[!] Error en layout Kamada-Kawai ({e_layout}), usando Spring.")
-                try:
-                    pos = nx.spring_layout(current_G, k=0.5, iterations=50, pos=pos if pos and all(n in current_G.nodes() for n in pos) else None)
-                except Exception as e_spring:
-                    print(f"[!] Error en layout Spring ({e_spring}), intentando layout aleatorio.")
-                    pos = nx.random_layout(current_G)
+        # El layout incremental (espnow_layout.py) sustituye a kamada_kawai_layout
+        # sobre el grafo completo: aquí solo se le avisa de los cambios y se
+        # toma la última posición publicada, sin esperar al cálculo.
+        if recompute:
+            layout.update_graph(current_G.nodes(), current_G.edges())
             recompute = False
+        pos = layout.positions()
 
         node_colors_list = []
         for node_id in current_G.nodes():
@@ -449,7 +423,7 @@ def update(frame):
             elif node_id in selected: node_colors_list.append('yellow')
             else: node_colors_list.append('skyblue')
 
-        if current_G.number_of_nodes() > 0 and pos and len(pos) == current_G.number_of_nodes():
+        if current_G.number_of_nodes() > 0 and pos and all(n in pos for n in current_G.nodes()):
             nx.draw_networkx_nodes(current_G, pos, ax=ax_main, node_color=node_colors_list, node_size=700, alpha=0.9)
             edges_to_draw = list(current_G.edges())
             edge_color_list_to_draw = []
@@ -458,16 +432,9 @@ def update(frame):
                 edge_key = tuple(sorted((u_orig, v_orig)))
                 current_edge_color = 'gray'
                 current_edge_width = 2
-                is_active_route_edge = False
-                active_route_color_found = None
-                for msg_id_iter, route_data in active_routes_viz.items(): # Renombrar msg_id
-                    if isinstance(route_data, dict) and 'path' in route_data:
-                        if edge_key in route_data['path']:
-                            active_route_color_found = route_data.get('color', 'purple')
-                            is_active_route_edge = True
-                            break
-                if is_active_route_edge:
-                    current_edge_color = active_route_color_found
+                route_records = routes.on_edge(edge_key) # Índice por arista: sin recorrer todas las rutas
+                if route_records:
+                    current_edge_color = ROUTE_COLORS.get(route_records[0].state, 'purple')
                     current_edge_width = 3.5 if current_edge_color in ['purple', 'lime', 'maroon', 'cyan'] else 2.5
                 elif edge_key in edge_colors:
                     current_edge_color = edge_colors[edge_key]
@@ -478,10 +445,15 @@ def update(frame):
 
     title_str = f"Red ESP-NOW — Nodos: {len([n for n in current_G.nodes() if n!='ALL'])}"
     if selected: title_str += f" (Seleccionados: {len(selected)})"
-    active_route_count = sum(1 for r_data in active_routes_viz.values() if isinstance(r_data, dict) and r_data.get('status') not in ['delivered', 'failed_no_ip', 'timeout'])
+    active_route_count = routes.active_count()
     if active_route_count > 0:
         title_str += f" Rutas activas: {active_route_count}"
+    ing = ingest.stats()
+    title_str += f" | Cola UDP: {ing['queue_depth']}"
+    if ing['dropped']:
+        title_str += f" Descartes: {ing['dropped']}"
     ax_main.set_title(title_str)
 
 ani = FuncAnimation(fig, update, interval=500, cache_frame_data=False)
-plt.show()
\ No newline at end of file
+plt.show()
+expiry.cancel(('broadcast',)); outbound.stop()
\ No newline at end of file
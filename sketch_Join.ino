@@ -5,6 +5,9 @@
 
 #define LED_PIN   2  // LED integrado para envío general
 #define LED2_PIN  4  // D4 para confirmación de recepción UNICAST y actividad de RUTA
+#define USE_BINARY_WIRE 0  // 1: informes al servidor en formato binario (espnow_protocol.py) en vez de líneas de texto
+#define UDP_COALESCE_MS 0  // >0: junta los informes durante estos ms en un solo datagrama (menos paquetes en tormentas de broadcast)
+#define HEARTBEAT_MS 10000 // Repite el CMD:JOIN como latido: el monitor marca inactivo el nodo que calla (0 = solo al arrancar)
 
 const char* WIFI_SSID = "ActivoSo"; // Reemplaza con tu SSID
 const char* WIFI_PASS = "87654321"; // Reemplaza con tu contraseña
@@ -39,18 +42,104 @@ bool macStringToBytes(const char* macStr, uint8_t* bytes) {
                 &bytes[0], &bytes[1], &bytes[2], &bytes[3], &bytes[4], &bytes[5]) == 6;
 }
 
+// --- Formato binario: 0xE5, versión, opcode; MACs de 6 bytes, msg_id u32 big-endian, payload con u8 de longitud ---
+#define WIRE_MAGIC   0xE5
+#define WIRE_VERSION 1
+#define OP_JOIN             0x01
+#define OP_BROADCAST_RECV   0x02
+#define OP_UNICAST_RECV     0x03
+#define OP_JOIN_ESPNOW_RECV 0x04
+#define OP_ROUTED_DATA_RECV 0x05
+#define OP_SEND_FAIL_TO     0x06
+#define OP_CMD              0x0F
+#define OP_ACK_ROUTE_STEP   0x10
+#define OP_ACK_ESPNOW_SENT  0x11
+#define OP_FAIL_ESPNOW_SENT 0x12
+#define OP_ROUTE_DELIVERED  0x13
+#define OP_BATCH            0x20  // (longitud u16 | trama)* en un datagrama
+
+typedef struct {
+  uint8_t b[300];
+  size_t n;
+} wire_t; // En la pila de quien informa: onSent corre en la tarea de WiFi, no se comparte buffer con loop()
+
+void wireBegin(wire_t &w, uint8_t op) { w.b[0] = WIRE_MAGIC; w.b[1] = WIRE_VERSION; w.b[2] = op; w.n = 3; }
+void wireMac(wire_t &w, const uint8_t* mac) { memcpy(w.b + w.n, mac, 6); w.n += 6; }
+void wireSelfMac(wire_t &w) { uint8_t m[6]; WiFi.macAddress(m); wireMac(w, m); }
+void wireU32(wire_t &w, uint32_t v) { for (int i = 3; i >= 0; i--) w.b[w.n++] = (v >> (8 * i)) & 0xFF; }
+void wireMsgId(wire_t &w, const char* msgId) { wireU32(w, (uint32_t)strtoul(msgId, NULL, 16)); } // msg_id: hex de 8 cifras
+void wirePayload(wire_t &w, const char* s) {
+  size_t len = strnlen(s, 255);
+  w.b[w.n++] = (uint8_t)len; memcpy(w.b + w.n, s, len); w.n += len;
+}
+uint8_t wireRecvOp(const char* cmd) { // 0 si no tiene opcode propio (va como OP_CMD)
+  if (strcmp(cmd, "BROADCAST") == 0) return OP_BROADCAST_RECV;
+  if (strcmp(cmd, "UNICAST") == 0) return OP_UNICAST_RECV;
+  if (strcmp(cmd, "JOIN_ESPNOW") == 0) return OP_JOIN_ESPNOW_RECV;
+  if (strcmp(cmd, "ROUTED_DATA") == 0) return OP_ROUTED_DATA_RECV;
+  return 0;
+}
+// --- Datagramas agrupados (UDP_COALESCE_MS > 0) ---
+// Texto: líneas separadas por '\n'. Binario: trama OP_BATCH. Los callbacks de ESP-NOW (tarea WiFi) y loop()
+// añaden informes bajo coalesceMux; solo loop() envía el datagrama acumulado.
+#define COALESCE_MAX_BYTES 1400
+uint8_t coalesceBuf[COALESCE_MAX_BYTES];
+uint8_t coalesceOut[COALESCE_MAX_BYTES];
+size_t coalesceLen = 0;
+unsigned long coalesceSince = 0;
+portMUX_TYPE coalesceMux = portMUX_INITIALIZER_UNLOCKED;
+
+void sendRawUDP(const uint8_t* b, size_t n) {
+  udp.beginPacket(bcast, UDP_PORT); // Fallback a broadcast si no hay IP de servidor
+  udp.write(b, n);
+  udp.endPacket();
+}
+
+bool coalesceAppend(const uint8_t* b, size_t n) { // false si no cabe: el llamador lo envía suelto
+  bool ok = false;
+  portENTER_CRITICAL(&coalesceMux);
+  size_t head = (coalesceLen == 0 && USE_BINARY_WIRE) ? 3 : 0;
+  size_t need = head + n + (USE_BINARY_WIRE ? 2 : (coalesceLen ? 1 : 0));
+  if (coalesceLen + need <= COALESCE_MAX_BYTES) {
+    if (coalesceLen == 0) {
+      coalesceSince = millis();
+      if (USE_BINARY_WIRE) { coalesceBuf[0] = WIRE_MAGIC; coalesceBuf[1] = WIRE_VERSION; coalesceBuf[2] = OP_BATCH; coalesceLen = 3; }
+    }
+    if (USE_BINARY_WIRE) { coalesceBuf[coalesceLen++] = n >> 8; coalesceBuf[coalesceLen++] = n & 0xFF; }
+    else if (coalesceLen) coalesceBuf[coalesceLen++] = '\n';
+    memcpy(coalesceBuf + coalesceLen, b, n); coalesceLen += n;
+    ok = true;
+  }
+  portEXIT_CRITICAL(&coalesceMux);
+  return ok;
+}
+
+void flushCoalesced(bool force) { // Solo desde loop(): coalesceOut no se comparte
+  size_t n = 0;
+  portENTER_CRITICAL(&coalesceMux);
+  if (coalesceLen && (force || millis() - coalesceSince >= UDP_COALESCE_MS)) {
+    n = coalesceLen; memcpy(coalesceOut, coalesceBuf, n); coalesceLen = 0;
+  }
+  portEXIT_CRITICAL(&coalesceMux);
+  if (n) sendRawUDP(coalesceOut, n);
+}
+
 void sendUDP(const String &s) {
   // Intentar enviar a la IP específica del servidor si está definida y es válida
   // if (serverIP[0] != 0) { // Asumiendo que 0.0.0.0 no es una IP válida para el servidor
   //   udp.beginPacket(serverIP, UDP_PORT);
   // } else {
-     udp.beginPacket(bcast, UDP_PORT); // Fallback a broadcast si no hay IP de servidor
+  if (UDP_COALESCE_MS == 0 || !coalesceAppend((const uint8_t*)s.c_str(), s.length()))
+    sendRawUDP((const uint8_t*)s.c_str(), s.length());
   // }
-  udp.print(s);
-  udp.endPacket();
   Serial.print("UDP Sent: "); Serial.println(s);
 }
 
+void sendWire(const wire_t &w) {
+  if (UDP_COALESCE_MS == 0 || !coalesceAppend(w.b, w.n)) sendRawUDP(w.b, w.n);
+  Serial.printf("UDP Sent: trama binaria op 0x%02X, %u bytes\n", w.b[2], (unsigned)w.n);
+}
+
 void ensurePeer(const uint8_t* mac_addr) {
   if (esp_now_is_peer_exist(mac_addr)) return;
   esp_now_peer_info_t peer = {};
@@ -75,8 +164,12 @@ void onSent(const uint8_t* mac_addr, esp_now_send_status_t status) {
     blinkLed(LED_PIN, 1, 50);
   } else {
     blinkLed(LED_PIN, 3, 100);
+#if USE_BINARY_WIRE
+    wire_t w; wireBegin(w, OP_SEND_FAIL_TO); wireSelfMac(w); wireMac(w, mac_addr); sendWire(w);
+#else
     String failMsg = "<" + WiFi.macAddress() + "> CMD:SEND_FAIL_TO " + String(macStr);
     sendUDP(failMsg);
+#endif
   }
 }
 
@@ -122,7 +215,20 @@ void onRecv(const esp_now_recv_info_t* info, const uint8_t* data, int len) {
 
   // Informar al servidor Python sobre la recepción de este mensaje ESP-NOW
   // El formato es <MI_MAC_QUE_RECIBIO_ESPNOW> CMD:<COMANDO_ESPNOW_RECIBIDO>_RECV <MAC_QUE_ENVIO_ESPNOW> <TEXTO_DEL_ESPNOW>
+#if USE_BINARY_WIRE
+  {
+    wire_t w; uint8_t op = wireRecvOp(cmdTypeStr.c_str());
+    wireBegin(w, op ? op : OP_CMD); wireSelfMac(w);
+    if (!op) { // OP_CMD: nombre del comando con longitud, flag de objetivo y objetivo
+      String c = cmdTypeStr + "_RECV";
+      w.b[w.n++] = (uint8_t)c.length(); memcpy(w.b + w.n, c.c_str(), c.length()); w.n += c.length();
+      w.b[w.n++] = 1;
+    }
+    wireMac(w, info->src_addr); wirePayload(w, m.text); sendWire(w);
+  }
+#else
   sendUDP("<" + myMac + "> CMD:" + cmdTypeStr + "_RECV " + String(srcMacStr) + " " + String(m.text));
+#endif
 
   if (strcmp(m.command, "UNICAST") == 0) {
     Serial.println("Comando UNICAST recibido vía ESP-NOW. Confirmando...");
@@ -155,7 +261,12 @@ void onRecv(const esp_now_recv_info_t* info, const uint8_t* data, int len) {
       if (myMac.equalsIgnoreCase(final_dest_mac_in_msg)) {
         Serial.println("  >> ESTE ESP ES EL DESTINO FINAL DE LA RUTA! <<");
         // Informar al servidor Python que el mensaje ha sido entregado
+#if USE_BINARY_WIRE
+        wire_t w; wireBegin(w, OP_ROUTE_DELIVERED); wireSelfMac(w); wireMac(w, info->src_addr);
+        wireMsgId(w, msg_id_in_msg); wirePayload(w, actual_payload_with_type); sendWire(w);
+#else
         sendUDP("ROUTE_DELIVERED " + myMac + " " + String(srcMacStr) + " " + String(msg_id_in_msg) + " " + String(actual_payload_with_type));
+#endif
         blinkLed(LED_PIN, 5, 80); 
         blinkLed(LED2_PIN, 5, 80, 80); 
         
@@ -176,6 +287,14 @@ void onRecv(const esp_now_recv_info_t* info, const uint8_t* data, int len) {
   }
 }
 
+void sendJoinUDP() {
+#if USE_BINARY_WIRE
+  wire_t w; wireBegin(w, OP_JOIN); wireSelfMac(w); sendWire(w);
+#else
+  sendUDP("<" + WiFi.macAddress() + "> CMD:JOIN");
+#endif
+}
+
 void setup() {
   pinMode(LED_PIN, OUTPUT); digitalWrite(LED_PIN, LOW);
   pinMode(LED2_PIN, OUTPUT); digitalWrite(LED2_PIN, LOW);
@@ -233,7 +352,7 @@ void setup() {
 
   Serial.println("Enviando mensajes de JOIN iniciales...");
   // 1. JOIN UDP al servidor Python
-  sendUDP("<" + WiFi.macAddress() + "> CMD:JOIN");
+  sendJoinUDP();
   
   // 2. JOIN_ESPNOW broadcast a otros ESPs
   msg_t jm_espnow = {}; 
@@ -256,6 +375,12 @@ void setup() {
 }
 
 void loop() {
+  if (UDP_COALESCE_MS > 0) flushCoalesced(false);
+  static unsigned long lastHeartbeat = millis();
+  if (HEARTBEAT_MS > 0 && millis() - lastHeartbeat >= HEARTBEAT_MS) { // Latido: el mismo JOIN del arranque
+    lastHeartbeat = millis();
+    sendJoinUDP();
+  }
   int packetSize = udp.parsePacket();
   if (packetSize) {
     char incomingPacket[256]; 
@@ -309,7 +434,11 @@ void loop() {
         Serial.printf("  UDP R_S - Next Hop: %s, Final Dest: %s, MSG_ID: %s, Payload: %s\n",
                       next_hop_mac_str, final_dest_mac_str, msg_id_str, route_payload_with_type);
         
+#if USE_BINARY_WIRE
+        { wire_t w; wireBegin(w, OP_ACK_ROUTE_STEP); wireSelfMac(w); wireMsgId(w, msg_id_str); sendWire(w); }
+#else
         sendUDP("ACK_ROUTE_STEP_RECEIVED " + myMac + " " + String(msg_id_str));
+#endif
 
         // Si este ESP no es el destino final de la ruta Y es un nodo intermedio para este msg_id
         if (!myMac.equalsIgnoreCase(final_dest_mac_str)) {
@@ -338,9 +467,18 @@ void loop() {
           esp_err_t result = esp_now_send(next_hop_bytes, (uint8_t*)&m_route_espnow, sizeof(m_route_espnow));
           if (result == ESP_OK) {
             // Informar al servidor Python que el envío ESP-NOW de este salto fue encolado
+#if USE_BINARY_WIRE
+            wire_t w; wireBegin(w, OP_ACK_ESPNOW_SENT); wireSelfMac(w); wireMac(w, next_hop_bytes); wireMsgId(w, msg_id_str); sendWire(w);
+#else
             sendUDP("ACK_ROUTE_ESPNOW_SENT " + myMac + " " + String(next_hop_mac_str) + " " + String(msg_id_str));
+#endif
           } else {
+#if USE_BINARY_WIRE
+            wire_t w; wireBegin(w, OP_FAIL_ESPNOW_SENT); wireSelfMac(w); wireMac(w, next_hop_bytes); wireMsgId(w, msg_id_str);
+            wireU32(w, (uint32_t)result); sendWire(w);
+#else
             sendUDP("FAIL_ROUTE_ESPNOW_SENT " + myMac + " " + String(next_hop_mac_str) + " " + String(msg_id_str) + " ERR:" + String(result));
+#endif
           }
         } else { Serial.println("Error: Formato MAC incorrecto para next_hop en ROUTE_STEP."); }
       } else { Serial.printf("Error: Formato de comando ROUTE_STEP incorrecto. Items parseados: %d. Comando: '%s'\n", parsed, cmd.c_str()); }
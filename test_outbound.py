@@ -0,0 +1,57 @@
+# --- Pruebas de espnow_outbound: reintento de ROUTE_STEP sin ACK ---
+#
+# Uso: python -m pytest -q test_outbound.py
+
+import socket, time
+from espnow_outbound import CommandScheduler
+
+
+def _pair():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); rx.bind(('127.0.0.1', 0)); rx.settimeout(0.05)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return rx, tx
+
+
+def _drain(rx, seconds):
+    got = []; end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try: got.append(rx.recv(2048))
+        except socket.timeout: pass
+    return got
+
+
+def _step(s, rx, held):
+    data = b"ROUTE_STEP 24:0A:C4:00:00:02 24:0A:C4:00:00:09 abcd1234 data_x"
+    if held:
+        with s.held(): s.send(data, rx.getsockname(), '24:0A:C4:00:00:01')
+    else: s.send(data, rx.getsockname(), '24:0A:C4:00:00:01')
+    return _drain(rx, 1.0)
+
+
+def test_step_retried_when_sent_inside_held():
+    rx, tx = _pair(); s = CommandScheduler(tx, step_timeout=0.1, step_retries=2).start()
+    try:
+        time.sleep(0.05) # El hilo del planificador ya está en wait(None)
+        got = _step(s, rx, held=True); st = s.stats()
+        assert len(got) == 3 and st['step_retries'] == 2 and st['step_unacked'] == 1 and st['unacked_steps'] == 0
+    finally:
+        s.stop(); rx.close(); tx.close()
+
+
+def test_step_retried_with_plain_send():
+    rx, tx = _pair(); s = CommandScheduler(tx, step_timeout=0.1, step_retries=2).start()
+    try:
+        got = _step(s, rx, held=False)
+        assert len(got) == 3 and s.stats()['step_retries'] == 2
+    finally:
+        s.stop(); rx.close(); tx.close()
+
+
+def test_ack_stops_retries():
+    rx, tx = _pair(); s = CommandScheduler(tx, step_timeout=0.2, step_retries=2).start()
+    try:
+        with s.held(): s.send(b"ROUTE_STEP a b id000001 x", rx.getsockname(), 'N1')
+        s.ack_step('N1', 'id000001')
+        assert len(_drain(rx, 0.8)) == 1 and s.stats()['step_retries'] == 0 and s.stats()['step_acked'] == 1
+    finally:
+        s.stop(); rx.close(); tx.close()